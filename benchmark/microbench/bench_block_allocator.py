@@ -0,0 +1,100 @@
+"""Microbenchmark of allocating and freeing the KV blocks of contexts.
+
+A pool of NUM_BLOCKS blocks holds NUM_LIVE_CONTEXTS contexts of CONTEXT_LEN tokens. In
+each round the oldest context is freed and a new one is allocated, so the pool keeps many
+free blocks. We compare:
+- recycle_pool: The old way. RecyclePool (free checks double frees by scanning the free
+    ids), and contexts allocate token by token.
+- block_allocator: BlockAllocator (O(1) alloc/free, bitmap double-free check), and
+    contexts allocate blocks in bulk.
+
+and report the time per context (allocate + free), for two block sizes.
+"""
+
+import logging
+import time
+from collections import deque
+
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+from parrot.utils import RecyclePool
+
+
+NUM_BLOCKS = 100000
+CONTEXT_LEN = 4096
+NUM_LIVE_CONTEXTS = 16
+NUM_ROUNDS = {"recycle_pool": 8, "block_allocator": 200}
+
+
+class _LegacyContext:
+    """The old allocation path of BlockContext, on a RecyclePool."""
+
+    def __init__(self, pool: RecyclePool, block_size: int):
+        self.pool = pool
+        self.block_size = block_size
+        self.token_kv_block_ids = []
+        self.token_kv_slot_ids = []
+
+    def allocate(self, length: int):
+        for _ in range(length):
+            idx = len(self.token_kv_block_ids)
+            if idx % self.block_size == 0:
+                block_id = self.pool.allocate()
+                self.token_kv_block_ids.append(block_id)
+                self.token_kv_slot_ids.append(block_id * self.block_size)
+            else:
+                self.token_kv_block_ids.append(self.token_kv_block_ids[-1])
+                self.token_kv_slot_ids.append(self.token_kv_slot_ids[-1] + 1)
+
+    def destruction(self):
+        for block_id in self.token_kv_block_ids[:: self.block_size]:
+            self.pool.free(block_id)
+
+
+def bench(name: str, block_size: int) -> None:
+    num_blocks = NUM_BLOCKS // block_size
+    if name == "recycle_pool":
+        pool = RecyclePool("KVCache pool", pool_size=num_blocks + 1)
+        make_context = lambda i: _LegacyContext(pool, block_size)
+    else:
+        pool = BlockAllocator("KVCache pool", num_blocks=num_blocks)
+        make_context = lambda i: BlockContext(
+            i, None, kv_cache_manager=pool, block_size=block_size
+        )
+
+    # Warm up: Use the whole pool once, so the freed blocks are recycled.
+    contexts = deque()
+    num_contexts = NUM_BLOCKS // CONTEXT_LEN
+    for i in range(num_contexts):
+        context = make_context(i)
+        context.allocate(CONTEXT_LEN)
+        contexts.append(context)
+    while len(contexts) > NUM_LIVE_CONTEXTS:
+        contexts.popleft().destruction()
+
+    num_rounds = NUM_ROUNDS[name]
+    st = time.perf_counter_ns()
+    for i in range(num_rounds):
+        contexts.popleft().destruction()
+        context = make_context(num_contexts + i)
+        context.allocate(CONTEXT_LEN)
+        contexts.append(context)
+    per_context = (time.perf_counter_ns() - st) / num_rounds / 1e6
+
+    print(
+        f"[{name}, block_size={block_size}] per context: {per_context:.3f} ms",
+        flush=True,
+    )
+
+
+def main():
+    for block_size in [1, 16]:
+        bench("recycle_pool", block_size)
+        bench("block_allocator", block_size)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
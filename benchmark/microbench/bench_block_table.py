@@ -0,0 +1,134 @@
+"""Microbenchmark of building the block tables and slot mappings of decoding jobs.
+
+NUM_JOBS jobs are forked off a shared prefix of PREFIX_LEN tokens and decode NUM_STEPS
+tokens. In each step, every job extends its context by one token, and the block tables
+(one row per job) and the slot mapping of the step are built, as in the paged-attention
+path of the builtin engine. We compare:
+- token_lists: The old way. Each context keeps per-token block id / slot id lists, and
+    the tables of the whole context are concatenated from the ancestors in every step.
+- block_table: Each context keeps an int32 block table (one entry per block) with the
+    prefix of the ancestors cached, and computes the slots of the new tokens only.
+
+and report the time per step, for two block sizes.
+"""
+
+import logging
+import time
+from typing import List
+
+import numpy as np
+
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+NUM_BLOCKS = 100000
+PREFIX_LEN = 4096
+NUM_JOBS = 64
+NUM_STEPS = 64
+
+
+class _LegacyContext:
+    """The old table path of BlockContext: per-token lists, concatenated per step."""
+
+    def __init__(self, parent, allocator: BlockAllocator, block_size: int):
+        self.parent = parent
+        self.allocator = allocator
+        self.block_size = block_size
+        self.token_kv_block_ids: List[int] = []
+        self.token_kv_slot_ids: List[int] = []
+
+    def allocate(self, length: int):
+        for _ in range(length):
+            idx = len(self.token_kv_block_ids)
+            if idx % self.block_size == 0:
+                block_id = self.allocator.allocate()
+                self.token_kv_block_ids.append(block_id)
+                self.token_kv_slot_ids.append(block_id * self.block_size)
+            else:
+                self.token_kv_block_ids.append(self.token_kv_block_ids[-1])
+                self.token_kv_slot_ids.append(self.token_kv_slot_ids[-1] + 1)
+
+    def get_context_block_ids(self) -> List[int]:
+        if self.parent is None:
+            return self.token_kv_block_ids
+        return self.parent.get_context_block_ids() + self.token_kv_block_ids
+
+    def get_context_slot_ids(self) -> List[int]:
+        if self.parent is None:
+            return self.token_kv_slot_ids
+        return self.parent.get_context_slot_ids() + self.token_kv_slot_ids
+
+
+def _step_token_lists(contexts, block_size: int):
+    block_tables = []
+    slot_mapping = []
+    for context in contexts:
+        context.allocate(1)
+        context_block_ids = context.get_context_block_ids()
+        context_slot_ids = context.get_context_slot_ids()
+        slot_mapping.append(context_slot_ids[-1:])
+        block_tables.append(context_block_ids[::block_size])
+    max_len = max(len(x) for x in block_tables)
+    block_tables = [x + [0] * (max_len - len(x)) for x in block_tables]
+    return np.array(block_tables, dtype=np.int32), np.array(slot_mapping, np.int32)
+
+
+def _step_block_table(contexts, block_size: int):
+    block_tables = []
+    slot_mapping = []
+    for context in contexts:
+        context.allocate(1)
+        block_tables.append(context.get_context_block_table())
+        slot_mapping.append(context.get_context_slot_ids(1))
+    max_len = max(len(x) for x in block_tables)
+    padded = np.zeros((len(block_tables), max_len), dtype=np.int32)
+    for i, x in enumerate(block_tables):
+        padded[i, : len(x)] = x
+    return padded, np.stack(slot_mapping).astype(np.int32)
+
+
+def bench(name: str, block_size: int) -> None:
+    allocator = BlockAllocator("KVCache pool", num_blocks=NUM_BLOCKS)
+    if name == "token_lists":
+        prefix = _LegacyContext(None, allocator, block_size)
+        prefix.allocate(PREFIX_LEN)
+        contexts = [
+            _LegacyContext(prefix, allocator, block_size) for _ in range(NUM_JOBS)
+        ]
+        step = _step_token_lists
+    else:
+        prefix = BlockContext(
+            0, None, kv_cache_manager=allocator, block_size=block_size
+        )
+        prefix.allocate(PREFIX_LEN)
+        contexts = [
+            BlockContext(
+                i + 1, prefix, kv_cache_manager=allocator, block_size=block_size
+            )
+            for i in range(NUM_JOBS)
+        ]
+        step = _step_block_table
+
+    st = time.perf_counter_ns()
+    for _ in range(NUM_STEPS):
+        step(contexts, block_size)
+    per_step = (time.perf_counter_ns() - st) / NUM_STEPS / 1e6
+
+    print(
+        f"[{name}, block_size={block_size}] per step: {per_step:.3f} ms",
+        flush=True,
+    )
+
+
+def main():
+    for block_size in [1, 16]:
+        bench("token_lists", block_size)
+        bench("block_table", block_size)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,143 @@
+"""Simulate an engine decoding running generations while long prompts arrive, to measure
+chunked prefill in the EngineScheduler.
+
+NUM_DECODES Generate jobs keep decoding, and long Fills (up to 32k tokens) arrive in a
+Poisson process. The real EngineScheduler schedules the jobs, and the latency of an
+iteration is linear in the number of batched tokens. We compare:
+- no_chunk: Each Fill is executed as a whole (the old behavior). It needs a token budget
+    (max_num_batched_tokens) as large as the longest Fill.
+- chunk_<size>: Fills are split into chunks interleaved with the decoding, within a small
+    token budget.
+
+and report the inter-token latency (ITL) of the running generations and the latency of
+the Fills.
+"""
+
+import logging
+import random
+from typing import List
+
+from parrot.constants import FILL_NO_CHUNK
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+
+
+NUM_DECODES = 32
+NUM_FILLS = 50
+FILL_RATE = 0.5  # Fills/s
+FILL_TOKENS_RANGE = (1024, 32768)
+
+# Iteration latency: ITERATION_BASE_LATENCY + PER_TOKEN_LATENCY * batched tokens
+ITERATION_BASE_LATENCY = 0.01  # s
+PER_TOKEN_LATENCY = 0.00005  # s
+
+# (name, fill_chunk_size, max_num_batched_tokens)
+SETTINGS = [
+    ("no_chunk", FILL_NO_CHUNK, 32768 + NUM_DECODES),
+    ("chunk_2048", 2048, 2048 + NUM_DECODES),
+    ("chunk_512", 512, 512 + NUM_DECODES),
+]
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class _SimContext:
+    def __init__(self):
+        self.context_len = 0
+
+    def get_context_len(self) -> int:
+        return self.context_len
+
+
+def bench(name: str, fill_chunk_size: int, max_num_batched_tokens: int) -> None:
+    rng = random.Random(0)
+    arrivals = []
+    t = 0.0
+    for i in range(NUM_FILLS):
+        t += rng.expovariate(FILL_RATE)
+        arrivals.append((t, rng.randint(*FILL_TOKENS_RANGE)))
+    arrivals.reverse()
+
+    scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=256,
+            max_num_batched_tokens=max_num_batched_tokens,
+            max_total_tokens=10**9,
+        ),
+        fill_chunk_size=fill_chunk_size,
+    )
+
+    sampling_config = SamplingConfig()
+    for i in range(NUM_DECODES):
+        job = Generate(
+            session_id=0,
+            task_id=i,
+            context_id=i,
+            parent_context_id=-1,
+            sampling_config=sampling_config,
+        )
+        job.context = _SimContext()
+        scheduler.add_job(job)
+
+    now = 0.0
+    itls: List[float] = []
+    fill_latencies: List[float] = []
+    fill_arrivals = {}
+    next_context_id = NUM_DECODES
+
+    while len(arrivals) > 0 or len(fill_arrivals) > 0:
+        while len(arrivals) > 0 and arrivals[-1][0] <= now:
+            arrival, tokens_num = arrivals.pop()
+            job = Fill(
+                session_id=0,
+                task_id=next_context_id,
+                context_id=next_context_id,
+                parent_context_id=-1,
+                token_ids=[0] * tokens_num,
+            )
+            job.context = _SimContext()
+            fill_arrivals[job.context_id] = arrival
+            next_context_id += 1
+            scheduler.add_job(job)
+
+        jobs = scheduler.schedule()
+        batched_tokens = sum(
+            job.iter_num_tokens if isinstance(job, Fill) else 1 for job in jobs
+        )
+        iter_latency = ITERATION_BASE_LATENCY + PER_TOKEN_LATENCY * batched_tokens
+        now += iter_latency
+
+        for job in jobs:
+            if isinstance(job, Fill):
+                job.context.context_len += job.iter_num_tokens
+                if job.finish_iter():
+                    job.finish_event.set()
+                    fill_latencies.append(now - fill_arrivals.pop(job.context_id))
+        # The running generations never stop.
+        itls.extend([iter_latency] * sum(isinstance(job, Generate) for job in jobs))
+
+        scheduler.finish()
+
+    print(
+        f"[{name}] ITL avg: {sum(itls) / len(itls) * 1e3:.1f} ms, "
+        f"p99.9: {_percentile(itls, 0.999) * 1e3:.1f} ms, max: {max(itls) * 1e3:.1f} ms; "
+        f"Fill latency avg: {sum(fill_latencies) / len(fill_latencies):.3f} s",
+        flush=True,
+    )
+
+
+def main():
+    for name, fill_chunk_size, max_num_batched_tokens in SETTINGS:
+        bench(name, fill_chunk_size, max_num_batched_tokens)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,236 @@
+"""Simulate map-reduce DAGs (e.g. summarization) scheduled by the GlobalScheduler, to
+measure critical-path-aware scheduling.
+
+Each DAG maps NUM_BRANCHES chunks (most are short, a few are long, so the DAG is limited by
+its slowest branch) and reduces their outputs. DAGs arrive in a Poisson process. The real
+GlobalScheduler dispatches the tasks to engines with limited task slots, and a task takes
+time proportional to its estimated cost (prompt and output tokens).
+
+We compare:
+- fifo: Tasks in submission order.
+- app_fifo: Deeper chains first (the only DAG signal before).
+- app_fifo + critical_path: Tasks on the critical paths of their DAGs first (least slack
+    first), then deeper chains first.
+
+and report the DAG completion time.
+"""
+
+import heapq
+import logging
+import random
+from typing import Dict, List
+
+from parrot.serve.scheduler import (
+    CompletionTask,
+    GlobalScheduler,
+    GlobalSchedulerConfig,
+    TaskCreator,
+)
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import (
+    RequestChain,
+    ComputeGraph,
+    ConstantFill,
+    PlaceholderFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+
+
+NUM_DAGS = 200
+NUM_BRANCHES = 16
+DAG_RATE = 0.1  # DAGs/s
+LONG_BRANCH_RATIO = 0.15
+
+CHUNK_CHARS = 2048
+# Output tokens of (short branches, long branches, reduce)
+SHORT_BRANCH_GEN = 64
+LONG_BRANCH_GEN = 512
+REDUCE_GEN = 128
+
+NUM_ENGINES = 2
+ENGINE_TASKS_CAPACITY = 4
+# Time to decode a token in a task slot.
+DECODE_TOKEN_TIME = 0.02  # s
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _make_request(nodes: List) -> RequestChain:
+    metadata = SemanticCallMetadata.get_default()
+    metadata.model_type = "text"
+    return RequestChain.from_nodes(nodes=nodes, metadata=metadata)
+
+
+def _task_time(task: CompletionTask) -> float:
+    # The estimated cost of the chain is in units of decoding a token.
+    return task.chain.cost * DECODE_TOKEN_TIME
+
+
+def bench(name: str, scheduler_cfg: GlobalSchedulerConfig) -> None:
+    rng = random.Random(0)
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+    for i in range(NUM_ENGINES):
+        engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"bench_engine_{i}",
+                engine_type=ENGINE_TYPE_OPENAI,
+                tasks_capacity=ENGINE_TASKS_CAPACITY,
+            )
+        )
+
+    graph = ComputeGraph()
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def add_request(nodes: List) -> RequestChain:
+        request_chain = _make_request(nodes)
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        return request_chain
+
+    # (time, seq, kind, payload)
+    events = []
+    seq = 0
+
+    def push_event(time: float, kind: str, payload) -> None:
+        nonlocal seq
+        heapq.heappush(events, (time, seq, kind, payload))
+        seq += 1
+
+    t = 0.0
+    for dag_id in range(NUM_DAGS):
+        t += rng.expovariate(DAG_RATE)
+        gen_lens = [
+            LONG_BRANCH_GEN if rng.random() < LONG_BRANCH_RATIO else SHORT_BRANCH_GEN
+            for _ in range(NUM_BRANCHES)
+        ]
+        push_event(t, "arrive", (dag_id, gen_lens))
+
+    dag_arrival: Dict[int, float] = {}
+    dag_pending_branches: Dict[int, int] = {}
+    dag_reduce_chain = {}
+    task_dag: Dict[int, int] = {}  # task_id -> dag_id
+    jcts: List[float] = []
+
+    def submit(comp_chain, dag_id: int) -> None:
+        task = task_creator.create_task(comp_chain)
+        task_dag[task.task_id] = dag_id
+        scheduler.submit_task(task)
+
+    while len(events) > 0:
+        now = events[0][0]
+        while len(events) > 0 and events[0][0] == now:
+            _, _, kind, payload = heapq.heappop(events)
+            if kind == "arrive":
+                dag_id, gen_lens = payload
+                dag_arrival[dag_id] = now
+                branch_chains = [
+                    add_request(
+                        [
+                            ConstantFill("x" * CHUNK_CHARS),
+                            PlaceholderGen(
+                                placeholder=RequestPlaceholder(
+                                    name="a",
+                                    is_output=True,
+                                    sampling_config={"max_gen_length": gen_len},
+                                )
+                            ),
+                        ]
+                    ).comp_chains[0]
+                    for gen_len in gen_lens
+                ]
+                reduce_chain = add_request(
+                    [ConstantFill("Summarize: ")]
+                    + [
+                        PlaceholderFill(
+                            placeholder=RequestPlaceholder(
+                                name=f"b{i}",
+                                var_id=chain.gen_node.sv.id,
+                                is_output=False,
+                            )
+                        )
+                        for i, chain in enumerate(branch_chains)
+                    ]
+                    + [
+                        PlaceholderGen(
+                            placeholder=RequestPlaceholder(
+                                name="c",
+                                is_output=True,
+                                sampling_config={"max_gen_length": REDUCE_GEN},
+                            )
+                        )
+                    ]
+                ).comp_chains[0]
+                activate_completion_chain(
+                    reduce_chain, PerformanceCriteria.THROUGHPUT
+                )
+
+                dag_pending_branches[dag_id] = NUM_BRANCHES
+                dag_reduce_chain[dag_id] = reduce_chain
+                for chain in branch_chains:
+                    submit(chain, dag_id)
+            else:
+                task: CompletionTask = payload
+                gen_node = task.chain.gen_node
+                gen_node.sv.set("y" * gen_node.sampling_config.max_gen_length)
+                dag_id = task_dag.pop(task.task_id)
+                # Release the slot in the engine.
+                task_creator.free_task(task)
+                if task.chain is dag_reduce_chain[dag_id]:
+                    jcts.append(now - dag_arrival[dag_id])
+                else:
+                    dag_pending_branches[dag_id] -= 1
+                    if dag_pending_branches[dag_id] == 0:
+                        submit(dag_reduce_chain[dag_id], dag_id)
+
+        queued = list(scheduler.task_queue.ordered_tasks(False))
+        scheduler.schedule()
+        for task in queued:
+            if task.is_scheduled:
+                push_event(now + _task_time(task), "finish", task)
+
+    print(
+        f"[{name}] DAG completion time avg: {sum(jcts) / len(jcts):.2f} s, "
+        f"p50: {_percentile(jcts, 0.5):.2f} s, p99: {_percentile(jcts, 0.99):.2f} s",
+        flush=True,
+    )
+
+
+def main():
+    bench("fifo", GlobalSchedulerConfig(max_queue_size=10**6))
+    bench("app_fifo", GlobalSchedulerConfig(app_fifo=True, max_queue_size=10**6))
+    bench(
+        "app_fifo + critical_path",
+        GlobalSchedulerConfig(app_fifo=True, critical_path=True, max_queue_size=10**6),
+    )
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
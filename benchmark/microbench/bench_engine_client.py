@@ -0,0 +1,126 @@
+"""Benchmark the round-trip latency and throughput of primitives from ServeCore to an engine.
+
+The engine is `parrot/testing/fake_engine_server.py`, launched in another process. Fills
+are empty, so the fake engine returns immediately and we measure the HTTP overhead only.
+We compare:
+- new session: A new `aiohttp.ClientSession` (i.e. a new connection) per primitive (the
+    old behavior).
+- pooled: The keep-alive client session of the engine, owned by EngineManager.
+"""
+
+import asyncio
+import logging
+import time
+from multiprocessing import Process
+from typing import List, Optional
+
+import aiohttp
+import uvicorn
+
+from parrot.protocol.internal.primitive_request import Fill
+from parrot.protocol.internal.layer_apis import ping_engine
+# NOTE: Import the scheduler first to avoid the circular import of the managers.
+import parrot.serve.scheduler
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.testing.fake_engine_server import (
+    app as fake_engine_app,
+    TESTING_SERVER_HOST,
+    TESTING_SERVER_PORT,
+    TESTING_SERVER_URL,
+)
+
+
+NUM_SEQUENTIAL = 1000
+NUM_CONCURRENT = 5000
+CONCURRENCY = 64
+
+
+def _launch_fake_engine():
+    uvicorn.run(
+        fake_engine_app,
+        host=TESTING_SERVER_HOST,
+        port=TESTING_SERVER_PORT,
+        log_level="warning",
+    )
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _make_fill(i: int) -> Fill:
+    return Fill(
+        session_id=0,
+        task_id=i,
+        context_id=i,
+        parent_context_id=-1,
+        end_flag=False,
+        token_ids=[],
+    )
+
+
+async def _bench(name: str, client_session: Optional[aiohttp.ClientSession]) -> None:
+    # Round-trip latency
+    latencies = []
+    for i in range(NUM_SEQUENTIAL):
+        st = time.perf_counter()
+        await _make_fill(i).apost(TESTING_SERVER_URL, client_session)
+        latencies.append(time.perf_counter() - st)
+
+    # Throughput
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(i: int):
+        async with semaphore:
+            await _make_fill(i).apost(TESTING_SERVER_URL, client_session)
+
+    st = time.perf_counter()
+    await asyncio.gather(*[send(i) for i in range(NUM_CONCURRENT)])
+    total_time = time.perf_counter() - st
+
+    print(
+        f"[{name}] round-trip latency p50: {_percentile(latencies, 0.5) * 1e3:.3f} ms, "
+        f"p99: {_percentile(latencies, 0.99) * 1e3:.3f} ms; "
+        f"throughput (concurrency={CONCURRENCY}): {NUM_CONCURRENT / total_time:.0f} primitives/s",
+        flush=True,
+    )
+
+
+async def main():
+    await _bench("new session", None)
+
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=ServeCoreContextManager(),
+        engine_heartbeat_timeout=666,
+    )
+    engine_id = engine_mgr.register_engine(
+        EngineConfig(
+            engine_name="bench_engine",
+            engine_type=ENGINE_TYPE_OPENAI,
+            host=TESTING_SERVER_HOST,
+            port=TESTING_SERVER_PORT,
+        )
+    )
+    await _bench("pooled", engine_mgr.get_client_session(engine_id))
+    await engine_mgr.close_client_sessions()
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    p = Process(target=_launch_fake_engine, daemon=True)
+    p.start()
+    # Wait for the engine server.
+    while not ping_engine(TESTING_SERVER_URL).pong:
+        time.sleep(0.1)
+
+    asyncio.run(main())
+
+    p.terminate()
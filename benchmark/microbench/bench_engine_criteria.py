@@ -0,0 +1,177 @@
+"""Simulate an engine serving a mix of latency-critical and throughput tasks, to measure
+how the EngineScheduler honors the LATENCY criteria.
+
+Each task is a Fill (the prompt) followed by a Generate. Latency-critical tasks (chat-like:
+short prompts, short outputs) and throughput tasks (long prompts, long outputs, e.g.
+offline summarization) arrive in Poisson processes. The real EngineScheduler schedules
+the jobs, and the latency of an iteration is linear in the number of batched tokens.
+
+We compare:
+- no_criteria: All jobs are treated the same (the old behavior).
+- criteria: Jobs of latency-critical tasks are marked `latency_critical`, so they are
+    scheduled first and their decoding is not stalled by the prefills of other jobs.
+
+and report the JCT and the time per output token (TPOT) of both kinds of tasks.
+"""
+
+import heapq
+import logging
+import random
+from typing import Dict, List
+
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+
+
+NUM_TASKS = 2000
+LATENCY_TASK_RATIO = 0.5
+REQUEST_RATE = 4  # tasks/s
+
+# (prompt tokens, output tokens)
+LATENCY_TASK_SHAPE = (128, 32)
+THROUGHPUT_TASK_SHAPE = (4096, 128)
+
+# Iteration latency: ITERATION_BASE_LATENCY + PER_TOKEN_LATENCY * batched tokens
+ITERATION_BASE_LATENCY = 0.01  # s
+PER_TOKEN_LATENCY = 0.00005  # s
+
+SCHEDULER_CONFIG = SchedulerConfig(
+    max_batch_size=64,
+    max_num_batched_tokens=8192,
+    max_total_tokens=10**9,
+)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class _SimContext:
+    def __init__(self):
+        self.context_len = 0
+
+    def get_context_len(self) -> int:
+        return self.context_len
+
+
+class _SimTask:
+    def __init__(self, task_id: int, arrival: float, latency_critical: bool):
+        self.task_id = task_id
+        self.arrival = arrival
+        self.latency_critical = latency_critical
+        self.prompt_len, self.gen_len = (
+            LATENCY_TASK_SHAPE if latency_critical else THROUGHPUT_TASK_SHAPE
+        )
+        self.context = _SimContext()
+        self.generated = 0
+        self.first_token_time = -1.0
+
+
+def bench(honor_criteria: bool) -> None:
+    rng = random.Random(0)
+    arrivals = []
+    t = 0.0
+    for i in range(NUM_TASKS):
+        t += rng.expovariate(REQUEST_RATE)
+        heapq.heappush(
+            arrivals, (t, i, _SimTask(i, t, rng.random() < LATENCY_TASK_RATIO))
+        )
+
+    scheduler = EngineScheduler(SCHEDULER_CONFIG)
+    sampling_config = SamplingConfig()
+    job_tasks: Dict[int, _SimTask] = {}  # context_id -> task
+
+    def add_job(job, task: _SimTask):
+        job.context = task.context
+        job_tasks[job.context_id] = task
+        scheduler.add_job(job)
+
+    jcts: Dict[bool, List[float]] = {True: [], False: []}
+    tpots: Dict[bool, List[float]] = {True: [], False: []}
+
+    now = 0.0
+    finished = 0
+    while finished < NUM_TASKS:
+        # Admit the arrived tasks.
+        if scheduler.is_empty and len(arrivals) > 0:
+            now = max(now, arrivals[0][0])
+        while len(arrivals) > 0 and arrivals[0][0] <= now:
+            _, task_id, task = heapq.heappop(arrivals)
+            fill = Fill(
+                session_id=0,
+                task_id=task_id,
+                context_id=task_id,
+                parent_context_id=-1,
+                token_ids=[0] * task.prompt_len,
+                latency_critical=honor_criteria and task.latency_critical,
+            )
+            add_job(fill, task)
+
+        jobs = scheduler.schedule()
+        batched_tokens = sum(
+            len(job.token_ids) if isinstance(job, Fill) else 1 for job in jobs
+        )
+        now += ITERATION_BASE_LATENCY + PER_TOKEN_LATENCY * batched_tokens
+
+        new_gens = []
+        for job in jobs:
+            task = job_tasks[job.context_id]
+            if isinstance(job, Fill):
+                task.context.context_len += len(job.token_ids)
+                job.finish_event.set()
+                new_gens.append(
+                    (
+                        Generate(
+                            session_id=0,
+                            task_id=task.task_id,
+                            context_id=task.task_id,
+                            parent_context_id=-1,
+                            sampling_config=sampling_config,
+                            end_flag=True,
+                            latency_critical=job.latency_critical,
+                        ),
+                        task,
+                    )
+                )
+            else:
+                task.context.context_len += 1
+                task.generated += 1
+                if task.first_token_time < 0:
+                    task.first_token_time = now
+                if task.generated == task.gen_len:
+                    job.finish_event.set()
+                    jcts[task.latency_critical].append(now - task.arrival)
+                    tpots[task.latency_critical].append(
+                        (now - task.first_token_time) / max(1, task.gen_len - 1)
+                    )
+                    finished += 1
+
+        scheduler.finish()
+        for job, task in new_gens:
+            add_job(job, task)
+
+    name = "criteria" if honor_criteria else "no_criteria"
+    for latency_critical, kind in [(True, "latency"), (False, "throughput")]:
+        print(
+            f"[{name}, {kind} tasks] "
+            f"JCT avg: {sum(jcts[latency_critical]) / len(jcts[latency_critical]):.3f} s, "
+            f"p99: {_percentile(jcts[latency_critical], 0.99):.3f} s; "
+            f"TPOT avg: {sum(tpots[latency_critical]) / len(tpots[latency_critical]) * 1e3:.2f} ms, "
+            f"p99: {_percentile(tpots[latency_critical], 0.99) * 1e3:.2f} ms",
+            flush=True,
+        )
+
+
+def main():
+    for honor_criteria in [False, True]:
+        bench(honor_criteria)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,170 @@
+"""Simulate an overloaded engine serving tasks with latency budgets, to measure how the
+EngineScheduler honors deadlines.
+
+Each task is a Fill (the prompt) followed by a Generate. Tasks arrive in a Poisson process
+at a rate close to the capacity of the engine, so queues build up, and each has a latency
+budget: tight (interactive) or loose (background). The real EngineScheduler schedules the
+jobs (reading the simulated clock), and the latency of an iteration is linear in the
+number of batched tokens.
+
+We compare:
+- fifo: Jobs carry no deadlines (the old behavior).
+- edf: Jobs carry the deadlines of their tasks, so they are scheduled
+    earliest-deadline-first, and jobs which have missed their deadlines are deprioritized.
+
+and report the deadline miss rate of both kinds of tasks.
+"""
+
+import heapq
+import logging
+import random
+from typing import Dict, List
+
+from parrot.engine import engine_scheduler
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+
+
+NUM_TASKS = 2000
+TIGHT_TASK_RATIO = 0.5
+REQUEST_RATE = 12  # tasks/s
+
+# (prompt tokens, output tokens, latency budget in seconds)
+TIGHT_TASK_SHAPE = (256, 32, 3.0)
+LOOSE_TASK_SHAPE = (1024, 128, 60.0)
+
+# Iteration latency: ITERATION_BASE_LATENCY + PER_TOKEN_LATENCY * batched tokens
+ITERATION_BASE_LATENCY = 0.01  # s
+PER_TOKEN_LATENCY = 0.00005  # s
+
+SCHEDULER_CONFIG = SchedulerConfig(
+    max_batch_size=16,
+    max_num_batched_tokens=8192,
+    max_total_tokens=10**9,
+)
+
+
+class _SimContext:
+    def __init__(self):
+        self.context_len = 0
+
+    def get_context_len(self) -> int:
+        return self.context_len
+
+
+class _SimTask:
+    def __init__(self, task_id: int, arrival: float, tight: bool):
+        self.task_id = task_id
+        self.arrival = arrival
+        self.tight = tight
+        self.prompt_len, self.gen_len, budget = (
+            TIGHT_TASK_SHAPE if tight else LOOSE_TASK_SHAPE
+        )
+        self.deadline = arrival + budget
+        self.context = _SimContext()
+        self.generated = 0
+
+
+def bench(honor_deadlines: bool) -> None:
+    rng = random.Random(0)
+    arrivals = []
+    t = 0.0
+    for i in range(NUM_TASKS):
+        t += rng.expovariate(REQUEST_RATE)
+        heapq.heappush(
+            arrivals, (t, i, _SimTask(i, t, rng.random() < TIGHT_TASK_RATIO))
+        )
+
+    now = 0.0
+    # NOTE: The scheduler compares deadlines with its clock. Use the simulated one.
+    engine_scheduler.time_counter_in_nanoseconds = lambda: int(now * 1e9)
+
+    scheduler = EngineScheduler(SCHEDULER_CONFIG)
+    sampling_config = SamplingConfig()
+    job_tasks: Dict[int, _SimTask] = {}  # context_id -> task
+
+    def add_job(job, task: _SimTask):
+        job.context = task.context
+        if honor_deadlines:
+            job.deadline = int(task.deadline * 1e9)
+        job_tasks[job.context_id] = task
+        scheduler.add_job(job)
+
+    missed: Dict[bool, List[bool]] = {True: [], False: []}
+
+    finished = 0
+    while finished < NUM_TASKS:
+        # Admit the arrived tasks.
+        if scheduler.is_empty and len(arrivals) > 0:
+            now = max(now, arrivals[0][0])
+        while len(arrivals) > 0 and arrivals[0][0] <= now:
+            _, task_id, task = heapq.heappop(arrivals)
+            fill = Fill(
+                session_id=0,
+                task_id=task_id,
+                context_id=task_id,
+                parent_context_id=-1,
+                token_ids=[0] * task.prompt_len,
+            )
+            add_job(fill, task)
+
+        jobs = scheduler.schedule()
+        batched_tokens = sum(
+            len(job.token_ids) if isinstance(job, Fill) else 1 for job in jobs
+        )
+        now += ITERATION_BASE_LATENCY + PER_TOKEN_LATENCY * batched_tokens
+
+        new_gens = []
+        for job in jobs:
+            task = job_tasks[job.context_id]
+            if isinstance(job, Fill):
+                task.context.context_len += len(job.token_ids)
+                job.finish_event.set()
+                new_gens.append(
+                    (
+                        Generate(
+                            session_id=0,
+                            task_id=task.task_id,
+                            context_id=task.task_id,
+                            parent_context_id=-1,
+                            sampling_config=sampling_config,
+                            end_flag=True,
+                        ),
+                        task,
+                    )
+                )
+            else:
+                task.context.context_len += 1
+                task.generated += 1
+                if task.generated == task.gen_len:
+                    job.finish_event.set()
+                    missed[task.tight].append(now > task.deadline)
+                    finished += 1
+
+        scheduler.finish()
+        for job, task in new_gens:
+            add_job(job, task)
+
+    name = "edf" if honor_deadlines else "fifo"
+    all_missed = missed[True] + missed[False]
+    print(
+        f"[{name}] deadline miss rate: "
+        f"tight tasks: {sum(missed[True]) / len(missed[True]) * 100:.1f}%, "
+        f"loose tasks: {sum(missed[False]) / len(missed[False]) * 100:.1f}%, "
+        f"all: {sum(all_missed) / len(all_missed) * 100:.1f}%",
+        flush=True,
+    )
+
+
+def main():
+    for honor_deadlines in [False, True]:
+        bench(honor_deadlines)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
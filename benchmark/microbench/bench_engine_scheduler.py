@@ -0,0 +1,125 @@
+"""Microbenchmark of the EngineScheduler with many queued jobs.
+
+NUM_JOBS tasks (a Fill followed by a Generate) are queued at once, so thousands of jobs
+wait in the scheduler during the run. Some of them are latency-critical or carry
+deadlines. The runner is simulated (it only extends the contexts), so we measure the
+time spent in the scheduler (add_job, schedule and finish) per iteration.
+
+We compare the scheduling policies:
+- fifo: Fill and Generate jobs are batched together (the default).
+- tgi: Fill and Generate jobs are scheduled in separate iterations.
+
+and report the scheduler overhead per iteration.
+"""
+
+import logging
+import random
+import time
+from typing import Dict, List
+
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+
+
+NUM_JOBS = 5000
+LATENCY_CRITICAL_RATIO = 0.1
+DEADLINE_RATIO = 0.25
+PROMPT_LEN = 256
+GEN_LEN = 64
+
+
+class _SimContext:
+    def __init__(self):
+        self.context_len = 0
+
+    def get_context_len(self) -> int:
+        return self.context_len
+
+
+def bench(policy: str) -> None:
+    rng = random.Random(0)
+    scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=256,
+            max_num_batched_tokens=8192,
+            max_total_tokens=65536,
+            policy=policy,
+        )
+    )
+    sampling_config = SamplingConfig()
+    generated: Dict[int, int] = {}
+    overheads: List[float] = []
+
+    st = time.perf_counter_ns()
+    for i in range(NUM_JOBS):
+        job = Fill(
+            session_id=0,
+            task_id=i,
+            context_id=i,
+            parent_context_id=-1,
+            token_ids=[0] * PROMPT_LEN,
+            latency_critical=rng.random() < LATENCY_CRITICAL_RATIO,
+            time_to_deadline=rng.uniform(600, 1200)
+            if rng.random() < DEADLINE_RATIO
+            else None,
+        )
+        job.context = _SimContext()
+        scheduler.add_job(job)
+    overheads.append(time.perf_counter_ns() - st)
+
+    finished = 0
+    while finished < NUM_JOBS:
+        st = time.perf_counter_ns()
+        jobs = scheduler.schedule()
+        overheads.append(time.perf_counter_ns() - st)
+
+        new_gens = []
+        for job in jobs:
+            if isinstance(job, Fill):
+                job.context.context_len += len(job.token_ids)
+                job.finish_event.set()
+                gen = Generate(
+                    session_id=0,
+                    task_id=job.task_id,
+                    context_id=job.context_id,
+                    parent_context_id=-1,
+                    sampling_config=sampling_config,
+                    end_flag=True,
+                    latency_critical=job.latency_critical,
+                )
+                gen.context = job.context
+                gen.deadline = job.deadline
+                new_gens.append(gen)
+            else:
+                job.context.context_len += 1
+                generated[job.task_id] = generated.get(job.task_id, 0) + 1
+                if generated[job.task_id] == GEN_LEN:
+                    job.finish_event.set()
+                    finished += 1
+
+        st = time.perf_counter_ns()
+        scheduler.finish()
+        for job in new_gens:
+            scheduler.add_job(job)
+        overheads[-1] += time.perf_counter_ns() - st
+
+    print(
+        f"[{policy}] iterations: {len(overheads) - 1}, scheduler overhead per iteration: "
+        f"avg {sum(overheads) / (len(overheads) - 1) / 1e6:.3f} ms, "
+        f"max {max(overheads[1:]) / 1e6:.3f} ms; total {sum(overheads) / 1e9:.3f} s",
+        flush=True,
+    )
+
+
+def main():
+    bench("fifo")
+    bench("tgi")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
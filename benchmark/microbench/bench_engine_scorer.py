@@ -0,0 +1,234 @@
+"""Simulate a heterogeneous cluster to compare the engine scorers of the GlobalScheduler.
+
+The cluster has fast and slow engines (e.g. different GPU types) of the same model. The
+iteration latency of an engine is linear in its batch size, and the slow engines are
+SLOW_RATIO times slower. Requests arrive in a Poisson process, and are scheduled by the
+real GlobalScheduler. The engines are simulated in discrete events, and report their
+runtime info (running jobs, recent iteration latency) in heartbeats.
+
+We compare:
+- serve_layer: Rank engines by the serve-layer counters only (the old behavior).
+- load_aware: Rank engines by the estimated latency cost with the real-time load.
+
+and report the normalized latency (latency per output token) and the JCT of requests.
+"""
+
+import heapq
+import logging
+import random
+from typing import Dict, List
+
+from parrot.serve.scheduler import (
+    CompletionTask,
+    TaskCreator,
+    GlobalScheduler,
+    GlobalSchedulerConfig,
+)
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import RequestPlaceholder
+from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI, LATENCY_ANALYZER_RECENT_N
+
+
+NUM_FAST_ENGINES = 2
+NUM_SLOW_ENGINES = 2
+SLOW_RATIO = 3.0
+# Iteration latency of a fast engine: PER_JOB_LATENCY * (batch size + FIXED_COST_JOBS)
+PER_JOB_LATENCY = 0.002  # s
+FIXED_COST_JOBS = 8
+TASKS_CAPACITY = 64
+
+NUM_REQUESTS = 2000
+REQUEST_RATE = 6  # requests/s
+GEN_LEN_RANGE = (50, 250)  # tokens
+HEARTBEAT_INTERVAL = 0.5  # s
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class _SimEngine:
+    def __init__(self, engine_id: int, per_job_latency: float):
+        self.engine_id = engine_id
+        self.per_job_latency = per_job_latency
+        # task_id -> (task, remaining tokens)
+        self.running: Dict[int, List] = {}
+        self.batch: List[int] = []
+        self.busy = False
+        self.latencies: List[float] = []
+
+    def iteration_latency(self, batch_size: int) -> float:
+        return self.per_job_latency * (batch_size + FIXED_COST_JOBS)
+
+    def runtime_info(self) -> EngineRuntimeInfo:
+        recent = self.latencies[-LATENCY_ANALYZER_RECENT_N:]
+        return EngineRuntimeInfo(
+            num_running_jobs=len(self.running),
+            num_total_jobs=len(self.running),
+            recent_average_latency=(sum(recent) / len(recent) * 1e9 if recent else 0),
+        )
+
+
+def bench(engine_scorer: str) -> None:
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=GlobalSchedulerConfig(
+            engine_scorer=engine_scorer, max_queue_size=NUM_REQUESTS
+        ),
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    sim_engines: Dict[int, _SimEngine] = {}
+    for i in range(NUM_FAST_ENGINES + NUM_SLOW_ENGINES):
+        is_slow = i >= NUM_FAST_ENGINES
+        engine_id = engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"{'slow' if is_slow else 'fast'}_{i}",
+                engine_type=ENGINE_TYPE_OPENAI,
+                tasks_capacity=TASKS_CAPACITY,
+            )
+        )
+        per_job_latency = PER_JOB_LATENCY * (SLOW_RATIO if is_slow else 1)
+        sim_engines[engine_id] = _SimEngine(engine_id, per_job_latency)
+
+    # Events: (time, seq, kind, payload)
+    rng = random.Random(0)
+    events = []
+    seq = 0
+
+    def push_event(t: float, kind: str, payload=None):
+        nonlocal seq
+        heapq.heappush(events, (t, seq, kind, payload))
+        seq += 1
+
+    t = 0.0
+    for i in range(NUM_REQUESTS):
+        t += rng.expovariate(REQUEST_RATE)
+        push_event(t, "arrive", rng.randint(*GEN_LEN_RANGE))
+    push_event(0.0, "heartbeat")
+
+    arrive_time: Dict[int, float] = {}
+    gen_lens: Dict[int, int] = {}
+    normalized_latencies = []
+    jcts = []
+    tasks_per_engine: Dict[str, int] = {}
+    finished = 0
+
+    # Tasks submitted but not placed in the simulated engines yet.
+    pending_tasks: List[CompletionTask] = []
+    placed = set()
+
+    def start_iteration(sim_engine: _SimEngine, now: float):
+        if sim_engine.busy or len(sim_engine.running) == 0:
+            return
+        sim_engine.busy = True
+        sim_engine.batch = list(sim_engine.running.keys())
+        latency = sim_engine.iteration_latency(len(sim_engine.batch))
+        sim_engine.latencies.append(latency)
+        push_event(now + latency, "iteration", sim_engine.engine_id)
+
+    def dispatch(now: float):
+        scheduler.schedule()
+        for task in pending_tasks:
+            if task.is_scheduled and task.task_id not in placed:
+                placed.add(task.task_id)
+                sim_engine = sim_engines[task.engine.engine_id]
+                sim_engine.running[task.task_id] = [task, gen_lens[task.task_id]]
+                tasks_per_engine[task.engine.name] = (
+                    tasks_per_engine.get(task.engine.name, 0) + 1
+                )
+                start_iteration(sim_engine, now)
+        pending_tasks[:] = [
+            task for task in pending_tasks if task.task_id not in placed
+        ]
+
+    while finished < NUM_REQUESTS:
+        now, _, kind, payload = heapq.heappop(events)
+
+        if kind == "arrive":
+            request_chain = RequestChain.from_nodes(
+                nodes=[
+                    ConstantFill("This is a test "),
+                    PlaceholderGen(
+                        placeholder=RequestPlaceholder(name="a", is_output=True)
+                    ),
+                ]
+            )
+            request_chain.metadata.model_type = "text"
+            var_mgr.create_vars_for_request(session_id, request_chain)
+            comp_chain = request_chain.comp_chains[0]
+            activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+            task = task_creator.create_task(comp_chain)
+            arrive_time[task.task_id] = now
+            gen_lens[task.task_id] = payload
+            scheduler.submit_task(task)
+            pending_tasks.append(task)
+            dispatch(now)
+        elif kind == "iteration":
+            sim_engine = sim_engines[payload]
+            sim_engine.busy = False
+            finished_tasks = []
+            for task_id in sim_engine.batch:
+                entry = sim_engine.running[task_id]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    finished_tasks.append(entry[0])
+            for task in finished_tasks:
+                sim_engine.running.pop(task.task_id)
+                jct = now - arrive_time[task.task_id]
+                jcts.append(jct)
+                normalized_latencies.append(jct / gen_lens[task.task_id])
+                placed.discard(task.task_id)
+                task_creator.free_task(task)
+                finished += 1
+            start_iteration(sim_engine, now)
+            if len(finished_tasks) > 0:
+                dispatch(now)
+        elif kind == "heartbeat":
+            for engine_id, sim_engine in sim_engines.items():
+                engine_mgr.engine_heartbeat(engine_id, sim_engine.runtime_info())
+            push_event(now + HEARTBEAT_INTERVAL, "heartbeat")
+
+    print(
+        f"[{engine_scorer}] normalized latency avg: "
+        f"{sum(normalized_latencies) / len(normalized_latencies) * 1e3:.2f} ms/token, "
+        f"p99: {_percentile(normalized_latencies, 0.99) * 1e3:.2f} ms/token; "
+        f"JCT avg: {sum(jcts) / len(jcts):.2f} s, p99: {_percentile(jcts, 0.99):.2f} s; "
+        f"tasks per engine: {tasks_per_engine}",
+        flush=True,
+    )
+
+
+def main():
+    for engine_scorer in ["serve_layer", "load_aware"]:
+        bench(engine_scorer)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
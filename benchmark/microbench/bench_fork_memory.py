@@ -0,0 +1,144 @@
+"""Memory efficiency of forked contexts on a fork-heavy synthetic workload.
+
+NUM_REQUESTS requests share a system prompt of SYSTEM_PROMPT_LEN tokens. Each request
+is a chain of `num_svs` semantic variables, each filled in a context forked from the
+previous one, with random lengths in SV_LEN_RANGE. At the end of the chain,
+`num_branches` branches are forked and each generates GEN_LEN tokens. Two workloads:
+- chain: Long chains (one fork per SV), one branch.
+- fan_out: Short chains, many branches.
+
+We compare:
+- padding: The old way. A parent is padded to a block boundary when it's forked, and
+    the child starts at a new block.
+- copy_on_write: The child shares the last partial block of the parent. The first
+    context appending to it writes in place; others copy it.
+
+and report, when all contexts are alive, the number of allocated blocks and the memory
+efficiency (tokens / allocated slots), for two block sizes. Padded tokens also count in
+the context lengths (attended as garbage); copied blocks hold duplicates of the parent
+tokens in the partial block.
+"""
+
+import logging
+import random
+
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+NUM_BLOCKS = 1000000
+NUM_REQUESTS = 64
+SYSTEM_PROMPT_LEN = 237
+SV_LEN_RANGE = (5, 50)
+GEN_LEN = 32
+WORKLOADS = {
+    # name: (num_svs, num_branches)
+    "chain": (16, 1),
+    "fan_out": (2, 8),
+}
+
+
+class _PaddingContext:
+    """The old fork path of BlockContext: Pad the parent to a block boundary."""
+
+    def __init__(self, parent, allocator: BlockAllocator, block_size: int):
+        self.allocator = allocator
+        self.block_size = block_size
+        self.num_tokens = 0
+        self.padded = False
+        self.num_padded = 0
+        self.num_blocks = 0
+        if parent is not None and not parent.padded:
+            total_len = (
+                (parent.num_tokens + block_size - 1) // block_size * block_size
+            )
+            parent.num_padded += total_len - parent.num_tokens
+            parent.allocate(total_len - parent.num_tokens)
+            parent.padded = True
+
+    def allocate(self, length: int):
+        self.num_tokens += length
+        num_blocks = (self.num_tokens + self.block_size - 1) // self.block_size
+        self.allocator.allocate_n(num_blocks - self.num_blocks)
+        self.num_blocks = num_blocks
+
+
+def _run_workload(make_context, allocate, num_svs: int, num_branches: int) -> int:
+    """Return the number of tokens."""
+
+    rng = random.Random(0)
+    system_prompt = make_context(None)
+    allocate(system_prompt, SYSTEM_PROMPT_LEN)
+    num_tokens = SYSTEM_PROMPT_LEN
+
+    for _ in range(NUM_REQUESTS):
+        context = system_prompt
+        for _ in range(num_svs):
+            context = make_context(context)
+            sv_len = rng.randint(*SV_LEN_RANGE)
+            allocate(context, sv_len)
+            num_tokens += sv_len
+
+        branches = [make_context(context) for _ in range(num_branches)]
+        for _ in range(GEN_LEN):
+            for branch in branches:
+                allocate(branch, 1)
+        num_tokens += num_branches * GEN_LEN
+
+    return num_tokens
+
+
+def bench(name: str, workload: str, block_size: int) -> None:
+    allocator = BlockAllocator("KVCache pool", num_blocks=NUM_BLOCKS)
+    contexts = []
+
+    if name == "padding":
+
+        def make_context(parent):
+            context = _PaddingContext(parent, allocator, block_size)
+            contexts.append(context)
+            return context
+
+    else:
+
+        def make_context(parent):
+            context = BlockContext(
+                len(contexts),
+                parent,
+                kv_cache_manager=allocator,
+                block_size=block_size,
+            )
+            contexts.append(context)
+            return context
+
+    def allocate(context, length):
+        context.allocate(length)
+
+    num_tokens = _run_workload(make_context, allocate, *WORKLOADS[workload])
+    num_blocks = allocator.get_allocated_num()
+    efficiency = num_tokens / (num_blocks * block_size)
+
+    if name == "padding":
+        extra = f"padded tokens: {sum(c.num_padded for c in contexts)}"
+    else:
+        extra = f"copied blocks: {len(allocator.pop_pending_copies())}"
+    print(
+        f"[{name}, {workload}, block_size={block_size}] tokens: {num_tokens}, "
+        f"allocated blocks: {num_blocks}, efficiency: {efficiency * 100:.1f}%, "
+        f"{extra}",
+        flush=True,
+    )
+
+
+def main():
+    for workload in WORKLOADS:
+        for block_size in [16, 32]:
+            bench("padding", workload, block_size)
+            bench("copy_on_write", workload, block_size)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
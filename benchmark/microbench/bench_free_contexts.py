@@ -0,0 +1,164 @@
+"""Benchmark freeing the contexts of finished tasks in the ServeCore event loop.
+
+The engine is `parrot/testing/fake_engine_server.py`, launched in another process. A burst
+of tasks finishes at once (e.g. a session ends), and their contexts are freed. We compare:
+- sync: Free every context by a blocking `/free_context` request in the event loop (the
+    old behavior).
+- background: Free the contexts in the manager immediately, and release them in the
+    engine by one `/free_contexts` request per engine in the background loop.
+
+and report the time the event loop is blocked by freeing, the lag of the event loop (how
+late a periodic 1ms timer fires) and the time until all contexts are released in the
+engine.
+"""
+
+import asyncio
+import logging
+import time
+from multiprocessing import Process
+from typing import List
+
+import uvicorn
+
+from parrot.protocol.internal.layer_apis import ping_engine, free_context
+# NOTE: Import the scheduler first to avoid the circular import of the managers.
+from parrot.serve.scheduler import CompletionTask
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import RequestChain, ConstantFill, PlaceholderGen
+from parrot.serve.graph.request import RequestPlaceholder
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.testing.fake_engine_server import (
+    app as fake_engine_app,
+    TESTING_SERVER_HOST,
+    TESTING_SERVER_PORT,
+    TESTING_SERVER_URL,
+)
+
+
+NUM_TASKS = 500
+
+
+def _launch_fake_engine():
+    uvicorn.run(
+        fake_engine_app,
+        host=TESTING_SERVER_HOST,
+        port=TESTING_SERVER_PORT,
+        log_level="warning",
+    )
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _create_tasks(
+    context_mgr: ServeCoreContextManager, engine_mgr: EngineManager, engine_id: int
+) -> List[CompletionTask]:
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+    engine = engine_mgr.get_engine(engine_id)
+
+    tasks = []
+    for i in range(NUM_TASKS):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"Task {i}: please write something."),
+                PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        task = CompletionTask(task_id=i, chain=request_chain.comp_chains[0])
+        task.schedule_to(engine, update_engine_info=False)
+        context_mgr.set_task_contexts(task)
+        tasks.append(task)
+    return tasks
+
+
+async def _bench(background: bool) -> None:
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    engine_id = engine_mgr.register_engine(
+        EngineConfig(
+            engine_name="bench_engine",
+            engine_type=ENGINE_TYPE_OPENAI,
+            host=TESTING_SERVER_HOST,
+            port=TESTING_SERVER_PORT,
+        )
+    )
+    tasks = _create_tasks(context_mgr, engine_mgr, engine_id)
+    contexts_num = len(context_mgr.contexts)
+
+    loop_lags = []
+    done = False
+
+    async def ticker():
+        interval = 0.001
+        while not done:
+            st = time.perf_counter()
+            await asyncio.sleep(interval)
+            loop_lags.append(time.perf_counter() - st - interval)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+
+    st = time.perf_counter()
+    if background:
+        for task in tasks:
+            context_mgr.free_task_contexts(task)
+        for var_id in list(context_mgr.constant_prefix_contexts.keys()):
+            context_mgr.free_constant_prefix_contexts(var_id)
+        block_time = time.perf_counter() - st
+
+        # The background loop of ServeCore.
+        await context_mgr.wait_pending_free_contexts()
+        while await context_mgr.free_pending_contexts(engine_mgr) > 0:
+            await context_mgr.wait_pending_free_contexts()
+    else:
+        # The old behavior: one blocking request per context.
+        for context in list(context_mgr.contexts.values()):
+            free_context(http_addr=TESTING_SERVER_URL, context_id=context.context_id)
+        block_time = time.perf_counter() - st
+    release_time = time.perf_counter() - st
+
+    done = True
+    await ticker_task
+    await engine_mgr.close_client_sessions()
+
+    print(
+        f"[{'background' if background else 'sync'}] {contexts_num} contexts, "
+        f"loop blocked: {block_time * 1e3:.2f} ms, "
+        f"loop lag p99: {_percentile(loop_lags, 0.99) * 1e3:.2f} ms, "
+        f"max: {max(loop_lags) * 1e3:.2f} ms; "
+        f"released in engine: {release_time * 1e3:.2f} ms",
+        flush=True,
+    )
+
+
+def main():
+    for background in [False, True]:
+        asyncio.run(_bench(background))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    p = Process(target=_launch_fake_engine, daemon=True)
+    p.start()
+    # Wait for the engine server.
+    while not ping_engine(TESTING_SERVER_URL).pong:
+        time.sleep(0.1)
+
+    main()
+
+    p.terminate()
@@ -0,0 +1,196 @@
+"""Microbenchmark of `GlobalScheduler.schedule()` latency with a large task queue.
+
+Compare the indexed task queue with the old implementation, which scans the rest of the
+queue for every task to build groups (O(n^2) per tick).
+
+The queue is filled with N tasks. Every GROUP_SIZE tasks share a CompChainGroup (graph
+group) and every GROUP_SIZE tasks share the same first node (context group), for each of
+GROUP_SIZES. Engines are saturated after the first tick, so each measured tick tries
+(and fails) to schedule every queued task, which is the steady state of a busy
+ServeCore. Groups of 128 and 1024 tasks are larger than an engine can take (64 tasks).
+"""
+
+import logging
+import time
+from typing import List
+
+from parrot.serve.scheduler import (
+    CompletionTask,
+    GlobalScheduler,
+    GlobalSchedulerConfig,
+    TaskCreator,
+)
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import (
+    RequestChain,
+    CompChainGroup,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+
+
+GROUP_SIZES = [8, 128, 1024]
+NUM_ENGINES = 4
+NUM_TICKS = 5
+# The old implementation is too slow for larger queues / groups.
+LEGACY_MAX_TASKS = 10000
+LEGACY_MAX_GROUP_SIZE = 128
+
+
+class LegacyGlobalScheduler(GlobalScheduler):
+    """GlobalScheduler with the list-based task queue (baseline)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.task_queue: List[CompletionTask] = []
+
+    def submit_task(self, task: CompletionTask) -> None:
+        self.task_queue.append(task)
+
+    def schedule(self) -> None:
+        if self.config.app_fifo:
+            self.task_queue.sort(key=lambda x: -x.chain.depth)
+
+        for i, task in enumerate(self.task_queue):
+            if task.is_scheduled:
+                continue
+
+            cur_group: List[CompletionTask] = [task]
+            chain_groups = set(task.chain.chain_groups)
+
+            graph_group_enabled = self.config.graph_group
+            ctx_group_enabled = self.config.ctx_group
+
+            if graph_group_enabled or ctx_group_enabled:
+                for j in range(i + 1, len(self.task_queue)):
+                    task_j = self.task_queue[j]
+
+                    if graph_group_enabled:
+                        chain_groups_j = set(task_j.chain.chain_groups)
+                        common_groups = chain_groups.intersection(chain_groups_j)
+                        if len(common_groups) > 0:
+                            cur_group.append(task_j)
+                            chain_groups = common_groups
+                            ctx_group_enabled = False
+
+                    if ctx_group_enabled:
+                        if task.chain.first_node.sv == task_j.chain.first_node.sv:
+                            cur_group.append(task_j)
+                            graph_group_enabled = False
+
+            self._find_engine(cur_group)
+
+        self.task_queue = [task for task in self.task_queue if not task.is_scheduled]
+
+
+def _prepare(scheduler_cls, num_tasks: int, group_size: int) -> GlobalScheduler:
+    scheduler_cfg = GlobalSchedulerConfig(
+        app_fifo=True,
+        graph_group=True,
+        ctx_group=True,
+        ctx_aware=False,
+        max_queue_size=num_tasks,
+    )
+
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = scheduler_cls(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    # Text engines don't need tokenizers.
+    for i in range(NUM_ENGINES):
+        engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"bench_engine_{i}",
+                engine_type=ENGINE_TYPE_OPENAI,
+                tasks_capacity=64,
+            )
+        )
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    chain_group = None
+    for i in range(num_tasks):
+        metadata = SemanticCallMetadata.get_default()
+        metadata.model_type = "text"
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"This is a test {i // group_size}"),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        comp_chain = request_chain.comp_chains[0]
+
+        # Graph groups. Staggered with context groups.
+        if (i + group_size // 2) % group_size == 0:
+            chain_group = CompChainGroup()
+        if chain_group is not None:
+            comp_chain.chain_groups.append(chain_group)
+            chain_group.chains.add(comp_chain)
+
+        activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+        scheduler.submit_task(task_creator.create_task(comp_chain))
+
+    return scheduler
+
+
+def bench(scheduler_cls, num_tasks: int, group_size: int) -> None:
+    scheduler = _prepare(scheduler_cls, num_tasks, group_size)
+
+    # The first tick fills the engines.
+    st = time.perf_counter_ns()
+    scheduler.schedule()
+    first_tick = (time.perf_counter_ns() - st) / 1e6
+
+    latencies = []
+    for _ in range(NUM_TICKS):
+        st = time.perf_counter_ns()
+        scheduler.schedule()
+        latencies.append((time.perf_counter_ns() - st) / 1e6)
+
+    print(
+        f"[{scheduler_cls.__name__}] queued tasks: {num_tasks}, "
+        f"group size: {group_size}, "
+        f"first tick: {first_tick:.2f} ms, "
+        f"steady tick: {sum(latencies) / len(latencies):.2f} ms "
+        f"(per task: {sum(latencies) / len(latencies) / num_tasks * 1e3:.2f} us)",
+        flush=True,
+    )
+
+
+def main():
+    for group_size in GROUP_SIZES:
+        for num_tasks in [1000, 10000, 100000]:
+            if num_tasks <= LEGACY_MAX_TASKS and group_size <= LEGACY_MAX_GROUP_SIZE:
+                bench(LegacyGlobalScheduler, num_tasks, group_size)
+            bench(GlobalScheduler, num_tasks, group_size)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
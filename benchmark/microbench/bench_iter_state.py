@@ -0,0 +1,101 @@
+"""Microbenchmark of the CPU time of preparing the generation (decode) metadata of an
+iteration for paged attention: block tables, context lens and slot mapping.
+
+BATCH_SIZE jobs with prompts of PROMPT_LEN tokens decode NUM_STEPS tokens. We compare:
+- rebuild: The old way. The metadata is rebuilt from the block tables of the contexts
+    every iteration, padded, and copied to the device with one `torch.tensor` per
+    tensor.
+- persistent: DecodeMetadataBuffers. The rows of the sequences are kept across
+    iterations and updated in place, and copied to the device in one async copy.
+
+and report the time per iteration, for several batch sizes.
+"""
+
+import logging
+import time
+
+import numpy as np
+import torch
+
+from parrot.engine.builtin.iter_buffers import DecodeMetadataBuffers
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+BLOCK_SIZE = 16
+PROMPT_LEN = 1024
+NUM_STEPS = 128
+BATCH_SIZES = [8, 64, 256]
+
+
+def _sync() -> None:
+    if DEVICE == "cuda":
+        torch.cuda.synchronize()
+
+
+def _step_rebuild(contexts, meta_buffers):
+    block_tables = []
+    context_lens = []
+    slot_mapping = []
+    for context in contexts:
+        block_tables.append(context.get_context_block_table())
+        context_lens.append(context.get_context_len())
+        slot_mapping.append(context.get_context_slot_ids(1))
+
+    max_len = max(len(x) for x in block_tables)
+    padded = np.zeros((len(block_tables), max_len), dtype=np.int64)
+    for i, x in enumerate(block_tables):
+        padded[i, : len(x)] = x
+    return (
+        torch.tensor(padded, dtype=torch.int32, device=DEVICE),
+        torch.tensor(context_lens, dtype=torch.int32, device=DEVICE),
+        torch.tensor(np.stack(slot_mapping), dtype=torch.int32, device=DEVICE),
+    )
+
+
+def _step_persistent(contexts, meta_buffers):
+    return meta_buffers.update(contexts)
+
+
+def bench(name: str, batch_size: int) -> None:
+    num_blocks = batch_size * (PROMPT_LEN + NUM_STEPS) // BLOCK_SIZE + batch_size
+    allocator = BlockAllocator("KVCache pool", num_blocks=num_blocks)
+    contexts = []
+    for i in range(batch_size):
+        context = BlockContext(
+            i, None, kv_cache_manager=allocator, block_size=BLOCK_SIZE
+        )
+        context.allocate(PROMPT_LEN)
+        contexts.append(context)
+    meta_buffers = DecodeMetadataBuffers(BLOCK_SIZE, DEVICE)
+    step = _step_rebuild if name == "rebuild" else _step_persistent
+
+    prepare_time = 0
+    for _ in range(NUM_STEPS):
+        for context in contexts:
+            context.allocate(1)
+        _sync()
+        st = time.perf_counter_ns()
+        step(contexts, meta_buffers)
+        prepare_time += time.perf_counter_ns() - st
+        _sync()
+
+    print(
+        f"[{name}, {DEVICE}, batch_size={batch_size}] per iteration: "
+        f"{prepare_time / NUM_STEPS / 1e6:.3f} ms",
+        flush=True,
+    )
+
+
+def main():
+    for batch_size in BATCH_SIZES:
+        bench("rebuild", batch_size)
+        bench("persistent", batch_size)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,95 @@
+"""Measure the bandwidth of swapping KV blocks of preempted contexts, to set
+`swap_bandwidth` in the builtin engine config.
+
+Contexts of CONTEXT_LEN tokens are swapped out to the host swap buffer (pinned memory for
+CUDA devices; a memory-mapped file for CPU devices) and swapped in again. The KV cache
+has the shape of a 7B model (32 layers, 32 heads, head size 128, float16) with fewer
+blocks. We compare:
+- swap: Swap out and swap in each context.
+- recompute (estimated): The cost model of recomputing with the default
+    `recompute_throughput`.
+
+and report the time per context, and the effective swap bandwidth.
+"""
+
+import logging
+import time
+
+import torch
+
+from parrot.engine.builtin.kv_swap import KVSwapManager
+from parrot.engine.context.block_context import BlockContext
+from parrot.engine.context.block_allocator import BlockAllocator
+
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+NUM_LAYERS = 32
+NUM_HEADS = 32
+HEAD_SIZE = 128
+BLOCK_SIZE = 16
+NUM_BLOCKS = 64
+CONTEXT_LEN = 128
+NUM_CONTEXTS = 8
+
+
+def _sync() -> None:
+    if DEVICE == "cuda":
+        torch.cuda.synchronize()
+
+
+def main():
+    shape = [NUM_LAYERS, NUM_BLOCKS, NUM_HEADS, HEAD_SIZE, BLOCK_SIZE]
+    k_cache = torch.zeros(shape, dtype=torch.float16, device=DEVICE)
+    v_cache = torch.zeros(shape, dtype=torch.float16, device=DEVICE)
+    kv_cache_manager = BlockAllocator("KVCache pool", num_blocks=NUM_BLOCKS)
+    swap_manager = KVSwapManager(
+        k_cache,
+        v_cache,
+        kv_cache_manager,
+        block_size=BLOCK_SIZE,
+        preempt_mode="swap",
+        num_swap_blocks=NUM_BLOCKS,
+    )
+
+    contexts = []
+    for i in range(NUM_CONTEXTS):
+        context = BlockContext(
+            i, None, kv_cache_manager=kv_cache_manager, block_size=BLOCK_SIZE
+        )
+        context.token_ids.extend(range(CONTEXT_LEN))
+        context.allocate(CONTEXT_LEN)
+        contexts.append(context)
+
+    _sync()
+    st = time.perf_counter_ns()
+    for context in contexts:
+        swap_manager.swap_out(context)
+    _sync()
+    swap_out_time = (time.perf_counter_ns() - st) / 1e9
+
+    st = time.perf_counter_ns()
+    for context in contexts:
+        swap_manager.swap_in(context)
+    _sync()
+    swap_in_time = (time.perf_counter_ns() - st) / 1e9
+
+    num_bytes = NUM_CONTEXTS * CONTEXT_LEN // BLOCK_SIZE * swap_manager.block_bytes
+    print(
+        f"[swap, {DEVICE}] per context: out {swap_out_time / NUM_CONTEXTS * 1e3:.2f} ms, "
+        f"in {swap_in_time / NUM_CONTEXTS * 1e3:.2f} ms; "
+        f"bandwidth: {2 * num_bytes / (swap_out_time + swap_in_time) / 1e9:.2f} GB/s",
+        flush=True,
+    )
+    print(
+        f"[recompute, estimated] per context: "
+        f"{swap_manager.get_recompute_cost(contexts[0]) * 1e3:.2f} ms "
+        f"(recompute_throughput={swap_manager.recompute_throughput:.0f} tokens/s)",
+        flush=True,
+    )
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,197 @@
+"""Measure the tokenization cost per task with multiple model families in one cluster.
+
+Three engines serve three models with different tokenizers. We compare:
+- eager: Tokenize every task by all registered tokenizers before scheduling (the old
+    behavior).
+- lazy: Estimate the tokens num for scheduling, and tokenize the task by the tokenizer of
+    the scheduled engine only.
+
+and report the tokenizers used per task, the tokenization time, the token ids held by each
+task and the error of the estimated tokens num.
+
+Byte-level BPE tokenizers are trained locally so that the benchmark runs without network.
+"""
+
+import logging
+import random
+import time
+
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers, decoders
+from transformers import PreTrainedTokenizerFast
+
+from parrot.serve.scheduler import (
+    TaskCreator,
+    GlobalScheduler,
+    GlobalSchedulerConfig,
+)
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import RequestPlaceholder
+from parrot.engine.config import EngineConfig
+
+
+NUM_TASKS = 600
+PROMPT_WORDS = 800
+# (model, tokenizer, vocab size)
+MODELS = [
+    ("llama", "bench/llama-tokenizer", 2048),
+    ("opt", "bench/opt-tokenizer", 4096),
+    ("vicuna", "bench/vicuna-tokenizer", 8192),
+]
+
+_WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have "
+    "from or one had by word but not what all were we when your can said there use an each "
+    "which she do how their if will up other about out many then them these so some her "
+    "would make like him into time has look two more write go see number no way could "
+    "people my than first water been call who oil its now find long down day did get come "
+    "made may part assistant answer question context document summary please following "
+    "helpful concise detailed explain step reason task user output format json list"
+).split()
+
+
+def _random_text(rng: random.Random, words_num: int) -> str:
+    words = [
+        rng.choice(_WORDS) if rng.random() < 0.9 else str(rng.randint(0, 99999))
+        for _ in range(words_num)
+    ]
+    return " ".join(words)
+
+
+def _build_tokenizer(vocab_size: int) -> PreTrainedTokenizerFast:
+    rng = random.Random(vocab_size)
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(
+        [_random_text(rng, 100) for _ in range(2000)], trainer
+    )
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+def bench(lazy: bool, tokenizers) -> None:
+    tokenizers_wrapper = TokenizersWrapper()
+    # Registered in advance, so that the engine manager won't load them from the hub.
+    tokenizers_wrapper.tokenizers.update(tokenizers)
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=GlobalSchedulerConfig(max_queue_size=NUM_TASKS),
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    for model, tokenizer_name, _ in MODELS:
+        engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"bench_{model}",
+                model=model,
+                tokenizer=tokenizer_name,
+                tasks_capacity=NUM_TASKS,
+                tokens_capacity=1 << 30,
+            )
+        )
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    rng = random.Random(0)
+    tokenize_time = 0
+    held_tokens_num = 0
+    estimate_errors = []
+
+    for _ in range(NUM_TASKS):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(_random_text(rng, PROMPT_WORDS)),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ]
+        )
+        # Spread the tasks to all engines.
+        request_chain.metadata.models = [rng.choice(MODELS)[0]]
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+        task = task_creator.create_task(comp_chain)
+
+        st = time.perf_counter_ns()
+        if lazy:
+            task.estimate_tokens_num(tokenizers_wrapper)
+        else:
+            task.tokenize_chain(tokenizers_wrapper)
+        tokenize_time += time.perf_counter_ns() - st
+
+        scheduler.submit_task(task)
+        scheduler.schedule()
+        engine = task.engine
+
+        if lazy:
+            estimated_tokens_num = task.get_token_nums(engine.tokenizer_name)
+            st = time.perf_counter_ns()
+            task.tokenize_chain(tokenizers_wrapper, [engine.tokenizer_name])
+            tokenize_time += time.perf_counter_ns() - st
+            engine.update_servelayer_runtime_info_task_tokens(task)
+
+            real_tokens_num = task.get_token_nums(engine.tokenizer_name)
+            estimate_errors.append(
+                abs(estimated_tokens_num - real_tokens_num) / real_tokens_num
+            )
+
+        held_tokens_num += sum(
+            len(token_ids)
+            for token_ids_list in task.tokenized_result.values()
+            for token_ids in token_ids_list
+        )
+        task_creator.free_task(task)
+
+    encoded_texts_num = sum(tokenizers_wrapper.encoded_texts_num.values())
+    result = (
+        f"[{'lazy' if lazy else 'eager'}] tokenizers per task: "
+        f"{encoded_texts_num / NUM_TASKS:.2f}, "
+        f"tokenize time per task: {tokenize_time / NUM_TASKS / 1e3:.1f} us, "
+        f"token ids held per task: {held_tokens_num / NUM_TASKS:.0f}"
+    )
+    if lazy:
+        result += (
+            f", estimation error: avg {sum(estimate_errors) / len(estimate_errors) * 100:.2f}%, "
+            f"max {max(estimate_errors) * 100:.2f}%"
+        )
+    print(result, flush=True)
+
+
+def main():
+    tokenizers = {
+        tokenizer_name: _build_tokenizer(vocab_size)
+        for _, tokenizer_name, vocab_size in MODELS
+    }
+
+    for lazy in [False, True]:
+        bench(lazy, tokenizers)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,111 @@
+"""Prefill savings of prefix caching on a shared-prompt synthetic workload.
+
+NUM_REQUESTS requests arrive one after another, in NUM_CONCURRENT concurrent slots. A
+request is a Fill of a prompt (one of NUM_SYSTEM_PROMPTS system prompts of
+SYSTEM_PROMPT_LEN tokens, followed by a unique query of QUERY_LEN_RANGE tokens) in a
+fresh context, followed by GEN_LEN generated tokens. The context is freed when the
+request finishes. We compare:
+- no_caching: Every prompt is computed from scratch.
+- prefix_caching: Full blocks are registered by their content, reused by later Fills,
+    and kept in the LRU pool after their contexts are freed, until the memory is
+    needed.
+
+and report the number of prefill tokens computed, the block hit rate and the CPU time
+of the block bookkeeping (hashing, lookups and allocation) per request, for two pool
+sizes: a large pool, and a small one where the cached blocks are reclaimed.
+"""
+
+import logging
+import random
+import time
+
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+BLOCK_SIZE = 16
+NUM_REQUESTS = 512
+NUM_CONCURRENT = 16
+NUM_SYSTEM_PROMPTS = 32
+SYSTEM_PROMPT_LEN = 1024
+QUERY_LEN_RANGE = (16, 256)
+GEN_LEN = 64
+POOL_SIZES = {
+    # name: num_blocks
+    "large": 8192,
+    "small": 1536,
+}
+
+
+def _fill(context: BlockContext, token_ids) -> int:
+    """Fill the context as the runner does. Return the number of computed tokens."""
+
+    num_reused = context.reuse_cached_blocks(token_ids)
+    token_ids = token_ids[num_reused:]
+    context.token_ids.extend(token_ids)
+    context.allocate(len(token_ids))
+    context.register_full_blocks()
+    return len(token_ids)
+
+
+def _generate(context: BlockContext, token_id: int) -> None:
+    context.allocate(1)
+    context.push_token_id(token_id)
+    context.register_full_blocks()
+
+
+def bench(name: str, pool: str) -> None:
+    allocator = BlockAllocator(
+        "KVCache pool",
+        num_blocks=POOL_SIZES[pool],
+        enable_prefix_caching=name == "prefix_caching",
+    )
+    rng = random.Random(0)
+    system_prompts = [
+        [rng.randrange(32000) for _ in range(SYSTEM_PROMPT_LEN)]
+        for _ in range(NUM_SYSTEM_PROMPTS)
+    ]
+
+    num_prompt_tokens = 0
+    num_computed_tokens = 0
+    running = []
+    st = time.perf_counter_ns()
+    for i in range(NUM_REQUESTS):
+        if len(running) == NUM_CONCURRENT:
+            context = running.pop(0)
+            for _ in range(GEN_LEN):
+                _generate(context, rng.randrange(32000))
+            context.destruction()
+
+        query_len = rng.randint(*QUERY_LEN_RANGE)
+        prompt = rng.choice(system_prompts) + [
+            rng.randrange(32000) for _ in range(query_len)
+        ]
+        context = BlockContext(
+            i, None, kv_cache_manager=allocator, block_size=BLOCK_SIZE
+        )
+        num_prompt_tokens += len(prompt)
+        num_computed_tokens += _fill(context, prompt)
+        running.append(context)
+    per_request = (time.perf_counter_ns() - st) / NUM_REQUESTS / 1e6
+
+    print(
+        f"[{name}, pool={pool}] prefill tokens computed: {num_computed_tokens} / "
+        f"{num_prompt_tokens} ({num_computed_tokens / num_prompt_tokens * 100:.1f}%), "
+        f"block hit rate: {allocator.get_prefix_cache_hit_rate() * 100:.1f}%, "
+        f"bookkeeping per request: {per_request:.3f} ms",
+        flush=True,
+    )
+
+
+def main():
+    for pool in POOL_SIZES:
+        bench("no_caching", pool)
+        bench("prefix_caching", pool)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,162 @@
+"""Benchmark add/query throughput of PrefixMatcher on 100k synthetic prompts.
+
+Prompts are composed of a system prompt (chosen from a Zipf-distributed pool) followed by a
+unique user text, and a fraction of prompts has no system prompt. We measure:
+- Add/query throughput.
+- Hit rate: fraction of prompts (with system prompts) whose split covers the system prompt.
+- Memory usage of the matcher.
+
+The old matcher (40-character lookup + string comparison, no eviction) is the baseline.
+"""
+
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from parrot.serve.prefix_matcher import PrefixMatcher
+
+
+NUM_PROMPTS = 100000
+NUM_SYSTEM_PROMPTS = 200
+NO_SYSTEM_PROMPT_RATIO = 0.1
+
+_WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have "
+    "from or one had by word but not what all were we when your can said there use an each "
+    "which she do how their if will up other about out many then them these so some her "
+    "would make like him into time has look two more write go see number no way could "
+    "people my than first water been call who oil its now find long down day did get come "
+    "made may part assistant answer question context document summary please following "
+    "helpful concise detailed explain step reason task user output format json list"
+).split()
+
+
+class LegacyPrefixMatcher:
+    """The old PrefixMatcher (baseline)."""
+
+    _START_LEN = 40
+    _GP_THRESHOLD = 3
+
+    def __init__(self):
+        self._prefix_counter: Dict[str, Dict[str, int]] = {}
+
+    def add_prefix(self, prefix: str) -> None:
+        if len(prefix) <= self._START_LEN:
+            return
+
+        lookup = prefix[: self._START_LEN]
+        if lookup not in self._prefix_counter:
+            self._prefix_counter[lookup] = {}
+
+        for k in list(self._prefix_counter[lookup].keys()):
+            if k[self._START_LEN] == prefix[self._START_LEN]:
+                i = self._START_LEN
+                while i < len(k) and i < len(prefix) and k[i] == prefix[i]:
+                    i += 1
+                new_k = k[:i]
+                if i == len(k):
+                    self._prefix_counter[lookup][k] += 1
+                else:
+                    self._prefix_counter[lookup][new_k] = (
+                        self._prefix_counter[lookup][k] + 1
+                    )
+                    self._prefix_counter[lookup].pop(k)
+                return
+
+        self._prefix_counter[lookup][prefix] = 1
+
+    def query_prefix(self, prefix: str) -> int:
+        if len(prefix) <= self._START_LEN:
+            return -1
+
+        lookup = prefix[: self._START_LEN]
+        if lookup not in self._prefix_counter:
+            return -1
+
+        for k, v in self._prefix_counter[lookup].items():
+            if v > self._GP_THRESHOLD and prefix.startswith(k):
+                return len(k)
+        return -1
+
+    @property
+    def memory_usage(self) -> int:
+        return sum(
+            sys.getsizeof(k) for bucket in self._prefix_counter.values() for k in bucket
+        )
+
+
+def _random_text(rng: random.Random, min_words: int, max_words: int) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(min_words, max_words))
+    return " ".join(words)
+
+
+def _generate_prompts(rng: random.Random) -> List[Tuple[str, str]]:
+    """Returns a list of (system prompt, prompt)."""
+
+    system_prompts = [
+        _random_text(rng, 50, 400).capitalize() + ".\n\n"
+        for _ in range(NUM_SYSTEM_PROMPTS)
+    ]
+    weights = [1 / (i + 1) for i in range(NUM_SYSTEM_PROMPTS)]
+
+    prompts = []
+    for _ in range(NUM_PROMPTS):
+        user_text = _random_text(rng, 10, 150)
+        if rng.random() < NO_SYSTEM_PROMPT_RATIO:
+            prompts.append(("", user_text))
+        else:
+            system_prompt = rng.choices(system_prompts, weights=weights)[0]
+            prompts.append((system_prompt, system_prompt + user_text))
+    return prompts
+
+
+def bench(name: str, matcher, prompts: List[Tuple[str, str]]) -> None:
+    add_time = 0
+    query_time = 0
+    hits = 0
+    total = 0
+
+    for system_prompt, prompt in prompts:
+        st = time.perf_counter_ns()
+        matcher.add_prefix(prompt)
+        add_time += time.perf_counter_ns() - st
+
+        st = time.perf_counter_ns()
+        pos = matcher.query_prefix(prompt)
+        query_time += time.perf_counter_ns() - st
+
+        if system_prompt != "":
+            total += 1
+            if pos >= len(system_prompt.rstrip()):
+                hits += 1
+
+    print(
+        f"[{name}] add: {len(prompts) / add_time * 1e9:.0f} prompts/s, "
+        f"query: {len(prompts) / query_time * 1e9:.0f} prompts/s, "
+        f"hit rate: {hits / total * 100:.2f}%, "
+        f"memory: {matcher.memory_usage / 1024 / 1024:.2f} MB",
+        flush=True,
+    )
+
+
+def main():
+    prompts = _generate_prompts(random.Random(0))
+    avg_len = sum(len(p) for _, p in prompts) / len(prompts)
+    print(f"{len(prompts)} prompts, average length: {avg_len:.0f} chars", flush=True)
+
+    bench("legacy", LegacyPrefixMatcher(), prompts)
+    for evict_policy in ["lru", "lfu"]:
+        for memory_budget in [64 * 1024 * 1024, 4 * 1024 * 1024]:
+            matcher = PrefixMatcher(
+                memory_budget=memory_budget, evict_policy=evict_policy
+            )
+            bench(
+                f"trie, {evict_policy}, budget={memory_budget // 1024 // 1024}MB",
+                matcher,
+                prompts,
+            )
+
+
+if __name__ == "__main__":
+    main()
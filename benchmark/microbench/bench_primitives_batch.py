@@ -0,0 +1,179 @@
+"""Benchmark coalescing the primitives of a map-reduce into /primitives_batch requests.
+
+The engine is `parrot/testing/fake_engine_server.py` (with zero per-token time, so only
+the overhead of requests is measured), launched in another process. A map-reduce with
+NUM_BRANCHES branches runs in ServeCore: each branch Fills its chunk and Generates, then
+the reduce step Fills the results and Generates. We compare:
+- no_batch: Each primitive is its own HTTP request (the old behavior).
+- batch: Primitives to the engine within the batch window are coalesced by the
+    PrimitiveBatcher into one /primitives_batch request.
+
+and report the number of HTTP requests per primitive and the latency of the map-reduce.
+"""
+
+import asyncio
+import logging
+import time
+from multiprocessing import Process
+from typing import List
+
+import uvicorn
+
+from parrot.protocol.internal.layer_apis import ping_engine
+from parrot.protocol.internal.primitive_request import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+# NOTE: Import the scheduler first to avoid the circular import of the managers.
+from parrot.serve.scheduler import CompletionTask
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.primitive_batcher import PrimitiveBatcher
+from parrot.engine.config import EngineConfig
+from parrot.constants import (
+    ENGINE_TYPE_OPENAI,
+    DEFAULT_PRIMITIVES_BATCH_WINDOW,
+    PRIMITIVES_NO_BATCH,
+)
+from parrot.testing import fake_engine_server
+from parrot.testing.fake_engine_server import (
+    app as fake_engine_app,
+    TESTING_SERVER_HOST,
+    TESTING_SERVER_PORT,
+    TESTING_SERVER_URL,
+)
+
+
+NUM_BRANCHES = 64
+CHUNK_TOKENS_NUM = 256
+NUM_ROUNDS = 20
+
+
+def _launch_fake_engine():
+    fake_engine_server.TESTING_FILL_PERTOKEN_TIME = 0
+    fake_engine_server.TESTING_DECODE_PERTOKEN_TIME = 0
+    uvicorn.run(
+        fake_engine_app,
+        host=TESTING_SERVER_HOST,
+        port=TESTING_SERVER_PORT,
+        log_level="warning",
+    )
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _map_reduce(batcher: PrimitiveBatcher, round_id: int) -> None:
+    async def run_branch(context_id: int, parent_context_id: int, tokens_num: int):
+        await batcher.submit(
+            Fill(
+                session_id=0,
+                task_id=context_id,
+                context_id=context_id,
+                parent_context_id=parent_context_id,
+                end_flag=False,
+                token_ids=list(range(tokens_num)),
+            )
+        )
+        await batcher.submit(
+            Generate(
+                session_id=0,
+                task_id=context_id,
+                context_id=context_id,
+                parent_context_id=parent_context_id,
+                end_flag=False,
+                sampling_config=SamplingConfig(),
+            )
+        )
+
+    base_id = round_id * (NUM_BRANCHES + 1)
+    # Map
+    await asyncio.gather(
+        *[
+            run_branch(base_id + i, -1, CHUNK_TOKENS_NUM)
+            for i in range(NUM_BRANCHES)
+        ]
+    )
+    # Reduce
+    await run_branch(base_id + NUM_BRANCHES, -1, NUM_BRANCHES * 16)
+
+
+async def _bench(batch_window: float) -> None:
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=ServeCoreContextManager(),
+        engine_heartbeat_timeout=666,
+    )
+    engine_id = engine_mgr.register_engine(
+        EngineConfig(
+            engine_name="bench_engine",
+            engine_type=ENGINE_TYPE_OPENAI,
+            host=TESTING_SERVER_HOST,
+            port=TESTING_SERVER_PORT,
+            primitives_batch_window=batch_window,
+        )
+    )
+    batcher = engine_mgr.get_primitive_batcher(engine_id)
+
+    # Count the HTTP requests.
+    requests_num = 0
+    if batch_window == PRIMITIVES_NO_BATCH:
+        submit = batcher.submit
+
+        async def counted_submit(primitive):
+            nonlocal requests_num
+            requests_num += 1
+            return await submit(primitive)
+
+        batcher.submit = counted_submit
+    else:
+        send = batcher._send
+
+        async def counted_send(batch):
+            nonlocal requests_num
+            requests_num += 1
+            return await send(batch)
+
+        batcher._send = counted_send
+
+    await _map_reduce(batcher, NUM_ROUNDS)  # Warm up
+    requests_num = 0
+
+    latencies = []
+    for round_id in range(NUM_ROUNDS):
+        st = time.perf_counter()
+        await _map_reduce(batcher, round_id)
+        latencies.append(time.perf_counter() - st)
+
+    await engine_mgr.close_client_sessions()
+
+    primitives_num = NUM_ROUNDS * (NUM_BRANCHES + 1) * 2
+    name = "no_batch" if batch_window == PRIMITIVES_NO_BATCH else "batch"
+    print(
+        f"[{name}] {NUM_BRANCHES} branches, "
+        f"requests per primitive: {requests_num / primitives_num:.3f}, "
+        f"map-reduce latency avg: {sum(latencies) / len(latencies) * 1e3:.2f} ms, "
+        f"p99: {_percentile(latencies, 0.99) * 1e3:.2f} ms",
+        flush=True,
+    )
+
+
+def main():
+    for batch_window in [PRIMITIVES_NO_BATCH, DEFAULT_PRIMITIVES_BATCH_WINDOW]:
+        asyncio.run(_bench(batch_window))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    p = Process(target=_launch_fake_engine, daemon=True)
+    p.start()
+    # Wait for the engine server.
+    while not ping_engine(TESTING_SERVER_URL).pong:
+        time.sleep(0.1)
+
+    main()
+
+    p.terminate()
@@ -0,0 +1,144 @@
+"""Compare the event-driven ServeCore loop with the old polling loop.
+
+Metrics:
+- Idle CPU usage of the ServeCore process (no task, no engine activity).
+- Submit-to-dispatch latency of tasks, i.e. from `GlobalScheduler.submit_task` to
+  the task being scheduled to an engine.
+"""
+
+import asyncio
+import logging
+import time
+import numpy as np
+
+from parrot.serve.core import ParrotServeCore, create_serve_core
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.testing.get_configs import get_sample_core_config_path
+
+
+# The interval of the polling loop before the event-driven version.
+POLLING_LOOP_INTERVAL = 0.0001
+
+
+async def polling_serve_loop(core: ParrotServeCore) -> None:
+    """The polling ServeCore loop (baseline)."""
+
+    while True:
+        core.session_mgr.check_running_sessions()
+        core.session_mgr.sweep_not_running_sessions()
+        core.engine_mgr.update_expired_engines()
+        core.engine_mgr.sweep_not_running_engines()
+
+        expired_vars = core.var_mgr.free_expired_constant_prefix_vars()
+        for var in expired_vars:
+            core.context_mgr.free_constant_prefix_contexts(var.id)
+
+        core.global_scheduler.schedule()
+
+        await asyncio.sleep(POLLING_LOOP_INTERVAL)
+
+
+def event_serve_loop(core: ParrotServeCore):
+    return core.serve_loop()
+
+
+def _create_core() -> ParrotServeCore:
+    core = create_serve_core(get_sample_core_config_path("localhost_serve_core.json"))
+    # Text engines don't need tokenizers.
+    core.register_engine(
+        {
+            "engine_config": EngineConfig(
+                engine_name="bench_engine",
+                engine_type=ENGINE_TYPE_OPENAI,
+                tasks_capacity=512,
+            ).__dict__
+        }
+    )
+    return core
+
+
+def _create_task(core: ParrotServeCore, session_id: int):
+    metadata = SemanticCallMetadata.get_default()
+    metadata.model_type = "text"
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("This is a test "),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ],
+        metadata=metadata,
+    )
+    core.var_mgr.create_vars_for_request(session_id, request_chain)
+    comp_chain = request_chain.comp_chains[0]
+    activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+    return core.task_creator.create_task(comp_chain)
+
+
+async def _bench_idle_cpu(loop_fn, duration: float) -> float:
+    core = _create_core()
+    loop_task = asyncio.create_task(loop_fn(core))
+
+    st_cpu = time.process_time()
+    st = time.perf_counter()
+    await asyncio.sleep(duration)
+    cpu_usage = (time.process_time() - st_cpu) / (time.perf_counter() - st)
+
+    loop_task.cancel()
+    return cpu_usage
+
+
+async def _bench_dispatch_latency(loop_fn, num_tasks: int) -> np.ndarray:
+    core = _create_core()
+    session_id = core.session_mgr.register_session()
+    loop_task = asyncio.create_task(loop_fn(core))
+
+    latencies = []
+    for _ in range(num_tasks):
+        task = _create_task(core, session_id)
+        # Random arrival
+        await asyncio.sleep(np.random.uniform(0, 0.002))
+
+        st = time.perf_counter_ns()
+        core.global_scheduler.submit_task(task)
+        await task.wait_scheduled()
+        latencies.append(time.perf_counter_ns() - st)
+
+        core.task_creator.free_task(task)
+        core.global_scheduler.wakeup()
+
+    loop_task.cancel()
+    return np.array(latencies) / 1e3  # us
+
+
+async def main():
+    np.random.seed(0)
+
+    for name, loop_fn in [
+        ("polling", polling_serve_loop),
+        ("event-driven", event_serve_loop),
+    ]:
+        cpu_usage = await _bench_idle_cpu(loop_fn, duration=3)
+        latencies = await _bench_dispatch_latency(loop_fn, num_tasks=1000)
+        print(
+            f"[{name}] idle CPU usage: {cpu_usage * 100:.2f}%, "
+            f"submit-to-dispatch latency (us): "
+            f"mean={latencies.mean():.2f}, p50={np.percentile(latencies, 50):.2f}, "
+            f"p99={np.percentile(latencies, 99):.2f}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    # Logging dominates the latency. Disable it like the release mode.
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    asyncio.run(main())
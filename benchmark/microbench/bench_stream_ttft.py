@@ -0,0 +1,242 @@
+"""Measure time-to-first-token (TTFT) of Generate in the GraphExecutor.
+
+A fake engine (in another thread) serves /fill, /primitives_batch and /generate_stream,
+decoding a token every DECODE_TIME seconds. Concurrent requests are submitted to a
+GraphExecutor and we measure, from the activation of the chain:
+- TTFT: the time until the first piece of text is available in the output SV.
+- Completion time: the time until the output SV is ready, which was the TTFT before
+    streaming (the executor waited for the whole generation).
+
+A byte-level BPE tokenizer is trained locally so that the benchmark runs without network.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from aiohttp import web
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers, decoders
+from transformers import PreTrainedTokenizerFast
+
+from parrot.serve.scheduler import TaskCreator, GlobalScheduler, GlobalSchedulerConfig
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.session.graph_executor import GraphExecutor
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import RequestPlaceholder
+from parrot.engine.config import EngineConfig
+from parrot.protocol.wire_format import (
+    JSON_CONTENT_TYPE,
+    decode_payload,
+    encode_payload,
+    encode_frame,
+)
+from parrot.sampling_config import SamplingConfig
+
+
+ENGINE_HOST = "localhost"
+ENGINE_PORT = 9871
+TOKENIZER_NAME = "bench/tokenizer"
+# LATENCY criteria allows 4 tasks in an engine. More requests will be queued.
+NUM_REQUESTS = 4
+GEN_TOKENS_NUM = 100
+DECODE_TIME = 0.02  # s per token
+
+_WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have "
+    "from or one had by word but not what all were we when your can said there use an each "
+    "which she do how their if will up other about out many then them these so some her "
+    "would make like him into time has look two more write go see number no way could"
+).split()
+
+
+def _build_tokenizer() -> PreTrainedTokenizerFast:
+    rng = random.Random(0)
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=1024, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(
+        [" ".join(rng.choices(_WORDS, k=100)) for _ in range(1000)], trainer
+    )
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+# ---------- Fake Engine ----------
+
+
+def _run_fake_engine(gen_token_ids, started: threading.Event) -> None:
+    async def fill(request):
+        payload = decode_payload(request.content_type, await request.read())
+        return web.json_response({"filled_len": len(payload["token_ids"])})
+
+    async def primitives_batch(request):
+        # Fills of concurrent requests are batched. Reply each result in a frame.
+        payload = decode_payload(request.content_type, await request.read())
+        resp = web.StreamResponse(headers={"Content-Type": JSON_CONTENT_TYPE})
+        await resp.prepare(request)
+        for i, item in enumerate(payload["primitives"]):
+            result = {"index": i, "filled_len": len(item["token_ids"])}
+            await resp.write(encode_frame(encode_payload(result, [], binary=False)))
+        await resp.write_eof()
+        return resp
+
+    async def generate_stream(request):
+        await request.json()
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for token_id in gen_token_ids:
+            await asyncio.sleep(DECODE_TIME)
+            await resp.write(token_id.to_bytes(4, "big"))
+        await resp.write_eof()
+        return resp
+
+    async def free_context(request):
+        return web.json_response({"context_len": 0})
+
+    app = web.Application()
+    app.router.add_post("/fill", fill)
+    app.router.add_post("/primitives_batch", primitives_batch)
+    app.router.add_post("/generate_stream", generate_stream)
+    app.router.add_post("/free_context", free_context)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, ENGINE_HOST, ENGINE_PORT).start())
+    started.set()
+    loop.run_forever()
+
+
+# ---------- Benchmark ----------
+
+
+async def _bench(tokenizer) -> None:
+    tokenizers_wrapper = TokenizersWrapper()
+    # Registered in advance, so that the engine manager won't load it from the hub.
+    tokenizers_wrapper.tokenizers[TOKENIZER_NAME] = tokenizer
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(GlobalSchedulerConfig(), engine_mgr, context_mgr)
+    task_creator = TaskCreator()
+    var_mgr = SemanticVariableManager(666)
+
+    engine_mgr.register_engine(
+        EngineConfig(
+            engine_name="bench_engine",
+            model="bench",
+            host=ENGINE_HOST,
+            port=ENGINE_PORT,
+            tokenizer=TOKENIZER_NAME,
+        )
+    )
+
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+    executor = GraphExecutor(
+        session_id=session_id,
+        task_creator=task_creator,
+        scheduler=scheduler,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+        tokenizers_wrapper=tokenizers_wrapper,
+    )
+
+    async def schedule_loop():
+        while True:
+            await scheduler.wait_wakeup()
+            scheduler.schedule()
+
+    schedule_task = asyncio.create_task(schedule_loop())
+
+    async def run_request(i: int):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"Request {i}: please write something."),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(
+                        name="a",
+                        is_output=True,
+                        sampling_config=SamplingConfig(
+                            max_gen_length=GEN_TOKENS_NUM, ignore_tokenizer_eos=True
+                        ),
+                    )
+                ),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        executor.add_request(request_chain)
+        out_var = request_chain.comp_chains[0].gen_node.sv
+
+        st = time.perf_counter()
+        activate_completion_chain(
+            request_chain.comp_chains[0], PerformanceCriteria.LATENCY
+        )
+        ttft = None
+        async for _ in out_var.astream():
+            if ttft is None:
+                ttft = time.perf_counter() - st
+        completion_time = time.perf_counter() - st
+
+        return ttft, completion_time
+
+    results = await asyncio.gather(*[run_request(i) for i in range(NUM_REQUESTS)])
+    schedule_task.cancel()
+    await engine_mgr.close_client_sessions()
+
+    ttfts = [ttft for ttft, _ in results]
+    completion_times = [completion_time for _, completion_time in results]
+    print(
+        f"{NUM_REQUESTS} requests, {GEN_TOKENS_NUM} tokens each, "
+        f"decode time: {DECODE_TIME * 1e3:.0f} ms/token\n"
+        f"  TTFT (streaming): avg {sum(ttfts) / len(ttfts) * 1e3:.1f} ms, "
+        f"max {max(ttfts) * 1e3:.1f} ms\n"
+        f"  Completion time (TTFT before streaming): "
+        f"avg {sum(completion_times) / len(completion_times) * 1e3:.1f} ms, "
+        f"max {max(completion_times) * 1e3:.1f} ms",
+        flush=True,
+    )
+
+
+def main():
+    tokenizer = _build_tokenizer()
+
+    rng = random.Random(1)
+    gen_token_ids = []
+    while len(gen_token_ids) < GEN_TOKENS_NUM:
+        gen_token_ids += tokenizer.encode(
+            " " + rng.choice(_WORDS), add_special_tokens=False
+        )
+    gen_token_ids = gen_token_ids[:GEN_TOKENS_NUM]
+
+    started = threading.Event()
+    threading.Thread(
+        target=_run_fake_engine, args=(gen_token_ids, started), daemon=True
+    ).start()
+    started.wait()
+
+    asyncio.run(_bench(tokenizer))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
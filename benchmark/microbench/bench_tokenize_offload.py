@@ -0,0 +1,168 @@
+"""Load test of tokenization in the ServeCore event loop, with mixed long and short requests.
+
+Requests arrive in a Poisson process. Most of them are short (a few hundred tokens) and a
+few are long documents (~30k tokens). Each request tokenizes its fills and then waits for a
+simulated engine. We compare:
+- inline: Tokenize synchronously in the event loop (the old behavior).
+- offload: Tokenize with the async APIs, which run long texts in the worker pool.
+
+and report the latency of short requests and the lag of the event loop (how late a
+periodic 1ms timer fires), which is the delay every other session sees.
+
+A byte-level BPE tokenizer is trained locally so that the benchmark runs without network.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import List
+
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers, decoders
+from transformers import PreTrainedTokenizerFast
+
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+
+
+TOKENIZER_NAME = "bench_bpe"
+NUM_REQUESTS = 2000
+REQUEST_RATE = 400  # requests/s
+LONG_REQUEST_RATIO = 0.02
+LONG_REQUEST_WORDS = 25000  # ~30k tokens
+SHORT_REQUEST_WORDS = 200
+ENGINE_TIME = 0.005  # s
+
+_WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have "
+    "from or one had by word but not what all were we when your can said there use an each "
+    "which she do how their if will up other about out many then them these so some her "
+    "would make like him into time has look two more write go see number no way could "
+    "people my than first water been call who oil its now find long down day did get come "
+    "made may part assistant answer question context document summary please following "
+    "helpful concise detailed explain step reason task user output format json list"
+).split()
+
+
+def _random_text(rng: random.Random, words_num: int) -> str:
+    # Add some random numbers so that the texts are not trivially tokenized.
+    words = [
+        rng.choice(_WORDS) if rng.random() < 0.9 else str(rng.randint(0, 99999))
+        for _ in range(words_num)
+    ]
+    return " ".join(words)
+
+
+def _build_tokenizer() -> PreTrainedTokenizerFast:
+    rng = random.Random(0)
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=4096, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(
+        [_random_text(rng, 100) for _ in range(2000)], trainer
+    )
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _run(
+    tokenizers_wrapper: TokenizersWrapper, requests: List[List[str]], offload: bool
+):
+    short_latencies = []
+    loop_lags = []
+    done = False
+
+    async def ticker():
+        interval = 0.001
+        while not done:
+            st = time.perf_counter()
+            await asyncio.sleep(interval)
+            loop_lags.append(time.perf_counter() - st - interval)
+
+    async def handle(texts: List[str], is_long: bool):
+        st = time.perf_counter()
+        if offload:
+            await tokenizers_wrapper.atokenize_batch(texts, TOKENIZER_NAME)
+        else:
+            for text in texts:
+                tokenizers_wrapper.tokenize_all(text)
+        await asyncio.sleep(ENGINE_TIME)
+        if not is_long:
+            short_latencies.append(time.perf_counter() - st)
+
+    ticker_task = asyncio.create_task(ticker())
+    rng = random.Random(1)
+    handlers = []
+    for texts in requests:
+        is_long = len(texts) > 1
+        handlers.append(asyncio.create_task(handle(texts, is_long)))
+        await asyncio.sleep(rng.expovariate(REQUEST_RATE))
+    await asyncio.gather(*handlers)
+    done = True
+    await ticker_task
+
+    return short_latencies, loop_lags
+
+
+def bench(tokenizers_wrapper: TokenizersWrapper, requests, offload: bool) -> None:
+    st = time.perf_counter()
+    short_latencies, loop_lags = asyncio.run(
+        _run(tokenizers_wrapper, requests, offload)
+    )
+    total_time = time.perf_counter() - st
+
+    print(
+        f"[{'offload' if offload else 'inline'}] total: {total_time:.2f} s, "
+        f"short requests latency p50: {_percentile(short_latencies, 0.5) * 1e3:.2f} ms, "
+        f"p99: {_percentile(short_latencies, 0.99) * 1e3:.2f} ms, "
+        f"max: {max(short_latencies) * 1e3:.2f} ms; "
+        f"loop lag p99: {_percentile(loop_lags, 0.99) * 1e3:.2f} ms, "
+        f"max: {max(loop_lags) * 1e3:.2f} ms",
+        flush=True,
+    )
+
+
+def main():
+    tokenizer = _build_tokenizer()
+
+    rng = random.Random(0)
+    requests = []
+    for _ in range(NUM_REQUESTS):
+        if rng.random() < LONG_REQUEST_RATIO:
+            # A long document with a system prompt and a question.
+            requests.append(
+                [
+                    _random_text(rng, 50),
+                    _random_text(rng, LONG_REQUEST_WORDS),
+                    _random_text(rng, 20),
+                ]
+            )
+        else:
+            requests.append([_random_text(rng, SHORT_REQUEST_WORDS)])
+
+    long_tokens_num = len(
+        tokenizer.encode(_random_text(rng, LONG_REQUEST_WORDS), add_special_tokens=False)
+    )
+    print(
+        f"{NUM_REQUESTS} requests, {LONG_REQUEST_RATIO * 100:.0f}% long requests "
+        f"(~{long_tokens_num} tokens), rate: {REQUEST_RATE} req/s",
+        flush=True,
+    )
+
+    for offload in [False, True]:
+        tokenizers_wrapper = TokenizersWrapper(workers_num=4)
+        tokenizers_wrapper.tokenizers[TOKENIZER_NAME] = tokenizer
+        bench(tokenizers_wrapper, requests, offload)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -0,0 +1,104 @@
+"""Microbenchmark of the wire formats of token ids in the internal APIs.
+
+For Fill requests (ServeCore encodes, engine decodes) and Generate responses (engine
+encodes, ServeCore decodes into the `GenerateResponse`) with 1k, 16k and 64k tokens, we
+compare:
+- json: Token ids as JSON integer lists (the old behavior).
+- binary: Token ids as int32 arrays in the binary format (parrot/protocol/wire_format.py).
+
+and report the payload size and the encode/decode time.
+"""
+
+import json
+import logging
+import random
+import time
+from typing import Callable
+
+from parrot.protocol.internal.layer_apis import GenerateResponse
+from parrot.protocol.wire_format import encode_binary, decode_binary
+from parrot.protocol.base_response import make_binary_response
+
+
+TOKENS_NUMS = [1024, 16 * 1024, 64 * 1024]
+VOCAB_SIZE = 32000
+
+
+def _time_us(func: Callable, repeat: int) -> float:
+    func()  # Warm up
+    st = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - st) / repeat * 1e6
+
+
+def bench(tokens_num: int) -> None:
+    rng = random.Random(tokens_num)
+    token_ids = [rng.randrange(VOCAB_SIZE) for _ in range(tokens_num)]
+    repeat = max(10, 200_000 // tokens_num)
+
+    fill_payload = {
+        "session_id": 0,
+        "task_id": 0,
+        "context_id": 0,
+        "parent_context_id": -1,
+        "end_flag": False,
+        "token_ids": token_ids,
+        "text": None,
+    }
+    gen_payload = {"generated_text": "", "generated_ids": token_ids}
+
+    # Fill requests
+    json_body = json.dumps(fill_payload).encode()
+    binary_body = encode_binary(fill_payload, ["token_ids"])
+    fill_results = {
+        "json": (
+            len(json_body),
+            _time_us(lambda: json.dumps(fill_payload).encode(), repeat),
+            _time_us(lambda: json.loads(json_body), repeat),
+        ),
+        "binary": (
+            len(binary_body),
+            _time_us(lambda: encode_binary(fill_payload, ["token_ids"]), repeat),
+            _time_us(lambda: decode_binary(binary_body), repeat),
+        ),
+    }
+
+    # Generate responses
+    json_body = json.dumps(gen_payload).encode()
+    binary_body = encode_binary(gen_payload, ["generated_ids"])
+    gen_results = {
+        "json": (
+            len(json_body),
+            _time_us(lambda: json.dumps(gen_payload).encode(), repeat),
+            _time_us(lambda: GenerateResponse(**json.loads(json_body)), repeat),
+        ),
+        "binary": (
+            len(binary_body),
+            _time_us(lambda: encode_binary(gen_payload, ["generated_ids"]), repeat),
+            _time_us(
+                lambda: make_binary_response(GenerateResponse, binary_body), repeat
+            ),
+        ),
+    }
+
+    for name, results in [("Fill", fill_results), ("Generate", gen_results)]:
+        for wire_format, (size, encode_time, decode_time) in results.items():
+            print(
+                f"[{tokens_num // 1024}k tokens, {name}, {wire_format}] "
+                f"size: {size / 1024:.1f} KiB, encode: {encode_time:.1f} us, "
+                f"decode: {decode_time:.1f} us",
+                flush=True,
+            )
+
+
+def main():
+    for tokens_num in TOKENS_NUMS:
+        bench(tokens_num)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.DEBUG)
+    logging.disable(logging.INFO)
+
+    main()
@@ -13,8 +13,30 @@ DEFAULT_ENGINE_SERVER_PORT = 9001
 DEFAULT_CORE_URL = f"http://{DEFAULT_SERVER_HOST}:{DEFAULT_CORE_SERVER_PORT}"
 DEFAULT_ENGINE_URL = f"http://{DEFAULT_SERVER_HOST}:{DEFAULT_ENGINE_SERVER_PORT}"
 
+# Wire formats of the internal APIs carrying token ids. See parrot/protocol/wire_format.py.
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "binary"
+WIRE_FORMATS = [
+    WIRE_FORMAT_JSON,
+    WIRE_FORMAT_BINARY,
+]
+
+# Keep-alive timeout of the pooled connections from ServeCore to engines.
+ENGINE_CLIENT_KEEPALIVE_TIMEOUT = 60
+
+# Fill/Generate primitives to the same engine issued within the window (in seconds) are
+# coalesced into one /primitives_batch request. See parrot/serve/primitive_batcher.py.
+DEFAULT_PRIMITIVES_BATCH_WINDOW = 0.001
+PRIMITIVES_NO_BATCH = -1
+CORE_PRIMITIVES_BATCH_MAX_SIZE = 128
+
 # ---------- Loop Interval ----------
-CORE_LOOP_INTERVAL = 0.0001
+# The ServeCore schedules on events (task submitted/finished, engine heartbeat). Only the
+# expiration checks (sessions, engines, constant prefix vars) run at a fixed interval.
+CORE_EXPIRE_CHECK_INTERVAL = 1
+# Contexts are freed in engines in the background. If some of them are not freed (e.g. still
+# running, or the engine is unreachable), retry after this interval.
+CORE_FREE_CONTEXTS_RETRY_INTERVAL = 0.1
 # The engine need a very short interval, prevent it from affecting the performance of LLM
 ENGINE_LOOP_INTERVAL = 0.000001
 
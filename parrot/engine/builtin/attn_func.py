@@ -3,6 +3,7 @@
 
 
 from typing import List, Optional
+import numpy as np
 import torch
 from torch import nn
 from xformers import ops as xops
@@ -72,9 +73,9 @@ class xFormersWithBuffer(AttnFunc):
         num_heads: int,
         head_size: int,
     ):
-        # Block Ids
-        whole_ctx_block_ids: List[int] = []  # The block ids of the whole context
-        newly_part_block_ids: List[int] = []  # The block ids of the newly part
+        # Block Ids. NOTE(chaofan): The block size is 1, so a block table is per token.
+        whole_ctx_block_ids: List[np.ndarray] = []  # The block ids of the whole context
+        newly_part_block_ids: List[np.ndarray] = []  # The block ids of the newly part
 
         # Mask
         q_lens: List[int] = []
@@ -82,15 +83,15 @@ class xFormersWithBuffer(AttnFunc):
 
         for job in jobs:
             if isinstance(job, Fill):
-                num_tokens = len(job.token_ids)
+                num_tokens = job.iter_num_tokens
                 iteration_state.num_fill_tokens.append(num_tokens)
             elif isinstance(job, Generate):
                 num_tokens = 1
                 iteration_state.generation_sampling_config.append(job.sampling_config)
 
-            context_block_ids = job.context.get_context_block_ids()
-            whole_ctx_block_ids.extend(context_block_ids)
-            newly_part_block_ids.extend(context_block_ids[-num_tokens:])
+            context_block_ids = job.context.get_context_block_table()
+            whole_ctx_block_ids.append(context_block_ids)
+            newly_part_block_ids.append(context_block_ids[-num_tokens:])
 
             q_lens.append(num_tokens)
             kv_lens.append(job.context.get_context_len())
@@ -118,12 +119,12 @@ class xFormersWithBuffer(AttnFunc):
 
         # Indices
         iteration_state.allocated_index_tensor = torch.tensor(
-            newly_part_block_ids,
+            _concat(newly_part_block_ids),
             dtype=torch.int64,
             device=builtin_config.device,
         )
         iteration_state.context_index_tensor = torch.tensor(
-            whole_ctx_block_ids,
+            _concat(whole_ctx_block_ids),
             dtype=torch.int64,
             device=builtin_config.device,
         )
@@ -188,8 +189,49 @@ class xFormersWithBuffer(AttnFunc):
         return attn_output.view(-1, self.num_heads * self.head_dim)
 
 
-def _pad_to_max(x: List[int], max_len: int, pad: int) -> List[int]:
-    return x + [pad] * (max_len - len(x))
+def _concat(arrays: List[np.ndarray]) -> np.ndarray:
+    if len(arrays) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(arrays)
+
+
+def _pad_to_max(arrays: List[np.ndarray], pad: int) -> np.ndarray:
+    """Stack the arrays to a [len(arrays), max_len] array, padding with `pad`."""
+
+    if len(arrays) == 0:
+        return np.zeros(0, dtype=np.int64)
+    max_len = max(len(x) for x in arrays)
+    padded = np.full((len(arrays), max_len), pad, dtype=np.int64)
+    for i, x in enumerate(arrays):
+        padded[i, : len(x)] = x
+    return padded
+
+
+def _get_slot_mapping(
+    builtin_config: BuiltinConfig,
+    fill_slot_mapping: List[np.ndarray],
+    generation_contexts: List[LowLevelContext],
+    generation_slots: torch.Tensor,
+) -> torch.Tensor:
+    """Slot mapping of the query tokens (Fills first).
+
+    Returns:
+        [num_seqs, max_num_slots_per_seq] tensor.
+    """
+
+    if len(fill_slot_mapping) == 0:
+        # Decode-only: The slots are in the persistent buffers already.
+        return generation_slots.view(-1, 1)
+
+    # NOTE: We must pad slot mapping to the same length.
+    slot_mapping = fill_slot_mapping + [
+        context.get_context_slot_ids(1) for context in generation_contexts
+    ]
+    return torch.tensor(
+        _pad_to_max(slot_mapping, 0),
+        dtype=torch.int32,
+        device=builtin_config.device,
+    )
 
 
 class xFormersFill_vLLMPagedAttentionGenerate(AttnFunc):
@@ -209,51 +251,35 @@ class xFormersFill_vLLMPagedAttentionGenerate(AttnFunc):
         num_heads: int,
         head_size: int,
     ):
-        block_size = builtin_config.block_size
-
         # Address Tables
-        block_tables = []  # [num_generation_seqs, max_num_blocks_per_seq]
-        slot_mapping = []  # [num_tokens]
-        context_lens = []  # [num_generation_seqs]
+        slot_mapping = []  # [num_fill_seqs, num_tokens]
+        generation_contexts = []  # [num_generation_seqs]
 
         # Fill part
         fill_q_lens: List[int] = []
         fill_kv_lens: List[int] = []
-        fill_slots: List[int] = []
-
-        # Maxium
-        max_num_blocks_per_seq = -1
-        max_num_slots_per_seq = -1
+        fill_slots: List[np.ndarray] = []
 
         for job in jobs:
             if isinstance(job, Fill):
-                num_tokens = len(job.token_ids)
+                num_tokens = job.iter_num_tokens
                 iteration_state.num_fill_tokens.append(num_tokens)
             elif isinstance(job, Generate):
                 num_tokens = 1
                 iteration_state.generation_sampling_config.append(job.sampling_config)
 
-            context_block_ids = job.context.get_context_block_ids()
-            context_slot_ids = job.context.get_context_slot_ids()
             context_len = job.context.get_context_len()
 
-            # Maintain slot mapping for query tokens
-            slot_mapping.append(context_slot_ids[-num_tokens:])
-            max_num_slots_per_seq = max(max_num_slots_per_seq, len(slot_mapping[-1]))
-
             if isinstance(job, Generate):
-                # Update block tables for generation tokens
-                # This tables is logicial block id -> physical block id, so we need to
-                # squeeze the tokens to blocks
-                block_tables.append(context_block_ids[::block_size])
-                context_lens.append(context_len)
-                max_num_blocks_per_seq = max(
-                    max_num_blocks_per_seq, len(block_tables[-1])
-                )
+                # Block tables (logicial block id -> physical block id), context lens
+                # and slots are kept in the persistent buffers.
+                generation_contexts.append(job.context)
             else:
                 fill_q_lens.append(num_tokens)
                 fill_kv_lens.append(context_len)
-                fill_slots.extend(context_slot_ids)
+                fill_slots.append(job.context.get_context_slot_ids())
+                # Maintain slot mapping for query tokens
+                slot_mapping.append(fill_slots[-1][-num_tokens:])
                 # assert (
                 #     context_len == num_tokens
                 # ), f"In vLLM, context-aware Fill is not allowed: context_len={context_len}."
@@ -281,38 +307,22 @@ class xFormersFill_vLLMPagedAttentionGenerate(AttnFunc):
 
         # Tensors for vLLM
 
-        # NOTE: We must pad block tables to the same length.
-        block_tables = [_pad_to_max(x, max_num_blocks_per_seq, 0) for x in block_tables]
-        slot_mapping = [_pad_to_max(x, max_num_slots_per_seq, 0) for x in slot_mapping]
+        (
+            iteration_state.block_tables,
+            iteration_state.context_lens,
+            generation_slots,
+        ) = iteration_state.meta_buffers.update(generation_contexts)
 
-        # print(block_tables)
-        # print(slot_mapping)
-        # print(context_lens)
-
-        iteration_state.block_tables = torch.tensor(
-            block_tables,
-            dtype=torch.int32,
-            device=builtin_config.device,
-        )
-
-        iteration_state.slot_mapping = torch.tensor(
-            slot_mapping,
-            dtype=torch.int32,
-            device=builtin_config.device,
+        iteration_state.slot_mapping = _get_slot_mapping(
+            builtin_config, slot_mapping, generation_contexts, generation_slots
         )
 
         iteration_state.fill_slots = torch.tensor(
-            fill_slots,
+            _concat(fill_slots),
             dtype=torch.int64,
             device=builtin_config.device,
         )
 
-        iteration_state.context_lens = torch.tensor(
-            context_lens,
-            dtype=torch.int32,
-            device=builtin_config.device,
-        )
-
     def forward(
         self,
         q: torch.Tensor,
@@ -481,58 +491,46 @@ class xFormersFill_SharedPromptsGenerate(AttnFunc):
         flash_context_len = xFormersFill_SharedPromptsGenerate.get_shared_context_len(
             jobs
         )
+        # NOTE(chaofan): The last partial block of the shared context is copied by the
+        # sequences when they append to it (copy-on-write), so only the full blocks are
+        # shared.
+        flash_context_len = flash_context_len // block_size * block_size
         logger.debug(f"Shared context length: {flash_context_len}")
 
-        flash_block_num = (flash_context_len + block_size - 1) // block_size
-        flash_pad_len = flash_block_num * block_size
+        flash_block_num = flash_context_len // block_size
 
         # Address Tables
-        paged_context_lens = []  # [num_generation_seqs]
-        context_block_ids = jobs[0].context.get_context_block_ids()
-        flash_block_table = context_block_ids[
-            :flash_pad_len:block_size
+        flash_block_table = jobs[0].context.get_context_block_table()[
+            :flash_block_num
         ]  # [max_num_blocks_per_seq]
-        paged_block_tables = []  # [num_generation_seqs, max_num_blocks_per_seq]
-        slot_mapping = []  # [num_tokens]
+        slot_mapping = []  # [num_fill_seqs, num_tokens]
+        generation_contexts = []  # [num_generation_seqs]
 
         # Fill part
         fill_q_lens: List[int] = []
         fill_kv_lens: List[int] = []
-        fill_slots: List[int] = []
-
-        # Maxium
-        max_num_blocks_per_seq = -1
-        max_num_slots_per_seq = -1
+        fill_slots: List[np.ndarray] = []
 
         for job in jobs:
             if isinstance(job, Fill):
-                num_tokens = len(job.token_ids)
+                num_tokens = job.iter_num_tokens
                 iteration_state.num_fill_tokens.append(num_tokens)
             elif isinstance(job, Generate):
                 num_tokens = 1
                 iteration_state.generation_sampling_config.append(job.sampling_config)
 
-            context_block_ids = job.context.get_context_block_ids()
-            context_slot_ids = job.context.get_context_slot_ids()
             context_len = job.context.get_context_len()
 
-            # Maintain slot mapping for query tokens
-            slot_mapping.append(context_slot_ids[-num_tokens:])
-            max_num_slots_per_seq = max(max_num_slots_per_seq, len(slot_mapping[-1]))
-
             if isinstance(job, Generate):
-                # Update block tables for generation tokens
-                # This tables is logicial block id -> physical block id, so we need to
-                # squeeze the tokens to blocks
-                paged_block_tables.append(context_block_ids[flash_pad_len::block_size])
-                paged_context_lens.append(context_len - flash_context_len)
-                max_num_blocks_per_seq = max(
-                    max_num_blocks_per_seq, len(paged_block_tables[-1])
-                )
+                # Block tables (logicial block id -> physical block id) after the shared
+                # part, context lens and slots are kept in the persistent buffers.
+                generation_contexts.append(job.context)
             else:
                 fill_q_lens.append(num_tokens)
                 fill_kv_lens.append(context_len)
-                fill_slots.extend(context_slot_ids)
+                fill_slots.append(job.context.get_context_slot_ids())
+                # Maintain slot mapping for query tokens
+                slot_mapping.append(fill_slots[-1][-num_tokens:])
                 # assert (
                 #     context_len == num_tokens
                 # ), f"In vLLM, context-aware Fill is not allowed: context_len={context_len}."
@@ -560,40 +558,30 @@ class xFormersFill_SharedPromptsGenerate(AttnFunc):
 
         # Tensors for vLLM
 
-        # NOTE: We must pad block tables to the same length.
-        paged_block_tables = [
-            _pad_to_max(x, max_num_blocks_per_seq, 0) for x in paged_block_tables
-        ]
-        slot_mapping = [_pad_to_max(x, max_num_slots_per_seq, 0) for x in slot_mapping]
-
-        iteration_state.flash_context_len = flash_context_len
-
-        iteration_state.flash_block_table = torch.tensor(
-            flash_block_table,
-            dtype=torch.int32,
-            device=builtin_config.device,
+        (
+            iteration_state.paged_block_tables,
+            iteration_state.paged_context_lens,
+            generation_slots,
+        ) = iteration_state.meta_buffers.update(
+            generation_contexts,
+            skip_blocks=flash_block_num,
+            skip_len=flash_context_len,
         )
 
-        iteration_state.paged_block_tables = torch.tensor(
-            paged_block_tables,
-            dtype=torch.int32,
-            device=builtin_config.device,
+        iteration_state.slot_mapping = _get_slot_mapping(
+            builtin_config, slot_mapping, generation_contexts, generation_slots
         )
 
-        iteration_state.paged_context_lens = torch.tensor(
-            paged_context_lens,
-            dtype=torch.int32,
-            device=builtin_config.device,
-        )
+        iteration_state.flash_context_len = flash_context_len
 
-        iteration_state.slot_mapping = torch.tensor(
-            slot_mapping,
+        iteration_state.flash_block_table = torch.tensor(
+            flash_block_table,
             dtype=torch.int32,
             device=builtin_config.device,
         )
 
         iteration_state.fill_slots = torch.tensor(
-            fill_slots,
+            _concat(fill_slots),
             dtype=torch.int64,
             device=builtin_config.device,
         )
@@ -2,7 +2,8 @@
 # Licensed under the MIT license.
 
 
-from typing import Dict, AsyncGenerator
+from typing import Dict, List, Optional, AsyncGenerator
+import numpy as np
 
 from parrot.utils import get_logger, MemTracker, get_cpu_memory_usage, cprofile
 from parrot.sampling_config import SamplingConfig
@@ -11,6 +12,7 @@ from parrot.constants import UNKNOWN_DATA_FIELD
 
 from ..llm_engine import LLMEngine
 from .builtin_runner import BuiltinRunner
+from .kv_swap import make_recompute_fill
 from ..latency_analyzer import LatencyAnalyzer
 from ..context.block_context import BlockContext
 from ..engine_scheduler import EngineScheduler
@@ -39,8 +41,13 @@ class BuiltinEngine(LLMEngine):
         self.runner = BuiltinRunner(
             model_name=self.engine_config.model, config=builtin_config
         )
-        self.scheduler = EngineScheduler(scheduler_config)
+        self.scheduler = EngineScheduler(
+            scheduler_config, fill_chunk_size=self.engine_config.fill_chunk_size
+        )
         self.latency_analyzer = LatencyAnalyzer()
+        # Jobs whose parent contexts are released (preempted) when they are added. They
+        # are bound to their contexts in the engine loop, when the parents are restored.
+        self.deferred_jobs: List[PrimitiveJob] = []
         self.gpu_mem_tracker = MemTracker(device=self.runner.local_rank)
 
         self._register_engine(self.engine_config)
@@ -55,27 +62,88 @@ class BuiltinEngine(LLMEngine):
             )
         )
 
-    def _add_job(self, job: PrimitiveJob):
-        logger.debug(f"Adding job: {job}")
-        self.scheduler.add_job(job)
+    def _get_released_parent(self, job: PrimitiveJob) -> Optional[BlockContext]:
+        """The parent context of a new context, if it's released (preempted)."""
+
+        context_map = self.runner.context_manager.map
+        if job.context_id in context_map or job.parent_context_id not in context_map:
+            return None
+        parent_context = context_map[job.parent_context_id]
+        return None if parent_context.is_resident else parent_context
+
+    def _bind_job(self, job: PrimitiveJob) -> None:
         self.runner.context_manager.bind_job_context(
             job,
             BlockContext,
             kv_cache_manager=self.runner.kv_cache_manager,
             block_size=self.builtin_config.block_size,
         )
+        self.scheduler.add_job(job)
+
+    def _add_job(self, job: PrimitiveJob):
+        logger.debug(f"Adding job: {job}")
+
+        # NOTE(chaofan): A new context is appended to its parent's blocks. If the parent
+        # is released, the job waits until it's restored in the engine loop, since
+        # restoring it (swap in / recompute) is not allowed outside the loop. Other jobs
+        # are bound at once.
+        if self._get_released_parent(job) is not None or self._depends_on_deferred(
+            job, self.deferred_jobs
+        ):
+            self.deferred_jobs.append(job)
+            return
+
+        self._bind_job(job)
+
+    @staticmethod
+    def _depends_on_deferred(
+        job: PrimitiveJob, deferred_jobs: List[PrimitiveJob]
+    ) -> bool:
+        """Whether the job uses the context (or the parent) of a deferred job. Such a
+        job is deferred too, to keep the order of the jobs of a context."""
+
+        return any(
+            deferred_job.context_id in (job.context_id, job.parent_context_id)
+            for deferred_job in deferred_jobs
+        )
+
+    def _bind_deferred_jobs(self) -> None:
+        """Bind the deferred jobs whose parent contexts are restored. Swapped-out
+        parents are swapped in; parents being recomputed are waited for."""
+
+        deferred_jobs = self.deferred_jobs
+        self.deferred_jobs = []
+        for job in deferred_jobs:
+            parent_context = self._get_released_parent(job)
+            if parent_context is not None and parent_context.swap_slots is not None:
+                self.runner.restore_contexts([parent_context])
+                parent_context = None
+
+            if parent_context is None and not self._depends_on_deferred(
+                job, self.deferred_jobs
+            ):
+                self._bind_job(job)
+            else:
+                self.deferred_jobs.append(job)
 
     # ---------- Public APIs ----------
 
     # override
     async def fill(self, payload: Dict) -> Dict:
+        token_ids = payload["token_ids"]
+        # NOTE(chaofan): In the binary wire format, token ids are a numpy array.
+        if isinstance(token_ids, np.ndarray):
+            token_ids = token_ids.tolist()
+
         fill_job = Fill(
             session_id=payload["session_id"],
             task_id=payload["task_id"],
             context_id=payload["context_id"],
             parent_context_id=payload["parent_context_id"],
             end_flag=payload["end_flag"],
-            token_ids=payload["token_ids"],
+            token_ids=token_ids,
+            latency_critical=payload.get("latency_critical", False),
+            time_to_deadline=payload.get("time_to_deadline"),
         )
 
         self._add_job(fill_job)
@@ -93,6 +161,8 @@ class BuiltinEngine(LLMEngine):
             parent_context_id=payload["parent_context_id"],
             sampling_config=SamplingConfig(**payload["sampling_config"]),
             end_flag=payload["end_flag"],
+            latency_critical=payload.get("latency_critical", False),
+            time_to_deadline=payload.get("time_to_deadline"),
         )
 
         self._add_job(generation_job)
@@ -123,6 +193,8 @@ class BuiltinEngine(LLMEngine):
             parent_context_id=parent_context_id,
             sampling_config=sampling_config,
             end_flag=end_flag,
+            latency_critical=payload.get("latency_critical", False),
+            time_to_deadline=payload.get("time_to_deadline"),
         )
         self._add_job(generation_job)
 
@@ -136,7 +208,7 @@ class BuiltinEngine(LLMEngine):
                 # NOTE(chaofan): We cannot free the context when it is still running.
                 raise RuntimeError(f"Context {context_id} is still running.")
 
-        context_len = self.runner.context_manager.free_context(context_id)
+        context_len = self.runner.free_context(context_id)
         return {
             "context_len": context_len,
         }
@@ -150,6 +222,12 @@ class BuiltinEngine(LLMEngine):
         # Memory
         num_cached_tokens = self.runner.context_manager.get_num_cached_tokens()
         num_max_blocks = self.runner.kv_cache_manager.get_history_max_allocated_num()
+        num_free_blocks = self.runner.kv_cache_manager.get_free_num()
+        blocks_fragmentation = self.runner.kv_cache_manager.get_fragmentation()
+        num_prefix_cached_blocks = self.runner.kv_cache_manager.get_num_cached_blocks()
+        prefix_cache_hit_rate = (
+            self.runner.kv_cache_manager.get_prefix_cache_hit_rate()
+        )
         cache_mem = (
             num_cached_tokens
             * self.runner.hf_model_config.hidden_size
@@ -175,6 +253,10 @@ class BuiltinEngine(LLMEngine):
         return EngineRuntimeInfo(
             num_cached_tokens=num_cached_tokens,
             num_max_blocks=num_max_blocks,
+            num_free_blocks=num_free_blocks,
+            blocks_fragmentation=blocks_fragmentation,
+            num_prefix_cached_blocks=num_prefix_cached_blocks,
+            prefix_cache_hit_rate=prefix_cache_hit_rate,
             num_running_jobs=num_running_jobs,
             num_total_jobs=num_total_jobs,
             cache_mem=cache_mem,
@@ -187,12 +269,20 @@ class BuiltinEngine(LLMEngine):
 
     # override
     async def engine_iter(self):
+        self._bind_deferred_jobs()
+
         # If there is no job, we don't need to run.
         if self.scheduler.is_empty:
             return
 
         jobs = self.scheduler.schedule()
 
+        # Release the KV cache of the preempted jobs, so the memory is actually freed.
+        # The dropped KV cache is recomputed by a Fill scheduled before the job.
+        for job in self.scheduler.preempted_jobs:
+            if self.runner.evict_context(job) == "recompute":
+                self.scheduler.add_recompute_job(job, make_recompute_fill(job))
+
         # with cprofile("run_iter"):
         e2e_time, model_time = self.runner.run_iter(jobs)
 
@@ -2,19 +2,22 @@
 # Licensed under the MIT license.
 
 
-from typing import List
+from typing import List, Tuple
 from transformers import AutoConfig
 import torch
 import time
 import psutil
 
-from parrot.utils import RecyclePool, get_logger, time_counter_in_nanoseconds
+from parrot.utils import get_logger, time_counter_in_nanoseconds
 from parrot.sampling_config import SamplingConfig
 
 from .model_instantiation import instantiate_model
-from .mem import init_model_cache_storage
+from .mem import init_model_cache_storage, get_kv_cache
+from .kv_swap import KVSwapManager
 from ..context.block_context import BlockContext
+from ..context.block_allocator import BlockAllocator
 from .iter_state import IterationState
+from .iter_buffers import DecodeMetadataBuffers
 from ..context.context_manager import EngineContextManager
 from ..primitive_job import PrimitiveJob, Fill, Generate
 from ..config import BuiltinConfig
@@ -38,7 +41,11 @@ class BuiltinRunner:
     def __init__(self, model_name: str, config: BuiltinConfig):
         self.builtin_config = config
         self.context_manager = EngineContextManager()
-        self.kv_cache_manager = RecyclePool("KVCache pool", pool_size=config.num_kv_cache_blocks)
+        self.kv_cache_manager = BlockAllocator(
+            "KVCache pool",
+            num_blocks=config.num_kv_cache_blocks,
+            enable_prefix_caching=config.enable_prefix_caching,
+        )
 
         # Init CUDA env
         if self.builtin_config.device_str.startswith("cuda:"):
@@ -65,6 +72,76 @@ class BuiltinRunner:
         # Init model cache storage
         init_model_cache_storage(self.hf_model_config, self.builtin_config)
 
+        # Release the KV cache of preempted jobs
+        k_cache, v_cache = get_kv_cache()
+        self.kv_swap_manager = KVSwapManager(
+            k_cache,
+            v_cache,
+            self.kv_cache_manager,
+            block_size=self.builtin_config.block_size,
+            preempt_mode=self.builtin_config.preempt_mode,
+            num_swap_blocks=self.builtin_config.num_swap_blocks,
+            swap_file=self.builtin_config.swap_file,
+            swap_bandwidth=self.builtin_config.swap_bandwidth,
+            recompute_throughput=self.builtin_config.recompute_throughput,
+        )
+
+        # Metadata of the generation sequences, kept across iterations
+        self.meta_buffers = DecodeMetadataBuffers(
+            block_size=self.builtin_config.block_size,
+            device=self.builtin_config.device,
+        )
+
+    def copy_blocks(self, copies: List[Tuple[int, int]]) -> None:
+        """Copy the KV cache of blocks (in all layers).
+
+        Args:
+            copies: List of (src_block_id, dst_block_id).
+        """
+
+        if len(copies) == 0:
+            return
+
+        src_block_ids, dst_block_ids = zip(*copies)
+        src_block_ids = torch.tensor(
+            src_block_ids, dtype=torch.int64, device=self.builtin_config.device
+        )
+        dst_block_ids = torch.tensor(
+            dst_block_ids, dtype=torch.int64, device=self.builtin_config.device
+        )
+        for cache in get_kv_cache():
+            cache[:, dst_block_ids] = cache[:, src_block_ids]
+
+    def free_context(self, context_id: int) -> int:
+        """Free the context and return the number of freed tokens."""
+
+        context = self.context_manager.map.get(context_id)
+        if context is not None:
+            self.meta_buffers.drop_context(context)
+        return self.context_manager.free_context(context_id)
+
+    def evict_context(self, job: PrimitiveJob) -> str:
+        """Release the KV cache of a preempted job.
+
+        Returns:
+            The mode used: "swap", "recompute" or "hold". See KVSwapManager.
+        """
+
+        if job.context is None:
+            return "hold"
+        return self.kv_swap_manager.evict(job.context)
+
+    def restore_contexts(self, contexts: List[BlockContext]) -> None:
+        """Swap in the KV cache of swapped-out contexts.
+
+        NOTE(chaofan): Contexts dropped for recomputation are restored by their
+        recompute Fills, which are scheduled by the EngineScheduler as other jobs.
+        """
+
+        for context in contexts:
+            if context.swap_slots is not None:
+                self.kv_swap_manager.swap_in(context)
+
     @torch.inference_mode()
     def run_iter(self, jobs: List[PrimitiveJob]) -> (int, int):
         logger.debug(f"Running {len(jobs)} jobs. ")
@@ -72,6 +149,9 @@ class BuiltinRunner:
         # torch.cuda.synchronize()
         st = time_counter_in_nanoseconds()
 
+        # Swap in the KV cache of preempted jobs.
+        self.restore_contexts([job.context for job in jobs if job.context is not None])
+
         # We should sort jobs such that Fill jobs are before Generation jobs.
         jobs.sort(key=lambda job: isinstance(job, Generate))
 
@@ -92,11 +172,14 @@ class BuiltinRunner:
                 )
 
             # Allocate blocks
-            allocated_blocks_id: List[int] = []
-
             if isinstance(job, Fill):
-                job.context.token_ids.extend(job.token_ids)
-                job.context.allocate(len(job.token_ids))
+                # NOTE(chaofan): With chunked prefill, the context is extended by the
+                # chunk of this iteration.
+                # NOTE(chaofan): The cached prefix of the Fill (prefix caching) is
+                # already reused when it's admitted by the scheduler.
+                iter_token_ids = job.get_iter_token_ids()
+                job.context.token_ids.extend(iter_token_ids)
+                job.context.allocate(len(iter_token_ids))
             elif isinstance(job, Generate):
                 job.context.allocate(1)
                 last_hidden_state = job.context.get_last_hidden_state()
@@ -106,7 +189,8 @@ class BuiltinRunner:
                     first_sampling_jobs.append(job)
                     job.context.last_hidden_state = None
 
-            job.context.token_kv_block_ids.extend(allocated_blocks_id)
+        # Copy the shared blocks written by this iteration (copy-on-write)
+        self.copy_blocks(self.kv_cache_manager.pop_pending_copies())
 
         # First sampling
         if len(first_sampling_states) > 0:
@@ -127,6 +211,7 @@ class BuiltinRunner:
             jobs,
             self.hf_model_config,
             self.builtin_config,
+            self.meta_buffers,
         )
 
         # Convert inputs
@@ -136,9 +221,9 @@ class BuiltinRunner:
         for job in jobs:
             context_len = job.context.get_context_len()
             if isinstance(job, Fill):
-                input_ids.extend(job.token_ids)
+                input_ids.extend(job.get_iter_token_ids())
                 input_positions.extend(
-                    range(context_len - len(job.token_ids), context_len)
+                    range(context_len - job.iter_num_tokens, context_len)
                 )
             elif isinstance(job, Generate):
                 input_ids.append(job.context.get_last_token_id())
@@ -179,13 +264,19 @@ class BuiltinRunner:
             assert job.context is not None, "Context should be assigned."
             if isinstance(job, Fill):
                 job.context.last_hidden_state = fill_hidden_states[i]
-                job.finish_event.set()
+                if job.finish_iter():
+                    if job.is_recompute:
+                        job.context.finish_recompute()
+                    job.finish_event.set()
             elif isinstance(job, Generate):
                 token_id = next_tokens[i - iteration_state.num_fill_jobs]
                 job.put_token(token_id)
                 if job.check_stop():
                     job.finish_event.set()
 
+            # Register the full blocks for prefix caching.
+            job.context.register_full_blocks()
+
         ed = time_counter_in_nanoseconds()
 
         e2e_time = ed - st
@@ -0,0 +1,198 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+from typing import List, Optional, Tuple
+import numpy as np
+import torch
+
+from ..context.block_context import BlockContext
+
+
+class DecodeMetadataBuffers:
+    """Persistent buffers of the metadata of the generation (decode) sequences in paged
+    attention: block tables, context lens and slot mapping.
+
+    Each generation sequence keeps its row across iterations. A row holds the whole
+    block table of its context, and is valid as long as the table_version of the
+    context is unchanged. In steady-state decoding, a row only gets its new block (every
+    `block_size` steps), its context len and its slot updated in place; rows are
+    reordered, added or removed only when the batch changes. The rows (without the
+    skipped blocks) are then packed into a (pinned, for CUDA) host staging buffer and
+    copied to the device in one async copy.
+    """
+
+    def __init__(
+        self,
+        block_size: int,
+        device: torch.device,
+        max_num_seqs: int = 64,
+        max_num_blocks_per_seq: int = 64,
+    ):
+        self.block_size = block_size
+        self.device = torch.device(device)
+        self.pin_memory = self.device.type == "cuda"
+
+        # Rows. [max_num_seqs, max_num_blocks_per_seq]. Entries after the blocks of a
+        # row are 0 (padding).
+        self.block_tables = np.zeros(
+            (max_num_seqs, max_num_blocks_per_seq), dtype=np.int32
+        )
+        # None for the row of a freed context.
+        self.row_contexts: List[Optional[BlockContext]] = []
+        self.row_table_versions: List[int] = []
+        self.row_num_blocks: List[int] = []
+
+        # Staging buffer: [context_lens (n) | slot_mapping (n) | block_tables (n, w)]
+        self.host_buffer: Optional[torch.Tensor] = None
+        self.device_buffer: Optional[torch.Tensor] = None
+        self._reserve_staging(max_num_seqs * (max_num_blocks_per_seq + 2))
+
+    def _reserve_staging(self, size: int) -> None:
+        if self.host_buffer is not None and self.host_buffer.numel() >= size:
+            return
+
+        if self.host_buffer is not None:
+            size = max(size, 2 * self.host_buffer.numel())
+        self.host_buffer = torch.empty(
+            size, dtype=torch.int32, pin_memory=self.pin_memory
+        )
+        if self.device.type == "cpu":
+            self.device_buffer = self.host_buffer
+        else:
+            self.device_buffer = torch.empty(
+                size, dtype=torch.int32, device=self.device
+            )
+
+    def _reserve_rows(self, num_seqs: int, num_blocks: int) -> None:
+        cur_seqs, cur_blocks = self.block_tables.shape
+        if num_seqs <= cur_seqs and num_blocks <= cur_blocks:
+            return
+
+        if num_seqs > cur_seqs:
+            num_seqs = max(num_seqs, 2 * cur_seqs)
+        if num_blocks > cur_blocks:
+            num_blocks = max(num_blocks, 2 * cur_blocks)
+        block_tables = np.zeros(
+            (max(num_seqs, cur_seqs), max(num_blocks, cur_blocks)), dtype=np.int32
+        )
+        block_tables[:cur_seqs, :cur_blocks] = self.block_tables
+        self.block_tables = block_tables
+
+    def _move_rows(self, contexts: List[BlockContext]) -> None:
+        """Move the rows of the sequences to their new positions. New sequences get
+        invalid rows, to be rewritten."""
+
+        old_pos = {
+            id(context): i
+            for i, context in enumerate(self.row_contexts)
+            if context is not None
+        }
+        src = [old_pos.get(id(context), -1) for context in contexts]
+
+        dst_rows = [i for i, s in enumerate(src) if s >= 0]
+        src_rows = [src[i] for i in dst_rows]
+        # NOTE(chaofan): Fancy indexing copies, so overlapping moves are safe.
+        self.block_tables[dst_rows] = self.block_tables[src_rows]
+
+        self.row_table_versions = [
+            self.row_table_versions[s] if s >= 0 else -1 for s in src
+        ]
+        self.row_num_blocks = [self.row_num_blocks[s] if s >= 0 else 0 for s in src]
+        self.row_contexts = list(contexts)
+
+    def drop_context(self, context: BlockContext) -> None:
+        """Drop the row of a freed context, so that the context is not referenced and
+        its row is not reused by another context."""
+
+        for i, row_context in enumerate(self.row_contexts):
+            if row_context is context:
+                self.row_contexts[i] = None
+                self.row_table_versions[i] = -1
+                self.row_num_blocks[i] = 0
+                return
+
+    def update(
+        self,
+        contexts: List[BlockContext],
+        skip_blocks: int = 0,
+        skip_len: int = 0,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Update the rows for the generation sequences of this iteration (in order),
+        and copy the metadata to the device.
+
+        Args:
+            contexts: The contexts of the generation jobs, in the order of the batch.
+            skip_blocks: Skip the first `skip_blocks` blocks of every table (e.g. the
+                shared prefix, handled separately). The rows are kept whole, so changing
+                it doesn't rewrite the rows.
+            skip_len: Subtract `skip_len` from every context len.
+
+        Returns:
+            block_tables [num_seqs, max_num_blocks_per_seq] (padded with 0),
+            context_lens [num_seqs], slot_mapping [num_seqs]. All int32, on the device.
+        """
+
+        num_seqs = len(contexts)
+        if num_seqs == 0:
+            # Keep the rows for the next iteration (e.g. a Fill-only iteration).
+            empty = self.device_buffer[:0]
+            return empty.view(0, 0), empty, empty
+
+        if len(contexts) != len(self.row_contexts) or any(
+            a is not b for a, b in zip(contexts, self.row_contexts)
+        ):
+            self._reserve_rows(num_seqs, 1)
+            self._move_rows(contexts)
+
+        block_size = self.block_size
+        context_lens = []
+        slot_mapping = []
+        for i, context in enumerate(contexts):
+            table = context.get_context_block_table()
+            num_blocks = len(table)
+            version = context.table_version
+            self._reserve_rows(num_seqs, num_blocks)
+
+            if version != self.row_table_versions[i]:
+                # Rewritten (or new): Copy the whole row.
+                self.block_tables[i, :num_blocks] = table
+                self.block_tables[i, num_blocks:] = 0
+                self.row_table_versions[i] = version
+            elif num_blocks > self.row_num_blocks[i]:
+                # Appended: Copy the new blocks only.
+                start = self.row_num_blocks[i]
+                self.block_tables[i, start:num_blocks] = table[start:num_blocks]
+            self.row_num_blocks[i] = num_blocks
+
+            context_len = context.get_context_len()
+            last_pos = context_len - 1
+            context_lens.append(context_len - skip_len)
+            slot_mapping.append(
+                int(table[last_pos // block_size]) * block_size + last_pos % block_size
+            )
+
+        # Pack and copy.
+        width = max(max(self.row_num_blocks) - skip_blocks, 1)
+        size = num_seqs * (width + 2)
+        self._reserve_rows(num_seqs, skip_blocks + width)
+        self._reserve_staging(size)
+
+        staging = self.host_buffer.numpy()
+        staging[:num_seqs] = context_lens
+        staging[num_seqs : 2 * num_seqs] = slot_mapping
+        tables = staging[2 * num_seqs : size].reshape(num_seqs, width)
+        tables[:] = self.block_tables[:num_seqs, skip_blocks : skip_blocks + width]
+
+        # NOTE(chaofan): The copy is ordered before the kernels of this iteration in the
+        # same stream, and the staging buffer is not rewritten until the next
+        # iteration, which starts after the outputs of this one are synchronized.
+        device_buffer = self.device_buffer[:size]
+        if self.device_buffer is not self.host_buffer:
+            device_buffer.copy_(self.host_buffer[:size], non_blocking=True)
+
+        return (
+            device_buffer[2 * num_seqs :].view(num_seqs, width),
+            device_buffer[:num_seqs],
+            device_buffer[num_seqs : 2 * num_seqs],
+        )
@@ -2,7 +2,7 @@
 # Licensed under the MIT license.
 
 
-from typing import List
+from typing import List, Optional
 import torch
 from transformers import PretrainedConfig
 
@@ -10,6 +10,7 @@ from parrot.sampling_config import SamplingConfig
 
 from ..config import BuiltinConfig
 from ..primitive_job import PrimitiveJob, Fill, Generate
+from .iter_buffers import DecodeMetadataBuffers
 
 
 class IterationState:
@@ -31,11 +32,20 @@ class IterationState:
         jobs: List[PrimitiveJob],
         model_config: PretrainedConfig,
         builtin_config: BuiltinConfig,
+        meta_buffers: Optional[DecodeMetadataBuffers] = None,
     ):
         # Metadata
         self.num_fill_tokens: List[int] = []
         self.generation_sampling_config: List[SamplingConfig] = []
 
+        # Persistent buffers of the generation metadata, shared across iterations. If
+        # not given, the metadata is built from scratch.
+        if meta_buffers is None:
+            meta_buffers = DecodeMetadataBuffers(
+                builtin_config.block_size, builtin_config.device
+            )
+        self.meta_buffers = meta_buffers
+
         num_heads = model_config.num_attention_heads
         head_size = model_config.hidden_size // num_heads
 
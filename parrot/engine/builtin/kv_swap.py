@@ -0,0 +1,246 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+from typing import List, Literal, Optional
+import os
+import tempfile
+import torch
+
+from parrot.exceptions import parrot_assert
+from parrot.utils import get_logger
+
+from ..context.block_context import BlockContext
+from ..context.block_allocator import BlockAllocator
+from ..primitive_job import PrimitiveJob, Fill
+
+
+logger = get_logger("KVSwap")
+
+
+PREEMPT_MODES = ["hold", "swap", "recompute", "auto"]
+
+
+class KVSwapManager:
+    """Release the KV cache of preempted contexts, and restore it when they are scheduled
+    again.
+
+    There are two ways to release the KV cache of a context:
+    - swap: Copy its blocks to a host buffer (pinned memory for CUDA devices; a
+        memory-mapped file for CPU devices), and copy them back into new blocks later.
+    - recompute: Drop its blocks, and recompute the KV cache from its tokens later, by
+        a Fill of these tokens (`make_recompute_fill`). The EngineScheduler schedules it
+        in place of the preempted job, under the same token budgets as other jobs.
+
+    The mode is chosen by `preempt_mode`. "hold" keeps the blocks (the old behavior), and
+    "auto" chooses the cheaper one by a cost model: Swapping moves the KV cache through
+    the host link twice, while recomputing costs a prefill of the tokens.
+
+    NOTE(chaofan): Only contexts without sub-contexts are released, since the blocks of a
+    context are shared by its sub-contexts.
+    """
+
+    def __init__(
+        self,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        kv_cache_manager: BlockAllocator,
+        block_size: int,
+        preempt_mode: Literal["hold", "swap", "recompute", "auto"] = "auto",
+        num_swap_blocks: int = 0,
+        swap_file: Optional[str] = None,
+        swap_bandwidth: float = 12.0,
+        recompute_throughput: float = 10000.0,
+    ) -> None:
+        """
+        Args:
+            k_cache, v_cache: The KV cache of all layers. Blocks are in dim 1.
+            kv_cache_manager: The allocator of KV blocks.
+            block_size: Number of tokens in a block.
+            preempt_mode: "hold", "swap", "recompute" or "auto".
+            num_swap_blocks: Number of blocks in the host swap buffer.
+            swap_file: Path of the memory-mapped swap file, for CPU devices. By default
+                a temporary file.
+            swap_bandwidth: Bandwidth between the device and the host swap buffer (GB/s).
+            recompute_throughput: Throughput of recomputing the KV cache (tokens/s).
+        """
+
+        parrot_assert(
+            preempt_mode in PREEMPT_MODES, f"Unknown preempt mode: {preempt_mode}."
+        )
+
+        self.k_cache = k_cache
+        self.v_cache = v_cache
+        self.kv_cache_manager = kv_cache_manager
+        self.block_size = block_size
+        self.preempt_mode = preempt_mode
+        self.swap_bandwidth = swap_bandwidth
+        self.recompute_throughput = recompute_throughput
+
+        self.block_bytes = (
+            k_cache[:, 0].numel() * k_cache.element_size()
+            + v_cache[:, 0].numel() * v_cache.element_size()
+        )
+
+        # ---------- Host swap buffer ----------
+        self.num_swap_blocks = num_swap_blocks if preempt_mode != "hold" else 0
+        self.free_slots: List[int] = list(range(self.num_swap_blocks))
+        self.swap_k: Optional[torch.Tensor] = None
+        self.swap_v: Optional[torch.Tensor] = None
+        if self.num_swap_blocks > 0:
+            self.swap_k = self._alloc_host_buffer(k_cache, swap_file, ".k")
+            self.swap_v = self._alloc_host_buffer(v_cache, swap_file, ".v")
+            logger.info(
+                f"Allocated {self.num_swap_blocks} host swap blocks. "
+                f"Total size: {self.num_swap_blocks * self.block_bytes / 1024**3:.2f} GiB."
+            )
+
+    def _alloc_host_buffer(
+        self, cache: torch.Tensor, swap_file: Optional[str], suffix: str
+    ) -> torch.Tensor:
+        shape = [cache.shape[0], self.num_swap_blocks] + list(cache.shape[2:])
+
+        if cache.device.type == "cuda":
+            return torch.empty(shape, dtype=cache.dtype, pin_memory=True)
+
+        # NOTE(chaofan): For CPU devices, the KV cache is already in the host memory.
+        # Swap to a memory-mapped file instead.
+        if swap_file is None:
+            fd, path = tempfile.mkstemp(prefix="parrot_kv_swap_", suffix=suffix)
+            os.close(fd)
+        else:
+            path = swap_file + suffix
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        buffer = torch.from_file(path, shared=True, size=numel, dtype=cache.dtype)
+        if swap_file is None:
+            # The mapping outlives the temporary file.
+            os.unlink(path)
+        return buffer.view(shape)
+
+    # ---------- Cost model ----------
+
+    def get_swap_cost(self, context: BlockContext) -> float:
+        """Estimated time (s) to swap out and swap in the context."""
+
+        num_bytes = len(context.get_own_block_ids()) * self.block_bytes
+        return 2 * num_bytes / (self.swap_bandwidth * 1e9)
+
+    def get_recompute_cost(self, context: BlockContext) -> float:
+        """Estimated time (s) to recompute the KV cache of the context."""
+
+        return context.get_this_context_len() / self.recompute_throughput
+
+    def choose_mode(self, context: BlockContext) -> str:
+        """Choose how to release the KV cache of a preempted context.
+
+        Returns:
+            "swap", "recompute", or "hold" (not released).
+        """
+
+        if (
+            self.preempt_mode == "hold"
+            or not context.is_resident
+            or len(context.sub_context_ids) > 0
+            or context.get_this_context_len() == 0
+        ):
+            return "hold"
+
+        can_swap = len(context.get_own_block_ids()) <= len(self.free_slots)
+        can_recompute = len(context.token_ids) >= context.get_this_context_len()
+
+        if self.preempt_mode == "swap":
+            return "swap" if can_swap else "hold"
+        if self.preempt_mode == "recompute":
+            return "recompute" if can_recompute else "hold"
+
+        # Auto
+        if can_swap and can_recompute:
+            if self.get_swap_cost(context) <= self.get_recompute_cost(context):
+                return "swap"
+            return "recompute"
+        if can_swap:
+            return "swap"
+        if can_recompute:
+            return "recompute"
+        return "hold"
+
+    # ---------- Release / Restore ----------
+
+    def evict(self, context: BlockContext) -> str:
+        """Release the KV cache of a preempted context.
+
+        Returns:
+            The mode used: "swap", "recompute" or "hold".
+        """
+
+        mode = self.choose_mode(context)
+        if mode == "swap":
+            self.swap_out(context)
+        elif mode == "recompute":
+            context.release_blocks()
+            context.drop_for_recompute()
+
+        logger.debug(f"Context {context.context_id} preempted. Mode: {mode}.")
+        return mode
+
+    def swap_out(self, context: BlockContext) -> None:
+        """Copy the blocks of the context to the host swap buffer and release them."""
+
+        block_ids = context.get_own_block_ids()
+        slots = self.free_slots[-len(block_ids) :]
+        del self.free_slots[-len(block_ids) :]
+
+        src = torch.tensor(block_ids, dtype=torch.int64, device=self.k_cache.device)
+        dst = torch.tensor(slots, dtype=torch.int64)
+        self.swap_k[:, dst] = self.k_cache[:, src].cpu()
+        self.swap_v[:, dst] = self.v_cache[:, src].cpu()
+
+        context.release_blocks()
+        context.swap_slots = slots
+        context.swap_manager = self
+
+    def swap_in(self, context: BlockContext) -> None:
+        """Copy the blocks of the context from the host swap buffer into new blocks."""
+
+        parrot_assert(context.swap_slots is not None, "Context is not swapped out.")
+
+        block_ids = context.reallocate_blocks()
+        src = torch.tensor(context.swap_slots, dtype=torch.int64)
+        dst = torch.tensor(block_ids, dtype=torch.int64, device=self.k_cache.device)
+        self.k_cache[:, dst] = self.swap_k[:, src].to(self.k_cache.device)
+        self.v_cache[:, dst] = self.swap_v[:, src].to(self.v_cache.device)
+
+        self.discard(context)
+
+    def discard(self, context: BlockContext) -> None:
+        """Free the swap slots of the context."""
+
+        self.free_slots.extend(context.swap_slots)
+        context.swap_slots = None
+        context.swap_manager = None
+
+
+def make_recompute_fill(job: PrimitiveJob) -> Fill:
+    """Make the Fill recomputing the dropped KV cache of a preempted job's context. It
+    inherits the priority of the job."""
+
+    context = job.context
+    parrot_assert(
+        context.recompute_token_ids is not None,
+        "Context is not dropped for recomputation.",
+    )
+
+    recompute_job = Fill(
+        session_id=job.session_id,
+        task_id=job.task_id,
+        context_id=job.context_id,
+        parent_context_id=job.parent_context_id,
+        token_ids=context.recompute_token_ids,
+        latency_critical=job.latency_critical,
+    )
+    recompute_job.deadline = job.deadline
+    recompute_job.is_recompute = True
+    recompute_job.context = context
+    return recompute_job
@@ -2,7 +2,7 @@
 # Licensed under the MIT license.
 
 
-from typing import Optional
+from typing import Optional, Tuple
 from transformers import PretrainedConfig
 import torch
 
@@ -176,6 +176,14 @@ def init_model_cache_storage(
     Model_Cache = ModelCacheStorage(hf_config, builtin_config)
 
 
+def get_kv_cache() -> Tuple[torch.Tensor, torch.Tensor]:
+    """Get the KV cache of all layers."""
+
+    global Model_Cache
+    assert Model_Cache is not None
+    return Model_Cache.k_cache, Model_Cache.v_cache
+
+
 def get_k_cache(layer_idx: int) -> torch.Tensor:
     global Model_Cache
     assert Model_Cache is not None
@@ -12,6 +12,10 @@ from parrot.constants import (
     DEFAULT_ENGINE_SERVER_PORT,
     ENGINE_TYPE_BUILTIN,
     ENGINE_TYPES,
+    WIRE_FORMAT_BINARY,
+    WIRE_FORMATS,
+    DEFAULT_PRIMITIVES_BATCH_WINDOW,
+    PRIMITIVES_NO_BATCH,
 )
 
 from .builtin.mem_layout import MemLayout, ATTN_FUNC_LAYOUT_MAP
@@ -37,6 +41,19 @@ class BuiltinConfig:
     mem_layout: Optional["MemLayout"] = None
     model_arch: Optional[str] = None
 
+    # Preemption: How to release the KV cache of preempted jobs. See kv_swap.py.
+    # "hold": keep it; "swap": swap it to the host; "recompute": drop and recompute it;
+    # "auto": choose the cheaper of swap/recompute by a cost model.
+    preempt_mode: Literal["hold", "swap", "recompute", "auto"] = "auto"
+    num_swap_blocks: int = 0  # Blocks in the host swap buffer. 0: no swap.
+    swap_file: Optional[str] = None  # Memory-mapped swap file for CPU devices.
+    swap_bandwidth: float = 12.0  # GB/s between the device and the host.
+    recompute_throughput: float = 10000.0  # Prefill tokens/s.
+
+    # Prefix caching: Reuse the KV blocks of the same prefix (by content) across
+    # contexts, and keep the unreferenced ones cached until the memory is needed.
+    enable_prefix_caching: bool = False
+
     def __post_init__(self):
         # Replace dtype and device
         self.dtype_str = self.dtype
@@ -109,6 +126,13 @@ class EngineConfig:
     host: str = DEFAULT_SERVER_HOST
     port: int = DEFAULT_ENGINE_SERVER_PORT
 
+    # The wire format of token ids accepted by the engine server: "json" or "binary".
+    wire_format: str = WIRE_FORMAT_BINARY
+
+    # Primitives issued within the window (in seconds) are sent to the engine server in
+    # one /primitives_batch request. PRIMITIVES_NO_BATCH: Send each primitive alone.
+    primitives_batch_window: float = DEFAULT_PRIMITIVES_BATCH_WINDOW
+
     # Heartbeat interval in seconds.
     heartbeat_interval: int = 3
 
@@ -158,6 +182,19 @@ class EngineConfig:
         if config["engine_type"] not in ENGINE_TYPES:
             return False
 
+        if config.get("wire_format", WIRE_FORMAT_BINARY) not in WIRE_FORMATS:
+            return False
+
+        fill_chunk_size = config.get("fill_chunk_size", FILL_NO_CHUNK)
+        if fill_chunk_size <= 0 and fill_chunk_size != FILL_NO_CHUNK:
+            return False
+
+        batch_window = config.get(
+            "primitives_batch_window", DEFAULT_PRIMITIVES_BATCH_WINDOW
+        )
+        if batch_window < 0 and batch_window != PRIMITIVES_NO_BATCH:
+            return False
+
         return True
 
     @classmethod
@@ -0,0 +1,267 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import numpy as np
+
+from parrot.exceptions import ParrotError
+
+
+class BlockAllocator:
+    """Allocator of KV cache blocks, in a pool of a fixed number of blocks.
+
+    Free block ids are kept in an array used as a stack, so allocating and freeing a block
+    are O(1) (and recently freed blocks are reused first).
+
+    Blocks are reference-counted, so that a block can be shared by contexts (e.g. the
+    last partial block of a parent and its forked children). A block is freed when its
+    last reference is dropped. The reference counts detect double frees, and give the
+    fragmentation of the pool.
+
+    Sharing a partial block is copy-on-write: The number of used slots of each block is
+    tracked, and only the context appending right after the used slots writes the block
+    in place; others copy it (`copy_on_write`). The copies are queued, to be executed on
+    the KV cache by the runner (`pop_pending_copies`).
+
+    With prefix caching, full blocks are registered by the digest of their content (see
+    BlockContext), and can be looked up and reused by other contexts. A registered block
+    whose last reference is dropped is kept in an LRU pool of cached blocks, instead of
+    freed. Cached blocks count as free: they are reclaimed (least recently used first)
+    when the free blocks run out.
+    """
+
+    def __init__(
+        self,
+        pool_name: str,
+        num_blocks: int,
+        enable_prefix_caching: bool = False,
+    ) -> None:
+        self.pool_name = pool_name
+        self.num_blocks = num_blocks
+        self.enable_prefix_caching = enable_prefix_caching
+
+        # Reversed, so that the smaller ids are allocated first.
+        self.free_ids: List[int] = list(range(num_blocks - 1, -1, -1))
+        self.ref_counts = np.zeros(num_blocks, dtype=np.int32)
+        self.num_used_slots = np.zeros(num_blocks, dtype=np.int32)
+        self.history_max = 0
+
+        # Pending copies of copy-on-write blocks: (src_block_id, dst_block_id).
+        self.pending_copies: List[Tuple[int, int]] = []
+
+        # Prefix caching
+        self.block_hashes: Dict[int, bytes] = {}  # block id -> digest
+        self.hash_to_block: Dict[bytes, int] = {}  # digest -> block id
+        # LRU pool of the unreferenced registered blocks.
+        self.cached_blocks: "OrderedDict[int, None]" = OrderedDict()
+        self.num_prefix_queries = 0
+        self.num_prefix_hits = 0
+
+    def _check_free_num(self, num: int) -> None:
+        if num > self.get_free_num():
+            raise ParrotError(
+                f"No free blocks in Pool: {self.pool_name} (num_blocks={self.num_blocks}, "
+                f"free={self.get_free_num()}, requested={num})."
+            )
+
+        # Reclaim the least recently used cached blocks.
+        while num > len(self.free_ids):
+            block_id, _ = self.cached_blocks.popitem(last=False)
+            del self.hash_to_block[self.block_hashes.pop(block_id)]
+            self.free_ids.append(block_id)
+
+    def _release(self, block_id: int) -> None:
+        """Put a block without references back to the pool."""
+
+        if block_id in self.block_hashes:
+            self.cached_blocks[block_id] = None
+        else:
+            self.free_ids.append(block_id)
+
+    def _update_history_max(self) -> None:
+        self.history_max = max(self.history_max, self.get_allocated_num())
+
+    def allocate(self) -> int:
+        """Allocate a block."""
+
+        self._check_free_num(1)
+        block_id = self.free_ids.pop()
+        self.ref_counts[block_id] = 1
+        self.num_used_slots[block_id] = 0
+        self._update_history_max()
+        return block_id
+
+    def allocate_n(self, num: int) -> List[int]:
+        """Allocate `num` blocks."""
+
+        if num == 0:
+            return []
+        self._check_free_num(num)
+        block_ids = self.free_ids[-num:]
+        del self.free_ids[-num:]
+        block_ids.reverse()
+        self.ref_counts[block_ids] = 1
+        self.num_used_slots[block_ids] = 0
+        self._update_history_max()
+        return block_ids
+
+    def fork(self, block_id: int) -> None:
+        """Add a reference to an allocated block."""
+
+        if self.ref_counts[block_id] == 0:
+            raise ValueError(f"The block {block_id} is free.")
+        self.ref_counts[block_id] += 1
+
+    def get_ref_count(self, block_id: int) -> int:
+        """Get the number of references to a block."""
+
+        return int(self.ref_counts[block_id])
+
+    def free(self, block_id: int) -> None:
+        """Drop a reference to a block. Free it if it's the last one."""
+
+        if self.ref_counts[block_id] == 0:
+            raise ValueError(f"The block {block_id} is already free.")
+        self.ref_counts[block_id] -= 1
+        if self.ref_counts[block_id] == 0:
+            self._release(block_id)
+
+    def free_many(self, block_ids: List[int]) -> None:
+        """Drop a reference to each of the blocks (distinct ids)."""
+
+        if len(block_ids) == 0:
+            return
+        ref_counts = self.ref_counts[block_ids]
+        if not ref_counts.all():
+            raise ValueError(f"Some of the blocks {block_ids} are already free.")
+        self.ref_counts[block_ids] = ref_counts - 1
+        if len(self.block_hashes) == 0 and (ref_counts == 1).all():
+            self.free_ids.extend(reversed(block_ids))
+            return
+        for block_id, ref_count in zip(reversed(block_ids), ref_counts[::-1]):
+            if ref_count == 1:
+                self._release(block_id)
+
+    # ---------- Copy-on-write ----------
+
+    def append_slots(self, block_id: int, offset: int, num_slots: int) -> bool:
+        """Try to write `num_slots` slots of a block from `offset` in place.
+
+        It's allowed if the block is not shared, or the slots from `offset` are not used
+        by any context yet (then they are claimed). Otherwise the caller should copy the
+        block first (`copy_on_write`).
+        """
+
+        if self.ref_counts[block_id] > 1 and self.num_used_slots[block_id] != offset:
+            return False
+        self.num_used_slots[block_id] = offset + num_slots
+        return True
+
+    def copy_on_write(self, block_id: int, num_slots: int) -> int:
+        """Copy a shared block to a new block, and drop the reference to the old one.
+
+        Args:
+            block_id: The shared block.
+            num_slots: The number of slots to copy (the used slots of the caller).
+
+        Returns:
+            The new block id. The copy is queued in `pending_copies`.
+        """
+
+        new_block_id = self.allocate()
+        self.num_used_slots[new_block_id] = num_slots
+        self.pending_copies.append((block_id, new_block_id))
+        self.free(block_id)
+        return new_block_id
+
+    def pop_pending_copies(self) -> List[Tuple[int, int]]:
+        """Pop the pending copies of copy-on-write blocks."""
+
+        copies = self.pending_copies
+        self.pending_copies = []
+        return copies
+
+    # ---------- Prefix caching ----------
+
+    def register_block(self, block_id: int, block_hash: bytes) -> None:
+        """Register a full block by the digest of its content, to be reused."""
+
+        if (
+            not self.enable_prefix_caching
+            or block_hash in self.hash_to_block
+            or block_id in self.block_hashes
+        ):
+            return
+        self.block_hashes[block_id] = block_hash
+        self.hash_to_block[block_hash] = block_id
+
+    def lookup_blocks(self, block_hashes: List[bytes]) -> List[int]:
+        """Look up the registered blocks of the longest prefix of `block_hashes`, and
+        add a reference to each of them (reviving them from the cached blocks if
+        needed).
+
+        Returns:
+            The block ids, one per matched hash.
+        """
+
+        block_ids: List[int] = []
+        for block_hash in block_hashes:
+            block_id = self.hash_to_block.get(block_hash)
+            if block_id is None:
+                break
+            if self.ref_counts[block_id] == 0:
+                del self.cached_blocks[block_id]
+            self.ref_counts[block_id] += 1
+            block_ids.append(block_id)
+
+        self.num_prefix_queries += len(block_hashes)
+        self.num_prefix_hits += len(block_ids)
+        self._update_history_max()
+        return block_ids
+
+    def get_prefix_cache_hit_rate(self) -> float:
+        """Get the ratio of the looked up blocks that hit."""
+
+        if self.num_prefix_queries == 0:
+            return 0.0
+        return self.num_prefix_hits / self.num_prefix_queries
+
+    def get_num_cached_blocks(self) -> int:
+        """Get the number of cached blocks (unreferenced, but kept for reuse)."""
+
+        return len(self.cached_blocks)
+
+    def get_free_num(self) -> int:
+        """Get the number of free blocks (including the cached blocks)."""
+
+        return len(self.free_ids) + len(self.cached_blocks)
+
+    def get_allocated_num(self) -> int:
+        """Get the number of allocated blocks."""
+
+        return self.num_blocks - self.get_free_num()
+
+    def get_history_max_allocated_num(self) -> int:
+        """Get the maximum number of allocated blocks."""
+
+        return self.history_max
+
+    def get_fragmentation(self) -> float:
+        """Get the fragmentation of the free blocks: 1 - (the largest run of contiguous
+        free blocks) / (the number of free blocks). 0 means the free blocks are
+        contiguous.
+
+        It scans the bitmap, so it's for statistics (e.g. runtime info), not hot paths.
+        """
+
+        num_free = self.get_free_num()
+        if num_free == 0:
+            return 0.0
+
+        # Boundaries of the runs of free blocks.
+        padded = np.concatenate(([True], self.ref_counts > 0, [True]))
+        edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+        largest_run = int((edges[1::2] - edges[::2]).max())
+        return 1.0 - largest_run / num_free
@@ -2,102 +2,440 @@
 # Licensed under the MIT license.
 
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
+import hashlib
+import numpy as np
 import torch
 
-from parrot.utils import RecyclePool
-
 from .low_level_context import LowLevelContext
+from .block_allocator import BlockAllocator
 
 
 class BlockContext(LowLevelContext):
-    """BlockContext: Use the idea of PagedAttention to manage the memory."""
+    """BlockContext: Use the idea of PagedAttention to manage the memory.
+
+    The context keeps a block table: the ids of the KV blocks of the whole context
+    (including its ancestors), one entry per block, in an int32 array. The blocks of the
+    ancestors are copied into the table once and reused in every iteration; they are
+    only copied again if an ancestor changes. So the cost of extending the context and
+    reading its table is O(new tokens), not O(context length).
+
+    A forked context shares the blocks of its parent, including the last partial block
+    of the parent (if any): the context continues right after the parent's tokens in
+    that block, instead of padding the parent to a block boundary. The shared partial
+    block is copy-on-write (see BlockAllocator): the first context appending to it writes
+    in place, and the others copy it. Hence the i-th token of the whole context is always
+    in the block `table[i // block_size]`, with offset `i % block_size`.
+
+    With prefix caching, the full blocks are keyed by a digest of their content (the
+    digest of the previous block and the token ids in the block) and registered in the
+    manager. A Fill reuses the registered blocks matching its leading tokens, instead of
+    recomputing them (see `reuse_cached_blocks`).
+
+    NOTE(chaofan): A context sees its parent as it was when forked. Tokens appended to
+    the parent later are not in the context.
+    """
 
     def __init__(
         self,
         context_id: int,
         parent_context: Optional["BlockContext"],
-        kv_cache_manager: RecyclePool,
+        kv_cache_manager: BlockAllocator,
         block_size: int,
     ):
         super().__init__(context_id, parent_context)
 
         # For blocked context
         self.block_size = block_size
-        self.padded = False
-        self.padded_len = 0
-
-        if self.parent_context is not None and not self.parent_context.padded:
-            # Get current length
-            context_len = self.parent_context.get_this_context_len()
 
-            # Pad the length to the multiple of block size
-            total_len = (
-                (context_len + self.block_size - 1) // self.block_size * self.block_size
-            )
-            self.parent_context.pad_to(total_len)
-
-        # KV blocks address
-        # length = num_tokens. Each element is a block id.
-        # Hence the list is like [0, 0, 0, 1, 1, 1, 2, 2, 2] (block size = 3)
-        self.token_kv_block_ids: List[int] = []
-        # KV blocks offset. like [0, 1, 2, 3, 4, 5, 6, 7, 8]
-        self.token_kv_slot_ids: List[int] = []
+        # Length of the parent context when forked, and the offset of this context in
+        # its first block (i.e. the number of parent tokens in the shared partial block).
+        self._fork_len = (
+            self.parent_context.get_context_len()
+            if self.parent_context is not None
+            else 0
+        )
+        self._start_offset = self._fork_len % self.block_size
+
+        # KV block table. [prefix blocks (of the ancestors) | own blocks | capacity]
+        # The prefix are the full blocks of the parent. The own blocks start with the
+        # shared partial block of the parent, if any.
+        self._block_table = np.empty(16, dtype=np.int32)
+        self._num_prefix_blocks = 0
+        self._num_own_blocks = 0
+        self._num_tokens = 0  # Number of tokens (KV slots) of this context.
+        # The table version changes when the blocks in the table (including the prefix)
+        # are rewritten, to invalidate the copies of the table (e.g. the prefixes cached
+        # by the sub-contexts). Appending blocks doesn't change it.
+        self._table_version = 0
+        self._prefix_version = -1  # Version of the parent table we copied.
 
         # Token ids
         self.token_ids: List[int] = []  # length = num_tokens
 
-        # KV cache manager i.e. a pool allocator.
+        # Prefix caching: Digests of the full own blocks, in order.
+        self._block_hashes: List[bytes] = []
+
+        # KV cache manager i.e. a block allocator.
         self.kv_cache_manager = kv_cache_manager
 
         # If the context is extended by the `fill` primitive, it should has a
         # `last_hidden_state` for the `generation` primitive.
         self.last_hidden_state: Optional[torch.Tensor] = None
 
-    def _allocate_one(self):
-        idx = len(self.token_kv_block_ids)
-        if idx % self.block_size == 0:
-            cur_block_id = self.kv_cache_manager.allocate()
-            self.token_kv_block_ids.append(cur_block_id)
-            self.token_kv_slot_ids.append(cur_block_id * self.block_size)
-            # print(self.token_kv_block_ids, idx)
-        else:
-            cur_block_id = self.token_kv_block_ids[-1]
-            last_slot_id = self.token_kv_slot_ids[-1]
-            self.token_kv_block_ids.append(cur_block_id)
-            self.token_kv_slot_ids.append(last_slot_id + 1)
-
-    def pad_to(self, length: int):
-        """Pad the context to a certain length."""
+        # Preemption. The KV blocks of a preempted context are released: its KV cache is
+        # either swapped out to the host (swap_slots), or dropped and recomputed by a
+        # Fill of its tokens (recompute_token_ids), scheduled before the preempted job.
+        # See KVSwapManager.
+        self.swap_slots: Optional[List[int]] = None
+        self.swap_manager = None
+        self.recompute_token_ids: Optional[List[int]] = None
+        # Kept aside while recomputing: the pending tokens (not in the KV cache) and the
+        # last hidden state.
+        self._recompute_saved: Optional[Tuple[List[int], Optional[torch.Tensor]]] = None
+
+        self._fork_parent_partial_block()
+
+    # ---------- Block table ----------
+
+    def _reserve(self, num_blocks: int) -> None:
+        """Make sure the table can hold `num_blocks` blocks."""
+
+        if num_blocks > len(self._block_table):
+            table = np.empty(max(num_blocks, 2 * len(self._block_table)), np.int32)
+            table[: self._num_prefix_blocks + self._num_own_blocks] = self._block_table[
+                : self._num_prefix_blocks + self._num_own_blocks
+            ]
+            self._block_table = table
+
+    def _fork_parent_partial_block(self) -> None:
+        """Share the last partial block of the parent (with the parent tokens in it) as
+        the first own block."""
+
+        if self._start_offset == 0:
+            return
+
+        block_id = int(
+            self.parent_context.get_context_block_table()[
+                self._fork_len // self.block_size
+            ]
+        )
+        self.kv_cache_manager.fork(block_id)
+        self._sync_prefix()
+        self._reserve(self._num_prefix_blocks + 1)
+        self._block_table[self._num_prefix_blocks] = block_id
+        self._num_own_blocks = 1
+
+    def _sync_prefix(self) -> None:
+        """Copy the (full blocks of the) table of the parent as the prefix, if it
+        changed."""
+
+        if self.parent_context is None:
+            return
+
+        parent_table = self.parent_context.get_context_block_table()
+        if self._prefix_version == self.parent_context._table_version:
+            return
+
+        own_blocks = self._get_own_block_table().copy()
+        num_prefix_blocks = self._fork_len // self.block_size
+        self._reserve(num_prefix_blocks + self._num_own_blocks)
+        self._num_prefix_blocks = num_prefix_blocks
+        self._block_table[:num_prefix_blocks] = parent_table[:num_prefix_blocks]
+        self._block_table[
+            self._num_prefix_blocks : self._num_prefix_blocks + self._num_own_blocks
+        ] = own_blocks
+        self._prefix_version = self.parent_context._table_version
+        self._table_version += 1
+
+    def _get_own_block_table(self) -> np.ndarray:
+        return self._block_table[
+            self._num_prefix_blocks : self._num_prefix_blocks + self._num_own_blocks
+        ]
+
+    def get_context_block_table(self) -> np.ndarray:
+        """Return the block ids of the whole context (one per block), as an int32 array.
+
+        NOTE(chaofan): It's a view of the internal table. Don't modify it.
+        """
+
+        self._sync_prefix()
+        return self._block_table[: self._num_prefix_blocks + self._num_own_blocks]
+
+    def get_context_slot_ids(self, num_last_tokens: Optional[int] = None) -> np.ndarray:
+        """Return the slot (block * block_size + offset) ids of the tokens in the whole
+        context, or only the last `num_last_tokens` tokens, as an int64 array."""
+
+        context_len = self.get_context_len()
+        start = 0 if num_last_tokens is None else context_len - num_last_tokens
+        positions = np.arange(start, context_len, dtype=np.int64)
+        table = self.get_context_block_table()
+        return (
+            table[positions // self.block_size].astype(np.int64) * self.block_size
+            + positions % self.block_size
+        )
 
-        cur_len = self.get_this_context_len()
-        assert length >= cur_len, "The length should be larger than the current length."
+    @property
+    def table_version(self) -> int:
+        """Version of the block table. See `__init__`."""
 
-        # Padded len = length - cur_len
-        self.padded_len = length - cur_len
+        self._sync_prefix()
+        return self._table_version
 
-        for _ in range(self.padded_len):
-            self._allocate_one()
+    def get_own_block_ids(self) -> List[int]:
+        """Return the ids of the blocks owned by this context (not the parents)."""
 
-        self.padded = True
+        return self._get_own_block_table().tolist()
 
     # override
     def destruction(self):
         super().destruction()
 
+        if self.swap_slots is not None:
+            # Swapped out: The blocks are already released.
+            self.swap_manager.discard(self)
+            return
+
         # Free every block in the manager
-        for block_id in self.token_kv_block_ids[:: self.block_size]:
-            self.kv_cache_manager.free(block_id)
+        self.kv_cache_manager.free_many(self.get_own_block_ids())
+
+    @property
+    def is_resident(self) -> bool:
+        """Whether the KV cache of this context is in the device memory."""
+
+        return self.swap_slots is None and self.recompute_token_ids is None
+
+    def release_blocks(self) -> None:
+        """Release the blocks of this context to the manager, keeping the block table.
+        Used when the context is swapped out."""
+
+        self.kv_cache_manager.free_many(self.get_own_block_ids())
+
+    def reallocate_blocks(self) -> List[int]:
+        """Allocate new blocks for the released ones, and update the block table.
+        Used when the context is swapped in.
+
+        Returns:
+            The new block ids, in the order of `get_own_block_ids()` before.
+        """
+
+        new_block_ids = self.kv_cache_manager.allocate_n(self._num_own_blocks)
+        self._get_own_block_table()[:] = new_block_ids
+        if self._num_own_blocks > 0:
+            self.kv_cache_manager.append_slots(
+                new_block_ids[-1], 0, self._get_num_last_block_slots()
+            )
+        self._table_version += 1
+        for block_id, block_hash in zip(new_block_ids, self._block_hashes):
+            self.kv_cache_manager.register_block(block_id, block_hash)
+        return new_block_ids
+
+    def reset_blocks(self) -> None:
+        """Clear the block table of this context (the blocks must be released). Used
+        when the KV cache is dropped for recomputation."""
+
+        self._num_own_blocks = 0
+        self._num_tokens = 0
+        self._block_hashes = []
+        self._table_version += 1
+        self._fork_parent_partial_block()
+
+    def drop_for_recompute(self) -> None:
+        """Drop the KV cache of this context (the blocks must be released), to be
+        recomputed by a Fill of `recompute_token_ids`. The context is refilled from
+        empty; the pending tokens and the last hidden state are restored by
+        `finish_recompute`."""
+
+        num_tokens = self._num_tokens
+        self.recompute_token_ids = self.token_ids[:num_tokens]
+        self._recompute_saved = (self.token_ids[num_tokens:], self.last_hidden_state)
+        self.token_ids = []
+        self.last_hidden_state = None
+        self.reset_blocks()
+
+    def finish_recompute(self) -> None:
+        """Called when the recompute Fill finishes."""
+
+        pending_token_ids, last_hidden_state = self._recompute_saved
+        self.token_ids.extend(pending_token_ids)
+        self.last_hidden_state = last_hidden_state
+        self.recompute_token_ids = None
+        self._recompute_saved = None
+
+    def _get_num_last_block_slots(self) -> int:
+        """Number of used slots in the last own block."""
+
+        return (self._start_offset + self._num_tokens - 1) % self.block_size + 1
 
     def allocate(self, length: int):
         """Allocate a certain length of blocks."""
 
-        for _ in range(length):
-            self._allocate_one()
+        if length == 0:
+            return
+
+        # Append to the last partial block first. Copy it if it's shared and the slots
+        # are used by another context.
+        offset = (self._start_offset + self._num_tokens) % self.block_size
+        if offset != 0 and self._num_own_blocks > 0:
+            last = self._num_prefix_blocks + self._num_own_blocks - 1
+            block_id = int(self._block_table[last])
+            num_slots = min(length, self.block_size - offset)
+            if not self.kv_cache_manager.append_slots(block_id, offset, num_slots):
+                new_block_id = self.kv_cache_manager.copy_on_write(block_id, offset)
+                self.kv_cache_manager.append_slots(new_block_id, offset, num_slots)
+                self._block_table[last] = new_block_id
+                self._table_version += 1
+
+        self._num_tokens += length
+        num_blocks = (
+            self._start_offset + self._num_tokens + self.block_size - 1
+        ) // self.block_size
+        num_new_blocks = num_blocks - self._num_own_blocks
+        if num_new_blocks == 0:
+            return
+
+        # Allocate new blocks in bulk.
+        end = self._num_prefix_blocks + self._num_own_blocks
+        self._reserve(end + num_new_blocks)
+        new_block_ids = self.kv_cache_manager.allocate_n(num_new_blocks)
+        self._block_table[end : end + num_new_blocks] = new_block_ids
+        self._num_own_blocks = num_blocks
+        self.kv_cache_manager.append_slots(
+            new_block_ids[-1], 0, self._get_num_last_block_slots()
+        )
+
+    # ---------- Prefix caching ----------
+
+    @staticmethod
+    def _hash_block(prev_hash: Optional[bytes], token_ids: np.ndarray) -> bytes:
+        """Digest of a block: chained with the digest of the previous block.
+
+        NOTE(chaofan): A collision maps a context onto the KV cache of another prefix,
+        so the key is a cryptographic digest, not `hash()`.
+        """
+
+        h = hashlib.blake2b(digest_size=32)
+        if prev_hash is not None:
+            h.update(prev_hash)
+        h.update(token_ids.astype(np.int32, copy=False).tobytes())
+        return h.digest()
+
+    def _get_context_token_ids(self, start: int, end: int) -> List[int]:
+        """Return the token ids in [start, end) of the whole context."""
+
+        if start >= self._fork_len:
+            return self.token_ids[start - self._fork_len : end - self._fork_len]
+        token_ids = self.parent_context._get_context_token_ids(
+            start, min(end, self._fork_len)
+        )
+        if end > self._fork_len:
+            token_ids = token_ids + self.token_ids[: end - self._fork_len]
+        return token_ids
+
+    def _get_block_hash(self, block_idx: int) -> Optional[bytes]:
+        """Return the hash of the `block_idx`-th block of the whole context, or None if
+        it's not hashed."""
+
+        num_prefix_blocks = self._fork_len // self.block_size
+        if block_idx < num_prefix_blocks:
+            return self.parent_context._get_block_hash(block_idx)
+        own_idx = block_idx - num_prefix_blocks
+        if own_idx < len(self._block_hashes):
+            return self._block_hashes[own_idx]
+        return None
+
+    def register_full_blocks(self) -> None:
+        """Hash the new full blocks of this context, and register them in the manager
+        to be reused. Called after their KV cache is computed."""
+
+        # NOTE(chaofan): A context being recomputed is refilled as usual.
+        if (
+            not self.kv_cache_manager.enable_prefix_caching
+            or self.swap_slots is not None
+        ):
+            return
+
+        block_size = self.block_size
+        num_prefix_blocks = self._fork_len // block_size
+        num_full_blocks = (self._fork_len + self._num_tokens) // block_size
+        start = num_prefix_blocks + len(self._block_hashes)
+        if start >= num_full_blocks:
+            return
+
+        prev_hash = self._get_block_hash(start - 1) if start > 0 else None
+        if start > 0 and prev_hash is None:
+            # The previous block is not hashed (e.g. the parent is not registered).
+            return
+
+        table = self.get_context_block_table()
+        for block_idx in range(start, num_full_blocks):
+            token_ids = self._get_context_token_ids(
+                block_idx * block_size, (block_idx + 1) * block_size
+            )
+            prev_hash = self._hash_block(prev_hash, np.asarray(token_ids))
+            self._block_hashes.append(prev_hash)
+            self.kv_cache_manager.register_block(int(table[block_idx]), prev_hash)
+
+    def reuse_cached_blocks(self, token_ids: List[int]) -> int:
+        """Extend the context with the registered blocks matching the leading tokens of
+        `token_ids`, whose KV cache is then not recomputed.
+
+        Only whole blocks are reused, from a block boundary. The last token is never
+        reused, so that the Fill still computes its last hidden state.
+
+        Returns:
+            The number of reused tokens (a multiple of block_size).
+        """
+
+        # NOTE(chaofan): A context being recomputed is refilled as usual.
+        if (
+            not self.kv_cache_manager.enable_prefix_caching
+            or self.swap_slots is not None
+        ):
+            return 0
+
+        block_size = self.block_size
+        context_len = self.get_context_len()
+        if context_len % block_size != 0:
+            return 0
+
+        block_idx = context_len // block_size
+        prev_hash = self._get_block_hash(block_idx - 1) if block_idx > 0 else None
+        if block_idx > 0 and prev_hash is None:
+            # The last block is not hashed.
+            return 0
+
+        data = np.asarray(token_ids)
+        block_hashes: List[bytes] = []
+        for start in range(0, len(token_ids) - block_size, block_size):
+            prev_hash = self._hash_block(prev_hash, data[start : start + block_size])
+            block_hashes.append(prev_hash)
+        if len(block_hashes) == 0:
+            return 0
+
+        block_ids = self.kv_cache_manager.lookup_blocks(block_hashes)
+        if len(block_ids) == 0:
+            return 0
+
+        num_reused = len(block_ids) * block_size
+        self._block_hashes.extend(block_hashes[: len(block_ids)])
+
+        self._sync_prefix()
+        end = self._num_prefix_blocks + self._num_own_blocks
+        self._reserve(end + len(block_ids))
+        self._block_table[end : end + len(block_ids)] = block_ids
+        self._num_own_blocks += len(block_ids)
+        self._num_tokens += num_reused
+        self.token_ids.extend(token_ids[:num_reused])
+        return num_reused
+
+    # override
+    def get_context_len(self) -> int:
+        return self._fork_len + self.get_this_context_len()
 
     # override
     def get_this_context_len(self) -> int:
-        return len(self.token_kv_block_ids)  # token len
+        return self._num_tokens  # token len
 
     # override
     def get_last_token_id(self) -> int:
@@ -107,22 +445,6 @@ class BlockContext(LowLevelContext):
     def push_token_id(self, token_id: int):
         self.token_ids.append(token_id)
 
-    def get_context_block_ids(self) -> List[int]:
-        """Return the context block ids."""
-
-        parent_block_ids = (
-            self.parent_context.get_context_block_ids() if self.parent_context else []
-        )
-        return parent_block_ids + self.token_kv_block_ids
-
-    def get_context_slot_ids(self) -> List[int]:
-        """Return the context slot (block + offset) ids."""
-
-        parent_slot_ids = (
-            self.parent_context.get_context_slot_ids() if self.parent_context else []
-        )
-        return parent_slot_ids + self.token_kv_slot_ids
-
     def get_last_hidden_state(self) -> torch.Tensor:
         """Return the last hidden state."""
 
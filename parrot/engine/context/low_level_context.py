@@ -49,6 +49,15 @@ class LowLevelContext(ABC):
     def get_this_context_len(self) -> int:
         """Return the length of the context, without recursing into parent contexts."""
 
+    def reuse_cached_blocks(self, token_ids: List[int]) -> int:
+        """Extend the context with the cached KV cache of the leading tokens of
+        `token_ids` (prefix caching). Return the number of reused tokens.
+
+        Contexts without a KV cache reuse nothing.
+        """
+
+        return 0
+
     # The following methods are used in the token-level context.
 
     @abstractmethod
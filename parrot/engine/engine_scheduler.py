@@ -2,13 +2,14 @@
 # Licensed under the MIT license.
 
 
-from typing import List, Dict
-import time
+from typing import List, Dict, Tuple
 
+from parrot.constants import FILL_NO_CHUNK
 from parrot.exceptions import parrot_assert
 from parrot.utils import get_logger, time_counter_in_nanoseconds
 
 from .primitive_job import PrimitiveJob, Fill, Generate
+from .job_queue import JobQueue
 from .config import SchedulerConfig
 
 
@@ -23,16 +24,34 @@ class EngineScheduler:
     next batch.
     """
 
-    def __init__(self, config: SchedulerConfig) -> None:
+    def __init__(
+        self, config: SchedulerConfig, fill_chunk_size: int = FILL_NO_CHUNK
+    ) -> None:
         self.max_batch_size = config.max_batch_size
         self.max_num_batched_tokens = config.max_num_batched_tokens
         self.max_total_tokens = config.max_total_tokens
 
-        self.waiting_jobs: List[PrimitiveJob] = []
+        # Chunked prefill: Fills are split into chunks of at most fill_chunk_size tokens,
+        # interleaved with the decoding of running jobs. FILL_NO_CHUNK: Fill as a whole.
+        parrot_assert(
+            fill_chunk_size == FILL_NO_CHUNK or fill_chunk_size > 0,
+            f"Invalid fill_chunk_size: {fill_chunk_size}",
+        )
+        self.fill_chunk_size = fill_chunk_size
+
+        # Waiting jobs, in the scheduling order. See JobQueue.
+        self.waiting_jobs = JobQueue()
         self.running_jobs: List[PrimitiveJob] = []
 
         self.policy = config.policy
 
+        # Jobs preempted in the last `schedule`. The engine may release their KV cache.
+        self.preempted_jobs: List[PrimitiveJob] = []
+
+        # Preempted jobs whose KV cache is being recomputed (context id -> job). They
+        # are held out of the waiting jobs until their recompute Fills finish.
+        self.held_jobs: Dict[int, PrimitiveJob] = {}
+
         # Use context id as key. Different jobs with the same context id can't
         # present at the same time.
         self.job_arrival_time: Dict[int, float] = {}
@@ -43,12 +62,33 @@ class EngineScheduler:
     def add_job(self, job: PrimitiveJob) -> None:
         """Add a job to the scheduler."""
 
-        self.waiting_jobs.append(job)
         cur_time = time_counter_in_nanoseconds()
+
+        # NOTE(chaofan): An empty Fill (e.g. an empty text, tokenized without special
+        # tokens) has nothing to compute: Its context is already bound, so it's done.
+        # A Fill with no tokens in the waiting jobs would never be admitted.
+        if isinstance(job, Fill) and job.token_ids is not None and job.num_tokens == 0:
+            job.start_time = job.end_time = cur_time
+            job.finish_event.set()
+            return
+
+        self.waiting_jobs.push(job, cur_time)
         self.job_arrival_time[job.context_id] = cur_time
         if job.task_id not in self.task_arrival_time:
             self.task_arrival_time[job.task_id] = cur_time
 
+    def add_recompute_job(self, job: PrimitiveJob, recompute_job: Fill) -> None:
+        """Recompute the dropped KV cache of a preempted (waiting) job first.
+
+        The recompute Fill takes the place of the job in the waiting jobs (with its
+        arrival time), so it's admitted under the same constraints as other jobs. The
+        job is held until the Fill finishes.
+        """
+
+        self.waiting_jobs.remove(job)
+        self.held_jobs[job.context_id] = job
+        self.waiting_jobs.push(recompute_job, self.job_arrival_time[job.context_id])
+
     def remove_job(self, job: PrimitiveJob) -> None:
         """Remove a job from the scheduler."""
 
@@ -77,42 +117,169 @@ class EngineScheduler:
         # return len(self.waiting_jobs) == 0 and len(self.running_jobs) == 0
         return self.num_total_jobs == 0
 
+    @staticmethod
+    def _deadline_key(job: PrimitiveJob, now: int) -> Tuple[bool, float]:
+        """Earliest-deadline-first. Jobs without deadlines are after those with, and jobs
+        which have missed their deadlines are deprioritized to the end."""
+
+        if job.deadline is None:
+            return (False, float("inf"))
+        return (job.deadline < now, job.deadline)
+
+    @staticmethod
+    def _reuse_cached_prefix(job: PrimitiveJob) -> None:
+        """Prefix caching: Extend the context of a waiting Fill with the cached KV cache
+        of its leading tokens, before its tokens are budgeted. So the reused tokens are
+        not charged."""
+
+        if isinstance(job, Fill) and job.token_ids is not None:
+            job.num_filled_tokens += job.context.reuse_cached_blocks(
+                job.token_ids[job.num_filled_tokens :]
+            )
+
+    def _get_job_num_tokens(self, job: PrimitiveJob, budget: int) -> int:
+        """The number of tokens of the job in the next iteration, given the remaining
+        token budget of the iteration."""
+
+        if isinstance(job, Generate) or job.token_ids is None:
+            return 1
+        if self.fill_chunk_size == FILL_NO_CHUNK:
+            return job.num_remain_tokens
+        return min(job.num_remain_tokens, self.fill_chunk_size, budget)
+
+    def _admit(self, job: PrimitiveJob, job_num_tokens: int) -> None:
+        """Move a (popped) waiting job to running, with its number of tokens in the next
+        iteration."""
+
+        if isinstance(job, Fill):
+            job.iter_num_tokens = job_num_tokens
+        self.running_jobs.append(job)
+        if job.start_time == -1:
+            job.start_time = time_counter_in_nanoseconds()
+
+    def _preempt_by_total_tokens(self, now: int) -> int:
+        """Check the total tokens constraint and do preemption.
+
+        Returns:
+            The number of total tokens of the running jobs after preemption.
+        """
+
+        # This is to avoid compute the same context multiple times.
+        # TODO(chaofan): Only do this in shared prefix mode.
+        # visited_context_ids = set()
+        # if ctx.context_id not in visited_context_ids:
+        #     cur_total_tokens += ctx.get_this_context_len()
+        #     visited_context_ids.add(ctx.context_id)
+        # parent_ctx = ctx.parent_context
+        # if parent_ctx and parent_ctx.context_id not in visited_context_ids:
+        #     cur_total_tokens += parent_ctx.get_this_context_len()
+        #     visited_context_ids.add(parent_ctx.context_id)
+
+        # For normal mode, we repeatly count prefix because it's repeated loaded.
+        cur_total_tokens = sum(
+            job.context.get_context_len() for job in self.running_jobs
+        )
+        if cur_total_tokens <= self.max_total_tokens:
+            return cur_total_tokens
+
+        # Latency-critical jobs (then jobs with earlier deadlines) are kept first.
+        # Others are preempted first.
+        self.running_jobs.sort(
+            key=lambda job: (
+                not job.latency_critical,
+                self._deadline_key(job, now),
+                self.task_arrival_time[job.task_id],
+                self.job_arrival_time[job.context_id],
+            )
+        )
+
+        new_running: List[PrimitiveJob] = []
+        cur_total_tokens = 0
+        preempted = False
+        for job in self.running_jobs:
+            if preempted:
+                self._preempt(job)
+                continue
+
+            # NOTE(chaofan): In shared prefix mode, we should only count the prefix context once.
+            job_tokens = job.context.get_context_len()
+            if cur_total_tokens + job_tokens > self.max_total_tokens:
+                preempted = True
+                self._preempt(job)
+                continue
+
+            new_running.append(job)
+            cur_total_tokens += job_tokens
+
+        self.running_jobs = new_running
+        return cur_total_tokens
+
     def schedule(self) -> List[PrimitiveJob]:
         """Schedule jobs."""
 
+        now = time_counter_in_nanoseconds()
+        self.preempted_jobs = []
+
         # TGI-style scheduling: Fill and Gen jobs are scheduled separately.
         if self.policy == "tgi":
-            cur_tokens_sum = 0
-            cur_num_jobs = 0
-            fill_running_jobs = []
+            cur_num_jobs = len(self.running_jobs)
+            cur_num_batched_tokens = 0
+            cur_total_tokens = sum(
+                job.context.get_context_len() for job in self.running_jobs
+            )
 
-            for job in self.waiting_jobs:
-                if not isinstance(job, Fill):
-                    continue
+            # Prefill iteration: Batch the waiting Fills. The running Generate jobs are
+            # paused (not preempted) in this iteration.
+            fill_jobs: List[PrimitiveJob] = []
+            while True:
+                job = self.waiting_jobs.peek(now, fill=True)
+                if job is None:
+                    break
 
-                job_num_tokens = len(job.token_ids) if job.token_ids else 0
+                self._reuse_cached_prefix(job)
+                job_num_tokens = self._get_job_num_tokens(
+                    job, self.max_num_batched_tokens - cur_num_batched_tokens
+                )
+                job_total_tokens = job.context.get_context_len() + job_num_tokens
 
-                if cur_tokens_sum + job_num_tokens > self.max_num_batched_tokens:
+                # Constraints
+                if (
+                    cur_num_jobs + 1 > self.max_batch_size
+                    # The token budget is used up (chunked prefill).
+                    or job_num_tokens == 0
+                    or (
+                        cur_num_batched_tokens + job_num_tokens
+                        > self.max_num_batched_tokens
+                    )
+                    or cur_total_tokens + job_total_tokens > self.max_total_tokens
+                ):
                     break
 
-                fill_running_jobs.append(job)
-                if job.start_time == -1:
-                    job.start_time = time_counter_in_nanoseconds()
-                cur_tokens_sum += job_num_tokens
-                cur_num_jobs += 1
-
-            if len(fill_running_jobs) > 0:
-                # Remove all fill_running_jobs from waiting_jobs.
-                self.waiting_jobs = [
-                    job for job in self.waiting_jobs if job not in fill_running_jobs
-                ]
+                self.waiting_jobs.pop(now, fill=True)
+                self._admit(job, job_num_tokens)
+                fill_jobs.append(job)
 
-                # Preempte all running Generation jobs.
-                self.waiting_jobs = self.running_jobs + self.waiting_jobs  # FIFO
-                self.running_jobs = fill_running_jobs
-                ret = fill_running_jobs.copy()
+                # Update
+                cur_num_jobs += 1
+                cur_num_batched_tokens += job_num_tokens
+                cur_total_tokens += job_total_tokens
 
-            assert False  # TODO: fix
+            if len(fill_jobs) > 0:
+                ret = fill_jobs
+            else:
+                # Decode iteration: Admit the waiting Generate jobs and decode all.
+                cur_num_batched_tokens = len(self.running_jobs)
+                while cur_num_jobs < self.max_batch_size:
+                    job = self.waiting_jobs.pop(now, fill=False)
+                    if job is None:
+                        break
+                    self._admit(job, 1)
+                    cur_num_jobs += 1
+                    cur_num_batched_tokens += 1
+
+                cur_total_tokens = self._preempt_by_total_tokens(now)
+                # NOTE(chaofan): Use copy() to avoid list modification.
+                ret = self.running_jobs.copy()
         elif self.policy == "fifo_v1":
             cur_num_jobs = len(self.running_jobs)
             cur_num_batched_tokens = len(
@@ -122,17 +289,16 @@ class EngineScheduler:
                 [job.context.get_context_len() for job in self.running_jobs]
             )
 
-            # print(
-            #     f"Scheduling: Waiting: {len(self.waiting_jobs)} Running: {len(self.running_jobs)}"
-            # )
-
-            while self.waiting_jobs:
-                job = self.waiting_jobs[0]
+            while True:
+                job = self.waiting_jobs.peek(now)
+                if job is None:
+                    break
 
+                self._reuse_cached_prefix(job)
                 job_num_tokens = (
                     1
                     if isinstance(job, Generate) or job.token_ids is None
-                    else len(job.token_ids)
+                    else job.num_remain_tokens
                 )
                 # NOTE(chaofan): In shared prefix mode, we should only count the prefix context once.
                 job_total_tokens = job.context.get_context_len()
@@ -148,10 +314,8 @@ class EngineScheduler:
                 if cur_total_tokens + job_total_tokens > self.max_total_tokens:
                     break
 
-                self.running_jobs.append(job)
-                if job.start_time == -1:
-                    job.start_time = time_counter_in_nanoseconds()
-                self.waiting_jobs.pop(0)
+                self.waiting_jobs.pop(now)
+                self._admit(job, job_num_tokens)
 
                 # Update
                 cur_num_jobs += 1
@@ -166,79 +330,47 @@ class EngineScheduler:
                 self.running_jobs
             )  # Note: running jobs must be all Gen jobs.
 
-            # print(
-            #     f"Scheduling: Waiting: {len(self.waiting_jobs)} Running: {len(self.running_jobs)}"
-            # )
+            # Decode preference: While latency-critical jobs are decoding, Fills of other
+            # jobs are deferred, so a long prefill doesn't stall their iterations.
+            # NOTE(chaofan): With chunked prefill, the stall is bounded by the chunk size,
+            # so Fills are not deferred.
+            latency_critical_decoding = self.fill_chunk_size == FILL_NO_CHUNK and any(
+                job.latency_critical and isinstance(job, Generate)
+                for job in self.running_jobs
+            )
 
-            while self.waiting_jobs:
-                job = self.waiting_jobs[0]
+            # Admit waiting jobs in the scheduling order, until one of them doesn't fit.
+            while True:
+                job = self.waiting_jobs.peek(now, defer_fills=latency_critical_decoding)
+                if job is None:
+                    break
 
-                job_num_tokens = (
-                    1
-                    if isinstance(job, Generate) or job.token_ids is None
-                    else len(job.token_ids)
+                self._reuse_cached_prefix(job)
+                job_num_tokens = self._get_job_num_tokens(
+                    job, self.max_num_batched_tokens - cur_num_batched_tokens
                 )
                 # Constraints
-                if cur_num_jobs + 1 > self.max_batch_size:
-                    break
                 if (
-                    cur_num_batched_tokens + job_num_tokens
-                    > self.max_num_batched_tokens
+                    cur_num_jobs + 1 > self.max_batch_size
+                    # The token budget is used up (chunked prefill).
+                    or job_num_tokens == 0
+                    or (
+                        cur_num_batched_tokens + job_num_tokens
+                        > self.max_num_batched_tokens
+                    )
                 ):
                     break
 
-                self.running_jobs.append(job)
-                if job.start_time == -1:
-                    job.start_time = time.perf_counter_ns()
-                self.waiting_jobs.pop(0)
+                self.waiting_jobs.pop(now, defer_fills=latency_critical_decoding)
+                self._admit(job, job_num_tokens)
 
                 # Update
                 cur_num_jobs += 1
                 cur_num_batched_tokens += job_num_tokens
+                if job.latency_critical and isinstance(job, Generate):
+                    latency_critical_decoding = True
 
-            # Check total tokens constraint and do preemption
-
-            # This is to avoid compute the same context multiple times.
-            # TODO(chaofan): Only do this in shared prefix mode.
-            # visited_context_ids = set()
-            # if ctx.context_id not in visited_context_ids:
-            #     cur_total_tokens += ctx.get_this_context_len()
-            #     visited_context_ids.add(ctx.context_id)
-            # parent_ctx = ctx.parent_context
-            # if parent_ctx and parent_ctx.context_id not in visited_context_ids:
-            #     cur_total_tokens += parent_ctx.get_this_context_len()
-            #     visited_context_ids.add(parent_ctx.context_id)
-
-            # For normal mode, we repeatly count prefix because it's repeated loaded.
-
-            self.running_jobs.sort(
-                key=lambda job: (
-                    self.task_arrival_time[job.task_id],
-                    self.job_arrival_time[job.context_id],
-                )
-            )
-
-            # print(f"Running jobs: {self.running_jobs}")
-
-            new_running: List[PrimitiveJob] = []
-            cur_total_tokens = 0
-            preempted = False
-            for job in self.running_jobs:
-                if preempted:
-                    self._preempt(job)
-                    continue
-
-                # NOTE(chaofan): In shared prefix mode, we should only count the prefix context once.
-                job_tokens = job.context.get_context_len()
-                if cur_total_tokens + job_tokens > self.max_total_tokens:
-                    preempted = True
-                    self._preempt(job)
-                    continue
-
-                new_running.append(job)
-                cur_total_tokens += job_tokens
-
-            self.running_jobs = new_running
+            cur_total_tokens = self._preempt_by_total_tokens(now)
 
             # NOTE(chaofan): Use copy() to avoid list modification.
             ret = self.running_jobs.copy()
@@ -251,7 +383,8 @@ class EngineScheduler:
         return ret
 
     def _preempt(self, job) -> None:
-        self.waiting_jobs.insert(0, job)
+        self.waiting_jobs.push(job, self.job_arrival_time[job.context_id])
+        self.preempted_jobs.append(job)
         # logger.debug(f"Job {job} preempted.")
 
     def finish(self) -> None:
@@ -260,7 +393,18 @@ class EngineScheduler:
         new_running: List[PrimitiveJob] = []
         for job in self.running_jobs:
             if not job.finish_event.is_set():
-                new_running.append(job)
+                # Chunked prefill: A partially filled Fill waits for its next chunk. It
+                # keeps its arrival time, so it's ahead of the later jobs.
+                if isinstance(job, Fill) and job.num_remain_tokens > 0:
+                    self.waiting_jobs.push(job, self.job_arrival_time[job.context_id])
+                else:
+                    new_running.append(job)
+            elif isinstance(job, Fill) and job.is_recompute:
+                # The KV cache is recomputed: Resume the held job.
+                held_job = self.held_jobs.pop(job.context_id)
+                self.waiting_jobs.push(
+                    held_job, self.job_arrival_time[job.context_id]
+                )
             else:
                 self.remove_job(job)
                 job.end_time = time_counter_in_nanoseconds()
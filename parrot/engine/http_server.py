@@ -5,11 +5,20 @@
 import argparse
 import asyncio
 from dataclasses import asdict
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from uvicorn import Config, Server
 
+from parrot.protocol.wire_format import (
+    BINARY_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    accepts_binary,
+    decode_payload,
+    encode_binary,
+    encode_payload,
+    encode_frame,
+)
 from parrot.utils import (
     get_logger,
     create_task_in_loop,
@@ -29,18 +38,57 @@ app = FastAPI()
 llm_engine: Optional[LLMEngine] = None
 
 
+# NOTE(chaofan): Token ids in /fill, /generate and /primitives_batch can be in the binary
+# wire format. See parrot/protocol/wire_format.py.
+
+
+async def _read_payload(request: Request) -> Dict:
+    return decode_payload(request.headers.get("content-type"), await request.body())
+
+
+def _make_response(request: Request, resp: Dict, binary_fields: List[str]):
+    if accepts_binary(request.headers.get("accept")):
+        return Response(
+            content=encode_binary(resp, binary_fields),
+            media_type=BINARY_CONTENT_TYPE,
+        )
+    return resp
+
+
 @app.post("/fill")
 async def fill(request: Request):
-    payload = await request.json()
+    payload = await _read_payload(request)
     logger.debug(f"Received fill request from session_id={payload['session_id']}")
     return await llm_engine.fill(payload)
 
 
 @app.post("/generate")
 async def generate(request: Request):
-    payload = await request.json()
+    payload = await _read_payload(request)
     logger.debug(f"Received generate request from session_id={payload['session_id']}")
-    return await llm_engine.generate(payload)
+    resp = await llm_engine.generate(payload)
+    return _make_response(request, resp, ["generated_ids"])
+
+
+@app.post("/primitives_batch")
+async def primitives_batch(request: Request):
+    payload = await _read_payload(request)
+    logger.debug(
+        f"Received primitives_batch request (batch_size={len(payload['primitives'])})"
+    )
+    binary = accepts_binary(request.headers.get("accept"))
+
+    # NOTE(chaofan): The results are streamed in frames as the primitives finish, so a
+    # short Fill is not delayed by a long Generate in the same batch.
+    async def _stream_results():
+        async for index, result in llm_engine.primitives_batch(payload):
+            body = encode_payload(dict(result, index=index), ["generated_ids"], binary)
+            yield encode_frame(body)
+
+    return StreamingResponse(
+        _stream_results(),
+        media_type=BINARY_CONTENT_TYPE if binary else JSON_CONTENT_TYPE,
+    )
 
 
 @app.post("/generate_stream")
@@ -59,6 +107,13 @@ async def free_context(request: Request):
     return await llm_engine.free_context(payload)
 
 
+@app.post("/free_contexts")
+async def free_contexts(request: Request):
+    payload = await request.json()
+    logger.debug(f"Received free_contexts request")
+    return await llm_engine.free_contexts(payload)
+
+
 @app.post("/ping")
 async def ping(request: Request):
     rt_info = llm_engine.get_runtime_info(profile=False)  # For speed
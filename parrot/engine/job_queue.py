@@ -0,0 +1,126 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+import heapq
+import itertools
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .primitive_job import PrimitiveJob, Fill
+
+
+# (deadline, arrival_time, seq, job)
+_Entry = Tuple[float, int, int, PrimitiveJob]
+
+# (latency_critical, is_fill, missed)
+_Bucket = Tuple[bool, bool, bool]
+
+
+class JobQueue:
+    """Waiting jobs of the EngineScheduler, in the scheduling order:
+
+    Latency-critical jobs first, then earliest-deadline-first (jobs without deadlines are
+    after those with, and jobs which have missed their deadlines are at the end), then
+    by arrival time.
+
+    Jobs are kept in heaps bucketed by (latency_critical, is_fill, missed), so peeking and
+    popping the next job are O(log n). The deadline of a job is missed as time goes by:
+    it's moved to the "missed" bucket lazily, when it reaches the top of its heap.
+    """
+
+    def __init__(self) -> None:
+        self._heaps: Dict[_Bucket, List[_Entry]] = {
+            bucket: [] for bucket in itertools.product([True, False], repeat=3)
+        }
+        self._seq = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[PrimitiveJob]:
+        """Iterate the jobs. (Not in the scheduling order.)"""
+
+        for heap in self._heaps.values():
+            for entry in heap:
+                yield entry[-1]
+
+    def push(self, job: PrimitiveJob, arrival_time: int) -> None:
+        """Push a job, with its arrival time (to break ties in the same priority)."""
+
+        deadline = float("inf") if job.deadline is None else job.deadline
+        bucket = (job.latency_critical, isinstance(job, Fill), False)
+        heapq.heappush(
+            self._heaps[bucket], (deadline, arrival_time, next(self._seq), job)
+        )
+        self._size += 1
+
+    def remove(self, job: PrimitiveJob) -> None:
+        """Remove a job. It's O(n), for the rare cases (e.g. preemption)."""
+
+        for heap in self._heaps.values():
+            for i, entry in enumerate(heap):
+                if entry[-1] is job:
+                    heap[i] = heap[-1]
+                    heap.pop()
+                    heapq.heapify(heap)
+                    self._size -= 1
+                    return
+        raise ValueError(f"Job {job} is not in the queue.")
+
+    def _select(
+        self, now: int, fill: Optional[bool], defer_fills: bool
+    ) -> Optional[_Bucket]:
+        best_bucket: Optional[_Bucket] = None
+        best_key = None
+        for bucket, heap in self._heaps.items():
+            latency_critical, is_fill, missed = bucket
+            if fill is not None and is_fill != fill:
+                continue
+            if defer_fills and is_fill and not latency_critical:
+                continue
+
+            if not missed:
+                # Move the jobs which have missed their deadlines.
+                missed_heap = self._heaps[(latency_critical, is_fill, True)]
+                while len(heap) > 0 and heap[0][0] < now:
+                    heapq.heappush(missed_heap, heapq.heappop(heap))
+
+            if len(heap) == 0:
+                continue
+            key = (not latency_critical, missed, heap[0][:3])
+            if best_key is None or key < best_key:
+                best_bucket, best_key = bucket, key
+
+        return best_bucket
+
+    def peek(
+        self, now: int, fill: Optional[bool] = None, defer_fills: bool = False
+    ) -> Optional[PrimitiveJob]:
+        """Get the next job in the scheduling order, without removing it.
+
+        Args:
+            now: Current time (time_counter_in_nanoseconds), to check the deadlines.
+            fill: Only Fills (True), only Generates (False), or both (None).
+            defer_fills: Skip the Fills which are not latency-critical.
+
+        Returns:
+            The next job. None if there are no such jobs.
+        """
+
+        bucket = self._select(now, fill, defer_fills)
+        if bucket is None:
+            return None
+        return self._heaps[bucket][0][-1]
+
+    def pop(
+        self, now: int, fill: Optional[bool] = None, defer_fills: bool = False
+    ) -> Optional[PrimitiveJob]:
+        """Remove and return the next job in the scheduling order. The arguments are the
+        same as `peek`."""
+
+        bucket = self._select(now, fill, defer_fills)
+        if bucket is None:
+            return None
+        self._size -= 1
+        return heapq.heappop(self._heaps[bucket])[-1]
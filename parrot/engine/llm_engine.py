@@ -3,7 +3,7 @@
 
 
 from abc import ABC, abstractmethod
-from typing import Dict, AsyncGenerator
+from typing import Dict, AsyncGenerator, Tuple
 import asyncio
 import time
 import threading
@@ -106,6 +106,92 @@ class LLMEngine(ABC):
         """
         ...
 
+    async def free_contexts(self, payload: Dict) -> Dict:
+        """Free contexts API. Free a batch of contexts in order.
+
+        A context which fails to be freed (e.g. it's still running) is skipped, so that
+        it doesn't fail the rest of the batch. Its error is reported in the response,
+        and ServeCore will retry it later.
+
+        Args:
+            payload: Dict[str, Any]. The payload of the free contexts API.
+
+        Returns:
+            Dict. The ids of the freed contexts, the total freed length, and the ids of
+            the failed contexts with their errors.
+        """
+
+        freed_context_ids = []
+        context_len = 0
+        failed_context_ids = []
+        errors = []
+        for context_id in payload["context_ids"]:
+            try:
+                resp = await self.free_context({"context_id": context_id})
+            except Exception as e:
+                # NOTE(chaofan): A running context is expected to fail. Other errors are
+                # unexpected, so they are logged loudly.
+                if isinstance(e, RuntimeError):
+                    logger.debug(f"Context {context_id} is not freed: {e}")
+                else:
+                    logger.warning(
+                        f"Context {context_id} is not freed: {type(e).__name__}, {e}"
+                    )
+                failed_context_ids.append(context_id)
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            freed_context_ids.append(context_id)
+            context_len += resp["context_len"]
+
+        return {
+            "freed_context_ids": freed_context_ids,
+            "context_len": context_len,
+            "failed_context_ids": failed_context_ids,
+            "errors": errors,
+        }
+
+    async def primitives_batch(
+        self, payload: Dict
+    ) -> AsyncGenerator[Tuple[int, Dict], None]:
+        """Primitives batch API. Execute a batch of Fill/Generate primitives.
+
+        All jobs of the batch are added to the scheduler together, so they can be
+        scheduled in the same iteration. Each result is yielded as soon as its primitive
+        finishes, so a short primitive doesn't wait for the others. A failed primitive
+        doesn't affect the others.
+
+        Args:
+            payload: Dict[str, Any]. The payload of the primitives batch API.
+
+        Yields:
+            (index, result) of the primitives, in the order they finish. The result is
+            the response of fill/generate, or {"error": ...}.
+        """
+
+        coros = []
+        for item in payload["primitives"]:
+            primitive = item["primitive"]
+            if primitive == "fill":
+                coros.append(self.fill(item))
+            elif primitive == "generate":
+                coros.append(self.generate(item))
+            else:
+                raise ValueError(f"Unknown primitive in batch: {primitive}")
+
+        async def _run(index: int, coro) -> Tuple[int, Dict]:
+            try:
+                return index, await coro
+            except Exception as e:
+                logger.error(f"Primitive in batch failed: {e}")
+                return index, {"error": str(e)}
+
+        # NOTE(chaofan): The tasks are created in order and start in the same step of
+        # the event loop, and fill/generate add their jobs before the first await. So
+        # the engine loop can't run an iteration in the middle of adding the batch.
+        tasks = [asyncio.ensure_future(_run(i, coro)) for i, coro in enumerate(coros)]
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+
     @abstractmethod
     def get_runtime_info(self, profile: bool) -> EngineRuntimeInfo:
         """Get runtime info of this engine.
@@ -136,6 +136,8 @@ class OpenAIEngine(LLMEngine):
             context_id=payload["context_id"],
             parent_context_id=payload["parent_context_id"],
             text=payload["text"],
+            latency_critical=payload.get("latency_critical", False),
+            time_to_deadline=payload.get("time_to_deadline"),
         )
 
         self._add_job(fill_job)
@@ -155,6 +157,8 @@ class OpenAIEngine(LLMEngine):
             context_id=payload["context_id"],
             parent_context_id=payload["parent_context_id"],
             sampling_config=SamplingConfig(**payload["sampling_config"]),
+            latency_critical=payload.get("latency_critical", False),
+            time_to_deadline=payload.get("time_to_deadline"),
         )
 
         self._add_job(generation_job)
@@ -6,6 +6,7 @@ from typing import List, Optional
 from asyncio import Event, Queue as AsyncQueue
 
 from parrot.sampling_config import SamplingConfig
+from parrot.utils import time_counter_in_nanoseconds
 
 from .context.low_level_context import LowLevelContext
 
@@ -20,12 +21,22 @@ class PrimitiveJob:
         context_id: int,
         parent_context_id: int,
         end_flag: bool,
+        latency_critical: bool = False,
+        time_to_deadline: Optional[float] = None,
     ) -> None:
         self.session_id = session_id
         self.task_id = task_id
         self.end_flag = end_flag
         self.context_id = context_id
         self.parent_context_id = parent_context_id
+        # Latency-critical jobs (from chains with the LATENCY criteria) are prioritized
+        # by the scheduler.
+        self.latency_critical = latency_critical
+        # Deadline (time_counter_in_nanoseconds of this engine) of the job. Jobs are
+        # scheduled earliest-deadline-first. None means no deadline.
+        self.deadline: Optional[int] = None
+        if time_to_deadline is not None:
+            self.deadline = time_counter_in_nanoseconds() + int(time_to_deadline * 1e9)
         self.context: Optional[LowLevelContext] = None
         self.finish_event = Event()
 
@@ -49,11 +60,56 @@ class Fill(PrimitiveJob):
         end_flag: bool = False,
         token_ids: Optional[List[int]] = None,
         text: Optional[str] = None,
+        latency_critical: bool = False,
+        time_to_deadline: Optional[float] = None,
     ) -> None:
-        super().__init__(session_id, task_id, context_id, parent_context_id, end_flag)
+        super().__init__(
+            session_id,
+            task_id,
+            context_id,
+            parent_context_id,
+            end_flag,
+            latency_critical,
+            time_to_deadline,
+        )
         self.token_ids = token_ids
         self.text = text
 
+        # Chunked prefill: The Fill may be executed in several iterations. The scheduler
+        # sets the number of tokens to fill in the next iteration.
+        self.num_filled_tokens = 0
+        self.iter_num_tokens = self.num_tokens
+
+        # Whether it recomputes the dropped KV cache of a preempted context. See
+        # KVSwapManager.
+        self.is_recompute = False
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_ids) if self.token_ids is not None else 0
+
+    @property
+    def num_remain_tokens(self) -> int:
+        return self.num_tokens - self.num_filled_tokens
+
+    def get_iter_token_ids(self) -> List[int]:
+        """The token ids to fill in this iteration."""
+
+        return self.token_ids[
+            self.num_filled_tokens : self.num_filled_tokens + self.iter_num_tokens
+        ]
+
+    def finish_iter(self) -> bool:
+        """Mark the tokens of this iteration as filled.
+
+        Returns:
+            bool. Whether all tokens are filled.
+        """
+
+        self.num_filled_tokens += self.iter_num_tokens
+        self.iter_num_tokens = self.num_remain_tokens
+        return self.num_remain_tokens == 0
+
     def __repr__(self) -> str:
         return (
             f"Fill(session_id={self.session_id}, "
@@ -77,8 +133,18 @@ class Generate(PrimitiveJob):
         parent_context_id: int,
         sampling_config: SamplingConfig,
         end_flag: bool = False,
+        latency_critical: bool = False,
+        time_to_deadline: Optional[float] = None,
     ) -> None:
-        super().__init__(session_id, task_id, context_id, parent_context_id, end_flag)
+        super().__init__(
+            session_id,
+            task_id,
+            context_id,
+            parent_context_id,
+            end_flag,
+            latency_critical,
+            time_to_deadline,
+        )
         self.sampling_config = sampling_config
         self.output_queue: AsyncQueue[int] = AsyncQueue()  # For token streaming
         self.gen_text = ""  # For text generation
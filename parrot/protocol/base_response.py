@@ -2,11 +2,14 @@
 # Licensed under the MIT license.
 
 
-from typing import Type
+from typing import Dict, Type
+import numpy as np
 from aiohttp import ClientResponse
 from pydantic import BaseModel
 from requests import Response
 
+from .wire_format import decode_binary, is_binary_content_type
+
 
 """
 Use Pydantic to build response models.
@@ -28,3 +31,38 @@ async def async_make_response(resp_cls: Type[BaseResponse], resp: ClientResponse
     resp_data = await resp.json()
     init_data = [(field, resp_data[field]) for field in resp_cls.__fields__]
     return resp_cls(**dict(init_data))
+
+
+def make_response_from_dict(resp_cls: Type[BaseResponse], resp_data: Dict):
+    """Make the response from the decoded data, which may contain numpy arrays (token
+    ids in the binary format)."""
+
+    arrays = {
+        field: value
+        for field, value in resp_data.items()
+        if isinstance(value, np.ndarray)
+    }
+    # NOTE(chaofan): Validating arrays with pydantic converts them to lists. We validate
+    # the other fields, and set the arrays (views of the body) directly.
+    init_data = [
+        (field, [] if field in arrays else resp_data[field])
+        for field in resp_cls.__fields__
+    ]
+    resp = resp_cls(**dict(init_data))
+    for field, value in arrays.items():
+        setattr(resp, field, value)
+    return resp
+
+
+def make_binary_response(resp_cls: Type[BaseResponse], body: bytes):
+    return make_response_from_dict(resp_cls, decode_binary(body))
+
+
+async def async_make_response_any_format(
+    resp_cls: Type[BaseResponse], resp: ClientResponse
+):
+    """Make the response according to its content type (JSON or binary)."""
+
+    if is_binary_content_type(resp.content_type):
+        return make_binary_response(resp_cls, await resp.read())
+    return await async_make_response(resp_cls, resp)
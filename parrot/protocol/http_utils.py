@@ -2,13 +2,27 @@
 # Licensed under the MIT license.
 
 
-from typing import Type, Optional, Literal
+import asyncio
+from typing import Type, Optional, Literal, Sequence, Dict, AsyncGenerator
 import requests
 import aiohttp
 
 from parrot.utils import get_logger
+from parrot.constants import WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON
 
-from .base_response import BaseResponse, make_response, async_make_response
+from .base_response import (
+    BaseResponse,
+    make_response,
+    async_make_response_any_format,
+)
+from .wire_format import (
+    BINARY_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    FRAME_PREFIX_SIZE,
+    encode_binary,
+    decode_frame_length,
+    decode_payload,
+)
 
 
 logger = get_logger("API")
@@ -55,6 +69,24 @@ def send_http_request(
     raise error
 
 
+def _make_request_kwargs(
+    wire_format: str,
+    binary_fields: Sequence[str],
+    batch_key: Optional[str],
+    fields: Dict,
+) -> Dict:
+    # In the binary format, token ids are sent as int32 arrays. See wire_format.py.
+    if wire_format == WIRE_FORMAT_BINARY:
+        return {
+            "data": encode_binary(fields, binary_fields, batch_key),
+            "headers": {
+                "Content-Type": BINARY_CONTENT_TYPE,
+                "Accept": f"{BINARY_CONTENT_TYPE}, {JSON_CONTENT_TYPE}",
+            },
+        }
+    return {"json": fields}
+
+
 async def async_send_http_request(
     client_session: aiohttp.ClientSession,
     response_cls: Type[BaseResponse],
@@ -62,25 +94,61 @@ async def async_send_http_request(
     api_url: str,
     timeout=None,
     method: Literal["GET", "POST", "DELETE"] = "POST",
+    wire_format: str = WIRE_FORMAT_JSON,
+    binary_fields: Sequence[str] = (),
+    batch_key: Optional[str] = None,
     **kwargs,
 ) -> BaseResponse:
     url = http_addr + api_url
+    request_kwargs = _make_request_kwargs(wire_format, binary_fields, batch_key, kwargs)
+
     if method == "GET":
-        async with client_session.get(url, json=kwargs, timeout=timeout) as resp:
+        async with client_session.get(url, timeout=timeout, **request_kwargs) as resp:
             assert resp.ok, f"Send http request error: {resp.reason}"
-            return await async_make_response(response_cls, resp)
+            return await async_make_response_any_format(response_cls, resp)
     elif method == "POST":
-        async with client_session.post(url, json=kwargs, timeout=timeout) as resp:
+        async with client_session.post(url, timeout=timeout, **request_kwargs) as resp:
             assert resp.ok, f"Send http request error: {resp.reason}"
-            return await async_make_response(response_cls, resp)
+            return await async_make_response_any_format(response_cls, resp)
     elif method == "DELETE":
-        async with client_session.delete(url, json=kwargs, timeout=timeout) as resp:
+        async with client_session.delete(
+            url, timeout=timeout, **request_kwargs
+        ) as resp:
             assert resp.ok, f"Send http request error: {resp.reason}"
-            return await async_make_response(response_cls, resp)
+            return await async_make_response_any_format(response_cls, resp)
     else:
         raise ValueError(f"Invalid http method: {method}")
 
 
+async def async_send_http_request_frames(
+    client_session: aiohttp.ClientSession,
+    http_addr: str,
+    api_url: str,
+    timeout=None,
+    wire_format: str = WIRE_FORMAT_JSON,
+    binary_fields: Sequence[str] = (),
+    batch_key: Optional[str] = None,
+    **kwargs,
+) -> AsyncGenerator[Dict, None]:
+    """POST a request whose response is streamed in frames (see wire_format.py), and
+    yield each decoded frame as soon as it arrives."""
+
+    url = http_addr + api_url
+    request_kwargs = _make_request_kwargs(wire_format, binary_fields, batch_key, kwargs)
+
+    async with client_session.post(url, timeout=timeout, **request_kwargs) as resp:
+        assert resp.ok, f"Send http request error: {resp.reason}"
+        while True:
+            try:
+                prefix = await resp.content.readexactly(FRAME_PREFIX_SIZE)
+            except asyncio.IncompleteReadError as e:
+                if len(e.partial) > 0:
+                    raise
+                break
+            body = await resp.content.readexactly(decode_frame_length(prefix))
+            yield decode_payload(resp.content_type, body)
+
+
 async def async_send_http_request_streaming(
     client_session: aiohttp.ClientSession,
     http_addr: str,
@@ -92,5 +160,11 @@ async def async_send_http_request_streaming(
     # NOTE(chaofan): Only POST now
     async with client_session.post(url, json=kwargs) as reader:
         # assert resp.ok, "Send http request error."
-        async for chunk in reader.content.iter_chunked(4):
+        # NOTE(chaofan): iter_chunked(4) may split a token id into two chunks, so we
+        # read exactly 4 bytes (a token id) each time.
+        while True:
+            try:
+                chunk = await reader.content.readexactly(4)
+            except asyncio.IncompleteReadError:
+                break
             yield int().from_bytes(chunk, "big")
@@ -9,7 +9,7 @@ from typing import List, Dict
 from parrot.utils import get_logger
 
 from ..base_response import BaseResponse
-from ..http_utils import send_http_request
+from ..http_utils import send_http_request, async_send_http_request
 from .runtime_info import EngineRuntimeInfo
 
 
@@ -25,9 +25,11 @@ Engine Management (Engine side):
 
 Context & LLMs:
     - free_context POST
+    - free_contexts POST
     - fill POST
     - generate POST
     - generate_stream POST
+    - primitives_batch POST
 """
 
 
@@ -54,6 +56,14 @@ class FreeContextResponse(BaseResponse):
     context_len: int
 
 
+class FreeContextsResponse(BaseResponse):
+    freed_context_ids: List[int]
+    context_len: int
+    # The contexts which failed to be freed, and their errors.
+    failed_context_ids: List[int] = []
+    errors: List[str] = []
+
+
 class FillResponse(BaseResponse):
     filled_len: int
 
@@ -80,6 +90,22 @@ def free_context(http_addr: str, context_id: int) -> FreeContextResponse:
         raise e
 
 
+async def afree_contexts(
+    client_session: aiohttp.ClientSession, http_addr: str, context_ids: List[int]
+) -> FreeContextsResponse:
+    try:
+        return await async_send_http_request(
+            client_session,
+            FreeContextsResponse,
+            http_addr,
+            "/free_contexts",
+            context_ids=context_ids,
+        )
+    except BaseException as e:
+        logger.error(f"Free contexts error in {http_addr}. Error: {e}")
+        raise e
+
+
 def ping_engine(http_addr: str) -> PingEngineResponse:
     try:
         return send_http_request(
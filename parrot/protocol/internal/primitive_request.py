@@ -3,19 +3,22 @@
 
 
 from dataclasses import dataclass, asdict
-from typing import List, Optional, AsyncGenerator
+from typing import List, Dict, Optional, Tuple, Union, AsyncGenerator
 import time
 import aiohttp
 
 from parrot.utils import get_logger, time_counter_in_nanoseconds
+from parrot.constants import WIRE_FORMAT_JSON
 
 from ..http_utils import (
     send_http_request,
     async_send_http_request,
     async_send_http_request_streaming,
+    async_send_http_request_frames,
     logger,
 )
 from ...sampling_config import SamplingConfig
+from ..base_response import make_response_from_dict
 from .layer_apis import FillResponse, GenerateResponse
 
 
@@ -32,6 +35,11 @@ class Primitive:
     parent_context_id: int
     end_flag: bool
 
+    def batch_item(self) -> Dict:
+        """The item of this primitive in a /primitives_batch request."""
+
+        raise NotImplementedError
+
 
 @dataclass
 class Fill(Primitive):
@@ -43,6 +51,25 @@ class Fill(Primitive):
 
     token_ids: Optional[List[int]] = None
     text: Optional[str] = None
+    # Jobs of latency-critical primitives are prioritized in the engine scheduler.
+    latency_critical: bool = False
+    # Seconds left before the deadline of the task when the primitive is created (None
+    # means no deadline). It's relative since the clocks of ServeCore and engines differ.
+    time_to_deadline: Optional[float] = None
+
+    def batch_item(self) -> Dict:
+        return {
+            "primitive": "fill",
+            "session_id": self.session_id,
+            "task_id": self.task_id,
+            "context_id": self.context_id,
+            "parent_context_id": self.parent_context_id,
+            "end_flag": self.end_flag,
+            "token_ids": self.token_ids,
+            "text": self.text,
+            "latency_critical": self.latency_critical,
+            "time_to_deadline": self.time_to_deadline,
+        }
 
     def post(self, engine_url: str) -> FillResponse:
         try:
@@ -59,6 +86,8 @@ class Fill(Primitive):
                 end_flag=self.end_flag,
                 token_ids=self.token_ids,
                 text=self.text,
+                latency_critical=self.latency_critical,
+                time_to_deadline=self.time_to_deadline,
             )
             ed = time_counter_in_nanoseconds()
             logger.debug(
@@ -69,29 +98,57 @@ class Fill(Primitive):
             logger.error(f"Fill error in {engine_url} error: {e}")
             raise e
 
-    async def apost(self, engine_url: str) -> FillResponse:
+    async def _apost(
+        self,
+        engine_url: str,
+        client_session: aiohttp.ClientSession,
+        wire_format: str,
+    ) -> FillResponse:
+        st = time_counter_in_nanoseconds()
+        resp: FillResponse = await async_send_http_request(
+            client_session=client_session,
+            response_cls=FillResponse,
+            http_addr=engine_url,
+            api_url="/fill",
+            wire_format=wire_format,
+            binary_fields=["token_ids"],
+            session_id=self.session_id,
+            task_id=self.task_id,
+            context_id=self.context_id,
+            end_flag=self.end_flag,
+            parent_context_id=self.parent_context_id,
+            token_ids=self.token_ids,
+            text=self.text,
+            latency_critical=self.latency_critical,
+            time_to_deadline=self.time_to_deadline,
+        )
+        ed = time_counter_in_nanoseconds()
+        logger.debug(
+            f"Fill request latency: {(ed - st) / 1e6} ms. session_id={self.session_id}, task_id={self.task_id}"
+        )
+        # self.context.token_nums += resp.filled_len
+        return resp
+
+    async def apost(
+        self,
+        engine_url: str,
+        client_session: Optional[aiohttp.ClientSession] = None,
+        wire_format: str = WIRE_FORMAT_JSON,
+    ) -> FillResponse:
+        """Post the Fill primitive to the engine.
+
+        Args:
+            engine_url: The http address of the engine.
+            client_session: The (pooled) client session to use. If None, a new session
+                is created for this request.
+            wire_format: The wire format accepted by the engine ("json" or "binary").
+        """
+
         try:
-            async with aiohttp.ClientSession() as client_session:
-                st = time_counter_in_nanoseconds()
-                resp: FillResponse = await async_send_http_request(
-                    client_session=client_session,
-                    response_cls=FillResponse,
-                    http_addr=engine_url,
-                    api_url="/fill",
-                    session_id=self.session_id,
-                    task_id=self.task_id,
-                    context_id=self.context_id,
-                    end_flag=self.end_flag,
-                    parent_context_id=self.parent_context_id,
-                    token_ids=self.token_ids,
-                    text=self.text,
-                )
-                ed = time_counter_in_nanoseconds()
-                logger.debug(
-                    f"Fill request latency: {(ed - st) / 1e6} ms. session_id={self.session_id}, task_id={self.task_id}"
-                )
-            # self.context.token_nums += resp.filled_len
-            return resp
+            if client_session is None:
+                async with aiohttp.ClientSession() as client_session:
+                    return await self._apost(engine_url, client_session, wire_format)
+            return await self._apost(engine_url, client_session, wire_format)
         except BaseException as e:
             logger.error(f"Fill error in {engine_url} error: {e}")
             raise e
@@ -105,54 +162,198 @@ class Generate(Primitive):
     """
 
     sampling_config: SamplingConfig
+    # Jobs of latency-critical primitives are prioritized in the engine scheduler.
+    latency_critical: bool = False
+    # Seconds left before the deadline of the task when the primitive is created (None
+    # means no deadline). It's relative since the clocks of ServeCore and engines differ.
+    time_to_deadline: Optional[float] = None
+
+    def batch_item(self) -> Dict:
+        return {
+            "primitive": "generate",
+            "session_id": self.session_id,
+            "task_id": self.task_id,
+            "context_id": self.context_id,
+            "parent_context_id": self.parent_context_id,
+            "end_flag": self.end_flag,
+            "sampling_config": asdict(self.sampling_config),
+            "latency_critical": self.latency_critical,
+            "time_to_deadline": self.time_to_deadline,
+        }
+
+    async def _apost(
+        self,
+        engine_url: str,
+        client_session: aiohttp.ClientSession,
+        wire_format: str,
+    ) -> GenerateResponse:
+        st = time_counter_in_nanoseconds()
+        resp: GenerateResponse = await async_send_http_request(
+            client_session=client_session,
+            response_cls=GenerateResponse,
+            http_addr=engine_url,
+            api_url="/generate",
+            wire_format=wire_format,
+            session_id=self.session_id,
+            task_id=self.task_id,
+            context_id=self.context_id,
+            parent_context_id=self.parent_context_id,
+            end_flag=self.end_flag,
+            sampling_config=asdict(self.sampling_config),
+            latency_critical=self.latency_critical,
+            time_to_deadline=self.time_to_deadline,
+        )
+        ed = time_counter_in_nanoseconds()
+        logger.debug(
+            f"Generate request latency: {(ed - st) / 1e6} ms. session_id={self.session_id}, task_id={self.task_id}"
+        )
+        # self.context.token_nums += len(resp.generated_ids)
+        return resp
+
+    async def apost(
+        self,
+        engine_url: str,
+        client_session: Optional[aiohttp.ClientSession] = None,
+        wire_format: str = WIRE_FORMAT_JSON,
+    ) -> GenerateResponse:
+        """Post the Generate primitive to the engine.
+
+        Args:
+            engine_url: The http address of the engine.
+            client_session: The (pooled) client session to use. If None, a new session
+                is created for this request.
+            wire_format: The wire format accepted by the engine ("json" or "binary").
+        """
 
-    async def apost(self, engine_url: str) -> GenerateResponse:
         try:
-            async with aiohttp.ClientSession() as client_session:
-                st = time_counter_in_nanoseconds()
-                resp: GenerateResponse = await async_send_http_request(
-                    client_session=client_session,
-                    response_cls=GenerateResponse,
-                    http_addr=engine_url,
-                    api_url="/generate",
-                    session_id=self.session_id,
-                    task_id=self.task_id,
-                    context_id=self.context_id,
-                    parent_context_id=self.parent_context_id,
-                    end_flag=self.end_flag,
-                    sampling_config=asdict(self.sampling_config),
-                )
-                ed = time_counter_in_nanoseconds()
-                logger.debug(
-                    f"Generate request latency: {(ed - st) / 1e6} ms. session_id={self.session_id}, task_id={self.task_id}"
-                )
-                # self.context.token_nums += len(resp.generated_ids)
-                return resp
+            if client_session is None:
+                async with aiohttp.ClientSession() as client_session:
+                    return await self._apost(engine_url, client_session, wire_format)
+            return await self._apost(engine_url, client_session, wire_format)
         except BaseException as e:
             logger.error(f"Generate error in {engine_url} error: {e}")
             raise e
 
-    async def astream(self, engine_url: str) -> AsyncGenerator:
+    async def _astream(
+        self, engine_url: str, client_session: aiohttp.ClientSession
+    ) -> AsyncGenerator:
+        st = time_counter_in_nanoseconds()
+        async for resp in async_send_http_request_streaming(
+            client_session=client_session,
+            http_addr=engine_url,
+            api_url="/generate_stream",
+            session_id=self.session_id,
+            task_id=self.task_id,
+            context_id=self.context_id,
+            end_flag=self.end_flag,
+            parent_context_id=self.parent_context_id,
+            sampling_config=asdict(self.sampling_config),
+            latency_critical=self.latency_critical,
+            time_to_deadline=self.time_to_deadline,
+        ):
+            # self.context.token_nums += 1
+            yield resp
+        ed = time_counter_in_nanoseconds()
+        logger.debug(
+            f"Generate stream latency: {(ed - st) / 1e6} ms. session_id={self.session_id}, task_id={self.task_id}"
+        )
+
+    async def astream(
+        self,
+        engine_url: str,
+        client_session: Optional[aiohttp.ClientSession] = None,
+    ) -> AsyncGenerator:
+        """Post the Generate primitive to the engine and stream the generated token ids.
+
+        Args:
+            engine_url: The http address of the engine.
+            client_session: The (pooled) client session to use. If None, a new session
+                is created for this request.
+        """
+
         try:
-            async with aiohttp.ClientSession() as client_session:
-                st = time_counter_in_nanoseconds()
-                async for resp in async_send_http_request_streaming(
-                    client_session=client_session,
-                    http_addr=engine_url,
-                    api_url="/generate_stream",
-                    session_id=self.session_id,
-                    task_id=self.task_id,
-                    context_id=self.context_id,
-                    end_flag=self.end_flag,
-                    parent_context_id=self.parent_context_id,
-                    sampling_config=asdict(self.sampling_config),
-                ):
-                    # self.context.token_nums += 1
+            if client_session is None:
+                async with aiohttp.ClientSession() as client_session:
+                    async for resp in self._astream(engine_url, client_session):
+                        yield resp
+            else:
+                async for resp in self._astream(engine_url, client_session):
                     yield resp
-                ed = time_counter_in_nanoseconds()
-                logger.debug(
-                    f"Generate stream latency: {(ed - st) / 1e6} ms. session_id={self.session_id}, task_id={self.task_id}"
-                )
         except BaseException as e:
             logger.error(f"Generate error in {engine_url} error: {e}")
             raise e
+
+
+def _make_batch_result(
+    primitive: Primitive, result: Dict
+) -> Union[FillResponse, GenerateResponse, Exception]:
+    if "error" in result:
+        return RuntimeError(result["error"])
+    if isinstance(primitive, Fill):
+        return make_response_from_dict(FillResponse, result)
+    return make_response_from_dict(GenerateResponse, result)
+
+
+async def astream_primitives_batch(
+    primitives: List[Primitive],
+    engine_url: str,
+    client_session: aiohttp.ClientSession,
+    wire_format: str = WIRE_FORMAT_JSON,
+) -> AsyncGenerator[
+    Tuple[int, Union[FillResponse, GenerateResponse, Exception]], None
+]:
+    """Post a batch of Fill/Generate primitives to the engine in one request.
+
+    The engine adds them to its scheduler at once, so they can run in the same iteration.
+    It replies each result as soon as the primitive finishes, so a short primitive
+    doesn't wait for the others in the batch.
+
+    Args:
+        primitives: List[Primitive]. The primitives. Streaming Generate is not supported.
+        engine_url: The http address of the engine.
+        client_session: The (pooled) client session to use.
+        wire_format: The wire format accepted by the engine ("json" or "binary").
+
+    Yields:
+        (index, result) of the primitives, in the order they finish. A primitive which
+        fails in the engine gets an exception, without affecting the others.
+    """
+
+    st = time_counter_in_nanoseconds()
+    async for result in async_send_http_request_frames(
+        client_session=client_session,
+        http_addr=engine_url,
+        api_url="/primitives_batch",
+        wire_format=wire_format,
+        binary_fields=["token_ids"],
+        batch_key="primitives",
+        primitives=[primitive.batch_item() for primitive in primitives],
+    ):
+        index = result.pop("index")
+        logger.debug(
+            f"Primitives batch result {index} latency: "
+            f"{(time_counter_in_nanoseconds() - st) / 1e6} ms. "
+            f"batch_size={len(primitives)}"
+        )
+        yield index, _make_batch_result(primitives[index], result)
+
+
+async def apost_primitives_batch(
+    primitives: List[Primitive],
+    engine_url: str,
+    client_session: aiohttp.ClientSession,
+    wire_format: str = WIRE_FORMAT_JSON,
+) -> List[Union[FillResponse, GenerateResponse, Exception]]:
+    """Post a batch of primitives like astream_primitives_batch, and wait for all of
+    them.
+
+    Returns:
+        The results of the primitives, in order.
+    """
+
+    results = [None] * len(primitives)
+    async for index, result in astream_primitives_batch(
+        primitives, engine_url, client_session, wire_format
+    ):
+        results[index] = result
+    return results
@@ -28,6 +28,13 @@ class EngineRuntimeInfo:
 
     num_cached_tokens: int = 0
     num_max_blocks: int = 0
+    num_free_blocks: int = 0
+    # Fragmentation of the free KV blocks. 0 means the free blocks are contiguous.
+    blocks_fragmentation: float = 0
+    # Prefix caching: Unreferenced blocks kept for reuse (counted as free), and the
+    # hit rate of the block lookups.
+    num_prefix_cached_blocks: int = 0
+    prefix_cache_hit_rate: float = 0
     num_running_jobs: int = 0
     num_total_jobs: int = 0  # Include both running and pending jobs
 
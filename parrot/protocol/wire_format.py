@@ -0,0 +1,179 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+import json
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+"""
+Binary wire format for the internal APIs carrying token ids (e.g. Fill, Generate).
+
+Token ids in JSON cost ~6 bytes per token, and encoding/decoding them in Python is slow
+for long prompts. In the binary format, the token id fields are sent as raw int32 arrays:
+
+    | magic (4 bytes) | header length (uint32) | header (JSON) | arrays (int32) |
+
+The header contains the other fields, and the names and lengths of the arrays in the
+order they are stored. All integers are little-endian.
+
+A batch (e.g. /primitives_batch) carries a list of items under a batch key. The arrays of
+the i-th item are named "<batch key>.<i>.<field>" in the header.
+
+A streamed response (e.g. the results of /primitives_batch) is a sequence of frames, one
+per item as soon as it's ready:
+
+    | body length (uint32) | body |
+
+Each body is encoded in the format of the response's content type.
+
+Decoded arrays are numpy arrays viewing the body buffer (zero copy).
+
+The format is negotiated by the content type:
+- Request: The ServeCore sends a binary body if the engine accepts it (EngineConfig.wire_format).
+- Response: The ServeCore sets the "Accept" header, and the engine replies in binary only
+    if it's accepted.
+"""
+
+
+BINARY_CONTENT_TYPE = "application/x-parrot-binary"
+JSON_CONTENT_TYPE = "application/json"
+
+_MAGIC = b"PRT1"
+_PREFIX = struct.Struct("<4sI")
+_ARRAYS_KEY = "__arrays__"
+_INT32 = np.dtype("<i4")
+_FRAME_PREFIX = struct.Struct("<I")
+FRAME_PREFIX_SIZE = _FRAME_PREFIX.size
+
+
+def _array_to_bytes(values) -> bytes:
+    if isinstance(values, np.ndarray):
+        return values.astype(_INT32, copy=False).tobytes()
+
+    # NOTE(chaofan): array.array converts a list of Python ints much faster than numpy.
+    arr = array("i", values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _pop_arrays(
+    fields: Dict,
+    array_fields: Sequence[str],
+    prefix: str,
+    arrays: List,
+    arrays_bytes: List,
+) -> None:
+    for name in array_fields:
+        # Items in a batch may not have all the fields (e.g. Fill and Generate).
+        if name not in fields:
+            continue
+        values = fields.pop(name)
+        if values is None:
+            fields[name] = None
+            continue
+        arrays.append((prefix + name, len(values)))
+        arrays_bytes.append(_array_to_bytes(values))
+
+
+def encode_binary(
+    fields: Dict,
+    array_fields: Sequence[str],
+    batch_key: Optional[str] = None,
+) -> bytes:
+    """Encode the fields into the binary format.
+
+    Args:
+        fields: Dict. The fields to be encoded.
+        array_fields: Sequence[str]. The names of the token id fields, which are encoded
+            as int32 arrays. A field with None value is encoded in the header.
+        batch_key: Optional[str]. If set, fields[batch_key] is a list of items, and
+            array_fields are the token id fields of each item.
+
+    Returns:
+        bytes. The encoded body.
+    """
+
+    header = dict(fields)
+    arrays = []
+    arrays_bytes = []
+    if batch_key is None:
+        _pop_arrays(header, array_fields, "", arrays, arrays_bytes)
+    else:
+        items = [dict(item) for item in header[batch_key]]
+        for i, item in enumerate(items):
+            _pop_arrays(item, array_fields, f"{batch_key}.{i}.", arrays, arrays_bytes)
+        header[batch_key] = items
+    header[_ARRAYS_KEY] = arrays
+
+    header_bytes = json.dumps(header).encode()
+    return b"".join([_PREFIX.pack(_MAGIC, len(header_bytes)), header_bytes] + arrays_bytes)
+
+
+def decode_binary(body: bytes) -> Dict:
+    """Decode a body in the binary format. Arrays are numpy int32 arrays viewing the body
+    (read-only, zero copy)."""
+
+    magic, header_len = _PREFIX.unpack_from(body, 0)
+    if magic != _MAGIC:
+        raise ValueError("Invalid binary body: magic mismatch.")
+
+    offset = _PREFIX.size
+    fields = json.loads(body[offset : offset + header_len])
+    offset += header_len
+
+    for name, length in fields.pop(_ARRAYS_KEY):
+        values = np.frombuffer(body, dtype=_INT32, count=length, offset=offset)
+        offset += length * _INT32.itemsize
+        if "." in name:
+            # An array of an item in a batch.
+            batch_key, index, name = name.split(".", 2)
+            fields[batch_key][int(index)][name] = values
+        else:
+            fields[name] = values
+
+    return fields
+
+
+def is_binary_content_type(content_type: Optional[str]) -> bool:
+    return content_type is not None and content_type.startswith(BINARY_CONTENT_TYPE)
+
+
+def accepts_binary(accept: Optional[str]) -> bool:
+    """Whether the "Accept" header of a request accepts the binary format."""
+
+    return accept is not None and BINARY_CONTENT_TYPE in accept
+
+
+def decode_payload(content_type: Optional[str], body: bytes) -> Dict:
+    """Decode a request/response body in either format, according to its content type."""
+
+    if is_binary_content_type(content_type):
+        return decode_binary(body)
+    return json.loads(body)
+
+
+def encode_payload(fields: Dict, array_fields: Sequence[str], binary: bool) -> bytes:
+    """Encode a request/response body in the binary format or in JSON."""
+
+    if binary:
+        return encode_binary(fields, array_fields)
+    return json.dumps(fields).encode()
+
+
+def encode_frame(body: bytes) -> bytes:
+    """Encode a body as a frame of a streamed response."""
+
+    return _FRAME_PREFIX.pack(len(body)) + body
+
+
+def decode_frame_length(prefix: bytes) -> int:
+    """Decode the body length from the prefix (FRAME_PREFIX_SIZE bytes) of a frame."""
+
+    return _FRAME_PREFIX.unpack(prefix)[0]
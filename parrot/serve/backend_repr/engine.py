@@ -36,10 +36,17 @@ class ServeLayerRuntimeInfo:
     def __init__(self):
         self.num_tasks = 0
         self.tokens_num = 0
+        self.num_latency_critical_tasks = 0
 
         # task_id -> upperbound
         self.tasks_num_upperbounds: Dict[int, int] = {}
 
+        # task_id -> tokens num accounted for the task
+        # NOTE(chaofan): Tasks are tokenized lazily after scheduled, so the tokens num
+        # may change (from an estimation to the real number). We record the accounted
+        # number to keep tokens_num consistent.
+        self.tasks_tokens_num: Dict[int, int] = {}
+
 
 class ExecutionEngine:
     """Represent an execution engine in the backend."""
@@ -102,6 +109,14 @@ class ExecutionEngine:
     def http_address(self) -> str:
         return f"http://{self.config.host}:{self.config.port}"
 
+    @property
+    def wire_format(self) -> str:
+        return self.config.wire_format
+
+    @property
+    def primitives_batch_window(self) -> float:
+        return self.config.primitives_batch_window
+
     @property
     def model_name(self) -> str:
         return self.model.model_name
@@ -151,6 +166,29 @@ class ExecutionEngine:
             + list(self._serve_layer_runtime_info.tasks_num_upperbounds.values())
         )
 
+    def get_num_latency_critical_tasks(self) -> int:
+        """Return the number of latency-critical tasks scheduled to this engine."""
+
+        return self._serve_layer_runtime_info.num_latency_critical_tasks
+
+    def get_num_running_jobs(self) -> int:
+        """Return the number of running jobs in the engine (from the latest heartbeat)."""
+
+        return self._real_time_runtime_info.num_running_jobs
+
+    def get_num_queued_jobs(self) -> int:
+        """Return the number of jobs waiting in the engine's local queue (from the latest
+        heartbeat)."""
+
+        info = self._real_time_runtime_info
+        return max(0, info.num_total_jobs - info.num_running_jobs)
+
+    def get_recent_iteration_latency(self) -> float:
+        """Return the recent average latency of an iteration in the engine, in
+        nanoseconds. 0 means unknown."""
+
+        return self._real_time_runtime_info.recent_average_latency
+
     def update_realtime_runtime_info(self, runtime_info: EngineRuntimeInfo) -> None:
         """Update the real-time runtime info of the engine."""
 
@@ -164,6 +202,8 @@ class ExecutionEngine:
         debug_str = ""
 
         self._serve_layer_runtime_info.num_tasks += 1
+        if task.schedule_annotation.latency_critical:
+            self._serve_layer_runtime_info.num_latency_critical_tasks += 1
 
         tasks_num_upperbound = task.schedule_annotation.tasks_num_upperbound
         self._serve_layer_runtime_info.tasks_num_upperbounds[task.task_id] = (
@@ -173,6 +213,7 @@ class ExecutionEngine:
         if self.model_type == ModelType.TOKEN_ID:
             tokens_num = task.get_token_nums(self.tokenizer_name)
             self._serve_layer_runtime_info.tokens_num += tokens_num
+            self._serve_layer_runtime_info.tasks_tokens_num[task.task_id] = tokens_num
             debug_str = f" (Add {tokens_num} tokens, Total {self._serve_layer_runtime_info.tokens_num} tokens)"
 
         # logger.debug(
@@ -190,10 +231,14 @@ class ExecutionEngine:
         debug_str = ""
 
         self._serve_layer_runtime_info.num_tasks -= 1
+        if task.schedule_annotation.latency_critical:
+            self._serve_layer_runtime_info.num_latency_critical_tasks -= 1
         self._serve_layer_runtime_info.tasks_num_upperbounds.pop(task.task_id)
 
         if self.model_type == ModelType.TOKEN_ID:
-            tokens_num = task.get_token_nums(self.tokenizer_name)
+            tokens_num = self._serve_layer_runtime_info.tasks_tokens_num.pop(
+                task.task_id
+            )
             self._serve_layer_runtime_info.tokens_num -= tokens_num
             debug_str = f" (Lose {tokens_num} tokens, Remaining {self._serve_layer_runtime_info.tokens_num} tokens)"
 
@@ -202,6 +247,21 @@ class ExecutionEngine:
         #     + debug_str
         # )
 
+    def update_servelayer_runtime_info_task_tokens(
+        self, task: "CompletionTask"
+    ) -> None:
+        """Update the tokens num of a scheduled task, e.g. after it's tokenized."""
+
+        parrot_assert(task.is_scheduled, "The task is not scheduled.")
+
+        if self.model_type != ModelType.TOKEN_ID:
+            return
+
+        tokens_num = task.get_token_nums(self.tokenizer_name)
+        old_tokens_num = self._serve_layer_runtime_info.tasks_tokens_num[task.task_id]
+        self._serve_layer_runtime_info.tokens_num += tokens_num - old_tokens_num
+        self._serve_layer_runtime_info.tasks_tokens_num[task.task_id] = tokens_num
+
     # ---------- For Profiling ----------
 
     def get_cache_mem(self) -> float:
@@ -19,6 +19,11 @@ class ServeCoreConfig:
     session_life_span: int = 600
     engine_heartbeat_timeout: int = 600
     constant_prefix_var_timeout: int = 600
+    prefix_matcher_memory_budget: int = 64 * 1024 * 1024  # In bytes
+    prefix_matcher_evict_policy: str = "lru"  # "lru" or "lfu"
+    token_ids_cache_max_tokens_num: int = 16 * 1024 * 1024
+    tokenizer_workers_num: int = 4
+    tokenizer_pool_type: str = "thread"  # "thread" or "process"
 
     @classmethod
     def verify_config(cls, config: Dict) -> bool:
@@ -2,12 +2,12 @@
 # Licensed under the MIT license.
 
 
-from typing import Dict, List
+import asyncio
+from typing import Dict, List, Set, Tuple, Optional
 
-from parrot.protocol.internal.layer_apis import free_context
+from parrot.protocol.internal.layer_apis import afree_contexts
 from parrot.utils import get_logger, RecyclePool
-from parrot.constants import NONE_CONTEXT_ID
-from parrot.exceptions import parrot_assert, ParrotCoreInternalError
+from parrot.exceptions import parrot_assert
 
 from parrot.serve.backend_repr import Context, ExecutionEngine
 from parrot.serve.scheduler import CompletionTask
@@ -16,62 +16,179 @@ from parrot.serve.scheduler import CompletionTask
 logger = get_logger("ContextManager")
 
 
-_PREFIX_HASH_BRACKET_LEFT = "{{"
-_PREFIX_HASH_BRACKET_RIGHT = "}}"
+class _PrefixTreeNode:
+    """A node in the PrefixCache tree. It represents the prefix composed of the SV ids on
+    the path from the root to it."""
+
+    def __init__(self, var_id: Optional[str], parent: Optional["_PrefixTreeNode"]):
+        self.var_id = var_id
+        self.parent = parent
+
+        # var_id -> child node
+        self.children: Dict[str, "_PrefixTreeNode"] = {}
+
+        # engine_id -> context id. The engines which hold a context of this prefix.
+        self.engine_contexts: Dict[int, int] = {}
+
+    @property
+    def is_root(self) -> bool:
+        return self.parent is None
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.children) == 0 and len(self.engine_contexts) == 0
 
 
 class PrefixCache:
-    """PrefixCache maps a prefix hash to a context id.
+    """PrefixCache maps a prefix to the contexts of it in different engines.
 
-    A prefix hash is a List of SemanticVariable ids.
+    A prefix is a List of SemanticVariable ids. The cache is a prefix tree shared by all
+    engines, where each node records which engines hold a context for the prefix.
 
     Example:
-    {{sv0}} -> Context0
-    {{sv0}}{{sv1}} -> Context1
-    {{sv0}}{{sv1}}{{sv2}} -> Context2
-    {{sv0}}{{sv1}}{{sv3}} -> Context3
+    sv0 -> {engine0: Context0, engine1: Context4}
+    └── sv1 -> {engine0: Context1}
+        ├── sv2 -> {engine0: Context2}
+        └── sv3 -> {engine0: Context3}
+
+    So one walk from the root returns the longest cached prefix on every engine.
     """
 
     def __init__(self):
-        # prefix hash -> context id.
-        self._prefix_ctx_map: Dict[str, int] = {}
+        self._root = _PrefixTreeNode(var_id=None, parent=None)
+
+        # context id -> List of (node, engine_id).
+        # A context can be cached in multiple nodes, e.g. in the "fuse_fill" mode.
+        self._context_nodes: Dict[int, List[Tuple[_PrefixTreeNode, int]]] = {}
 
-        # reversed dict for freeing context.
-        self._prefix_ctx_map_reversed: Dict[int, str] = {}
+        # engine_id -> context ids cached in this engine.
+        self._engine_context_ids: Dict[int, Set[int]] = {}
 
-    def get_cached_prefix_context(self, prefix_hash: str) -> int:
-        """Get the context id of a prefix from the cache.
+    def get_cached_prefix_contexts(self, engine_id: int, prefix: List[str]) -> List[int]:
+        """Get the context ids of the longest cached prefix in an engine.
 
         Args:
-            prefix_hash: The hash of the prefix.
+            engine_id: The id of the engine.
+            prefix: The prefix, i.e. a list of SV ids.
 
         Returns:
-            The context id of the prefix. If the prefix is not in the cache, return NONE_CONTEXT_ID.
+            The context ids of the longest cached prefix. The i-th context id corresponds
+            to the prefix `prefix[:i+1]`.
         """
 
-        return self._prefix_ctx_map.get(prefix_hash, NONE_CONTEXT_ID)
+        context_ids = []
+        node = self._root
+        for var_id in prefix:
+            node = node.children.get(var_id)
+            if node is None or engine_id not in node.engine_contexts:
+                break
+            context_ids.append(node.engine_contexts[engine_id])
+        return context_ids
 
-    def cache_prefix_context(self, prefix_hash: str, context_id: int) -> None:
-        """Cache contexts of the prefix.
+    def cache_prefix_contexts(
+        self, engine_id: int, prefix: List[str], context_ids: List[int]
+    ) -> None:
+        """Cache contexts of the prefix in an engine.
 
         Args:
-            prefix_hash: The hash of the prefix.
-            context_id: The context id of the prefix.
+            engine_id: The id of the engine.
+            prefix: The prefix, i.e. a list of SV ids.
+            context_ids: The i-th context id is the context of the prefix `prefix[:i+1]`.
+                Prefixes already cached in the engine should have the same context ids.
         """
 
         parrot_assert(
-            prefix_hash not in self._prefix_ctx_map, "Prefix should not be cached."
+            len(prefix) == len(context_ids),
+            "The lengths of prefix and context ids should be the same.",
         )
-        self._prefix_ctx_map[prefix_hash] = context_id
-        self._prefix_ctx_map_reversed[context_id] = prefix_hash
+
+        node = self._root
+        for var_id, context_id in zip(prefix, context_ids):
+            if var_id not in node.children:
+                node.children[var_id] = _PrefixTreeNode(var_id=var_id, parent=node)
+            node = node.children[var_id]
+
+            if engine_id in node.engine_contexts:
+                parrot_assert(
+                    node.engine_contexts[engine_id] == context_id,
+                    "Prefix should not be cached with another context.",
+                )
+                continue
+
+            node.engine_contexts[engine_id] = context_id
+            if context_id not in self._context_nodes:
+                self._context_nodes[context_id] = []
+            self._context_nodes[context_id].append((node, engine_id))
+            if engine_id not in self._engine_context_ids:
+                self._engine_context_ids[engine_id] = set()
+            self._engine_context_ids[engine_id].add(context_id)
+
+    def query_cached_prefix_lens(self, prefix: List[str]) -> Dict[int, int]:
+        """Query the length of the longest cached prefix in every engine, in one walk.
+
+        Args:
+            prefix: The prefix, i.e. a list of SV ids.
+
+        Returns:
+            engine_id -> length of the longest cached prefix. Engines without any cached
+            prefix are not included.
+        """
+
+        prefix_lens: Dict[int, int] = {}
+        node = self._root
+        for depth, var_id in enumerate(prefix):
+            node = node.children.get(var_id)
+            if node is None:
+                break
+
+            # Only the engines which cache all the shorter prefixes can be extended.
+            hit = False
+            for engine_id in node.engine_contexts:
+                if prefix_lens.get(engine_id, 0) == depth:
+                    prefix_lens[engine_id] = depth + 1
+                    hit = True
+            if not hit:
+                break
+
+        return prefix_lens
 
     def remove_context_id(self, context_id: int) -> None:
-        """Remove the context id of a prefix."""
+        """Remove the context id from the cache. Empty nodes are pruned."""
+
+        if context_id not in self._context_nodes:
+            return
+
+        for node, engine_id in self._context_nodes.pop(context_id):
+            node.engine_contexts.pop(engine_id)
+            self._engine_context_ids[engine_id].discard(context_id)
+
+            # Prune the empty nodes upwards.
+            while not node.is_root and node.is_empty:
+                node.parent.children.pop(node.var_id)
+                node = node.parent
+
+    def remove_engine(self, engine_id: int) -> None:
+        """Remove all contexts cached in an engine."""
+
+        context_ids = list(self._engine_context_ids.get(engine_id, []))
+        for context_id in context_ids:
+            self.remove_context_id(context_id)
+        self._engine_context_ids.pop(engine_id, None)
+
+    def pretty_print(self) -> str:
+        """Pretty print the prefix tree."""
 
-        if context_id in self._prefix_ctx_map_reversed:
-            prefix_hash = self._prefix_ctx_map_reversed[context_id]
-            self._prefix_ctx_map.pop(prefix_hash)
-            self._prefix_ctx_map_reversed.pop(context_id)
+        ret = "PrefixCache: \n"
+
+        def _print_node(node: _PrefixTreeNode, indent: int) -> str:
+            node_str = "  " * indent + f"{node.var_id} -> {node.engine_contexts}\n"
+            for child in node.children.values():
+                node_str += _print_node(child, indent + 1)
+            return node_str
+
+        for child in self._root.children.values():
+            ret += _print_node(child, 0)
+        return ret
 
 
 class ServeCoreContextManager:
@@ -106,12 +223,17 @@ class ServeCoreContextManager:
 
         self._context_id_pool = RecyclePool("Context pool")
 
-        # engine_id -> PrefixCache
-        self.prefix_caches: Dict[int, PrefixCache] = {}
+        # The PrefixCache shared by all engines.
+        self.prefix_cache = PrefixCache()
 
-    @staticmethod
-    def _hash_var_id(var_id: str) -> str:
-        return f"{_PREFIX_HASH_BRACKET_LEFT}{var_id}{_PREFIX_HASH_BRACKET_RIGHT}"
+        # engine_id -> (engine, context ids to be freed in the engine, in order)
+        # Contexts are removed from the manager immediately when freed, and released in the
+        # engines in batches by the background loop (see free_pending_contexts).
+        # NOTE(chaofan): The id of a context is recycled only after the engine frees it.
+        # Otherwise a new context with the same id may be bound to the old context in the
+        # engine.
+        self._pending_free_contexts: Dict[int, Tuple[ExecutionEngine, List[int]]] = {}
+        self._pending_free_event = asyncio.Event()
 
     # ---------- Basic Context Operation ----------
 
@@ -159,29 +281,72 @@ class ServeCoreContextManager:
         if self._context_ref_counter[context_id] > 0:
             return
 
-        try:
-            engine = context.engine
-            resp = free_context(
-                http_addr=engine.http_address,
-                context_id=context_id,
-            )
-        except BaseException as e:
-            logger.error(
-                f"Context (context_id={context_id}) did not free correctly: {type(e)}, {e}."
-            )
-            raise ParrotCoreInternalError(e)
-        else:
-            logger.debug(
-                f"Context (context_id={context_id}) freed. Freed tokens: {resp.context_len}"
-            )
-
         # Remove context from the PrefixCache.
-        prefix_cache = self.prefix_caches[engine.engine_id]
-        prefix_cache.remove_context_id(context_id)
+        self.prefix_cache.remove_context_id(context_id)
 
         # Remove context from the Manager.
         self.contexts.pop(context_id)
-        self._context_id_pool.free(context_id)
+        self._context_ref_counter.pop(context_id)
+
+        # Free the context in the engine in the background.
+        engine = context.engine
+        if engine.engine_id not in self._pending_free_contexts:
+            self._pending_free_contexts[engine.engine_id] = (engine, [])
+        self._pending_free_contexts[engine.engine_id][1].append(context_id)
+        self._pending_free_event.set()
+
+        logger.debug(
+            f"Context (context_id={context_id}) freed. Pending to be freed in engine {engine.name}."
+        )
+
+    async def _free_engine_contexts(
+        self,
+        engine: ExecutionEngine,
+        context_ids: List[int],
+        engine_mgr: "EngineManager",
+    ) -> List[int]:
+        """Free a batch of contexts in an engine. Returns the ids which are not freed."""
+
+        # The engine is removed/dead, so its contexts are gone.
+        # NOTE(chaofan): The engine id may be reused by a new engine.
+        if (
+            not engine.is_running
+            or engine_mgr.engines.get(engine.engine_id) is not engine
+        ):
+            freed_context_ids = context_ids
+        else:
+            try:
+                resp = await afree_contexts(
+                    client_session=engine_mgr.get_client_session(engine.engine_id),
+                    http_addr=engine.http_address,
+                    context_ids=context_ids,
+                )
+            except BaseException as e:
+                logger.warning(
+                    f"Free contexts in engine {engine.name} failed, retry later: {type(e)}, {e}."
+                )
+                return context_ids
+
+            freed_context_ids = resp.freed_context_ids
+            logger.debug(
+                f"Contexts {freed_context_ids} freed in engine {engine.name}. "
+                f"Freed tokens: {resp.context_len}"
+            )
+            for context_id, error in zip(resp.failed_context_ids, resp.errors):
+                logger.debug(
+                    f"Context {context_id} is not freed in engine {engine.name}, "
+                    f"retry later: {error}"
+                )
+
+        for context_id in freed_context_ids:
+            self._context_id_pool.free(context_id)
+
+        freed_context_ids = set(freed_context_ids)
+        return [
+            context_id
+            for context_id in context_ids
+            if context_id not in freed_context_ids
+        ]
 
     def _add_ref_counter(self, context: Context) -> None:
         context_id = context.context_id
@@ -203,6 +368,58 @@ class ServeCoreContextManager:
         )
         self._free_context(context)
 
+    @property
+    def pending_free_contexts_num(self) -> int:
+        """The number of contexts which are freed but not released in the engines yet."""
+
+        return sum(
+            len(context_ids) for _, context_ids in self._pending_free_contexts.values()
+        )
+
+    async def wait_pending_free_contexts(self) -> None:
+        """Wait until there are contexts to be freed in the engines."""
+
+        await self._pending_free_event.wait()
+        self._pending_free_event.clear()
+
+    async def free_pending_contexts(self, engine_mgr: "EngineManager") -> int:
+        """Free the pending contexts in the engines, in one batch per engine.
+
+        Contexts which are not freed (e.g. still running, or the engine is unreachable)
+        remain pending, and the caller should retry later.
+
+        Args:
+            engine_mgr: EngineManager. For the client sessions to the engines.
+
+        Returns:
+            int. The number of contexts still pending.
+        """
+
+        pending = self._pending_free_contexts
+        self._pending_free_contexts = {}
+        if len(pending) == 0:
+            return 0
+
+        engine_ids = list(pending.keys())
+        rets = await asyncio.gather(
+            *[
+                self._free_engine_contexts(*pending[engine_id], engine_mgr)
+                for engine_id in engine_ids
+            ]
+        )
+
+        # Put the remaining contexts back, before the contexts freed in the meantime.
+        for engine_id, remain_context_ids in zip(engine_ids, rets):
+            if len(remain_context_ids) == 0:
+                continue
+            engine = pending[engine_id][0]
+            if engine_id in self._pending_free_contexts:
+                remain_context_ids += self._pending_free_contexts[engine_id][1]
+            self._pending_free_contexts[engine_id] = (engine, remain_context_ids)
+            self._pending_free_event.set()
+
+        return self.pending_free_contexts_num
+
     def set_task_contexts(self, task: CompletionTask) -> None:
         """Initialize the contexts for a CompletionTask.
 
@@ -217,24 +434,24 @@ class ServeCoreContextManager:
         )
 
         chain = task.chain
-        prefix_cache = self.prefix_caches[task.engine.engine_id]
-        prefix_hash = ""
-        prefix_no_cache_flag = False
-
-        for node in chain.iter():
-            prefix_hash += self._hash_var_id(node.var_id)
-
-            if not prefix_no_cache_flag:
-                # If the prefix is already cached, use cached context
-                context_id = prefix_cache.get_cached_prefix_context(prefix_hash)
-                if context_id != NONE_CONTEXT_ID:
-                    context = self.contexts[context_id]
-                    self._add_ref_counter(context)
-                    task.contexts.append(context)
-                    continue
-                else:
-                    # For succeeding nodes, the prefix couldn't be cached.
-                    prefix_no_cache_flag = True
+        engine_id = task.engine.engine_id
+        prefix = [node.var_id for node in chain.iter()]
+        cached_context_ids = self.prefix_cache.get_cached_prefix_contexts(
+            engine_id, prefix
+        )
+        # The prefix (Fill nodes) and contexts to be cached.
+        prefix_len = 0
+        prefix_context_ids: List[int] = []
+
+        for i, node in enumerate(chain.iter()):
+            # If the prefix is already cached, use cached context
+            if i < len(cached_context_ids):
+                context = self.contexts[cached_context_ids[i]]
+                self._add_ref_counter(context)
+                task.contexts.append(context)
+                prefix_len += 1
+                prefix_context_ids.append(context.context_id)
+                continue
 
             # The prefix is not cached. Create a new context and cache it.
             # If the node is the first node in the chain, create a new context.
@@ -262,7 +479,12 @@ class ServeCoreContextManager:
             task.contexts.append(context)
             # Cache the context, if it's the prefix.
             if not node.is_gen:
-                prefix_cache.cache_prefix_context(prefix_hash, context.context_id)
+                prefix_len += 1
+                prefix_context_ids.append(context.context_id)
+
+        self.prefix_cache.cache_prefix_contexts(
+            engine_id, prefix[:prefix_len], prefix_context_ids
+        )
 
     def free_task_contexts(self, task: CompletionTask) -> None:
         """Free the contexts of a task."""
@@ -307,22 +529,9 @@ class ServeCoreContextManager:
 
         parrot_assert(not task.is_scheduled, "Task should not be scheduled.")
 
+        prefix = [node.var_id for node in task.chain.iter()]
         # engine_id -> cached_prefix_num
-        sort_dict = {}
-
-        for engine_id, prefix_cache in self.prefix_caches.items():
-            prefix_hash = ""
-            for node in task.chain.iter():
-                prefix_hash += self._hash_var_id(node.var_id)
-                if (
-                    prefix_cache.get_cached_prefix_context(prefix_hash)
-                    != NONE_CONTEXT_ID
-                ):
-                    if engine_id not in sort_dict:
-                        sort_dict[engine_id] = 0
-                    sort_dict[engine_id] += 1
-                else:
-                    break
+        sort_dict = self.prefix_cache.query_cached_prefix_lens(prefix)
 
         return sorted(sort_dict, key=lambda x: sort_dict[x], reverse=True)
 
@@ -367,12 +576,7 @@ class ServeCoreContextManager:
 
         self.session_contexts.pop(session_id)
 
-    def register_engine_prefix_cache(self, engine_id: int):
-        """Register the prefix cache of an engine."""
-
-        self.prefix_caches[engine_id] = PrefixCache()
-
     def remove_engine_prefix_cache(self, engine_id: int):
         """Remove the prefix cache of an engine."""
 
-        self.prefix_caches.pop(engine_id)
+        self.prefix_cache.remove_engine(engine_id)
@@ -3,16 +3,20 @@
 
 
 import json
-from typing import Dict
+from typing import Dict, AsyncGenerator
 import asyncio
 
 from parrot.utils import get_logger
-from parrot.constants import CORE_LOOP_INTERVAL
+from parrot.constants import (
+    CORE_EXPIRE_CHECK_INTERVAL,
+    CORE_FREE_CONTEXTS_RETRY_INTERVAL,
+)
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.engine.config import EngineConfig
 from parrot.exceptions import ParrotCoreInternalError
 
 from parrot.serve.graph import (
+    SemanticVariable,
     PlaceholderGen,
     get_performance_criteria,
     activate_completion_chain,
@@ -56,11 +60,18 @@ class ParrotServeCore:
         self.config = ServeCoreConfig(**config)
 
         # ---------- Components ----------
-        self.prefix_matcher = PrefixMatcher()
+        self.prefix_matcher = PrefixMatcher(
+            memory_budget=self.config.prefix_matcher_memory_budget,
+            evict_policy=self.config.prefix_matcher_evict_policy,
+        )
         self.var_mgr = SemanticVariableManager(
             constant_prefix_var_timeout=self.config.constant_prefix_var_timeout
         )
-        self.tokenizers_wrapper = TokenizersWrapper()
+        self.tokenizers_wrapper = TokenizersWrapper(
+            cache_max_tokens_num=self.config.token_ids_cache_max_tokens_num,
+            workers_num=self.config.tokenizer_workers_num,
+            pool_type=self.config.tokenizer_pool_type,
+        )
         self.context_mgr = ServeCoreContextManager()
         self.task_creator = TaskCreator()
 
@@ -109,6 +120,10 @@ class ParrotServeCore:
         logger.debug(f"Register engine received.")
         engine_config = EngineConfig(**payload["engine_config"])
         engine_id = self.engine_mgr.register_engine(engine_config)
+
+        # New capacity is available.
+        self.global_scheduler.wakeup()
+
         return {"engine_id": engine_id}
 
     def engine_heartbeat(self, payload: Dict) -> Dict:
@@ -129,6 +144,9 @@ class ParrotServeCore:
 
         self.engine_mgr.engine_heartbeat(engine_id, engine_info)
 
+        # The runtime info of the engine changes.
+        self.global_scheduler.wakeup()
+
         return {}
 
     # ---------- Public Serving APIs ----------
@@ -276,16 +294,8 @@ class ParrotServeCore:
 
         return {}
 
-    async def get_semantic_variable(self, var_id: str, payload: Dict) -> Dict:
-        """Get the content from a Semantic Variable.
-
-        Args:
-            var_id: str. The variable ID.
-            payload: Dict. The payload.
-
-        Returns:
-            Dict. The response.
-        """
+    def _access_semantic_variable(self, var_id: str, payload: Dict) -> SemanticVariable:
+        """Get a Semantic Variable for reading, and activate its producer."""
 
         session_id = payload["session_id"]
         criteria = payload["criteria"]
@@ -302,17 +312,55 @@ class ParrotServeCore:
                     producer.comp_chain, get_performance_criteria(criteria)
                 )
 
+        logger.debug(f"Semantic variable (id={var_id}) get with criteria: {criteria}.")
+
+        return var
+
+    async def get_semantic_variable(self, var_id: str, payload: Dict) -> Dict:
+        """Get the content from a Semantic Variable.
+
+        Args:
+            var_id: str. The variable ID.
+            payload: Dict. The payload.
+
+        Returns:
+            Dict. The response.
+        """
+
+        var = self._access_semantic_variable(var_id, payload)
+
         await var.wait_ready()
         content = var.get()
 
-        logger.debug(f"Semantic variable (id={var_id}) get with criteria: {criteria}.")
-
         return {"content": content}
 
+    async def stream_semantic_variable(
+        self, var_id: str, payload: Dict
+    ) -> AsyncGenerator[str, None]:
+        """Stream the content of a Semantic Variable as it's generated.
+
+        Args:
+            var_id: str. The variable ID.
+            payload: Dict. The payload.
+
+        Returns:
+            An async generator of text pieces.
+        """
+
+        var = self._access_semantic_variable(var_id, payload)
+        return var.astream()
+
     # ---------- ServeCore Loop ----------
 
-    async def serve_loop(self) -> None:
-        """Start the Core serving loop."""
+    async def _schedule_loop(self) -> None:
+        """Schedule tasks when the GlobalScheduler is woken up."""
+
+        while True:
+            await self.global_scheduler.wait_wakeup()
+            self.global_scheduler.schedule()
+
+    async def _expire_check_loop(self) -> None:
+        """Periodically update and clean up expired resources."""
 
         while True:
             # Update and clean up sessions and engines
@@ -325,11 +373,38 @@ class ParrotServeCore:
             expired_vars = self.var_mgr.free_expired_constant_prefix_vars()
             for var in expired_vars:
                 self.context_mgr.free_constant_prefix_contexts(var.id)
+                self.tokenizers_wrapper.evict_cache(var.id)
 
-            # Schedule tasks
-            self.global_scheduler.schedule()
+            await asyncio.sleep(CORE_EXPIRE_CHECK_INTERVAL)
+
+    async def _free_contexts_loop(self) -> None:
+        """Free contexts in engines in the background, in one batch per engine."""
+
+        while True:
+            await self.context_mgr.wait_pending_free_contexts()
+            pending_num = await self.context_mgr.free_pending_contexts(self.engine_mgr)
+            if pending_num > 0:
+                await asyncio.sleep(CORE_FREE_CONTEXTS_RETRY_INTERVAL)
+
+    async def serve_loop(self) -> None:
+        """Start the Core serving loop.
+
+        Scheduling is event-driven, and the expiration checks run on their own timer.
+        Contexts are freed in engines by another loop, so that freeing never blocks the
+        serving.
+        """
+
+        await asyncio.gather(
+            self._schedule_loop(),
+            self._expire_check_loop(),
+            self._free_contexts_loop(),
+        )
+
+    async def shutdown(self) -> None:
+        """Release the resources of the ServeCore. Called after the serving loop is
+        stopped."""
 
-            await asyncio.sleep(CORE_LOOP_INTERVAL)
+        await self.engine_mgr.close_client_sessions()
 
 
 def create_serve_core(
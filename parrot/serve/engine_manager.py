@@ -2,10 +2,18 @@
 # Licensed under the MIT license.
 
 
+import asyncio
 from typing import Dict, List, Optional, Tuple
+import aiohttp
 
 from parrot.exceptions import ParrotCoreUserError, parrot_assert
-from parrot.utils import RecyclePool, get_logger, time_counter_in_nanoseconds
+from parrot.constants import ENGINE_CLIENT_KEEPALIVE_TIMEOUT
+from parrot.utils import (
+    RecyclePool,
+    get_logger,
+    time_counter_in_nanoseconds,
+    create_task_in_loop,
+)
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.engine.config import EngineConfig
 from parrot.protocol.internal.layer_apis import ping_engine
@@ -19,6 +27,7 @@ from parrot.serve.backend_repr import (
 
 from .tokenizer_wrapper import TokenizersWrapper
 from .context_manager import ServeCoreContextManager
+from .primitive_batcher import PrimitiveBatcher
 
 
 logger = get_logger("EngineManager")
@@ -55,6 +64,17 @@ class EngineManager:
 
         self.engine_heartbeat_timeout = engine_heartbeat_timeout
 
+        # ---------- HTTP Clients ----------
+        # engine_id -> (client session, the event loop it belongs to)
+        # Each engine has a pooled client session, so that primitives reuse keep-alive
+        # connections instead of opening a new connection per request.
+        self._client_sessions: Dict[
+            int, Tuple[aiohttp.ClientSession, asyncio.AbstractEventLoop]
+        ] = {}
+
+        # engine_id -> primitive batcher (using the pooled client session)
+        self._primitive_batchers: Dict[int, PrimitiveBatcher] = {}
+
     def _register_model(self, model: LanguageModel) -> LanguageModel:
         if model.model_name in self.models:
             self._models_ref_counter[model.model_name] += 1
@@ -87,12 +107,75 @@ class EngineManager:
         self._engine_last_seen_time.pop(engine_id)
         self._engine_id_pool.free(engine_id)
 
+        self._close_client_session(engine_id)
+        self._primitive_batchers.pop(engine_id, None)
+
         self.context_mgr.remove_engine_prefix_cache(engine_id)
 
         logger.debug(f"Engine {engine.name} (id={engine_id}) is removed.")
 
+    def _close_client_session(self, engine_id: int) -> None:
+        if engine_id not in self._client_sessions:
+            return
+
+        client_session, loop = self._client_sessions.pop(engine_id)
+        # NOTE(chaofan): If the loop is closed, the connections are already gone.
+        if not client_session.closed and not loop.is_closed():
+            create_task_in_loop(client_session.close(), loop=loop, fail_fast=False)
+
     # ---------- Methods for Executor ----------
 
+    def get_client_session(self, engine_id: int) -> aiohttp.ClientSession:
+        """Get the pooled HTTP client session to the engine. Must be called in the event
+        loop.
+
+        The number of connections is bounded by the tasks capacity of the engine, since
+        a task sends at most one primitive at a time.
+
+        Args:
+            engine_id: int. The engine ID.
+
+        Returns:
+            aiohttp.ClientSession: The client session.
+        """
+
+        parrot_assert(engine_id in self.engines, f"Engine {engine_id} not found.")
+
+        loop = asyncio.get_running_loop()
+        if engine_id in self._client_sessions:
+            client_session, session_loop = self._client_sessions[engine_id]
+            if not client_session.closed and session_loop is loop:
+                return client_session
+            self._close_client_session(engine_id)
+
+        engine = self.engines[engine_id]
+        connector = aiohttp.TCPConnector(
+            limit=engine.config.tasks_capacity,
+            keepalive_timeout=ENGINE_CLIENT_KEEPALIVE_TIMEOUT,
+        )
+        client_session = aiohttp.ClientSession(connector=connector)
+        self._client_sessions[engine_id] = (client_session, loop)
+        return client_session
+
+    def get_primitive_batcher(self, engine_id: int) -> PrimitiveBatcher:
+        """Get the primitive batcher of the engine, which coalesces the Fill/Generate
+        primitives to it. Must be called in the event loop.
+
+        Args:
+            engine_id: int. The engine ID.
+
+        Returns:
+            PrimitiveBatcher: The primitive batcher.
+        """
+
+        client_session = self.get_client_session(engine_id)
+        batcher = self._primitive_batchers.get(engine_id)
+        # A new batcher is created if the pooled session is renewed (e.g. in a new loop).
+        if batcher is None or batcher.client_session is not client_session:
+            batcher = PrimitiveBatcher(self.engines[engine_id], client_session)
+            self._primitive_batchers[engine_id] = batcher
+        return batcher
+
     def raise_exception(self, engine_id: int, exception: Exception) -> None:
         """Raise an exception in the engine.
 
@@ -104,6 +187,15 @@ class EngineManager:
         engine = self.engines[engine_id]
         engine.mark_bad(exception)
 
+    async def close_client_sessions(self) -> None:
+        """Close the client sessions to all engines. Called when the ServeCore shuts
+        down (see `ParrotServeCore.shutdown`)."""
+
+        for client_session, _ in self._client_sessions.values():
+            await client_session.close()
+        self._client_sessions.clear()
+        self._primitive_batchers.clear()
+
     # ---------- Methods for Global Scheduler ----------
 
     def get_live_engines(self) -> List[ExecutionEngine]:
@@ -134,9 +226,6 @@ class EngineManager:
         self.engines[engine_id] = engine
         self._engine_last_seen_time[engine_id] = time_counter_in_nanoseconds()
 
-        # Register engine prefix cache
-        self.context_mgr.register_engine_prefix_cache(engine_id=engine_id)
-
         logger.debug(f"Engine {engine.name} (id={engine_id}) registered.")
         return engine_id
 
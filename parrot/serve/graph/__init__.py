@@ -10,5 +10,5 @@ from .request import ChunkedSemanticCallRequest
 from .perf_criteria import PerformanceCriteria, get_performance_criteria
 from .semantic_variable import SemanticVariable
 from .nodes import BaseNode, ConstantFill, PlaceholderFill, PlaceholderGen
-from .graph import CompletionChain, RequestChain, ComputeGraph
+from .graph import CompletionChain, CompChainGroup, RequestChain, ComputeGraph
 from .graph_traverse import activate_completion_chain
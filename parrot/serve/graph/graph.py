@@ -6,7 +6,7 @@ from asyncio import Event
 from typing import List, Dict, Set, Optional, Union
 
 from parrot.exceptions import parrot_assert, ParrotCoreUserError
-from parrot.utils import RecyclePool
+from parrot.utils import RecyclePool, time_counter_in_nanoseconds
 
 from .perf_criteria import PerformanceCriteria
 from .request import (
@@ -95,6 +95,13 @@ class CompletionChain:
         self._criteria: Optional[PerformanceCriteria] = None
         # Distance to "get" node.
         self._depth: int = 99999
+        # Deadline (time_counter_in_nanoseconds) of the chain, propagated from the latency
+        # budgets of the requests depending on it. None means no deadline.
+        self._deadline: Optional[int] = None
+        # Estimated cost of the chain, and the estimated length of the critical path from
+        # the end of the chain to the "get" node (in units of decoding a token).
+        self._cost: float = 0.0
+        self._downstream_cost: float = 0.0
 
         # Groups this chain belongs to.
         self.chain_groups: List[CompChainGroup] = []
@@ -119,6 +126,10 @@ class CompletionChain:
     def metadata(self) -> SemanticCallMetadata:
         return self._request_chain.metadata
 
+    @property
+    def request_deadline(self) -> Optional[int]:
+        return self._request_chain.deadline
+
     def pretty_print(self) -> str:
         """Pretty print it using Graph's pretty print APIs."""
 
@@ -130,8 +141,16 @@ class CompletionChain:
 
         return ret
 
-    def activate(self, criteria: PerformanceCriteria, depth: int) -> None:
-        """Activate the CompletionChain with a given PerformanceCriteria."""
+    def activate(
+        self,
+        criteria: PerformanceCriteria,
+        depth: int,
+        deadline: Optional[int] = None,
+        cost: float = 0.0,
+        downstream_cost: float = 0.0,
+    ) -> None:
+        """Activate the CompletionChain with a given PerformanceCriteria (and deadline,
+        estimated costs)."""
 
         parrot_assert(
             not self.is_activated,
@@ -139,8 +158,25 @@ class CompletionChain:
         )
         self._criteria = criteria
         self._depth = depth
+        self._deadline = deadline
+        self._cost = cost
+        self._downstream_cost = downstream_cost
         self._activated_event.set()
 
+    def update_downstream_cost(self, downstream_cost: float) -> bool:
+        """Update the downstream cost if a longer path to a "get" node is found (e.g. a
+        later request consumes the output of this chain).
+
+        Returns:
+            bool. Whether the downstream cost is updated.
+        """
+
+        parrot_assert(self.is_activated, "CompletionChain has not been activated.")
+        if downstream_cost <= self._downstream_cost:
+            return False
+        self._downstream_cost = downstream_cost
+        return True
+
     async def wait_activated(self) -> None:
         await self._activated_event.wait()
 
@@ -154,6 +190,44 @@ class CompletionChain:
         parrot_assert(self.is_activated, "CompletionChain has not been activated.")
         return self._depth
 
+    @property
+    def deadline(self) -> Optional[int]:
+        parrot_assert(self.is_activated, "CompletionChain has not been activated.")
+        return self._deadline
+
+    @property
+    def cost(self) -> float:
+        """The estimated cost of the chain (in units of decoding a token)."""
+
+        parrot_assert(self.is_activated, "CompletionChain has not been activated.")
+        return self._cost
+
+    @property
+    def critical_path(self) -> float:
+        """The estimated length of the critical path from the start of the chain to the
+        "get" node. Chains with longer critical paths should be scheduled first."""
+
+        parrot_assert(self.is_activated, "CompletionChain has not been activated.")
+        return self._cost + self._downstream_cost
+
+    @property
+    def slack(self) -> float:
+        """How much the chain can be delayed without delaying the consumers of its chain
+        groups, i.e. the longest critical path of the unfinished chains in its groups
+        minus its own. Zero if it's on the critical path."""
+
+        critical_path = self.critical_path
+        longest = critical_path
+        for chain_group in self.chain_groups:
+            for chain in chain_group.chains:
+                if chain is self or not chain.is_activated:
+                    continue
+                # Finished chains don't delay the consumers any more.
+                if chain.gen_node.has_sv and chain.gen_node.sv.is_ready():
+                    continue
+                longest = max(longest, chain.critical_path)
+        return longest - critical_path
+
     def iter(self) -> _CompletionChainIterator:
         return _CompletionChainIterator(self.first_node)
 
@@ -200,6 +274,13 @@ class RequestChain:
         self.metadata = metadata
         self.comp_chains: List[CompletionChain] = []
 
+        # The deadline is counted from the creation of the request.
+        self.deadline: Optional[int] = None
+        if metadata.latency_budget is not None:
+            self.deadline = time_counter_in_nanoseconds() + int(
+                metadata.latency_budget * 1e9
+            )
+
         # Only valid after inserted into a graph.
         self._placeholders_mapping: List[Dict] = []
 
@@ -1,9 +1,10 @@
 # Copyright (c) 2023 by Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import Set, List
+from typing import Dict, Set, List, Optional
 
 from parrot.exceptions import parrot_assert
+from parrot.utils import time_counter_in_nanoseconds
 
 from .graph import CompletionChain, CompChainGroup
 from .nodes import PlaceholderGen
@@ -20,9 +21,108 @@ The algorithm works as follows:
 2. Then it traverses backward to its predecessors, activates them and propagates the performance
     deduction result recursively.
 3. Then algorithm ends when it reaches the end of the graph or an activated node.
+
+Deadlines (from the latency budgets of requests) are propagated in the same way. The time
+left before the deadline of a chain is split between the chain and its (not activated)
+predecessors in proportion to their estimated costs: a predecessor must finish earlier if
+the chain itself is expensive. A chain's deadline is also bounded by the deadline of its own
+request.
+
+The critical path is propagated in the same way, too: the estimated length of the longest
+path from the end of a chain to a "get" node (the downstream cost) is the longest
+"cost + downstream cost" of its consumers. If a later request consumes the output of an
+activated chain through a longer path, the downstream costs of the chain and its
+predecessors are updated.
 """
 
 
+# NOTE(chaofan): The cost estimation is rough, since texts are not tokenized yet: ~4 chars
+# per token, and the prefill of a token is much cheaper than decoding one.
+_CHARS_PER_TOKEN = 4
+_FILL_TOKEN_COST = 0.05
+
+
+def _estimate_chain_cost(chain: CompletionChain) -> float:
+    """Estimate the cost of a chain, in units of the time of decoding a token."""
+
+    fill_tokens = 0.0
+    for node in chain.iter_fill():
+        if not node.has_sv:
+            continue
+        if node.sv.is_ready():
+            fill_tokens += len(node.get()) / _CHARS_PER_TOKEN
+        elif node.sv.has_producer:
+            # The output of the producer, at most.
+            producer: PlaceholderGen = node.sv.get_producer()
+            fill_tokens += producer.sampling_config.max_gen_length
+
+    gen_tokens = 0
+    if chain.gen_node is not None:
+        gen_tokens = chain.gen_node.sampling_config.max_gen_length
+
+    return fill_tokens * _FILL_TOKEN_COST + gen_tokens
+
+
+def _get_predecessors(chain: CompletionChain) -> List[CompletionChain]:
+    predecessors: List[CompletionChain] = []
+    for node in chain.iter_fill():
+        if node.sv.has_producer:
+            producer: PlaceholderGen = node.sv.get_producer()
+            predecessors.append(producer.comp_chain)
+    if chain.first_node.has_edge_a_prev_node:
+        predecessors.append(chain.first_node.get_edge_a_prev_node().comp_chain)
+    return predecessors
+
+
+def _estimate_path_cost(chain: CompletionChain, memo: Dict[int, float]) -> float:
+    """Estimate the cost of the longest path of not activated chains ending with the chain."""
+
+    key = id(chain)
+    if key in memo:
+        return memo[key]
+
+    upstream_cost = 0.0
+    for next_chain in _get_predecessors(chain):
+        if not next_chain.is_activated:
+            upstream_cost = max(upstream_cost, _estimate_path_cost(next_chain, memo))
+
+    memo[key] = _estimate_chain_cost(chain) + upstream_cost
+    return memo[key]
+
+
+def _update_downstream_cost(chain: CompletionChain, downstream_cost: float) -> None:
+    """Propagate a longer downstream cost through activated chains."""
+
+    if not chain.update_downstream_cost(downstream_cost):
+        return
+    for next_chain in _get_predecessors(chain):
+        _update_downstream_cost(next_chain, chain.critical_path)
+
+
+def _min_deadline(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def _split_deadline(
+    deadline: Optional[int], now: int, chain_cost: float, upstream_cost: float
+) -> Optional[int]:
+    """The deadline of a predecessor whose path costs upstream_cost, given the chain's."""
+
+    if deadline is None:
+        return None
+    # Already missed. The predecessors are as urgent as the chain.
+    if deadline <= now:
+        return deadline
+    total_cost = chain_cost + upstream_cost
+    if total_cost <= 0:
+        return deadline
+    return now + int((deadline - now) * upstream_cost / total_cost)
+
+
 def _back_propagate_criteria(criteria: PerformanceCriteria) -> PerformanceCriteria:
     if criteria == PerformanceCriteria.LATENCY:
         return PerformanceCriteria.LATENCY
@@ -35,8 +135,13 @@ def _back_propagate_criteria(criteria: PerformanceCriteria) -> PerformanceCriter
 def _traverse(
     chain: CompletionChain,
     criteria: PerformanceCriteria,
+    deadline: Optional[int],
+    downstream_cost: float,
+    now: int,
+    cost_memo: Dict[int, float],
 ) -> None:
     if chain.is_activated:
+        _update_downstream_cost(chain, downstream_cost)
         return
 
     # Propagate the performance criteria.
@@ -44,6 +149,18 @@ def _traverse(
     # Grouping chains.
     chain_group = CompChainGroup()
 
+    # Propagate the deadline and the critical path.
+    deadline = _min_deadline(deadline, chain.request_deadline)
+    chain_cost = _estimate_chain_cost(chain)
+    next_downstream_cost = chain_cost + downstream_cost
+
+    def _next_deadline(next_chain: CompletionChain) -> Optional[int]:
+        if next_chain.is_activated:
+            return None
+        return _split_deadline(
+            deadline, now, chain_cost, _estimate_path_cost(next_chain, cost_memo)
+        )
+
     next_chains: List[CompletionChain] = []
 
     for node in chain.iter_fill():
@@ -52,14 +169,28 @@ def _traverse(
             next_chain: CompletionChain = producer.comp_chain
             next_chain.chain_groups.append(chain_group)
             chain_group.chains.add(next_chain)
-            _traverse(next_chain, next_criteria)
+            _traverse(
+                next_chain,
+                next_criteria,
+                _next_deadline(next_chain),
+                next_downstream_cost,
+                now,
+                cost_memo,
+            )
             next_chains.append(next_chain)
 
     if chain.first_node.has_edge_a_prev_node:
         prev_gen = chain.first_node.get_edge_a_prev_node()
         parrot_assert(prev_gen.is_gen, "The previous node is not a Gen node.")
         next_chain = prev_gen.comp_chain
-        _traverse(next_chain, next_criteria)
+        _traverse(
+            next_chain,
+            next_criteria,
+            _next_deadline(next_chain),
+            next_downstream_cost,
+            now,
+            cost_memo,
+        )
         next_chains.append(next_chain)
 
     # Lastly, activate the chain.
@@ -67,7 +198,7 @@ def _traverse(
     for next_chain in next_chains:
         depth = max(depth, next_chain.depth + 1)
 
-    chain.activate(criteria, depth)
+    chain.activate(criteria, depth, deadline, chain_cost, downstream_cost)
 
 
 def activate_completion_chain(
@@ -82,4 +213,11 @@ def activate_completion_chain(
 
     parrot_assert(not chain.is_activated, "Chain is already activated.")
 
-    _traverse(chain=chain, criteria=criteria)
+    _traverse(
+        chain=chain,
+        criteria=criteria,
+        deadline=None,
+        downstream_cost=0.0,
+        now=time_counter_in_nanoseconds(),
+        cost_memo={},
+    )
@@ -89,6 +89,7 @@ class SemanticCallMetadata:
         "cache_prefix",
         "output_criteria",
         "fuse_fill",
+        "latency_budget",
     ]
 
     models: List[str]
@@ -97,6 +98,9 @@ class SemanticCallMetadata:
     cache_prefix: bool
     output_criteria: Optional[Union[PerformanceCriteria, str]]
     fuse_fill: bool
+    # The latency budget (in seconds) of the request, counted from its submission. The
+    # deadline is propagated to the chains it depends on.
+    latency_budget: Optional[float] = None
 
     @classmethod
     def get_default_dict(cls) -> Dict:
@@ -109,6 +113,7 @@ class SemanticCallMetadata:
             "cache_prefix": True,
             "output_criteria": None,
             "fuse_fill": False,
+            "latency_budget": None,
         }
 
     @classmethod
@@ -192,9 +197,8 @@ class ChunkedSemanticCallRequest:
         processed_payload = payload.copy()
 
         # Assign default values.
-        processed_payload.setdefault("models", [])
-        processed_payload.setdefault("model_type", "token_id")
-        processed_payload.setdefault("remove_pure_fill", True)
+        for key, value in SemanticCallMetadata.get_default_dict().items():
+            processed_payload.setdefault(key, value)
 
         return processed_payload
 
@@ -1,7 +1,7 @@
 # Copyright (c) 2023 by Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import List, Optional
+from typing import List, Optional, AsyncGenerator
 from asyncio import Event
 
 from parrot.exceptions import parrot_assert
@@ -50,8 +50,16 @@ class SemanticVariable:
         # Text content.
         self._content: Optional[str] = None
 
+        # Partial content, streamed by the producer before the content is ready.
+        self._partial_content: str = ""
+        # Number of readers streaming the content. The producer streams the partial
+        # content only if there are readers.
+        self._num_stream_readers: int = 0
+
         # Events
         self._ready_event: Event = Event()  # Ready event means the content is ready.
+        # Set (and replaced) when the partial content is updated.
+        self._partial_event: Event = Event()
 
         # Producer of this SV. It must be a PlaceholderGen node.
         self._producer: Optional["PlaceholderGen"] = None
@@ -66,8 +74,40 @@ class SemanticVariable:
         """Set the content of the semantic variable."""
 
         assert self._content is None, f"This semantic variable (id={self.id}) is filled"
+        # Readers have read the partial content, so the content must extend it.
+        parrot_assert(
+            content.startswith(self._partial_content),
+            f"The content of semantic variable (id={self.id}) doesn't extend its "
+            "partial content.",
+        )
         self._content = content
         self._ready_event.set()
+        self._notify_partial()
+
+    def _notify_partial(self) -> None:
+        # NOTE(chaofan): Replace the event instead of clearing it, so that all readers
+        # waiting on the old event are woken up.
+        partial_event = self._partial_event
+        self._partial_event = Event()
+        partial_event.set()
+
+    def append_partial(self, text: str) -> None:
+        """Append streamed text to the partial content of the semantic variable."""
+
+        parrot_assert(
+            not self.is_ready(), f"This semantic variable (id={self.id}) is filled"
+        )
+        if len(text) == 0:
+            return
+        self._partial_content += text
+        self._notify_partial()
+
+    def get_partial(self) -> str:
+        """Get the content generated so far. Returns the full content if it's ready."""
+
+        if self.is_ready():
+            return self._content
+        return self._partial_content
 
     def get(self) -> str:
         """Get the content of the semantic variable."""
@@ -83,6 +123,38 @@ class SemanticVariable:
 
         await self._ready_event.wait()
 
+    @property
+    def has_stream_readers(self) -> bool:
+        return self._num_stream_readers > 0
+
+    def astream(self) -> AsyncGenerator[str, None]:
+        """Stream the content of this SV. Yields pieces of the text as they arrive, until
+        the content is ready.
+
+        The reader is registered when this is called. If the producer has started
+        without any reader, the content arrives in one piece when it's ready.
+        """
+
+        self._num_stream_readers += 1
+        return self._astream()
+
+    async def _astream(self) -> AsyncGenerator[str, None]:
+        try:
+            pos = 0
+            while True:
+                # Get the event before reading, so no update is missed.
+                partial_event = self._partial_event
+                is_ready = self.is_ready()
+                content = self.get_partial()
+                if len(content) > pos:
+                    yield content[pos:]
+                    pos = len(content)
+                if is_ready:
+                    break
+                await partial_event.wait()
+        finally:
+            self._num_stream_readers -= 1
+
     def assign_producer(self, producer: "PlaceholderGen") -> None:
         """Assign the producer of this SV. This will add some edges in the graph."""
 
@@ -7,7 +7,7 @@ import asyncio
 import traceback
 from typing import Optional
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from uvicorn import Config, Server
 import os
 
@@ -130,6 +130,13 @@ async def get_semantic_variable(var_id: str, request: Request):
     return response
 
 
+@app.get(f"/{API_VERSION}" + "/semantic_var/{var_id}/stream")
+async def stream_semantic_variable(var_id: str, request: Request):
+    payload = await request.json()
+    generator = await pcore.stream_semantic_variable(var_id, payload)
+    return StreamingResponse(generator, media_type="text/plain; charset=utf-8")
+
+
 @app.get(f"/{API_VERSION}/semantic_var")
 async def get_semantic_variable_list(request: Request):
     raise NotImplementedError("Not implemented yet.")
@@ -180,9 +187,14 @@ def start_server(
     uvicorn_server = Server(config)
     # NOTE(chaofan): We use `fail_fast` because this project is still in development
     # For real deployment, maybe we don't need to quit the backend when there is an error
-    create_task_in_loop(pcore.serve_loop(), loop=loop, fail_fast=True)
+    serve_loop_task = create_task_in_loop(pcore.serve_loop(), loop=loop, fail_fast=True)
     loop.run_until_complete(uvicorn_server.serve())
 
+    # The server is stopped (e.g. by Ctrl-C). Stop the serving loop and clean up.
+    serve_loop_task.cancel()
+    loop.run_until_complete(asyncio.gather(serve_loop_task, return_exceptions=True))
+    loop.run_until_complete(pcore.shutdown())
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parrot ServeCore http server")
@@ -1,26 +1,217 @@
 # Copyright (c) 2023 by Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import Dict
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from parrot.exceptions import parrot_assert
+
+
+class _TrieNode:
+    """A node in the compressed prefix trie.
+
+    The edge from its parent to it is a string whose length is a multiple of the block size.
+    """
+
+    def __init__(self, edge: str, parent: Optional["_TrieNode"], count: int):
+        self.edge = edge
+        self.parent = parent
+
+        # first block of child's edge -> child
+        self.children: Dict[str, "_TrieNode"] = {}
+
+        # Hit count: number of added prefixes passing through this node.
+        self.count = count
+
+        # The common characters of all continuations after this node (None if there is no
+        # continuation yet). Since the trie is block-wise, it lets the matched prefix end
+        # in the middle of a block.
+        self.ext: Optional[str] = None
+        # Logical time of the last access (add/query).
+        self.last_access = 0
+
+        self.removed = False
+
+    @property
+    def is_leaf(self) -> bool:
+        return len(self.children) == 0
 
 
 class PrefixMatcher:
     """Prefix matcher uses a heuristic algorithm to find the most common prefix among a set of strings.
 
-    If there is a common prefix part between them, we will add the count of the common part.
-    If the count reaches a certain threshold, we will consider it as a GlobalPrefix.
+    The prefixes are stored in a compressed trie over fixed-size character blocks. Each node
+    counts the number of prefixes passing through it. If the count of a common part reaches a
+    certain threshold, we will consider it as a GlobalPrefix.
+
+    The memory of the trie is bounded by a budget. When it's exceeded, leaves are evicted
+    according to the evict policy:
+    - "lru": Evict the least recently added/matched leaf.
+    - "lfu": Evict the leaf with the least hit count (ties broken by LRU).
     """
 
-    _START_LEN = 40
-    _GP_THRESHOLD = 3
+    # Estimated memory of a node, except the edge string.
+    _NODE_OVERHEAD_BYTES = 256
+
+    def __init__(
+        self,
+        block_size: int = 16,
+        min_prefix_len: int = 40,
+        max_prefix_len: int = 8192,
+        gp_threshold: int = 3,
+        memory_budget: int = 64 * 1024 * 1024,
+        evict_policy: str = "lru",
+    ):
+        parrot_assert(
+            evict_policy in ["lru", "lfu"], f"Unknown evict policy: {evict_policy}."
+        )
+
+        self.block_size = block_size
+        # Prefixes shorter than min_prefix_len are not considered as global prefixes.
+        self.min_prefix_len = min_prefix_len
+        # Texts are truncated to max_prefix_len before adding.
+        self.max_prefix_len = max_prefix_len
+        self.gp_threshold = gp_threshold
+        self.memory_budget = memory_budget
+        self.evict_policy = evict_policy
+
+        self._root = _TrieNode(edge="", parent=None, count=0)
+        self._nodes_num = 0
+        self._memory_usage = 0
+        self._clock = 0
+
+        # Candidates of eviction: (evict key, node id, node). Lazily invalidated.
+        self._evict_heap: List[Tuple[Tuple[int, ...], int, _TrieNode]] = []
+
+    # ---------- Internal Methods ----------
+
+    def _node_memory(self, node: _TrieNode) -> int:
+        return len(node.edge) + self._NODE_OVERHEAD_BYTES
+
+    def _evict_key(self, node: _TrieNode) -> Tuple[int, ...]:
+        if self.evict_policy == "lru":
+            return (node.last_access,)
+        return (node.count, node.last_access)
+
+    def _push_evict_candidate(self, node: _TrieNode) -> None:
+        heapq.heappush(self._evict_heap, (self._evict_key(node), id(node), node))
+
+        # Compact the heap if there are too many stale entries.
+        if len(self._evict_heap) > 4 * self._nodes_num + 1024:
+            self._evict_heap = [
+                (self._evict_key(node), id(node), node)
+                for _, _, node in self._evict_heap
+                if not node.removed and node.is_leaf
+            ]
+            # Deduplicate
+            self._evict_heap = list({id(e[2]): e for e in self._evict_heap}.values())
+            heapq.heapify(self._evict_heap)
+
+    def _new_node(self, edge: str, parent: _TrieNode, count: int) -> _TrieNode:
+        node = _TrieNode(edge=edge, parent=parent, count=count)
+        node.last_access = self._clock
+        parent.children[edge[: self.block_size]] = node
+        self._nodes_num += 1
+        self._memory_usage += self._node_memory(node)
+        return node
+
+    def _remove_leaf(self, node: _TrieNode) -> None:
+        parent = node.parent
+        parent.children.pop(node.edge[: self.block_size])
+        node.removed = True
+        self._nodes_num -= 1
+        self._memory_usage -= self._node_memory(node)
 
-    def __init__(self):
-        # NOTE(chaofan): This table is two-level.
-        # The first level is the first _START_LEN characters of the prefix, to speed up the lookup.
-        # The second level is a list of prefix strings.
-        # TODO(chaofan): Advanced evict policy.
+        # The parent becomes a leaf.
+        if parent is not self._root and parent.is_leaf:
+            self._push_evict_candidate(parent)
 
-        self._prefix_counter: Dict[str, Dict[str, int]] = {}
+    def _split_node(self, node: _TrieNode, pos: int) -> _TrieNode:
+        """Split the edge of the node at pos (a multiple of the block size). Returns the
+        new upper node."""
+
+        parent = node.parent
+        upper = _TrieNode(edge=node.edge[:pos], parent=parent, count=node.count)
+        upper.last_access = node.last_access
+        parent.children[upper.edge[: self.block_size]] = upper
+
+        node.edge = node.edge[pos:]
+        node.parent = upper
+        upper.children[node.edge[: self.block_size]] = node
+        upper.ext = node.edge[: self.block_size]
+
+        self._nodes_num += 1
+        self._memory_usage += self._NODE_OVERHEAD_BYTES
+        return upper
+
+    def _evict(self) -> None:
+        while self._memory_usage > self.memory_budget and len(self._evict_heap) > 0:
+            key, _, node = heapq.heappop(self._evict_heap)
+            # Stale entries
+            if node.removed or not node.is_leaf:
+                continue
+            if key != self._evict_key(node):
+                self._push_evict_candidate(node)
+                continue
+            self._remove_leaf(node)
+
+    def _common_blocks_len(self, edge: str, text: str, start: int) -> int:
+        """Length of the common part (in whole blocks) of edge and text[start:]."""
+
+        # Fast path: the whole edge matches.
+        if text.startswith(edge, start):
+            return len(edge)
+
+        i = 0
+        while i < len(edge):
+            block = text[start + i : start + i + self.block_size]
+            if block != edge[i : i + self.block_size]:
+                break
+            i += self.block_size
+        return i
+
+    @staticmethod
+    def _common_chars(a: str, b: str) -> str:
+        i = 0
+        while i < len(a) and i < len(b) and a[i] == b[i]:
+            i += 1
+        return a[:i]
+
+    def _merge_ext(self, node: _TrieNode, continuation: str) -> None:
+        if node is self._root:
+            return
+        if node.ext is None:
+            node.ext = continuation
+        else:
+            node.ext = self._common_chars(node.ext, continuation)
+
+    def _align_to_token_boundary(self, text: str, pos: int) -> int:
+        """Move the split position backward to a position where the prefix tokenizes
+        identically, i.e. right before a run of whitespaces.
+
+        NOTE(chaofan): Common tokenizers (BPE / SentencePiece) attach the leading space to the
+        following word, and a run of whitespaces may be merged into one token. So splitting
+        before a whitespace run won't change tokens of the prefix.
+        """
+
+        i = min(pos, len(text) - 1)
+        while i > 0 and not text[i].isspace():
+            i -= 1
+        while i > 0 and text[i - 1].isspace():
+            i -= 1
+        return i
+
+    # ---------- Public Methods ----------
+
+    @property
+    def memory_usage(self) -> int:
+        """Estimated memory usage of the trie in bytes."""
+
+        return self._memory_usage
+
+    @property
+    def nodes_num(self) -> int:
+        return self._nodes_num
 
     def add_prefix(self, prefix: str) -> None:
         """Add a prefix to the global prefix cache.
@@ -29,39 +220,44 @@ class PrefixMatcher:
             prefix (str): The prefix to be added.
         """
 
+        text = prefix[: self.max_prefix_len]
+        # Only whole blocks are stored.
+        text = text[: len(text) - len(text) % self.block_size]
+
         # Too short
-        if len(prefix) <= self._START_LEN:
+        if len(text) <= self.min_prefix_len:
             return
 
-        lookup = prefix[: self._START_LEN]
-        if lookup not in self._prefix_counter:
-            self._prefix_counter[lookup] = {}
+        self._clock += 1
+        node = self._root
+        pos = 0
+        while pos < len(text):
+            self._merge_ext(node, prefix[pos : pos + self.block_size])
+
+            child = node.children.get(text[pos : pos + self.block_size])
+            if child is None:
+                # Add the rest as a new leaf
+                node = self._new_node(edge=text[pos:], parent=node, count=1)
+                self._push_evict_candidate(node)
+                pos = len(text)
+                break
 
-        prefixes = list(self._prefix_counter[lookup].keys())
+            common_len = self._common_blocks_len(child.edge, text, pos)
+            if common_len < len(child.edge):
+                child = self._split_node(child, common_len)
 
-        for k in prefixes:
-            # Matched
-            if k[self._START_LEN] == prefix[self._START_LEN]:
-                # Reduce to common prefix
-                i = self._START_LEN
-                while i < len(k) and i < len(prefix) and k[i] == prefix[i]:
-                    i += 1
+            child.count += 1
+            child.last_access = self._clock
+            if child.is_leaf:
+                self._push_evict_candidate(child)
 
-                new_k = k[:i]
+            node = child
+            pos += common_len
 
-                if i == len(k):
-                    # Common prefix is the same
-                    self._prefix_counter[lookup][k] += 1
-                else:
-                    # Common prefix changes
-                    self._prefix_counter[lookup][new_k] = (
-                        self._prefix_counter[lookup][k] + 1
-                    )
-                    self._prefix_counter[lookup].pop(k)
-                return
+        # The (unaligned) tail of the prefix is the continuation of the last node.
+        self._merge_ext(node, prefix[pos : pos + self.block_size])
 
-        # Add to table
-        self._prefix_counter[lookup][prefix] = 1
+        self._evict()
 
     def query_prefix(self, prefix: str) -> int:
         """Query whether the prefix is a global prefix.
@@ -71,19 +267,43 @@ class PrefixMatcher:
 
         Returns:
             -1 if the prefix is not a global prefix.
-            Otherwise, returns the position of the last matched character.
+            Otherwise, returns the position of the last matched character. The position is
+            aligned to the token boundary.
         """
 
-        if len(prefix) <= self._START_LEN:
+        if len(prefix) <= self.min_prefix_len:
             return -1
 
-        lookup = prefix[: self._START_LEN]
+        self._clock += 1
+        node = self._root
+        pos = 0
+        # The common characters of the texts after the matched blocks.
+        ext = ""
+        while pos < len(prefix):
+            block = prefix[pos : pos + self.block_size]
+            child = node.children.get(block)
+            if child is None or child.count <= self.gp_threshold:
+                ext = node.ext or ""
+                break
+
+            child.last_access = self._clock
+            common_len = self._common_blocks_len(child.edge, prefix, pos)
+            if common_len < len(child.edge):
+                pos += common_len
+                ext = child.edge[common_len : common_len + self.block_size]
+                break
 
-        if lookup not in self._prefix_counter:
+            node = child
+            pos += common_len
+
+        matched_len = pos + len(
+            self._common_chars(ext, prefix[pos : pos + self.block_size])
+        )
+        if matched_len <= self.min_prefix_len:
             return -1
 
-        for k, v in self._prefix_counter[lookup].items():
-            if v > self._GP_THRESHOLD and prefix.startswith(k):
-                return len(k)
+        split_pos = self._align_to_token_boundary(prefix, matched_len)
+        if split_pos <= self.min_prefix_len:
+            return -1
 
-        return -1
+        return split_pos
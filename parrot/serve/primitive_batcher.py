@@ -0,0 +1,134 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+import asyncio
+from typing import List, Optional, Set, Tuple, Union
+import aiohttp
+
+from parrot.constants import PRIMITIVES_NO_BATCH, CORE_PRIMITIVES_BATCH_MAX_SIZE
+from parrot.utils import get_logger
+from parrot.protocol.internal.primitive_request import (
+    Primitive,
+    astream_primitives_batch,
+)
+from parrot.protocol.internal.layer_apis import FillResponse, GenerateResponse
+
+from parrot.serve.backend_repr import ExecutionEngine
+
+
+logger = get_logger("PrimitiveBatcher")
+
+
+class PrimitiveBatcher:
+    """PrimitiveBatcher coalesces the Fill/Generate primitives to an engine.
+
+    Primitives submitted within the batch window (e.g. the branches of a map-reduce) are
+    sent in one /primitives_batch request, and the engine schedules them together. Each
+    submitter still gets its own result (or exception), as soon as its primitive
+    finishes in the engine.
+
+    A batch with a single primitive is sent by its own endpoint (/fill, /generate).
+    """
+
+    def __init__(
+        self,
+        engine: ExecutionEngine,
+        client_session: aiohttp.ClientSession,
+        max_batch_size: int = CORE_PRIMITIVES_BATCH_MAX_SIZE,
+    ):
+        self.engine = engine
+        self.client_session = client_session
+        self.batch_window = engine.primitives_batch_window
+        self.max_batch_size = max_batch_size
+
+        # (primitive, future of its result)
+        self._pending: List[Tuple[Primitive, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Keep references to the sending tasks, so they are not garbage collected.
+        self._sending_tasks: Set[asyncio.Task] = set()
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch = self._pending
+        self._pending = []
+        if len(batch) == 0:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._sending_tasks.add(task)
+        task.add_done_callback(self._sending_tasks.discard)
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result) -> None:
+        # The submitter may be cancelled.
+        if future.done():
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+    async def _send(self, batch: List[Tuple[Primitive, asyncio.Future]]) -> None:
+        primitives = [primitive for primitive, _ in batch]
+        try:
+            if len(primitives) == 1:
+                result = await primitives[0].apost(
+                    self.engine.http_address,
+                    self.client_session,
+                    self.engine.wire_format,
+                )
+                self._set_result(batch[0][1], result)
+            else:
+                logger.debug(
+                    f"Send a batch of {len(primitives)} primitives to engine "
+                    f"{self.engine.name} (id={self.engine.engine_id})."
+                )
+                # Each submitter is resolved as soon as its own result arrives.
+                async for index, result in astream_primitives_batch(
+                    primitives,
+                    self.engine.http_address,
+                    self.client_session,
+                    self.engine.wire_format,
+                ):
+                    self._set_result(batch[index][1], result)
+        except Exception as e:
+            for _, future in batch:
+                self._set_result(future, e)
+            return
+
+        for _, future in batch:
+            self._set_result(
+                future, RuntimeError("The engine didn't reply the primitive's result.")
+            )
+
+    async def submit(
+        self, primitive: Primitive
+    ) -> Union[FillResponse, GenerateResponse]:
+        """Submit a Fill/Generate primitive and wait for its result.
+
+        Args:
+            primitive: Primitive. The primitive. Streaming Generate is not supported.
+
+        Returns:
+            The response of the primitive.
+        """
+
+        if self.batch_window == PRIMITIVES_NO_BATCH:
+            return await primitive.apost(
+                self.engine.http_address, self.client_session, self.engine.wire_format
+            )
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((primitive, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+
+        return await future
@@ -3,5 +3,12 @@
 
 
 from .completion_task import CompletionTask, TaskStatus
+from .task_queue import TaskQueue
 from .task_creator import TaskCreator
 from .global_scheduler import GlobalScheduler, GlobalSchedulerConfig
+from .engine_scorer import (
+    EngineScorer,
+    ServeLayerScorer,
+    LoadAwareScorer,
+    get_engine_scorer,
+)
@@ -2,6 +2,7 @@
 # Licensed under the MIT license.
 
 
+import asyncio
 from enum import Enum
 from typing import List, Dict, Optional
 from asyncio import Event
@@ -42,6 +43,12 @@ class CompletionTask:
         # A tokenized result is a List of token ids, i.e. List[List[int]]
         self.tokenized_result: Optional[Dict[str, List[List[int]]]] = None
 
+        # Estimated number of tokens in the Fill part.
+        # Map from tokenizer name to the number of tokens.
+        # NOTE(chaofan): The task is tokenized lazily, only by the tokenizer of the engine
+        # it's scheduled to. Before that, the scheduler uses the estimation.
+        self.estimated_tokens_num: Dict[str, int] = {}
+
         # Context bound to the task
         # A list of contexts that are bound to the task
         self.contexts: List[Context] = []
@@ -84,28 +91,127 @@ class CompletionTask:
 
         self.engine.update_servelayer_runtime_info_remove_task(self)
 
-    def tokenize_chain(self, tokenizers_wrapper: "TokenizersWrapper") -> None:
-        """Tokenize the chain using the tokenizers in the wrapper."""
+    @staticmethod
+    def _get_fill_cache_key(
+        fill_node, text: str, tokenizers_wrapper: "TokenizersWrapper"
+    ) -> Optional[str]:
+        """Get the key for caching the tokenized result of a Fill node.
+
+        Cache the tokenized results of constants, which are usually shared by
+        requests (system prompts, few-shot examples, ...).
+        Constant prefix SVs are content-hashed in the global namespace, so we use
+        their ids as the keys and evict them together with the SVs. Other constants
+        are hashed in the session namespace, so we use the content hash instead.
+        """
+
+        if fill_node.has_placeholder:
+            return None
+        if fill_node.sv.is_constant_prefix:
+            return fill_node.sv.id
+        return tokenizers_wrapper.get_content_cache_key(text)
+
+    def estimate_tokens_num(self, tokenizers_wrapper: "TokenizersWrapper") -> None:
+        """Estimate the number of tokens of the chain by all tokenizers in the wrapper,
+        without tokenizing it."""
+
+        parrot_assert(self.chain.sv_created, "SVs are not created yet.")
+
+        self.estimated_tokens_num = {}
+        for fill_node in self.chain.iter_fill():
+            text = fill_node.get()
+            cache_key = self._get_fill_cache_key(fill_node, text, tokenizers_wrapper)
+            for tokenizer_name in tokenizers_wrapper.tokenizers:
+                self.estimated_tokens_num[tokenizer_name] = self.estimated_tokens_num.get(
+                    tokenizer_name, 0
+                ) + tokenizers_wrapper.estimate_tokens_num(
+                    text, tokenizer_name, cache_key
+                )
+
+    def tokenize_chain(
+        self,
+        tokenizers_wrapper: "TokenizersWrapper",
+        tokenizer_names: Optional[List[str]] = None,
+    ) -> None:
+        """Tokenize the chain using the tokenizers in the wrapper.
+
+        Args:
+            tokenizers_wrapper: The tokenizers wrapper.
+            tokenizer_names: The tokenizers to use. If None, use all tokenizers.
+        """
 
         parrot_assert(not self.is_tokenized, "Tokenized result is already available.")
         parrot_assert(self.chain.sv_created, "SVs are not created yet.")
 
-        self.tokenized_result = {}
+        if tokenizer_names is None:
+            tokenizer_names = list(tokenizers_wrapper.tokenizers.keys())
+
+        self.tokenized_result = {
+            tokenizer_name: [] for tokenizer_name in tokenizer_names
+        }
+        for fill_node in self.chain.iter_fill():
+            text = fill_node.get()
+            cache_key = self._get_fill_cache_key(fill_node, text, tokenizers_wrapper)
+
+            for tokenizer_name in tokenizer_names:
+                self.tokenized_result[tokenizer_name].append(
+                    tokenizers_wrapper.tokenize(text, tokenizer_name, cache_key)
+                )
+
+    async def atokenize_chain(
+        self,
+        tokenizers_wrapper: "TokenizersWrapper",
+        tokenizer_names: Optional[List[str]] = None,
+    ) -> None:
+        """Tokenize the chain without blocking the event loop.
+
+        All Fills of the chain are tokenized together in a batch.
+
+        Args:
+            tokenizers_wrapper: The tokenizers wrapper.
+            tokenizer_names: The tokenizers to use. If None, use all tokenizers.
+        """
+
+        parrot_assert(not self.is_tokenized, "Tokenized result is already available.")
+        parrot_assert(self.chain.sv_created, "SVs are not created yet.")
+
+        if tokenizer_names is None:
+            tokenizer_names = list(tokenizers_wrapper.tokenizers.keys())
+
+        texts = []
+        cache_keys = []
         for fill_node in self.chain.iter_fill():
-            tokenized_result: Dict = tokenizers_wrapper.tokenize_all(fill_node.get())
-            for key, value in tokenized_result.items():
-                if key not in self.tokenized_result:
-                    self.tokenized_result[key] = []
-                self.tokenized_result[key].append(value)
+            text = fill_node.get()
+            texts.append(text)
+            cache_keys.append(
+                self._get_fill_cache_key(fill_node, text, tokenizers_wrapper)
+            )
+
+        results = await asyncio.gather(
+            *[
+                tokenizers_wrapper.atokenize_batch(texts, tokenizer_name, cache_keys)
+                for tokenizer_name in tokenizer_names
+            ]
+        )
+        self.tokenized_result = dict(zip(tokenizer_names, results))
 
     def get_token_nums(self, tokenizer_name: str) -> int:
-        """Get the number of tokens in the tokenized result."""
+        """Get the number of tokens of the task.
+
+        If the task is not tokenized by the tokenizer yet, returns the estimated number.
+        """
+
+        if self.is_tokenized and tokenizer_name in self.tokenized_result:
+            tokens_num = 0
+            # Add the number of tokens in Fill part.
+            for token_ids in self.tokenized_result[tokenizer_name]:
+                tokens_num += len(token_ids)
+        else:
+            parrot_assert(
+                tokenizer_name in self.estimated_tokens_num,
+                f"Tokens num of tokenizer {tokenizer_name} is not available.",
+            )
+            tokens_num = self.estimated_tokens_num[tokenizer_name]
 
-        parrot_assert(self.is_tokenized, "Tokenized result is not available.")
-        tokens_num = 0
-        # Add the number of tokens in Fill part.
-        for token_ids in self.tokenized_result[tokenizer_name]:
-            tokens_num += len(token_ids)
         # Add the number of tokens in Gen part.
         tokens_num += self.chain.gen_node.sampling_config.max_gen_length
         return tokens_num
@@ -0,0 +1,148 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple, Type
+
+from parrot.exceptions import parrot_assert
+
+from parrot.serve.backend_repr import ExecutionEngine
+
+from .completion_task import CompletionTask
+
+
+class EngineScorer(ABC):
+    """EngineScorer scores the candidate engines of a group of tasks in the GlobalScheduler.
+
+    The engine with the lowest score is selected. Candidates have passed the
+    availability checks (model, capacity, tasks_num_upperbound) already. Tasks in a group
+    have the same criteria.
+    """
+
+    @staticmethod
+    def avoid_latency_critical(engine: ExecutionEngine, tasks: List[CompletionTask]) -> bool:
+        """Whether the placement should be avoided for the latency-critical tasks in the
+        engine, i.e. placing throughput tasks with them."""
+
+        return (
+            not tasks[0].schedule_annotation.latency_critical
+            and engine.get_num_latency_critical_tasks() > 0
+        )
+
+    @abstractmethod
+    def score(self, engine: ExecutionEngine, tasks: List[CompletionTask]) -> Tuple:
+        """Score the engine for placing the tasks. Lower is better.
+
+        Args:
+            engine: ExecutionEngine. The candidate engine.
+            tasks: List[CompletionTask]. The group of tasks to be placed.
+
+        Returns:
+            A comparable tuple.
+        """
+
+        ...
+
+
+class ServeLayerScorer(EngineScorer):
+    """Rank engines by the serve-layer counters only.
+
+    Prefer the engine with the tightest tasks_num_upperbound, then the one with the least
+    remaining tokens capacity. So latency-critical tasks share the engines with low
+    tasks_num_upperbound, and throughput tasks are packed densely into fewer engines,
+    away from the latency-critical ones.
+    """
+
+    def score(self, engine: ExecutionEngine, tasks: List[CompletionTask]) -> Tuple:
+        return (
+            self.avoid_latency_critical(engine, tasks),
+            engine.get_tasks_num_upperbound(),
+            engine.get_remain_tokens_capacity(),
+        )
+
+
+class LoadAwareScorer(EngineScorer):
+    """Rank engines by the estimated latency cost of the placement, using the real-time
+    runtime info from heartbeats.
+
+    The latency of an iteration of an engine is modeled as linear in its batch size:
+        L(b) = c * (b + fixed_cost_jobs)
+    where c is the per-job latency of the engine, fitted from the recent average
+    iteration latency it reports. So engines with slower GPUs have larger c.
+
+    The load b of an engine is the larger one of the tasks reserved by ServeCore and the
+    jobs the engine reports running, plus the jobs queued in the engine. Placing n tasks:
+    - The new tasks run at L(b + n) per iteration.
+    - Each of the b tasks already there is slowed down by L(b + n) - L(b) = c * n.
+
+    The score is the sum of them:
+        n * L(b + n) + interference_weight * b * c * n
+
+    Throughput tasks are kept away from the engines with latency-critical tasks first.
+    """
+
+    def __init__(
+        self,
+        fixed_cost_jobs: float = 8,
+        default_iteration_latency: float = 20_000_000,  # ns
+        interference_weight: float = 1.0,
+    ):
+        parrot_assert(fixed_cost_jobs > 0, "fixed_cost_jobs must be positive.")
+
+        # The fixed cost of an iteration (weights loading, kernel launches, ...) in the
+        # unit of the cost of a job.
+        self.fixed_cost_jobs = fixed_cost_jobs
+        # The latency of an iteration of an idle engine (in nanoseconds), used before the
+        # engine reports its latency.
+        self.default_iteration_latency = default_iteration_latency
+        self.interference_weight = interference_weight
+
+    def get_per_job_latency(self, engine: ExecutionEngine) -> float:
+        """Fit the per-job latency c of the engine, in nanoseconds."""
+
+        iteration_latency = engine.get_recent_iteration_latency()
+        if iteration_latency <= 0:
+            return self.default_iteration_latency / self.fixed_cost_jobs
+
+        # NOTE(chaofan): The latency is measured with the running jobs in the engine
+        # (approximately, since the heartbeat is slightly outdated).
+        return iteration_latency / (
+            engine.get_num_running_jobs() + self.fixed_cost_jobs
+        )
+
+    def get_load(self, engine: ExecutionEngine) -> int:
+        """The number of jobs in the engine, running or waiting to run."""
+
+        return (
+            max(engine.get_num_tasks(), engine.get_num_running_jobs())
+            + engine.get_num_queued_jobs()
+        )
+
+    def score(self, engine: ExecutionEngine, tasks: List[CompletionTask]) -> Tuple:
+        c = self.get_per_job_latency(engine)
+        b = self.get_load(engine)
+        n = len(tasks)
+
+        new_tasks_latency = n * c * (b + n + self.fixed_cost_jobs)
+        interference = b * c * n
+        return (
+            self.avoid_latency_critical(engine, tasks),
+            new_tasks_latency + self.interference_weight * interference,
+        )
+
+
+ENGINE_SCORERS: Dict[str, Type[EngineScorer]] = {
+    "serve_layer": ServeLayerScorer,
+    "load_aware": LoadAwareScorer,
+}
+
+
+def get_engine_scorer(name: str, **kwargs) -> EngineScorer:
+    """Create an EngineScorer by its name."""
+
+    parrot_assert(
+        name in ENGINE_SCORERS,
+        f"Unknown engine scorer: {name}. Supported: {list(ENGINE_SCORERS.keys())}",
+    )
+    return ENGINE_SCORERS[name](**kwargs)
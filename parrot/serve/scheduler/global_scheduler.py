@@ -2,8 +2,11 @@
 # Licensed under the MIT license.
 
 
-from typing import Optional, List, Set
-from dataclasses import dataclass
+from typing import Optional, List, Set, Dict, Tuple
+from dataclasses import dataclass, field
+from asyncio import Event
+from bisect import bisect_right
+import heapq
 
 from parrot.exceptions import ParrotCoreUserError
 from parrot.utils import get_logger, RecyclePool
@@ -15,6 +18,8 @@ from parrot.serve.backend_repr.model import get_model_type, ModelType
 from ..engine_manager import EngineManager
 from ..context_manager import ServeCoreContextManager
 from .completion_task import CompletionTask, TaskStatus
+from .task_queue import TaskQueue, is_critical_task
+from .engine_scorer import get_engine_scorer
 
 
 logger = get_logger("GlobalScheduler")
@@ -26,8 +31,15 @@ class GlobalSchedulerConfig:
     graph_group: bool = False
     ctx_group: bool = False
     ctx_aware: bool = False
+    # Schedule the tasks on the critical paths of their DAGs first (least slack first).
+    # Tasks with slack are grouped separately from the critical ones.
+    critical_path: bool = False
     max_queue_size: int = 1024
 
+    # The policy to rank candidate engines. See engine_scorer.py.
+    engine_scorer: str = "serve_layer"
+    engine_scorer_args: Dict = field(default_factory=dict)
+
 
 class GlobalScheduler:
     """GlobalScheduler (GS) solves the task scheduling problem in the global scope."""
@@ -44,7 +56,17 @@ class GlobalScheduler:
         self.context_mgr = context_mgr
 
         # ---------- Task Queue ----------
-        self.task_queue: List[CompletionTask] = []
+        self.task_queue = TaskQueue()
+
+        # ---------- Engine Scorer ----------
+        self.engine_scorer = get_engine_scorer(
+            config.engine_scorer, **config.engine_scorer_args
+        )
+
+        # ---------- Wakeup ----------
+        # The scheduler is event-driven: it only runs when something that may change the
+        # scheduling result happens (task submitted/finished, engine registered/heartbeat).
+        self._wakeup_event: Event = Event()
 
     def _get_engine_list(
         self,
@@ -57,7 +79,8 @@ class GlobalScheduler:
         models = tasks[0].chain.metadata.models
         model_type_str = tasks[0].chain.metadata.model_type
         model_type = get_model_type(model_type_str)
-        # TODO(chaofan): Throughput/latency criteria
+        # NOTE(chaofan): The criteria are honored by the tasks_num_upperbound lowered from
+        # them, and by the engine scorer.
 
         def check_engine_available(engine: ExecutionEngine):
             # Check whether the mode type matches
@@ -95,6 +118,132 @@ class GlobalScheduler:
 
         return [engine for engine in engine_list if check_engine_available(engine)]
 
+    def _get_ordered_bucket(
+        self,
+        key: Tuple,
+        bucket: Dict[int, CompletionTask],
+        positions: Dict[int, int],
+        ordered_buckets: Dict[Tuple, List[int]],
+    ) -> List[int]:
+        """The positions of the tasks in an index bucket, in the scheduling order. Each
+        bucket is sorted once per tick, when it's first visited."""
+
+        ordered_bucket = ordered_buckets.get(key)
+        if ordered_bucket is None:
+            # NOTE(chaofan): The bucket is in the submission order, which is mostly the
+            # scheduling order, so the sort is close to linear.
+            ordered_bucket = sorted(positions[task_id] for task_id in bucket)
+            ordered_buckets[key] = ordered_bucket
+        return ordered_bucket
+
+    def _group_tasks(
+        self,
+        task: CompletionTask,
+        tasks: List[CompletionTask],
+        positions: Dict[int, int],
+        ordered_buckets: Dict[Tuple, List[int]],
+        max_group_size: int,
+    ) -> List[CompletionTask]:
+        """Group the task with tasks behind it in the queue.
+
+        Args:
+            task: The leading task of the group.
+            tasks: The tasks in the current scheduling order.
+            positions: Map from task_id to its position in the current scheduling order.
+            ordered_buckets: The index buckets sorted in this tick.
+            max_group_size: The max number of tasks in the group. Tasks behind are left
+                for the later groups.
+
+        Returns:
+            The group of tasks, with the leading task as the first one.
+        """
+
+        cur_group: List[CompletionTask] = [task]
+        task_pos = positions[task.task_id]
+
+        # The buckets of the indexes the task is in. Only tasks behind the leading task
+        # can be grouped with it.
+        buckets: List[List[int]] = []
+        if self.config.graph_group:
+            for chain_group in set(task.chain.chain_groups):
+                buckets.append(
+                    self._get_ordered_bucket(
+                        ("graph", chain_group),
+                        self.task_queue.get_tasks_by_chain_group(chain_group),
+                        positions,
+                        ordered_buckets,
+                    )
+                )
+        if self.config.ctx_group:
+            sv_id = task.chain.first_node.sv.id
+            buckets.append(
+                self._get_ordered_bucket(
+                    ("ctx", sv_id),
+                    self.task_queue.get_tasks_by_first_sv(sv_id),
+                    positions,
+                    ordered_buckets,
+                )
+            )
+        behind = [
+            map(bucket.__getitem__, range(bisect_right(bucket, task_pos), len(bucket)))
+            for bucket in buckets
+        ]
+
+        chain_groups = set(task.chain.chain_groups)
+
+        # Tasks on the critical path are not grouped with tasks with slack, which would
+        # slow them down in the same engine.
+        if self.config.critical_path:
+            is_critical = is_critical_task(task)
+
+        # Only allow one type of grouping at a time
+        graph_group_enabled = self.config.graph_group
+        ctx_group_enabled = self.config.ctx_group
+
+        # NOTE(chaofan): Visit the candidates in the queue order (merging the ordered
+        # buckets), so the chosen type of grouping and the narrowed chain groups are the
+        # same as scanning the queue.
+        last_pos = task_pos
+        for pos in heapq.merge(*behind):
+            if len(cur_group) >= max_group_size:
+                break
+
+            # A task in several buckets.
+            if pos == last_pos:
+                continue
+            last_pos = pos
+
+            task_j = tasks[pos]
+            # Scheduled with a former group in this tick.
+            if task_j not in self.task_queue:
+                continue
+
+            # TODO(chaofan): Models match check
+
+            # Criteria match check. Only group tasks with the same criteria.
+            if task_j.chain.criteria != task.chain.criteria:
+                continue
+
+            # Critical path check.
+            if self.config.critical_path and is_critical_task(task_j) != is_critical:
+                continue
+
+            # Graph group check
+            if graph_group_enabled:
+                common_groups = chain_groups.intersection(task_j.chain.chain_groups)
+                if len(common_groups) > 0:
+                    cur_group.append(task_j)
+                    chain_groups = common_groups
+                    ctx_group_enabled = False  # Use graph group this round
+
+            # Context group check
+            if ctx_group_enabled:
+                if task.chain.first_node.sv == task_j.chain.first_node.sv:
+                    cur_group.append(task_j)
+                    graph_group_enabled = False  # Use context group this round
+
+        return cur_group
+
     def _find_engine(self, tasks: List[CompletionTask]) -> None:
         """Find the best engine for a group of tasks."""
 
@@ -127,33 +276,17 @@ class GlobalScheduler:
             )
             # print(engine_ids_with_prefixes)
 
-        best_engine = None
-        for engine in engine_list:
-            if best_engine is None:
-                best_engine = engine
-            elif (
-                self.config.ctx_aware
-                and engine.engine_id in engine_ids_with_prefixes
-                and best_engine.engine_id not in engine_ids_with_prefixes
-            ):
-                # Context-aware engine is preferred
-                best_engine = engine
+        def engine_key(engine: ExecutionEngine):
+            # Context-aware engine is preferred
+            if self.config.ctx_aware:
+                no_prefix = engine.engine_id not in engine_ids_with_prefixes
             else:
-                # Select the best engine (minimizing the negative impacts, i.e. minimizing the decreasing of upperbound)
-                # If the upperbound is not affected, select the engine with the most capacity.
-                if (
-                    engine.get_tasks_num_upperbound()
-                    < best_engine.get_tasks_num_upperbound()
-                ):
-                    best_engine = engine
-                elif (
-                    engine.get_remain_tokens_capacity()
-                    < best_engine.get_remain_tokens_capacity()
-                ):
-                    best_engine = engine
+                no_prefix = False
+            return (no_prefix, self.engine_scorer.score(engine, tasks))
+
+        best_engine = min(engine_list, key=engine_key)
 
         # Dispatch the tasks to the engine
-        assert best_engine is not None
         for task in tasks:
             task.schedule_to(best_engine)
 
@@ -175,63 +308,80 @@ class GlobalScheduler:
             " to GlobalScheduler."
         )
 
-        self.task_queue.append(task)
+        self.task_queue.push(task)
         task.status = TaskStatus.INQUEUE
+        self.wakeup()
         return
 
+    def wakeup(self) -> None:
+        """Notify the scheduler that the scheduling state changes.
+
+        Called when a task is submitted, a task releases its capacity in an engine, or the
+        status of engines changes.
+        """
+
+        self._wakeup_event.set()
+
+    async def wait_wakeup(self) -> None:
+        """Wait until the scheduler is woken up. The wakeup flag is consumed."""
+
+        await self._wakeup_event.wait()
+        self._wakeup_event.clear()
+
     def schedule(self) -> None:
         """Try to schedule all tasks in scheduler's queue."""
 
-        if self.config.app_fifo:
-            # Sort the tasks by the order of depth
-            # The deeper the chain, the higher the priority
-            self.task_queue.sort(key=lambda x: -x.chain.depth)
-
         # NOTE(chaofan): The tasks are sorted by priority, by default.
-        for i, task in enumerate(self.task_queue):
-            if task.is_scheduled:
+        # If critical_path is enabled, the less the slack, the higher the priority.
+        # If app_fifo is enabled, the deeper the chain, the higher the priority.
+        tasks = self.task_queue.ordered_tasks(
+            self.config.app_fifo, self.config.critical_path
+        )
+        positions: Dict[int, int] = {}
+        for i, task in enumerate(tasks):
+            positions[task.task_id] = i
+            self.task_queue.sync_chain_groups(task)
+
+        ordered_buckets: Dict[Tuple, List[int]] = {}
+
+        scheduled_task: List[CompletionTask] = []
+        for task in tasks:
+            # Tasks scheduled with a former group are already removed from the queue.
+            if task not in self.task_queue:
                 continue
 
             # Group tasks in rest queue
-            cur_group: List[CompletionTask] = [task]
-            chain_groups = set(task.chain.chain_groups)
-
-            # Only allow one type of grouping at a time
-            graph_group_enabled = self.config.graph_group
-            ctx_group_enabled = self.config.ctx_group
-
-            if graph_group_enabled or ctx_group_enabled:
-                for j in range(i + 1, len(self.task_queue)):
-                    task_j = self.task_queue[j]
-
-                    # TODO(chaofan): Models match check
-                    models_i = task.chain.metadata.models
-                    models_j = task_j.chain.metadata.models
-
-                    # TODO(chaofan): Criteria match check. Only group tasks with the same criteria.
-
-                    # Graph group check
-                    if graph_group_enabled:
-                        chain_groups_j = set(task_j.chain.chain_groups)
-                        common_groups = chain_groups.intersection(chain_groups_j)
-                        if len(common_groups) > 0:
-                            cur_group.append(task_j)
-                            chain_groups = common_groups
-                            ctx_group_enabled = False  # Use graph group this round
-
-                    # Context group check
-                    if ctx_group_enabled:
-                        if task.chain.first_node.sv == task_j.chain.first_node.sv:
-                            cur_group.append(task_j)
-                            graph_group_enabled = False  # Use context group this round
+            if self.config.graph_group or self.config.ctx_group:
+                # NOTE(chaofan): The checks of engines only get stricter when tasks are
+                # added to a group. So if the task alone fits no engine (e.g. engines
+                # are full), no group led by it does, and we skip building the group.
+                # Otherwise the group is capped by the most tasks an engine can take.
+                engine_list = self._get_engine_list(
+                    [task], task.schedule_annotation.tasks_num_upperbound
+                )
+                if len(engine_list) == 0:
+                    continue
+                max_group_size = max(
+                    min(
+                        engine.get_remain_tasks_capacity(),
+                        engine.get_tasks_num_upperbound() - engine.get_num_tasks(),
+                    )
+                    for engine in engine_list
+                )
+                cur_group = self._group_tasks(
+                    task, tasks, positions, ordered_buckets, max_group_size
+                )
+            else:
+                cur_group = [task]
 
             # Try to find engines for the group
             self._find_engine(cur_group)
 
-        # Update the task queue
-        prev_task_queue = self.task_queue
-        scheduled_task = [task for task in prev_task_queue if task.is_scheduled]
-        self.task_queue = [task for task in prev_task_queue if not task.is_scheduled]
+            # Update the task queue
+            for task_j in cur_group:
+                if task_j.is_scheduled:
+                    self.task_queue.remove(task_j)
+                    scheduled_task.append(task_j)
 
         # Display the scheduled results.
         # NOTE(chaofan): Only display >0 case to reduce the log size.
@@ -4,6 +4,7 @@
 """Annotations in request."""
 
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -18,5 +19,11 @@ class ScheduleAnnotation:
     # with more than this number of tokens.
     tokens_num_upperbound: int = 2048
 
-    # Unimplemented
-    ddl_requirement: float = 0.0
+    # Latency-critical tasks are scheduled before others in the GlobalScheduler, spread
+    # to lightly loaded engines, and their jobs are prioritized in engines.
+    latency_critical: bool = False
+
+    # Deadline (time_counter_in_nanoseconds) of the task. Tasks are scheduled
+    # earliest-deadline-first, and tasks which have missed their deadlines are
+    # deprioritized. None means no deadline.
+    deadline: Optional[int] = None
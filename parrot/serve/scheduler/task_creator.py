@@ -27,6 +27,7 @@ class TaskCreator:
             return ScheduleAnnotation(
                 tasks_num_upperbound=4,
                 tokens_num_upperbound=4096,
+                latency_critical=True,
             )
         elif criteria == PerformanceCriteria.THROUGHPUT:
             return ScheduleAnnotation(
@@ -53,6 +54,7 @@ class TaskCreator:
         # Create a new Task
         task_id = self._task_id_pool.allocate()
         schedule_annotation = self._lower_criteria(completion_chain.criteria)
+        schedule_annotation.deadline = completion_chain.deadline
 
         logger.debug(
             f"Create Task(task_id={task_id}) for CompletionChain(request_id={completion_chain.request_id},"
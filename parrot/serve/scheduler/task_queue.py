@@ -0,0 +1,166 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+from typing import Dict, List, Tuple
+
+from parrot.exceptions import parrot_assert
+from parrot.utils import time_counter_in_nanoseconds
+
+from parrot.serve.graph import CompChainGroup
+
+from .completion_task import CompletionTask
+
+
+# Slack within this ratio of the critical path is ignored, so tasks on nearly equal paths
+# (e.g. the same-sized branches of a map-reduce) are all critical.
+CRITICAL_SLACK_RATIO = 0.05
+
+
+def get_task_slack(task: CompletionTask) -> float:
+    """The slack of the task's chain, with small slack ignored."""
+
+    slack = task.chain.slack
+    if slack <= CRITICAL_SLACK_RATIO * (task.chain.critical_path + slack):
+        return 0.0
+    return slack
+
+
+def is_critical_task(task: CompletionTask) -> bool:
+    """Whether the task is on the critical path of its DAG."""
+
+    return get_task_slack(task) == 0.0
+
+
+class TaskQueue:
+    """The queue of tasks waiting to be scheduled in the GlobalScheduler.
+
+    Besides the queue order, it maintains indexes of tasks by:
+    - The CompChainGroups of the task's chain (for graph group).
+    - The id of the SemanticVariable of the task's first node (for context group).
+
+    So that the group members of a task are found without scanning the whole queue
+    (O(group size)), and a scheduled task is removed in O(1).
+    """
+
+    def __init__(self):
+        # task_id -> task. Python dict keeps the insertion (submission) order.
+        self._tasks: Dict[int, CompletionTask] = {}
+
+        # CompChainGroup -> (task_id -> task)
+        self._chain_group_index: Dict[CompChainGroup, Dict[int, CompletionTask]] = {}
+
+        # task_id -> number of chain groups indexed.
+        # NOTE(chaofan): The chain groups of a chain can grow after the task is submitted,
+        # because a later request may consume the output of this chain. We sync the
+        # index lazily by checking the length (chain groups are only appended).
+        self._indexed_groups_num: Dict[int, int] = {}
+
+        # First node's SV id -> (task_id -> task)
+        self._first_sv_index: Dict[str, Dict[int, CompletionTask]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, task: CompletionTask) -> bool:
+        return task.task_id in self._tasks
+
+    def push(self, task: CompletionTask) -> None:
+        """Push a task to the end of the queue."""
+
+        parrot_assert(task.task_id not in self._tasks, "Task is already in the queue.")
+
+        self._tasks[task.task_id] = task
+
+        self._indexed_groups_num[task.task_id] = 0
+        self.sync_chain_groups(task)
+
+        sv_id = task.chain.first_node.sv.id
+        self._first_sv_index.setdefault(sv_id, {})[task.task_id] = task
+
+    def remove(self, task: CompletionTask) -> None:
+        """Remove a task from the queue and all indexes."""
+
+        parrot_assert(task.task_id in self._tasks, "Task is not in the queue.")
+
+        task_id = task.task_id
+        self._tasks.pop(task_id)
+
+        indexed_groups_num = self._indexed_groups_num.pop(task_id)
+        # NOTE(chaofan): A chain may be in the same group for multiple times, if the
+        # consumer uses the output of this chain multiple times.
+        for chain_group in set(task.chain.chain_groups[:indexed_groups_num]):
+            self._remove_from_index(self._chain_group_index, chain_group, task_id)
+
+        sv_id = task.chain.first_node.sv.id
+        self._remove_from_index(self._first_sv_index, sv_id, task_id)
+
+    def sync_chain_groups(self, task: CompletionTask) -> None:
+        """Index the chain groups which are appended to the task's chain after the
+        task is pushed."""
+
+        chain_groups = task.chain.chain_groups
+        indexed_groups_num = self._indexed_groups_num[task.task_id]
+        if indexed_groups_num == len(chain_groups):
+            return
+
+        for chain_group in chain_groups[indexed_groups_num:]:
+            self._chain_group_index.setdefault(chain_group, {})[task.task_id] = task
+        self._indexed_groups_num[task.task_id] = len(chain_groups)
+
+    def ordered_tasks(
+        self, app_fifo: bool, critical_path: bool = False
+    ) -> List[CompletionTask]:
+        """Get the tasks in the scheduling order.
+
+        Latency-critical tasks are always before the others. Within them, tasks are
+        ordered earliest-deadline-first, tasks without deadlines are after those with, and
+        tasks which have missed their deadlines are deprioritized to the end.
+
+        Args:
+            app_fifo: If True, the deeper the chain, the higher the priority. Tasks with
+                the same depth are in FIFO order.
+            critical_path: If True, the less the slack of the chain (estimated from the
+                critical paths in its chain groups), the higher the priority. Tasks on the
+                critical paths have no slack. It's prior to app_fifo.
+        """
+
+        now = time_counter_in_nanoseconds()
+
+        def deadline_key(task: CompletionTask) -> Tuple[bool, float]:
+            deadline = task.schedule_annotation.deadline
+            if deadline is None:
+                return (False, float("inf"))
+            return (deadline < now, deadline)
+
+        def key(task: CompletionTask) -> Tuple:
+            return (
+                not task.schedule_annotation.latency_critical,
+                deadline_key(task),
+                get_task_slack(task) if critical_path else 0,
+                -task.chain.depth if app_fifo else 0,
+            )
+
+        tasks = list(self._tasks.values())
+        # Stable sort keeps the FIFO order of tasks with the same priority.
+        tasks.sort(key=key)
+        return tasks
+
+    def get_tasks_by_chain_group(
+        self, chain_group: CompChainGroup
+    ) -> Dict[int, CompletionTask]:
+        """Get the tasks (task_id -> task) in the queue whose chains belong to the group."""
+
+        return self._chain_group_index.get(chain_group, {})
+
+    def get_tasks_by_first_sv(self, sv_id: str) -> Dict[int, CompletionTask]:
+        """Get the tasks (task_id -> task) in the queue whose first node is the SV."""
+
+        return self._first_sv_index.get(sv_id, {})
+
+    @staticmethod
+    def _remove_from_index(index: Dict, key, task_id: int) -> None:
+        bucket = index[key]
+        bucket.pop(task_id)
+        if len(bucket) == 0:
+            index.pop(key)
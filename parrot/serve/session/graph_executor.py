@@ -3,7 +3,7 @@
 
 from typing import Optional, Dict
 
-from parrot.utils import get_logger, create_task_in_loop
+from parrot.utils import get_logger, create_task_in_loop, time_counter_in_nanoseconds
 from parrot.exceptions import parrot_assert
 from parrot.protocol.internal.primitive_request import Primitive, Fill, Generate
 from parrot.protocol.internal.layer_apis import FillResponse, GenerateResponse
@@ -61,6 +61,7 @@ class GraphExecutor:
     async def _execute_coroutine(self, completion_chain: CompletionChain) -> None:
         """Coroutine for executing a CompletionChain."""
 
+        task: Optional[CompletionTask] = None
         try:
             # Block until it's activated by a GET.
             await completion_chain.wait_activated()
@@ -72,17 +73,31 @@ class GraphExecutor:
             for node in completion_chain.iter_fill():
                 await node.wait_ready()
 
-            # Tokenize the task.
-            task.tokenize_chain(self.tokenizers_wrapper)
+            # Estimate the tokens num for capacity checks in scheduling. The task is
+            # tokenized after the engine is decided.
+            task.estimate_tokens_num(self.tokenizers_wrapper)
 
             # Submit the task to the scheduler and wait for the task to be scheduled.
             self.scheduler.submit_task(task)
             await task.wait_scheduled()
+
+            # Tokenize the task by the tokenizer of the engine only. Long texts are
+            # tokenized in the worker pool so that they don't block other sessions.
+            if task.engine.requires_token_ids:
+                await task.atokenize_chain(
+                    self.tokenizers_wrapper, [task.engine.tokenizer_name]
+                )
+                task.engine.update_servelayer_runtime_info_task_tokens(task)
         except Exception as e:
             logger.error(
                 f"Error when scheduling chain. (session_id={self.session_id}): {e}"
             )
             self.exception_interrupt(e)
+
+            # Release the capacity taken by the task if it's already scheduled.
+            if task is not None and task.is_scheduled:
+                self.task_creator.free_task(task)
+                self.scheduler.wakeup()
             return
 
         # The task is scheduled. Assign contexts to the task.
@@ -96,6 +111,9 @@ class GraphExecutor:
         self.task_creator.free_task(task)
         self.context_mgr.free_task_contexts(task)
 
+        # The capacity taken by the task is released. Wake up the scheduler.
+        self.scheduler.wakeup()
+
     def exception_interrupt(self, exception: BaseException):
         self.bad_exception = exception
 
@@ -119,6 +137,15 @@ class GraphExecutor:
         parrot_assert(completion_task.is_scheduled, "Task is not scheduled.")
 
         completion_task.status = TaskStatus.EXECUTING
+        # Jobs of latency-critical tasks are prioritized in the engine.
+        latency_critical = completion_task.schedule_annotation.latency_critical
+        deadline = completion_task.schedule_annotation.deadline
+
+        def time_to_deadline() -> Optional[float]:
+            # Engines order jobs by deadlines in their own clocks.
+            if deadline is None:
+                return None
+            return (deadline - time_counter_in_nanoseconds()) / 1e9
 
         type_token_id_flag = completion_task.engine.model_type == ModelType.TOKEN_ID
         if type_token_id_flag:
@@ -147,8 +174,14 @@ class GraphExecutor:
             context.start_event.set()
 
             try:
+                # Pooled connections to the engine.
+                client_session = self.engine_mgr.get_client_session(engine.engine_id)
+                # Fill/Generate primitives to the same engine are coalesced.
+                primitive_batcher = self.engine_mgr.get_primitive_batcher(
+                    engine.engine_id
+                )
+
                 if node.is_gen:
-                    # TODO(chaofan): Add streaming generation support.
                     if type_token_id_flag:
                         # If not ignore_tokenizer_eos, we should add eos_token_id to stop_token_ids
                         if not node.sampling_config.ignore_tokenizer_eos:
@@ -161,6 +194,8 @@ class GraphExecutor:
                         parent_context_id=context.parent_context_id,
                         end_flag=False,
                         sampling_config=node.sampling_config,
+                        latency_critical=latency_critical,
+                        time_to_deadline=time_to_deadline(),
                     )
 
                     logger.debug(
@@ -168,20 +203,44 @@ class GraphExecutor:
                         f"submit Generate primitive. (sampling_config={node.sampling_config})"
                     )
 
-                    resp = await primitive.apost(engine.http_address)
+                    if type_token_id_flag and node.sv.has_stream_readers:
+                        # Stream the generated tokens and detokenize them incrementally,
+                        # so that the partial content is available in the SV before the
+                        # generation finishes. Without readers, the Generate goes
+                        # through the batcher in the binary format instead.
+                        detokenizer = (
+                            self.tokenizers_wrapper.get_incremental_detokenizer(
+                                tokenizer_name
+                            )
+                        )
+                        async for token_id in primitive.astream(
+                            engine.http_address, client_session
+                        ):
+                            node.sv.append_partial(detokenizer.step(token_id))
+                        node.sv.append_partial(detokenizer.flush())
 
-                    if type_token_id_flag:
+                        logger.debug(
+                            f"Task (task_id={completion_task.task_id}, session_id={self.session_id}) "
+                            f"receive Generate primitive's result. (generated_tokens_num={len(detokenizer.token_ids)})"
+                        )
+
+                        # NOTE(chaofan): The content is the streamed text, so the pieces
+                        # read by the readers add up to it.
+                        generated_text = detokenizer.text
+                    elif type_token_id_flag:
+                        resp = await primitive_batcher.submit(primitive)
                         generated_ids = resp.generated_ids
                         logger.debug(
                             f"Task (task_id={completion_task.task_id}, session_id={self.session_id}) "
                             f"receive Generate primitive's result. (generated_tokens_num={len(generated_ids)})"
                         )
 
-                        generated_text = self.tokenizers_wrapper.detokenize(
+                        generated_text = await self.tokenizers_wrapper.adetokenize(
                             token_ids=generated_ids,
                             tokenizer_name=tokenizer_name,
                         )
                     else:
+                        resp = await primitive_batcher.submit(primitive)
                         generated_text = resp.generated_text
 
                         logger.debug(
@@ -217,12 +276,14 @@ class GraphExecutor:
                             parent_context_id=context.parent_context_id,
                             end_flag=False,
                             token_ids=token_ids,
+                            latency_critical=latency_critical,
+                            time_to_deadline=time_to_deadline(),
                         )
                         logger.debug(
                             f"Task (task_id={completion_task.task_id}, session_id={self.session_id}) "
                             f"submit Fill primitive. (tokens_num={len(token_ids)})"
                         )
-                        resp = await primitive.apost(engine.http_address)
+                        resp = await primitive_batcher.submit(primitive)
                     else:
                         text = node.get()
                         primitive = Fill(
@@ -232,12 +293,14 @@ class GraphExecutor:
                             parent_context_id=context.parent_context_id,
                             end_flag=False,
                             text=text,
+                            latency_critical=latency_critical,
+                            time_to_deadline=time_to_deadline(),
                         )
                         logger.debug(
                             f"Task (task={completion_task.task_id}, session_id={self.session_id}) "
                             f"submit Fill primitive. (text_len={len(text)})"
                         )
-                        resp = await primitive.apost(engine.http_address)
+                        resp = await primitive_batcher.submit(primitive)
 
                 context.ready_event.set()
                 logger.debug(f"Context (context_id={context.context_id}) is ready.")
@@ -13,9 +13,11 @@ from parrot.exceptions import ParrotCoreUserError, parrot_assert
 from parrot.serve.graph import (
     ChunkedSemanticCallRequest,
     RequestChain,
+    PerformanceCriteria,
     get_performance_criteria,
     activate_completion_chain,
 )
+from parrot.serve.graph.request import TextChunk
 
 from parrot.serve.backend_repr import Context
 from parrot.serve.scheduler import TaskCreator, GlobalScheduler
@@ -88,6 +90,37 @@ class Session:
 
     # ---------- Internal methods ----------
 
+    def _split_global_prefix(self, chunked_request: ChunkedSemanticCallRequest) -> None:
+        """Feed the first text chunk of the request into the PrefixMatcher, and split it at
+        the detected global prefix.
+
+        The frontend may render arguments into the template directly, so a shared system
+        prompt followed by inlined texts becomes one text chunk. After splitting, the
+        global prefix becomes a separate constant prefix SV which is shared by requests.
+        """
+
+        if not chunked_request.metadata.cache_prefix:
+            return
+
+        if len(chunked_request.body) == 0 or not isinstance(
+            chunked_request.body[0], TextChunk
+        ):
+            return
+
+        prefix_text = chunked_request.body[0].text
+        self.prefix_matcher.add_prefix(prefix_text)
+        split_pos = self.prefix_matcher.query_prefix(prefix_text)
+
+        # Not a global prefix, or the whole chunk is the global prefix.
+        if split_pos == -1 or split_pos >= len(prefix_text):
+            return
+
+        chunked_request.split_prefix_chunk(split_pos)
+        logger.debug(
+            f"Request(request_id={chunked_request.request_id}) splits global prefix at "
+            f"position {split_pos}."
+        )
+
     # ---------- Status Methods ----------
 
     @property
@@ -119,6 +152,7 @@ class Session:
         )
 
         # Prefix matching and splitting.
+        self._split_global_prefix(chunked_request)
 
         # Convert the ChunkedRequest to a RequestChain.
         request_chain = RequestChain.from_chunked_request(chunked_request)
@@ -131,9 +165,12 @@ class Session:
         # Add the request to the executor.
         self.executor.add_request(request_chain=request_chain)
 
-        # If criteria is specified, activate it immediately.
-        if chunked_request.metadata.output_criteria is not None:
-            criteria = chunked_request.metadata.output_criteria
+        # If criteria (or latency budget) is specified, activate it immediately.
+        # A request with a latency budget is latency-critical by default.
+        criteria = chunked_request.metadata.output_criteria
+        if criteria is None and chunked_request.metadata.latency_budget is not None:
+            criteria = PerformanceCriteria.LATENCY
+        if criteria is not None:
             if isinstance(criteria, str):
                 criteria = get_performance_criteria(criteria)
             activate_completion_chain(request_chain.comp_chains[-1], criteria)
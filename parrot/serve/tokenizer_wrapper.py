@@ -2,7 +2,16 @@
 # Licensed under the MIT license.
 
 
-from typing import Dict, List, Union
+import asyncio
+import copy
+import hashlib
+import math
+import multiprocessing
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Union, Optional
 from transformers import AutoTokenizer, PreTrainedTokenizer, PreTrainedTokenizerFast
 
 from parrot.exceptions import parrot_assert
@@ -11,17 +20,252 @@ from parrot.exceptions import parrot_assert
 HFTokenizer = Union[PreTrainedTokenizer, PreTrainedTokenizerFast]
 
 
+class TokenIdsCache:
+    """A bounded LRU cache of tokenized results.
+
+    Keys are stable identities of texts, e.g. ids of content-hashed SVs or content hashes.
+    Each entry maps tokenizer names to token ids, stored compactly as int32 arrays.
+    """
+
+    def __init__(self, max_tokens_num: int):
+        self.max_tokens_num = max_tokens_num
+
+        # cache key -> (tokenizer name -> token ids)
+        self._entries: OrderedDict[str, Dict[str, array]] = OrderedDict()
+        self._tokens_num = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def tokens_num(self) -> int:
+        return self._tokens_num
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def get(self, cache_key: str, tokenizer_name: str) -> Optional[List[int]]:
+        entry = self._entries.get(cache_key)
+        if entry is None or tokenizer_name not in entry:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(cache_key)
+        return entry[tokenizer_name].tolist()
+
+    def put(self, cache_key: str, tokenizer_name: str, token_ids: List[int]) -> None:
+        if cache_key not in self._entries:
+            self._entries[cache_key] = {}
+        entry = self._entries[cache_key]
+        self._entries.move_to_end(cache_key)
+
+        if tokenizer_name in entry:
+            return
+        entry[tokenizer_name] = array("i", token_ids)
+        self._tokens_num += len(token_ids)
+
+        # Evict the least recently used entries.
+        while self._tokens_num > self.max_tokens_num and len(self._entries) > 1:
+            _, evicted_entry = self._entries.popitem(last=False)
+            self._tokens_num -= sum(len(ids) for ids in evicted_entry.values())
+
+    def get_tokens_num(self, cache_key: str, tokenizer_name: str) -> Optional[int]:
+        """Get the number of cached token ids, without counting it as an access."""
+
+        entry = self._entries.get(cache_key)
+        if entry is None or tokenizer_name not in entry:
+            return None
+        return len(entry[tokenizer_name])
+
+    def evict(self, cache_key: str) -> None:
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._tokens_num -= sum(len(ids) for ids in entry.values())
+
+    def evict_tokenizer(self, tokenizer_name: str) -> None:
+        for entry in self._entries.values():
+            token_ids = entry.pop(tokenizer_name, None)
+            if token_ids is not None:
+                self._tokens_num -= len(token_ids)
+
+
+# ---------- Worker Functions ----------
+
+
+def _batch_encode(tokenizer: HFTokenizer, texts: List[str]) -> List[List[int]]:
+    return tokenizer(texts, add_special_tokens=False)["input_ids"]
+
+
+def _decode(tokenizer: HFTokenizer, token_ids: List[int]) -> str:
+    return tokenizer.decode(
+        token_ids,
+        skip_special_tokens=True,
+        spaces_between_special_tokens=False,
+        clean_up_tokenization_spaces=False,
+    )
+
+
+# Copies of tokenizers in the worker thread (for the thread pool), keyed by the id of
+# the shared tokenizer. A HF fast tokenizer can't be used by several threads at once:
+# the Rust object raises "Already borrowed" when one thread changes its state (e.g. the
+# truncation / padding) while another one is encoding.
+_thread_local = threading.local()
+
+
+def _get_thread_tokenizer(tokenizer: HFTokenizer) -> HFTokenizer:
+    if not hasattr(_thread_local, "tokenizers"):
+        _thread_local.tokenizers = {}
+
+    # Keep the shared tokenizer in the entry, so that its id is not reused.
+    entry = _thread_local.tokenizers.get(id(tokenizer))
+    if entry is None:
+        entry = (tokenizer, copy.deepcopy(tokenizer))
+        _thread_local.tokenizers[id(tokenizer)] = entry
+    return entry[1]
+
+
+def _thread_batch_encode(tokenizer: HFTokenizer, texts: List[str]) -> List[List[int]]:
+    return _batch_encode(_get_thread_tokenizer(tokenizer), texts)
+
+
+def _thread_decode(tokenizer: HFTokenizer, token_ids: List[int]) -> str:
+    return _decode(_get_thread_tokenizer(tokenizer), token_ids)
+
+
+# Tokenizers loaded in the worker process (for the process pool).
+_worker_tokenizers: Dict[str, HFTokenizer] = {}
+
+
+def _get_worker_tokenizer(tokenizer_name: str) -> HFTokenizer:
+    if tokenizer_name not in _worker_tokenizers:
+        _worker_tokenizers[tokenizer_name] = AutoTokenizer.from_pretrained(
+            tokenizer_name
+        )
+    return _worker_tokenizers[tokenizer_name]
+
+
+def _worker_batch_encode(tokenizer_name: str, texts: List[str]) -> List[List[int]]:
+    return _batch_encode(_get_worker_tokenizer(tokenizer_name), texts)
+
+
+def _worker_decode(tokenizer_name: str, token_ids: List[int]) -> str:
+    return _decode(_get_worker_tokenizer(tokenizer_name), token_ids)
+
+
+class IncrementalDetokenizer:
+    """Detokenize a stream of token ids incrementally.
+
+    Decoding a single token is not enough: a token may be part of a multi-byte character,
+    and the decoded text of a token may depend on the previous ones (e.g. the leading
+    space in SentencePiece). So we decode a small window of tokens (the last emitted
+    tokens and the pending ones) and emit the new text after the already emitted part,
+    once it's complete.
+    """
+
+    def __init__(self, tokenizer: HFTokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids: List[int] = []
+        # The emitted text.
+        self.text = ""
+
+        # token_ids[prefix_offset:read_offset] is the context of the window, whose text
+        # is already emitted. token_ids[read_offset:] is not emitted yet.
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def _emit(self, final: bool) -> str:
+        prefix_text = _decode(
+            self.tokenizer, self.token_ids[self._prefix_offset : self._read_offset]
+        )
+        new_text = _decode(self.tokenizer, self.token_ids[self._prefix_offset :])
+
+        # An incomplete character. Wait for more tokens, unless the stream ends.
+        if len(new_text) <= len(prefix_text) or (
+            not final and new_text.endswith("\ufffd")
+        ):
+            return ""
+
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.token_ids)
+        text = new_text[len(prefix_text) :]
+        self.text += text
+        return text
+
+    def step(self, token_id: int) -> str:
+        """Add a token id. Returns the newly decoded text (may be empty)."""
+
+        self.token_ids.append(token_id)
+        return self._emit(final=False)
+
+    def flush(self) -> str:
+        """End the stream. Returns the pending text (may be empty or incomplete)."""
+
+        return self._emit(final=True)
+
+
 class TokenizersWrapper:
     """TokenizersWrapper wraps a unified interface to tokenize/detokenize text.
 
     Different engines in OS may use different tokenizers, which are stored as a
     dictionary in this manager.
+
+    The async APIs (atokenize_batch, adetokenize) run large jobs in a worker pool so
+    that they don't block the event loop of ServeCore:
+    - "thread": A thread pool. HF fast tokenizers release the GIL in the Rust code. Each
+        worker thread uses its own copies of the tokenizers.
+    - "process": A process pool for slow (Python) tokenizers. Each worker process loads
+        the tokenizers by names.
     """
 
-    def __init__(self):
+    # Texts shorter than this (in total) are tokenized inline. Offloading them costs more
+    # than tokenizing.
+    _OFFLOAD_MIN_CHARS = 4096
+    # Token ids shorter than this are detokenized inline.
+    _OFFLOAD_MIN_TOKENS = 1024
+    # Tokens per character used in estimation before any text is tokenized. Slightly
+    # overestimated (English text is ~0.25 for common tokenizers) to be safe in capacity.
+    _DEFAULT_TOKENS_PER_CHAR = 0.3
+
+    def __init__(
+        self,
+        cache_max_tokens_num: int = 16 * 1024 * 1024,
+        workers_num: int = 4,
+        pool_type: str = "thread",
+    ):
+        parrot_assert(
+            pool_type in ["thread", "process"], f"Unknown pool type: {pool_type}."
+        )
+
         # Map from tokenizer name to tokenizer object
         self.tokenizers: Dict[str, HFTokenizer] = {}
 
+        # Cache of tokenized results of frequently used texts (e.g. constant prefixes).
+        self.token_ids_cache = TokenIdsCache(max_tokens_num=cache_max_tokens_num)
+
+        # Observed (chars num, tokens num) of each tokenizer, for estimating tokens num.
+        self._observed_chars_num: Dict[str, int] = {}
+        self._observed_tokens_num: Dict[str, int] = {}
+
+        # Statistics: number of texts actually encoded by each tokenizer.
+        self.encoded_texts_num: Dict[str, int] = {}
+
+        self.pool_type = pool_type
+        if pool_type == "thread":
+            self._executor: Executor = ThreadPoolExecutor(
+                max_workers=workers_num, thread_name_prefix="parrot_tokenizer"
+            )
+        else:
+            # NOTE(chaofan): Use "spawn" because forking a process with running threads
+            # (e.g. the thread pool of Rust tokenizers) may deadlock.
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers_num,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
     def register_tokenizer(self, tokenizer_name: str):
         """Register a new tokenizer in the server."""
 
@@ -38,6 +282,9 @@ class TokenizersWrapper:
             f"Tokenizer {tokenizer_name} does not exist.",
         )
         self.tokenizers.pop(tokenizer_name)
+        self.token_ids_cache.evict_tokenizer(tokenizer_name)
+        self._observed_chars_num.pop(tokenizer_name, None)
+        self._observed_tokens_num.pop(tokenizer_name, None)
 
     def get_tokenizer(self, tokenizer_name: str):
         parrot_assert(
@@ -47,24 +294,92 @@ class TokenizersWrapper:
 
         return self.tokenizers[tokenizer_name]
 
+    def _record_encoded(self, tokenizer_name: str, text: str, tokens_num: int) -> None:
+        self._observed_chars_num[tokenizer_name] = (
+            self._observed_chars_num.get(tokenizer_name, 0) + len(text)
+        )
+        self._observed_tokens_num[tokenizer_name] = (
+            self._observed_tokens_num.get(tokenizer_name, 0) + tokens_num
+        )
+        self.encoded_texts_num[tokenizer_name] = (
+            self.encoded_texts_num.get(tokenizer_name, 0) + 1
+        )
+
+    def estimate_tokens_num(
+        self, text: str, tokenizer_name: str, cache_key: Optional[str] = None
+    ) -> int:
+        """Estimate the number of tokens of a text without tokenizing it.
+
+        If the text is cached, returns the exact number. Otherwise, the number is
+        estimated by the tokens-per-char ratio observed from this tokenizer.
+        """
+
+        if cache_key is not None:
+            tokens_num = self.token_ids_cache.get_tokens_num(cache_key, tokenizer_name)
+            if tokens_num is not None:
+                return tokens_num
+
+        chars_num = self._observed_chars_num.get(tokenizer_name, 0)
+        if chars_num == 0:
+            tokens_per_char = self._DEFAULT_TOKENS_PER_CHAR
+        else:
+            tokens_per_char = self._observed_tokens_num[tokenizer_name] / chars_num
+        return math.ceil(len(text) * tokens_per_char)
+
     # NOTE(chaofan): Ignore special tokens because we chunk the inputs.
 
-    def tokenize(self, text: str, tokenizer_name: str) -> List[int]:
-        """Tokenize a text using a specific tokenizer."""
+    @staticmethod
+    def get_content_cache_key(text: str) -> str:
+        """Get the cache key of a text by its content."""
+
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def tokenize(
+        self, text: str, tokenizer_name: str, cache_key: Optional[str] = None
+    ) -> List[int]:
+        """Tokenize a text using a specific tokenizer.
+
+        Args:
+            text: The text to be tokenized.
+            tokenizer_name: The name of the tokenizer.
+            cache_key: If not None, the result is cached with this key. The key must
+                identify the content of the text.
+        """
+
+        if cache_key is not None:
+            token_ids = self.token_ids_cache.get(cache_key, tokenizer_name)
+            if token_ids is not None:
+                return token_ids
 
         tokenizer = self.get_tokenizer(tokenizer_name)
-        return tokenizer.encode(text, add_special_tokens=False)
+        token_ids = tokenizer.encode(text, add_special_tokens=False)
+        self._record_encoded(tokenizer_name, text, len(token_ids))
+
+        if cache_key is not None:
+            self.token_ids_cache.put(cache_key, tokenizer_name, token_ids)
+        return token_ids
+
+    def evict_cache(self, cache_key: str) -> None:
+        """Evict the cached tokenized results of a key."""
+
+        self.token_ids_cache.evict(cache_key)
 
-    def tokenize_all(self, text: str) -> Dict[str, List[int]]:
+    def tokenize_all(
+        self, text: str, cache_key: Optional[str] = None
+    ) -> Dict[str, List[int]]:
         """Tokenize a text using all tokenizers.
 
+        Args:
+            text: The text to be tokenized.
+            cache_key: If not None, the results are cached with this key.
+
         Returns:
             A dictionary from tokenizer name to token ids.
         """
 
         result = {}
         for tokenizer_name in self.tokenizers:
-            result[tokenizer_name] = self.tokenize(text, tokenizer_name)
+            result[tokenizer_name] = self.tokenize(text, tokenizer_name, cache_key)
         return result
 
     def detokenize(
@@ -73,9 +388,88 @@ class TokenizersWrapper:
         tokenizer_name: str,
     ) -> str:
         tokenizer = self.get_tokenizer(tokenizer_name)
-        return tokenizer.decode(
-            token_ids,
-            skip_special_tokens=True,
-            spaces_between_special_tokens=False,
-            clean_up_tokenization_spaces=False,
+        return _decode(tokenizer, token_ids)
+
+    def get_incremental_detokenizer(
+        self, tokenizer_name: str
+    ) -> IncrementalDetokenizer:
+        """Get an incremental detokenizer for streaming generation."""
+
+        return IncrementalDetokenizer(self.get_tokenizer(tokenizer_name))
+
+    # ---------- Async APIs ----------
+
+    async def _abatch_encode(
+        self, texts: List[str], tokenizer_name: str
+    ) -> List[List[int]]:
+        tokenizer = self.get_tokenizer(tokenizer_name)
+        if sum(len(text) for text in texts) < self._OFFLOAD_MIN_CHARS:
+            return _batch_encode(tokenizer, texts)
+
+        loop = asyncio.get_running_loop()
+        if self.pool_type == "thread":
+            return await loop.run_in_executor(
+                self._executor, _thread_batch_encode, tokenizer, texts
+            )
+        return await loop.run_in_executor(
+            self._executor, _worker_batch_encode, tokenizer_name, texts
+        )
+
+    async def atokenize_batch(
+        self,
+        texts: List[str],
+        tokenizer_name: str,
+        cache_keys: Optional[List[Optional[str]]] = None,
+    ) -> List[List[int]]:
+        """Tokenize a batch of texts using a specific tokenizer, without blocking the
+        event loop. Uncached texts are encoded together in one batch.
+
+        Args:
+            texts: The texts to be tokenized.
+            tokenizer_name: The name of the tokenizer.
+            cache_keys: The cache keys of the texts (None for not caching).
+        """
+
+        if cache_keys is None:
+            cache_keys = [None] * len(texts)
+        parrot_assert(len(cache_keys) == len(texts), "Cache keys mismatch texts.")
+
+        results: List[Optional[List[int]]] = [None] * len(texts)
+        miss_indices = []
+        for i, cache_key in enumerate(cache_keys):
+            if cache_key is not None:
+                results[i] = self.token_ids_cache.get(cache_key, tokenizer_name)
+            if results[i] is None:
+                miss_indices.append(i)
+
+        if len(miss_indices) > 0:
+            token_ids_list = await self._abatch_encode(
+                [texts[i] for i in miss_indices], tokenizer_name
+            )
+            for i, token_ids in zip(miss_indices, token_ids_list):
+                results[i] = token_ids
+                self._record_encoded(tokenizer_name, texts[i], len(token_ids))
+                if cache_keys[i] is not None:
+                    self.token_ids_cache.put(cache_keys[i], tokenizer_name, token_ids)
+
+        return results
+
+    async def adetokenize(
+        self,
+        token_ids: List[int],
+        tokenizer_name: str,
+    ) -> str:
+        """Detokenize the token ids without blocking the event loop."""
+
+        tokenizer = self.get_tokenizer(tokenizer_name)
+        if len(token_ids) < self._OFFLOAD_MIN_TOKENS:
+            return _decode(tokenizer, token_ids)
+
+        loop = asyncio.get_running_loop()
+        if self.pool_type == "thread":
+            return await loop.run_in_executor(
+                self._executor, _thread_decode, tokenizer, token_ids
+            )
+        return await loop.run_in_executor(
+            self._executor, _worker_decode, tokenizer_name, token_ids
         )
@@ -12,9 +12,10 @@ start the OS server at: http://localhost:9000
 
 import asyncio
 import argparse
+from typing import Dict, Optional
 from dataclasses import asdict
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 import uvicorn
 from uvicorn import Config, Server
 import time
@@ -27,6 +28,15 @@ from parrot.constants import (
 )
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.protocol.internal.layer_apis import register_engine, engine_heartbeat
+from parrot.protocol.wire_format import (
+    BINARY_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    accepts_binary,
+    decode_payload,
+    encode_binary,
+    encode_payload,
+    encode_frame,
+)
 from parrot.utils import get_logger, create_task_in_loop
 
 # ---------- Constants ----------
@@ -86,15 +96,12 @@ def fake_engine_daemon():
         time.sleep(TESTING_ENGINE_HEARTBEAT_INTERVAL)
 
 
-@app.post("/fill")
-async def fill(request: Request):
+def _fill(payload: Dict) -> Dict:
     global num_running_jobs
     global num_cached_tokens
 
     num_running_jobs += 1
 
-    payload = await request.json()
-
     token_ids = payload["token_ids"]
     text = payload["text"]
 
@@ -121,13 +128,11 @@ async def fill(request: Request):
     }
 
 
-@app.post("/generate")
-async def generate(request: Request):
+def _generate(payload: Dict) -> Dict:
     global num_running_jobs
     global num_cached_tokens
 
     num_running_jobs += 1
-    payload = await request.json()
 
     gen_len = min(45, int(np.random.exponential(32) + 3))
 
@@ -144,6 +149,61 @@ async def generate(request: Request):
     }
 
 
+def _make_response(request: Request, resp: Dict):
+    if accepts_binary(request.headers.get("accept")):
+        return Response(
+            content=encode_binary(resp, ["generated_ids"]),
+            media_type=BINARY_CONTENT_TYPE,
+        )
+    return resp
+
+
+@app.post("/fill")
+async def fill(request: Request):
+    payload = decode_payload(request.headers.get("content-type"), await request.body())
+    return _fill(payload)
+
+
+@app.post("/generate")
+async def generate(request: Request):
+    payload = decode_payload(request.headers.get("content-type"), await request.body())
+    return _make_response(request, _generate(payload))
+
+
+@app.post("/primitives_batch")
+async def primitives_batch(request: Request):
+    payload = decode_payload(request.headers.get("content-type"), await request.body())
+    binary = accepts_binary(request.headers.get("accept"))
+
+    # Simulate the primitives concurrently, and stream each result when it's done.
+    async def _run(index: int, item: Dict):
+        try:
+            if item["primitive"] == "fill":
+                result = await asyncio.to_thread(_fill, item)
+            elif item["primitive"] == "generate":
+                result = await asyncio.to_thread(_generate, item)
+            else:
+                raise ValueError(f"Unknown primitive: {item['primitive']}")
+        except Exception as e:
+            result = {"error": repr(e)}
+        return index, result
+
+    async def _stream_results():
+        tasks = [
+            asyncio.ensure_future(_run(i, item))
+            for i, item in enumerate(payload["primitives"])
+        ]
+        for next_done in asyncio.as_completed(tasks):
+            index, result = await next_done
+            body = encode_payload(dict(result, index=index), ["generated_ids"], binary)
+            yield encode_frame(body)
+
+    return StreamingResponse(
+        _stream_results(),
+        media_type=BINARY_CONTENT_TYPE if binary else JSON_CONTENT_TYPE,
+    )
+
+
 @app.post("/generate_stream")
 async def generate_stream(request: Request):
     global num_running_jobs
@@ -191,6 +251,27 @@ async def free_context(request: Request):
     }
 
 
+@app.post("/free_contexts")
+async def free_contexts(request: Request):
+    global num_cached_tokens
+
+    payload = await request.json()
+
+    context_len = 0
+
+    for context_id in payload["context_ids"]:
+        if context_id in context_len_map:
+            num_cached_tokens -= context_len_map[context_id]
+            context_len += context_len_map[context_id]
+
+    return {
+        "freed_context_ids": payload["context_ids"],
+        "context_len": context_len,
+        "failed_context_ids": [],
+        "errors": [],
+    }
+
+
 @app.post("/ping")
 async def ping(request: Request):
     global num_running_jobs
@@ -22,9 +22,6 @@ from parrot.constants import (
     DEFAULT_ENGINE_SERVER_PORT,
 )
 
-from parrot.serve.http_server import start_server as start_core_server
-from parrot.engine.http_server import start_server as start_engine_server
-
 from .get_configs import get_sample_engine_config_path, get_sample_core_config_path
 from .fake_engine_server import app as FakeEngineApp
 from .fake_core_server import app as FakeCoreApp
@@ -88,7 +85,13 @@ def fake_engine_server():
     time.sleep(0.1)
 
 
+# NOTE(chaofan): The real servers are imported in their processes, so the fake servers
+# can be used without the dependencies of the builtin engine (e.g. its kernels).
+
+
 def _launch_core():
+    from parrot.serve.http_server import start_server as start_core_server
+
     core_config_path = get_sample_core_config_path("localhost_serve_core.json")
     release_mode = False
 
@@ -108,6 +111,8 @@ def core_server():
 
 
 def _launch_engine(engine_config_name: str, connect_to_core: bool, override_args: Dict):
+    from parrot.engine.http_server import start_server as start_engine_server
+
     engine_config_path = get_sample_engine_config_path(engine_config_name)
     start_engine_server(
         engine_config_path=engine_config_path,
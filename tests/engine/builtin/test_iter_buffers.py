@@ -0,0 +1,92 @@
+from parrot.engine.builtin.iter_buffers import DecodeMetadataBuffers
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+BLOCK_SIZE = 4
+
+
+def _check(meta_buffers, contexts, skip_blocks=0, skip_len=0):
+    for context in contexts:
+        context.allocate(1)
+    block_tables, context_lens, slot_mapping = meta_buffers.update(
+        contexts, skip_blocks=skip_blocks, skip_len=skip_len
+    )
+
+    tables = [
+        context.get_context_block_table()[skip_blocks:].tolist() for context in contexts
+    ]
+    width = max(max(len(table) for table in tables), 1)
+    assert block_tables.tolist() == [
+        table + [0] * (width - len(table)) for table in tables
+    ]
+    assert context_lens.tolist() == [
+        context.get_context_len() - skip_len for context in contexts
+    ]
+    assert slot_mapping.tolist() == [
+        context.get_context_slot_ids(1).item() for context in contexts
+    ]
+
+
+def test_decode_metadata_buffers():
+    allocator = BlockAllocator("test pool", num_blocks=256)
+    meta_buffers = DecodeMetadataBuffers(
+        BLOCK_SIZE, "cpu", max_num_seqs=2, max_num_blocks_per_seq=2
+    )
+
+    prefix = BlockContext(0, None, kv_cache_manager=allocator, block_size=BLOCK_SIZE)
+    prefix.allocate(6)
+    contexts = [
+        BlockContext(i + 1, prefix, kv_cache_manager=allocator, block_size=BLOCK_SIZE)
+        for i in range(3)
+    ]
+
+    # Steady decoding (the buffers grow).
+    for _ in range(10):
+        _check(meta_buffers, contexts)
+
+    # A sequence leaves; a new one joins; the order changes.
+    new_context = BlockContext(
+        4, prefix, kv_cache_manager=allocator, block_size=BLOCK_SIZE
+    )
+    contexts = [contexts[2], new_context, contexts[0]]
+    for _ in range(5):
+        _check(meta_buffers, contexts)
+
+    # The blocks of a sequence are rewritten (e.g. swapped in).
+    contexts[0].release_blocks()
+    others = allocator.allocate_n(4)
+    contexts[0].reallocate_blocks()
+    allocator.free_many(others)
+    _check(meta_buffers, contexts)
+
+    # Skip the shared prefix.
+    for _ in range(3):
+        _check(meta_buffers, contexts, skip_blocks=2, skip_len=8)
+
+    # A Fill-only iteration keeps the rows.
+    block_tables, _, _ = meta_buffers.update([])
+    assert block_tables.shape == (0, 0)
+    _check(meta_buffers, contexts, skip_blocks=2, skip_len=8)
+
+    # Changing the skipped blocks doesn't rewrite the rows.
+    row_table_versions = list(meta_buffers.row_table_versions)
+    for skip_blocks in [0, 2, 1]:
+        _check(
+            meta_buffers, contexts, skip_blocks=skip_blocks, skip_len=skip_blocks * 4
+        )
+    assert meta_buffers.row_table_versions == row_table_versions
+
+    # The row of a freed context is dropped, and not reused by a new context.
+    freed = contexts.pop(1)
+    meta_buffers.drop_context(freed)
+    freed.destruction()
+    assert all(context is not freed for context in meta_buffers.row_contexts)
+    contexts.append(
+        BlockContext(5, prefix, kv_cache_manager=allocator, block_size=BLOCK_SIZE)
+    )
+    _check(meta_buffers, contexts)
+
+
+if __name__ == "__main__":
+    test_decode_metadata_buffers()
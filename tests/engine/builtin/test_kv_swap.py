@@ -0,0 +1,269 @@
+import torch
+from types import SimpleNamespace
+
+from parrot.engine.builtin.kv_swap import KVSwapManager, make_recompute_fill
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.context.block_context import BlockContext
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.context_manager import EngineContextManager
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+
+
+NUM_LAYERS = 2
+NUM_BLOCKS = 16
+BLOCK_SIZE = 4
+
+
+def _make_cache():
+    # Block layout: [num_layers, num_blocks, num_heads, head_size, block_size]
+    k_cache = torch.zeros([NUM_LAYERS, NUM_BLOCKS, 2, 8, BLOCK_SIZE], device="cpu")
+    v_cache = torch.zeros([NUM_LAYERS, NUM_BLOCKS, 2, 8, BLOCK_SIZE], device="cpu")
+    kv_cache_manager = BlockAllocator("KVCache pool", num_blocks=NUM_BLOCKS)
+    return k_cache, v_cache, kv_cache_manager
+
+
+def _make_context(context_id, kv_cache_manager, k_cache, v_cache, num_tokens):
+    context = BlockContext(
+        context_id, None, kv_cache_manager=kv_cache_manager, block_size=BLOCK_SIZE
+    )
+    context.token_ids.extend(range(num_tokens))
+    context.allocate(num_tokens)
+    for block_id in context.get_own_block_ids():
+        k_cache[:, block_id] = torch.randn(k_cache[:, block_id].shape)
+        v_cache[:, block_id] = torch.randn(v_cache[:, block_id].shape)
+    return context
+
+
+def test_swap_out_in():
+    k_cache, v_cache, kv_cache_manager = _make_cache()
+    # CPU cache: Swap to a memory-mapped file.
+    swap_manager = KVSwapManager(
+        k_cache,
+        v_cache,
+        kv_cache_manager,
+        block_size=BLOCK_SIZE,
+        preempt_mode="swap",
+        num_swap_blocks=8,
+    )
+
+    context = _make_context(0, kv_cache_manager, k_cache, v_cache, num_tokens=10)
+    block_ids = context.get_own_block_ids()
+    k_data = k_cache[:, block_ids].clone()
+    v_data = v_cache[:, block_ids].clone()
+
+    assert swap_manager.evict(context) == "swap"
+    assert not context.is_resident
+    assert kv_cache_manager.get_allocated_num() == 0
+    assert context.get_context_len() == 10
+
+    # The released blocks are reused and overwritten.
+    other = _make_context(1, kv_cache_manager, k_cache, v_cache, num_tokens=12)
+
+    swap_manager.swap_in(context)
+    assert context.is_resident
+    assert len(swap_manager.free_slots) == 8
+    new_block_ids = context.get_own_block_ids()
+    assert set(new_block_ids).isdisjoint(other.get_own_block_ids())
+    assert torch.equal(k_cache[:, new_block_ids], k_data)
+    assert torch.equal(v_cache[:, new_block_ids], v_data)
+    assert context.get_context_slot_ids().tolist() == [
+        new_block_ids[i // BLOCK_SIZE] * BLOCK_SIZE + i % BLOCK_SIZE for i in range(10)
+    ]
+
+
+def test_preempt_mode_choice():
+    k_cache, v_cache, kv_cache_manager = _make_cache()
+    swap_manager = KVSwapManager(
+        k_cache,
+        v_cache,
+        kv_cache_manager,
+        block_size=BLOCK_SIZE,
+        preempt_mode="auto",
+        num_swap_blocks=2,
+        # Recomputing is cheaper than swapping.
+        swap_bandwidth=1e-9,
+    )
+
+    context = _make_context(0, kv_cache_manager, k_cache, v_cache, num_tokens=6)
+    # A pending generated token, not in the KV cache yet.
+    context.push_token_id(100)
+    assert swap_manager.evict(context) == "recompute"
+    assert kv_cache_manager.get_allocated_num() == 0
+    assert context.recompute_token_ids == list(range(6))
+    # Refilled from empty by the recompute Fill.
+    assert context.get_context_len() == 0
+    assert context.token_ids == []
+
+    # A context with sub-contexts holds its blocks.
+    parent = _make_context(1, kv_cache_manager, k_cache, v_cache, num_tokens=4)
+    BlockContext(2, parent, kv_cache_manager=kv_cache_manager, block_size=BLOCK_SIZE)
+    assert swap_manager.evict(parent) == "hold"
+
+    # Swapping is cheaper, but there are not enough swap slots.
+    swap_manager.swap_bandwidth = 1e9
+    context = _make_context(3, kv_cache_manager, k_cache, v_cache, num_tokens=8)
+    assert swap_manager.evict(context) == "swap"
+    context = _make_context(4, kv_cache_manager, k_cache, v_cache, num_tokens=8)
+    assert swap_manager.evict(context) == "recompute"
+
+
+def _run_iter(jobs):
+    # What the runner does.
+    for job in jobs:
+        context = job.context
+        if isinstance(job, Fill):
+            token_ids = job.get_iter_token_ids()
+            context.token_ids.extend(token_ids)
+            context.allocate(len(token_ids))
+            context.last_hidden_state = torch.zeros(1)
+            if job.finish_iter():
+                if job.is_recompute:
+                    context.finish_recompute()
+                job.finish_event.set()
+        else:
+            context.allocate(1)
+            context.push_token_id(200 + context.get_context_len())
+
+
+def test_recompute_then_decode():
+    k_cache, v_cache, kv_cache_manager = _make_cache()
+    swap_manager = KVSwapManager(
+        k_cache,
+        v_cache,
+        kv_cache_manager,
+        block_size=BLOCK_SIZE,
+        preempt_mode="recompute",
+    )
+    config = SchedulerConfig(
+        max_batch_size=4, max_num_batched_tokens=4, max_total_tokens=1000
+    )
+    scheduler = EngineScheduler(config, fill_chunk_size=4)
+
+    context = _make_context(0, kv_cache_manager, k_cache, v_cache, num_tokens=6)
+    context.push_token_id(100)  # Pending
+    gen_job = Generate(
+        session_id=0,
+        task_id=0,
+        context_id=0,
+        parent_context_id=-1,
+        sampling_config=SamplingConfig(),
+    )
+    gen_job.context = context
+    scheduler.add_job(gen_job)
+    assert scheduler.schedule() == [gen_job]
+    _run_iter([gen_job])
+    scheduler.finish()
+    token_ids = list(context.token_ids)
+    assert context.get_context_len() == 7
+
+    # Preempted: What the engine does.
+    scheduler.max_total_tokens = 4
+    assert scheduler.schedule() == []
+    assert scheduler.preempted_jobs == [gen_job]
+    assert swap_manager.evict(context) == "recompute"
+    scheduler.add_recompute_job(gen_job, make_recompute_fill(gen_job))
+    assert kv_cache_manager.get_allocated_num() == 0
+
+    # The recompute Fill is scheduled in place of the job, in chunks under the token
+    # budget. The job is held until it finishes.
+    scheduler.max_total_tokens = 1000
+    for num_tokens in [4, 3]:
+        jobs = scheduler.schedule()
+        assert len(jobs) == 1 and jobs[0].is_recompute
+        assert jobs[0].iter_num_tokens == num_tokens
+        _run_iter(jobs)
+        scheduler.finish()
+    assert context.is_resident
+    assert context.token_ids == token_ids
+    assert context.get_context_len() == 7
+
+    # Then the job decodes, from the pending token.
+    for _ in range(3):
+        assert scheduler.schedule() == [gen_job]
+        _run_iter([gen_job])
+        scheduler.finish()
+    assert context.get_context_len() == 10
+    assert context.token_ids == token_ids + [208, 209, 210]
+    assert len(context.get_own_block_ids()) == 3
+
+
+def test_defer_jobs_of_released_parent():
+    # NOTE: Imported here since the builtin engine needs the CUDA kernels.
+    from parrot.engine.builtin.builtin_engine import BuiltinEngine
+
+    k_cache, v_cache, kv_cache_manager = _make_cache()
+    swap_manager = KVSwapManager(
+        k_cache,
+        v_cache,
+        kv_cache_manager,
+        block_size=BLOCK_SIZE,
+        preempt_mode="recompute",
+    )
+
+    # What the engine loop uses, without a model.
+    engine = BuiltinEngine.__new__(BuiltinEngine)
+    engine.runner = SimpleNamespace(
+        context_manager=EngineContextManager(),
+        kv_cache_manager=kv_cache_manager,
+        restore_contexts=swap_manager.swap_in,
+    )
+    engine.builtin_config = SimpleNamespace(block_size=BLOCK_SIZE)
+    engine.scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=8, max_num_batched_tokens=64, max_total_tokens=1000
+        )
+    )
+    engine.deferred_jobs = []
+
+    context_map = engine.runner.context_manager.map
+    parent = _make_context(0, kv_cache_manager, k_cache, v_cache, num_tokens=6)
+    other_parent = _make_context(1, kv_cache_manager, k_cache, v_cache, num_tokens=6)
+    context_map[0] = parent
+    context_map[1] = other_parent
+    # The parent is being recomputed.
+    assert swap_manager.evict(parent) == "recompute"
+
+    def make_fill(context_id, parent_context_id):
+        return Fill(
+            session_id=0,
+            task_id=context_id,
+            context_id=context_id,
+            parent_context_id=parent_context_id,
+            token_ids=[1, 2, 3],
+        )
+
+    child_fill = make_fill(2, 0)
+    child_gen = Generate(
+        session_id=0,
+        task_id=2,
+        context_id=2,
+        parent_context_id=0,
+        sampling_config=SamplingConfig(),
+    )
+    unrelated_fill = make_fill(3, 1)
+    new_fill = make_fill(4, -1)
+    for job in [child_fill, child_gen, unrelated_fill, new_fill]:
+        engine._add_job(job)
+
+    # Only the jobs of the released parent wait. The unrelated jobs are bound at once.
+    assert engine.deferred_jobs == [child_fill, child_gen]
+    assert list(engine.scheduler.waiting_jobs) == [unrelated_fill, new_fill]
+    assert unrelated_fill.context.parent_context is other_parent
+    engine._bind_deferred_jobs()
+    assert engine.deferred_jobs == [child_fill, child_gen]
+
+    # The recompute Fill finishes: The jobs of the parent are bound in order.
+    parent.recompute_token_ids = None
+    engine._bind_deferred_jobs()
+    assert engine.deferred_jobs == []
+    assert list(engine.scheduler.waiting_jobs)[-2:] == [child_fill, child_gen]
+    assert child_fill.context is child_gen.context
+
+
+if __name__ == "__main__":
+    test_swap_out_in()
+    test_preempt_mode_choice()
+    test_recompute_then_decode()
+    # test_defer_jobs_of_released_parent()
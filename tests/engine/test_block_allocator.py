@@ -0,0 +1,110 @@
+import pytest
+
+from parrot.exceptions import ParrotError
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+def test_block_allocator():
+    allocator = BlockAllocator("test pool", num_blocks=8)
+    assert allocator.allocate() == 0
+    assert allocator.allocate_n(3) == [1, 2, 3]
+    assert allocator.get_free_num() == 4
+    assert allocator.get_fragmentation() == 0.0
+
+    # Free blocks: 1, 2, 4, 5, 6, 7. The largest run is 4 of 6.
+    allocator.free_many([1, 2])
+    assert allocator.get_free_num() == 6
+    assert allocator.get_fragmentation() == pytest.approx(1 - 4 / 6)
+
+    # Recently freed blocks are reused first.
+    assert allocator.allocate_n(2) == [1, 2]
+    allocator.free(3)
+    assert allocator.allocate() == 3
+
+    # Double free
+    allocator.free(0)
+    with pytest.raises(ValueError):
+        allocator.free(0)
+    with pytest.raises(ValueError):
+        allocator.free_many([1, 0])
+
+    # Shared blocks are freed with the last reference.
+    allocator.fork(3)
+    allocator.free(3)
+    assert allocator.get_ref_count(3) == 1
+    allocator.free_many([3])
+    assert allocator.allocate() == 3
+
+    # Out of blocks
+    assert allocator.get_history_max_allocated_num() == 4
+    with pytest.raises(ParrotError):
+        allocator.allocate_n(6)
+    allocator.allocate_n(5)
+    assert allocator.get_free_num() == 0
+    assert allocator.get_history_max_allocated_num() == 8
+
+
+def test_block_context_allocate():
+    allocator = BlockAllocator("test pool", num_blocks=8)
+    context = BlockContext(0, None, kv_cache_manager=allocator, block_size=4)
+
+    context.allocate(3)
+    context.allocate(6)
+    assert context.get_context_block_table().tolist() == [0, 1, 2]
+    assert context.get_context_slot_ids().tolist() == list(range(9))
+    assert allocator.get_allocated_num() == 3
+
+    # The child shares the last partial block of the parent (no padding).
+    child = BlockContext(1, context, kv_cache_manager=allocator, block_size=4)
+    assert context.get_this_context_len() == 9
+    assert allocator.get_ref_count(2) == 2
+    child.allocate(1)
+    assert child.get_own_block_ids() == [2]
+    assert child.get_context_slot_ids().tolist() == list(range(10))
+
+    child.destruction()
+    context.destruction()
+    assert allocator.get_allocated_num() == 0
+
+
+def test_copy_on_write():
+    allocator = BlockAllocator("test pool", num_blocks=8)
+    parent = BlockContext(0, None, kv_cache_manager=allocator, block_size=4)
+    parent.allocate(6)
+    children = [
+        BlockContext(i + 1, parent, kv_cache_manager=allocator, block_size=4)
+        for i in range(3)
+    ]
+    assert allocator.get_ref_count(1) == 4
+
+    # The first child appending to the partial block writes in place.
+    children[0].allocate(3)
+    assert children[0].get_own_block_ids() == [1, 2]
+    assert allocator.pop_pending_copies() == []
+
+    # The others copy it.
+    children[1].allocate(1)
+    assert children[1].get_own_block_ids() == [3]
+    assert allocator.pop_pending_copies() == [(1, 3)]
+    assert allocator.get_ref_count(1) == 3
+
+    # So does the parent, when it appends after the fork.
+    parent.allocate(1)
+    assert parent.get_own_block_ids() == [0, 4]
+    assert allocator.pop_pending_copies() == [(1, 4)]
+
+    # The untouched child keeps the block of the parent.
+    assert children[2].get_context_block_table().tolist() == [0, 1]
+    assert children[2].get_context_len() == 6
+
+    for child in children:
+        child.destruction()
+    parent.destruction()
+    assert allocator.get_allocated_num() == 0
+
+
+if __name__ == "__main__":
+    test_block_allocator()
+    test_block_context_allocate()
+    test_copy_on_write()
@@ -0,0 +1,83 @@
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+
+
+BLOCK_SIZE = 4
+
+
+def _make_context(context_id, parent, allocator):
+    return BlockContext(
+        context_id, parent, kv_cache_manager=allocator, block_size=BLOCK_SIZE
+    )
+
+
+def _expected_slot_ids(block_table, context_len):
+    return [
+        block_table[i // BLOCK_SIZE] * BLOCK_SIZE + i % BLOCK_SIZE
+        for i in range(context_len)
+    ]
+
+
+def test_block_table():
+    allocator = BlockAllocator("test pool", num_blocks=32)
+    root = _make_context(0, None, allocator)
+    root.allocate(6)
+
+    # Forked children share the blocks of the parent.
+    children = [_make_context(i + 1, root, allocator) for i in range(2)]
+    assert root.get_this_context_len() == 6
+    for child in children:
+        child.allocate(5)
+
+    root_table = root.get_context_block_table().tolist()
+    for child in children:
+        table = child.get_context_block_table().tolist()
+        assert table[:1] == root_table[:1]
+        assert table[1:] == child.get_own_block_ids()
+        assert len(table) == 3
+
+        slot_ids = child.get_context_slot_ids().tolist()
+        assert slot_ids == _expected_slot_ids(table, 11)
+        assert child.get_context_slot_ids(3).tolist() == slot_ids[-3:]
+
+    # Decode: The prefix is copied only once.
+    child = children[0]
+    version = child._prefix_version
+    for _ in range(8):
+        child.allocate(1)
+        child.get_context_block_table()
+    assert child._prefix_version == version
+    assert child.get_context_len() == 19
+    assert child.get_context_slot_ids().tolist() == _expected_slot_ids(
+        child.get_context_block_table().tolist(), 19
+    )
+
+    # The prefix is synced again if an ancestor changes.
+    grandchild = _make_context(3, child, allocator)
+    grandchild.allocate(2)
+    old_block_ids = root.get_own_block_ids()
+    root.release_blocks()
+    others = allocator.allocate_n(2)
+    block_ids = root.reallocate_blocks()
+    assert block_ids != old_block_ids
+    assert grandchild.get_context_block_table().tolist()[:1] == block_ids[:1]
+    allocator.free_many(others)
+
+    grandchild.destruction()
+    for child in children:
+        child.destruction()
+    root.destruction()
+    assert allocator.get_allocated_num() == 0
+
+    # A long prefix, with more blocks than the initial capacity of the table.
+    root = _make_context(4, None, allocator)
+    root.allocate(100)
+    child = _make_context(5, root, allocator)
+    child.allocate(3)
+    table = child.get_context_block_table().tolist()
+    assert table == root.get_own_block_ids() + child.get_own_block_ids()
+    assert child.get_context_slot_ids().tolist() == _expected_slot_ids(table, 103)
+
+
+if __name__ == "__main__":
+    test_block_table()
@@ -0,0 +1,182 @@
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.job_queue import JobQueue
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.sampling_config import SamplingConfig
+from parrot.constants import FILL_NO_CHUNK
+
+
+class _FakeContext:
+    def __init__(self):
+        self.context_len = 0
+
+    def get_context_len(self) -> int:
+        return self.context_len
+
+    def reuse_cached_blocks(self, token_ids) -> int:
+        return 0
+
+
+def _make_jobs():
+    gen_job = Generate(
+        session_id=0,
+        task_id=0,
+        context_id=0,
+        parent_context_id=-1,
+        sampling_config=SamplingConfig(),
+    )
+    gen_job.context = _FakeContext()
+    fill_job = Fill(
+        session_id=0,
+        task_id=1,
+        context_id=1,
+        parent_context_id=-1,
+        token_ids=list(range(10)),
+    )
+    fill_job.context = _FakeContext()
+    return gen_job, fill_job
+
+
+def _run_iter(jobs) -> None:
+    # What the runner does.
+    for job in jobs:
+        if isinstance(job, Fill):
+            job.context.context_len += job.iter_num_tokens
+            if job.finish_iter():
+                job.finish_event.set()
+        else:
+            job.context.context_len += 1
+
+
+def test_chunked_prefill():
+    config = SchedulerConfig(
+        max_batch_size=4, max_num_batched_tokens=6, max_total_tokens=1000
+    )
+
+    # No chunking: The Fill can't fit into the token budget.
+    scheduler = EngineScheduler(config, fill_chunk_size=FILL_NO_CHUNK)
+    gen_job, fill_job = _make_jobs()
+    scheduler.add_job(gen_job)
+    scheduler.add_job(fill_job)
+    assert scheduler.schedule() == [gen_job]
+
+    # Chunking: The Fill is split into chunks of 4, 4, 2 tokens, interleaved with the
+    # decoding of the Generate.
+    scheduler = EngineScheduler(config, fill_chunk_size=4)
+    gen_job, fill_job = _make_jobs()
+    scheduler.add_job(gen_job)
+    scheduler.add_job(fill_job)
+
+    chunks = []
+    while not fill_job.finish_event.is_set():
+        jobs = scheduler.schedule()
+        assert gen_job in jobs and fill_job in jobs
+        chunks.append(fill_job.iter_num_tokens)
+        _run_iter(jobs)
+        scheduler.finish()
+
+    assert chunks == [4, 4, 2]
+    assert fill_job.context.get_context_len() == 10
+    assert scheduler.running_jobs == [gen_job]
+    assert len(scheduler.waiting_jobs) == 0
+
+
+def test_job_queue_order():
+    queue = JobQueue()
+    jobs = [
+        Fill(session_id=0, task_id=i, context_id=i, parent_context_id=-1)
+        for i in range(4)
+    ]
+    jobs[1].deadline = 100
+    jobs[2].latency_critical = True
+    jobs[3].deadline = 5  # Missed
+    for i, job in enumerate(jobs):
+        queue.push(job, arrival_time=i)
+    assert len(queue) == 4
+
+    # Latency-critical, then EDF, then jobs without deadlines, then missed.
+    assert queue.peek(now=10) is jobs[2]
+    assert queue.peek(now=10, fill=False) is None
+    assert [queue.pop(now=10) for _ in range(4)] == [jobs[2], jobs[1], jobs[0], jobs[3]]
+    assert queue.pop(now=10) is None
+    assert len(queue) == 0
+
+
+def test_tgi_policy():
+    config = SchedulerConfig(
+        max_batch_size=4, max_num_batched_tokens=16, max_total_tokens=1000, policy="tgi"
+    )
+    scheduler = EngineScheduler(config)
+
+    def run():
+        jobs = scheduler.schedule()
+        _run_iter(jobs)
+        scheduler.finish()
+        return jobs
+
+    gen_job, fill_job = _make_jobs()
+    scheduler.add_job(gen_job)
+    scheduler.add_job(fill_job)
+    # Fills are scheduled separately, before decoding.
+    assert run() == [fill_job]
+    assert run() == [gen_job]
+
+    _, fill_job = _make_jobs()
+    fill_job.context_id = 2
+    scheduler.add_job(fill_job)
+    # The decoding Generate is paused (not preempted) in the prefill iteration.
+    assert run() == [fill_job]
+    assert scheduler.running_jobs == [gen_job]
+    assert run() == [gen_job]
+
+
+def test_preempted_jobs():
+    config = SchedulerConfig(
+        max_batch_size=4, max_num_batched_tokens=16, max_total_tokens=12
+    )
+    scheduler = EngineScheduler(config)
+    gen_job, fill_job = _make_jobs()
+    gen_job.context.context_len = 8
+    scheduler.add_job(gen_job)
+    scheduler.add_job(fill_job)
+    assert scheduler.schedule() == [gen_job, fill_job]
+    assert scheduler.preempted_jobs == []
+
+    # The Fill extends its context over the limit: It's preempted, so the engine can
+    # release its KV cache.
+    fill_job.context.context_len = 10
+    assert scheduler.schedule() == [gen_job]
+    assert scheduler.preempted_jobs == [fill_job]
+    assert list(scheduler.waiting_jobs) == [fill_job]
+
+
+def test_empty_fill():
+    for policy, fill_chunk_size in [("fifo", FILL_NO_CHUNK), ("fifo", 4), ("tgi", 4)]:
+        config = SchedulerConfig(
+            max_batch_size=4,
+            max_num_batched_tokens=16,
+            max_total_tokens=1000,
+            policy=policy,
+        )
+        scheduler = EngineScheduler(config, fill_chunk_size=fill_chunk_size)
+
+        # An empty Fill (e.g. an empty constant) queued ahead of a normal Fill.
+        empty_fill_job = Fill(
+            session_id=0, task_id=2, context_id=2, parent_context_id=-1, token_ids=[]
+        )
+        empty_fill_job.context = _FakeContext()
+        _, fill_job = _make_jobs()
+        scheduler.add_job(empty_fill_job)
+        scheduler.add_job(fill_job)
+
+        # The empty Fill is done at once, and doesn't block the jobs behind it.
+        assert empty_fill_job.finish_event.is_set()
+        assert scheduler.schedule() == [fill_job]
+
+
+if __name__ == "__main__":
+    test_chunked_prefill()
+    test_job_queue_order()
+    test_tgi_policy()
+    test_preempted_jobs()
+    test_empty_fill()
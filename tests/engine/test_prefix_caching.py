@@ -0,0 +1,136 @@
+import pytest
+
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.context.block_allocator import BlockAllocator
+from parrot.engine.context.block_context import BlockContext
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill
+from parrot.exceptions import ParrotError
+
+
+BLOCK_SIZE = 4
+
+
+def _make_context(context_id, parent, allocator):
+    return BlockContext(
+        context_id, parent, kv_cache_manager=allocator, block_size=BLOCK_SIZE
+    )
+
+
+def _fill(context, token_ids):
+    """Fill the context as the runner does. Return the number of reused tokens."""
+
+    num_reused = context.reuse_cached_blocks(token_ids)
+    token_ids = token_ids[num_reused:]
+    context.token_ids.extend(token_ids)
+    context.allocate(len(token_ids))
+    context.register_full_blocks()
+    return num_reused
+
+
+def test_lru_pool():
+    allocator = BlockAllocator("test pool", num_blocks=4, enable_prefix_caching=True)
+    block_ids = allocator.allocate_n(3)
+    for i, block_id in enumerate(block_ids):
+        allocator.register_block(block_id, bytes([i]))
+
+    # Unreferenced registered blocks are cached, and count as free.
+    allocator.free_many(block_ids)
+    assert allocator.get_num_cached_blocks() == 3
+    assert allocator.get_free_num() == 4
+    assert allocator.get_allocated_num() == 0
+
+    # Revive a cached block. The lookup stops at the first miss.
+    assert allocator.lookup_blocks([b"\x00", b"\x05", b"\x01"]) == block_ids[:1]
+    assert allocator.get_ref_count(block_ids[0]) == 1
+    assert allocator.get_num_cached_blocks() == 2
+    assert allocator.get_prefix_cache_hit_rate() == 1 / 3
+
+    # The least recently used cached blocks are reclaimed when memory is needed. The
+    # blocks are released from the tail, so the tail is reclaimed first.
+    allocator.allocate_n(2)
+    assert allocator.get_num_cached_blocks() == 1
+    assert allocator.lookup_blocks([b"\x02"]) == []
+    assert allocator.lookup_blocks([b"\x01"]) == block_ids[1:2]
+
+    with pytest.raises(ParrotError):
+        allocator.allocate()
+
+
+def test_reuse_cached_blocks():
+    allocator = BlockAllocator("test pool", num_blocks=64, enable_prefix_caching=True)
+    prompt = list(range(10))
+
+    context = _make_context(0, None, allocator)
+    assert _fill(context, prompt) == 0
+    block_table = context.get_context_block_table().tolist()
+    context.destruction()
+    assert allocator.get_num_cached_blocks() == 2  # The 2 full blocks
+
+    # Same prompt: The full blocks are reused, the rest is computed.
+    context = _make_context(1, None, allocator)
+    assert _fill(context, prompt) == 8
+    assert context.get_context_block_table().tolist()[:2] == block_table[:2]
+    assert context.get_context_len() == 10
+    assert context.token_ids == prompt
+
+    # Shared by a live context.
+    other = _make_context(2, None, allocator)
+    assert _fill(other, prompt[:8] + [100, 101]) == 8
+    assert allocator.get_ref_count(block_table[0]) == 2
+
+    # The last token is never reused; a different prefix doesn't match.
+    assert _fill(_make_context(3, None, allocator), prompt[:8]) == 4
+    assert _fill(_make_context(4, None, allocator), [100] + prompt[1:]) == 0
+
+    # Forked at a block boundary: The blocks after the prefix are reused.
+    parent = _make_context(5, None, allocator)
+    _fill(parent, prompt[:4])
+    child = _make_context(6, parent, allocator)
+    assert _fill(child, prompt[4:]) == 4
+    assert child.get_own_block_ids()[0] == block_table[1]
+
+    # Dropped for recomputation: The blocks are reused when recomputed.
+    context.release_blocks()
+    context.reset_blocks()
+    assert _fill(context, prompt) == 8
+
+
+def test_reuse_at_admission():
+    allocator = BlockAllocator("test pool", num_blocks=64, enable_prefix_caching=True)
+    prompt = list(range(10))
+    _fill(_make_context(0, None, allocator), prompt)
+
+    # The Fill doesn't fit into the token budget, but its cached prefix is reused when
+    # it's admitted, and only the rest is charged.
+    config = SchedulerConfig(
+        max_batch_size=4, max_num_batched_tokens=4, max_total_tokens=1000
+    )
+    scheduler = EngineScheduler(config)
+    fill_job = Fill(
+        session_id=0, task_id=0, context_id=1, parent_context_id=-1, token_ids=prompt
+    )
+    fill_job.context = _make_context(1, None, allocator)
+    scheduler.add_job(fill_job)
+    assert scheduler.schedule() == [fill_job]
+    assert fill_job.num_filled_tokens == 8
+    assert fill_job.get_iter_token_ids() == prompt[8:]
+    assert fill_job.context.get_context_len() == 8
+
+
+def test_prefix_caching_disabled():
+    allocator = BlockAllocator("test pool", num_blocks=64)
+    prompt = list(range(10))
+
+    context = _make_context(0, None, allocator)
+    _fill(context, prompt)
+    context.destruction()
+    assert allocator.get_num_cached_blocks() == 0
+    assert _fill(_make_context(1, None, allocator), prompt) == 0
+
+
+if __name__ == "__main__":
+    test_lru_pool()
+    test_reuse_cached_blocks()
+    test_reuse_at_admission()
+    test_prefix_caching_disabled()
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+
+from parrot.engine.llm_engine import LLMEngine
+
+
+class _FakeEngine(LLMEngine):
+    """Fill returns at once; Generate waits until it's released."""
+
+    def __init__(self):
+        self.generate_released = asyncio.Event()
+
+    async def fill(self, payload):
+        if payload["context_id"] < 0:
+            raise RuntimeError("Bad context")
+        return {"filled_len": len(payload["token_ids"])}
+
+    async def generate(self, payload):
+        await self.generate_released.wait()
+        return {"generated_text": "xxx", "generated_ids": [1, 2, 3]}
+
+    def generate_stream(self, payload):
+        raise NotImplementedError
+
+    async def free_context(self, payload):
+        context_id = payload["context_id"]
+        if context_id == 1:
+            raise RuntimeError(f"Context {context_id} is still running.")
+        if context_id == 2:
+            raise KeyError(context_id)
+        return {"context_len": 8}
+
+    def get_runtime_info(self, profile):
+        raise NotImplementedError
+
+    async def engine_iter(self):
+        pass
+
+
+def test_primitives_batch_per_item():
+    async def main():
+        engine = _FakeEngine()
+        payload = {
+            "primitives": [
+                {"primitive": "generate", "context_id": 0},
+                {"primitive": "fill", "context_id": 1, "token_ids": [1, 2, 3]},
+                {"primitive": "fill", "context_id": -1, "token_ids": [1]},
+            ]
+        }
+        results = engine.primitives_batch(payload)
+
+        # The Fills are replied while the Generate in the same batch is still running.
+        first_two = [await results.__anext__() for _ in range(2)]
+        assert sorted(first_two) == [
+            (1, {"filled_len": 3}),
+            (2, {"error": "Bad context"}),
+        ]
+        assert not engine.generate_released.is_set()
+
+        engine.generate_released.set()
+        index, result = await results.__anext__()
+        assert index == 0 and result["generated_ids"] == [1, 2, 3]
+        with pytest.raises(StopAsyncIteration):
+            await results.__anext__()
+
+    asyncio.run(main())
+
+
+def test_free_contexts_per_item():
+    engine = _FakeEngine()
+    resp = asyncio.run(engine.free_contexts({"context_ids": [0, 1, 2, 3]}))
+
+    # A failed context doesn't fail the rest, and its error is reported.
+    assert resp["freed_context_ids"] == [0, 3]
+    assert resp["context_len"] == 16
+    assert resp["failed_context_ids"] == [1, 2]
+    assert resp["errors"][0] == "RuntimeError: Context 1 is still running."
+    assert resp["errors"][1].startswith("KeyError")
+
+
+if __name__ == "__main__":
+    test_primitives_batch_per_item()
+    test_free_contexts_per_item()
@@ -0,0 +1,47 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from parrot.protocol.http_utils import async_send_http_request_streaming
+
+
+def test_generate_stream_split_token_ids():
+    token_ids = [1, 255, 256, 70000, 2**31 - 1, 42]
+    data = b"".join(token_id.to_bytes(4, "big") for token_id in token_ids)
+
+    async def generate_stream(request):
+        await request.json()
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        # Write the token ids in pieces of odd sizes, across the token boundaries.
+        pos = 0
+        for size in [3, 5, 1, 7, 2]:
+            await resp.write(data[pos : pos + size])
+            await asyncio.sleep(0.01)
+            pos += size
+        await resp.write(data[pos:])
+        await resp.write_eof()
+        return resp
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/generate_stream", generate_stream)
+        async with TestServer(app) as server:
+            async with aiohttp.ClientSession() as client_session:
+                received = [
+                    token_id
+                    async for token_id in async_send_http_request_streaming(
+                        client_session,
+                        f"http://{server.host}:{server.port}",
+                        "/generate_stream",
+                    )
+                ]
+        assert received == token_ids
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    test_generate_stream_split_token_ids()
@@ -0,0 +1,186 @@
+import asyncio
+from fastapi import Request
+
+from parrot.engine.llm_engine import LLMEngine
+from parrot.protocol.internal.layer_apis import FillResponse, GenerateResponse
+from parrot.protocol.base_response import make_binary_response, make_response_from_dict
+from parrot.protocol.wire_format import (
+    BINARY_CONTENT_TYPE,
+    FRAME_PREFIX_SIZE,
+    encode_binary,
+    decode_binary,
+    decode_payload,
+    encode_frame,
+    decode_frame_length,
+)
+
+
+def test_binary_wire_format():
+    token_ids = list(range(1000))
+    body = encode_binary(
+        {"context_id": 1, "token_ids": token_ids, "text": None}, ["token_ids"]
+    )
+    # 4 bytes per token
+    assert len(body) < 4 * len(token_ids) + 100
+
+    payload = decode_binary(body)
+    assert payload["context_id"] == 1
+    assert payload["text"] is None
+    assert payload["token_ids"].tolist() == token_ids
+
+    # None arrays are kept in the header.
+    payload = decode_binary(
+        encode_binary({"token_ids": None, "text": "a"}, ["token_ids"])
+    )
+    assert payload["token_ids"] is None
+
+    # Decode into the response (zero copy).
+    body = encode_binary(
+        {"generated_text": "", "generated_ids": token_ids}, ["generated_ids"]
+    )
+    resp = make_binary_response(GenerateResponse, body)
+    assert resp.generated_text == ""
+    assert list(resp.generated_ids) == token_ids
+
+
+def test_binary_wire_format_batch():
+    items = [
+        {"primitive": "fill", "context_id": 0, "token_ids": [1, 2, 3], "text": None},
+        {"primitive": "generate", "context_id": 1},
+        {"primitive": "fill", "context_id": 2, "token_ids": None, "text": "abc"},
+    ]
+    body = encode_binary({"primitives": items}, ["token_ids"], batch_key="primitives")
+
+    payload = decode_binary(body)
+    assert len(payload["primitives"]) == 3
+    assert payload["primitives"][0]["token_ids"].tolist() == [1, 2, 3]
+    assert "token_ids" not in payload["primitives"][1]
+    assert payload["primitives"][2]["token_ids"] is None
+    assert payload["primitives"][2]["text"] == "abc"
+
+
+def _split_frames(stream: bytes):
+    frames = []
+    offset = 0
+    while offset < len(stream):
+        length = decode_frame_length(stream[offset : offset + FRAME_PREFIX_SIZE])
+        offset += FRAME_PREFIX_SIZE
+        frames.append(stream[offset : offset + length])
+        offset += length
+    return frames
+
+
+def test_frames():
+    bodies = [b"", b"abc", encode_binary({"generated_ids": [1, 2]}, ["generated_ids"])]
+    stream = b"".join(encode_frame(body) for body in bodies)
+    assert _split_frames(stream) == bodies
+
+
+class _EchoEngine(LLMEngine):
+    """Records the payloads, and generates the filled tokens back."""
+
+    def __init__(self):
+        self.filled_token_ids = {}
+
+    async def fill(self, payload):
+        self.filled_token_ids[payload["context_id"]] = payload["token_ids"]
+        return {"filled_len": len(payload["token_ids"])}
+
+    async def generate(self, payload):
+        token_ids = self.filled_token_ids[payload["context_id"]].tolist()
+        return {"generated_text": "", "generated_ids": token_ids}
+
+    def generate_stream(self, payload):
+        raise NotImplementedError
+
+    async def free_context(self, payload):
+        raise NotImplementedError
+
+    def get_runtime_info(self, profile):
+        raise NotImplementedError
+
+    async def engine_iter(self):
+        pass
+
+
+def _make_request(api_url: str, body: bytes) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": api_url,
+        "headers": [
+            (b"content-type", BINARY_CONTENT_TYPE.encode()),
+            (b"accept", BINARY_CONTENT_TYPE.encode()),
+        ],
+    }
+    return Request(scope, receive)
+
+
+def test_http_server_binary_round_trip():
+    # NOTE: The engine server imports the builtin engine (and its kernels).
+    from parrot.engine import http_server
+
+    async def main():
+        http_server.llm_engine = _EchoEngine()
+
+        # /fill and /generate
+        resp = await http_server.fill(
+            _make_request(
+                "/fill",
+                encode_binary(
+                    {"session_id": 0, "context_id": 0, "token_ids": [1, 2, 3]},
+                    ["token_ids"],
+                ),
+            )
+        )
+        assert resp == {"filled_len": 3}
+        assert http_server.llm_engine.filled_token_ids[0].tolist() == [1, 2, 3]
+
+        resp = await http_server.generate(
+            _make_request(
+                "/generate", encode_binary({"session_id": 0, "context_id": 0}, [])
+            )
+        )
+        assert resp.media_type == BINARY_CONTENT_TYPE
+        resp = make_binary_response(GenerateResponse, resp.body)
+        assert resp.generated_ids.tolist() == [1, 2, 3]
+
+        # /primitives_batch: Each result is a frame.
+        items = [
+            {"primitive": "fill", "context_id": 1, "token_ids": [4, 5]},
+            {"primitive": "fill", "context_id": 2, "token_ids": [6]},
+        ]
+        resp = await http_server.primitives_batch(
+            _make_request(
+                "/primitives_batch",
+                encode_binary(
+                    {"primitives": items}, ["token_ids"], batch_key="primitives"
+                ),
+            )
+        )
+        assert resp.media_type == BINARY_CONTENT_TYPE
+        stream = b"".join([chunk async for chunk in resp.body_iterator])
+        results = {}
+        for body in _split_frames(stream):
+            result = decode_payload(resp.media_type, body)
+            results[result.pop("index")] = make_response_from_dict(FillResponse, result)
+        assert results == {
+            0: FillResponse(filled_len=2),
+            1: FillResponse(filled_len=1),
+        }
+        assert http_server.llm_engine.filled_token_ids[1].tolist() == [4, 5]
+
+    try:
+        asyncio.run(main())
+    finally:
+        http_server.llm_engine = None
+
+
+if __name__ == "__main__":
+    test_binary_wire_format()
+    test_binary_wire_format_batch()
+    test_frames()
+    test_http_server_binary_round_trip()
@@ -1,12 +1,16 @@
 import json
+import asyncio
 
 from parrot.serve.backend_repr import Context, ExecutionEngine, LanguageModel
 from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
 from parrot.testing.get_configs import get_sample_engine_config_path
 
 from parrot.serve.variable_manager import SemanticVariableManager
 from parrot.serve.scheduler import CompletionTask
 from parrot.serve.context_manager import PrefixCache, ServeCoreContextManager
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
 from parrot.sampling_config import SamplingConfig
 from parrot.serve.graph import (
     RequestChain,
@@ -20,11 +24,26 @@ from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 def test_prefix_cache():
     svs = ["sv0", "sv1", "sv2"]
     prefix_cache = PrefixCache()
-    prefix_hash = ""
-    for context_id, sv in enumerate(svs):
-        prefix_hash += ServeCoreContextManager._hash_var_id(sv)
-        prefix_cache.cache_prefix_context(prefix_hash, context_id)
-    print(prefix_cache._prefix_ctx_map)
+    prefix_cache.cache_prefix_contexts(engine_id=0, prefix=svs, context_ids=[0, 1, 2])
+    prefix_cache.cache_prefix_contexts(
+        engine_id=0, prefix=["sv0", "sv1", "sv3"], context_ids=[0, 1, 3]
+    )
+    prefix_cache.cache_prefix_contexts(engine_id=1, prefix=["sv0"], context_ids=[4])
+    print(prefix_cache.pretty_print())
+
+    assert prefix_cache.get_cached_prefix_contexts(0, svs) == [0, 1, 2]
+    assert prefix_cache.get_cached_prefix_contexts(1, svs) == [4]
+    assert prefix_cache.query_cached_prefix_lens(svs) == {0: 3, 1: 1}
+
+    # Free a context: the node is pruned.
+    prefix_cache.remove_context_id(2)
+    assert prefix_cache.query_cached_prefix_lens(svs) == {0: 2, 1: 1}
+    assert "sv2" not in prefix_cache._root.children["sv0"].children["sv1"].children
+
+    # Remove an engine.
+    prefix_cache.remove_engine(0)
+    assert prefix_cache.query_cached_prefix_lens(svs) == {1: 1}
+    assert len(prefix_cache._root.children["sv0"].children) == 0
 
 
 def test_context_manager():
@@ -63,13 +82,79 @@ def test_context_manager():
     task.schedule_to(engine, update_engine_info=False)
 
     context_mgr = ServeCoreContextManager()
-    context_mgr.register_engine_prefix_cache(engine.engine_id)
     context_mgr.set_task_contexts(task)
 
     print(context_mgr._context_ref_counter)
-    print(context_mgr.prefix_caches[engine.engine_id]._prefix_ctx_map)
+    print(context_mgr.prefix_cache.pretty_print())
+
+
+def test_free_contexts_in_background():
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    # NOTE: No engine server is launched.
+    engine_id = engine_mgr.register_engine(
+        EngineConfig(
+            engine_name="test",
+            engine_type=ENGINE_TYPE_OPENAI,
+            host="localhost",
+            port=9876,
+        )
+    )
+    engine = engine_mgr.get_engine(engine_id)
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def create_task(task_id: int) -> CompletionTask:
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"Test{task_id}"),
+                PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        task = CompletionTask(task_id=task_id, chain=request_chain.comp_chains[0])
+        task.schedule_to(engine, update_engine_info=False)
+        context_mgr.set_task_contexts(task)
+        return task
+
+    tasks = [create_task(i) for i in range(4)]
+    context_ids = [ctx.context_id for task in tasks for ctx in task.contexts]
+
+    # Freeing doesn't wait for the engine. The ids are not recycled until the engine
+    # frees them.
+    for task in tasks:
+        context_mgr.free_task_contexts(task)
+    for var_id in list(context_mgr.constant_prefix_contexts.keys()):
+        context_mgr.free_constant_prefix_contexts(var_id)
+    assert len(context_mgr.contexts) == 0
+    assert context_mgr.pending_free_contexts_num == len(context_ids)
+    assert context_mgr._context_id_pool.allocate() not in context_ids
+
+    async def main():
+        await context_mgr.wait_pending_free_contexts()
+
+        # The engine is unreachable. The contexts remain pending.
+        pending_num = await context_mgr.free_pending_contexts(engine_mgr)
+        assert pending_num == len(context_ids)
+
+        # The contexts of a dead engine are released without requests.
+        engine_mgr.raise_exception(engine_id, RuntimeError("test"))
+        pending_num = await context_mgr.free_pending_contexts(engine_mgr)
+        assert pending_num == 0
+        await engine_mgr.close_client_sessions()
+
+    asyncio.run(main())
+    recycled_ids = [context_mgr._context_id_pool.allocate() for _ in context_ids]
+    assert sorted(recycled_ids) == sorted(context_ids)
 
 
 if __name__ == "__main__":
     test_prefix_cache()
     test_context_manager()
+    test_free_contexts_in_background()
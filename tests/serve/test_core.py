@@ -1,4 +1,16 @@
+import asyncio
+
 from parrot.serve.core import create_serve_core
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
 
 from parrot.testing.get_configs import get_sample_core_config_path
 
@@ -15,6 +27,53 @@ def test_core_register_session():
     core.register_session({})
 
 
+def test_core_event_driven_schedule():
+    config_path = get_sample_core_config_path("localhost_serve_core.json")
+    core = create_serve_core(config_path)
+    core.register_engine(
+        {
+            "engine_config": EngineConfig(
+                engine_name="test", engine_type=ENGINE_TYPE_OPENAI
+            ).__dict__
+        }
+    )
+    session_id = core.session_mgr.register_session()
+
+    metadata = SemanticCallMetadata.get_default()
+    metadata.model_type = "text"
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("This is a test "),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ],
+        metadata=metadata,
+    )
+    core.var_mgr.create_vars_for_request(session_id, request_chain)
+    activate_completion_chain(
+        request_chain.comp_chains[0], PerformanceCriteria.LATENCY
+    )
+    task = core.task_creator.create_task(request_chain.comp_chains[0])
+
+    async def main():
+        loop_task = asyncio.create_task(core.serve_loop())
+        await asyncio.sleep(0.1)
+
+        # Submitting the task wakes up the scheduler.
+        core.global_scheduler.submit_task(task)
+        await asyncio.wait_for(task.wait_scheduled(), timeout=1)
+
+        loop_task.cancel()
+
+        # The pooled client sessions to the engines are closed.
+        engine_id = task.engine.engine_id
+        client_session = core.engine_mgr.get_client_session(engine_id)
+        await core.shutdown()
+        assert client_session.closed
+
+    asyncio.run(main())
+
+
 if __name__ == "__main__":
     test_launch_core()
     test_core_register_session()
+    test_core_event_driven_schedule()
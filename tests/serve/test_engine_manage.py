@@ -1,8 +1,10 @@
 import json
 import time
+import asyncio
 
 
 from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
 from parrot.serve.context_manager import ServeCoreContextManager
 from parrot.serve.tokenizer_wrapper import TokenizersWrapper
 from parrot.serve.engine_manager import EngineManager
@@ -37,5 +39,33 @@ def test_engine_manager():
     print(engine_mgr.engines, engine_mgr.models)
 
 
+def test_engine_client_session():
+    context_mgr = ServeCoreContextManager()
+    tokenizers_wrapper = TokenizersWrapper()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=5,
+    )
+    engine_id = engine_mgr.register_engine(
+        EngineConfig(engine_name="test", engine_type=ENGINE_TYPE_OPENAI)
+    )
+
+    async def main():
+        # The client session is reused.
+        client_session = engine_mgr.get_client_session(engine_id)
+        assert engine_mgr.get_client_session(engine_id) is client_session
+        assert client_session.connector.limit == EngineConfig.tasks_capacity
+
+        # The client session is closed when the engine is swept.
+        engine_mgr.raise_exception(engine_id, RuntimeError("test"))
+        engine_mgr.sweep_not_running_engines()
+        await asyncio.sleep(0.1)
+        assert client_session.closed
+
+    asyncio.run(main())
+
+
 if __name__ == "__main__":
-    test_engine_manager()
+    # test_engine_manager()
+    test_engine_client_session()
@@ -8,16 +8,61 @@ def test_prefix_matcher():
     prefix_matcher.add_prefix("This is a test")
 
     # Will add
-    for i in range(PrefixMatcher._GP_THRESHOLD + 1):
-        prefix_matcher.add_prefix("A" * PrefixMatcher._START_LEN + "BBB" + str(i))
+    system_prompt = "You are a helpful assistant. Answer the following question. "
+    for i in range(prefix_matcher.gp_threshold + 1):
+        prefix_matcher.add_prefix(system_prompt + f"Question {i}: What is {i}?")
 
-    print(prefix_matcher._prefix_counter)
-
-    query_str = "A" * PrefixMatcher._START_LEN + "BBB" + "XXX"
+    query_str = system_prompt + "Question X: What is X?"
     pos = prefix_matcher.query_prefix(query_str)
     assert pos != -1
     print("prefix: " + query_str[:pos], "suffix: " + query_str[pos:])
 
+    # Split on the token boundary.
+    assert query_str[pos].isspace() and not query_str[pos - 1].isspace()
+    assert query_str[:pos] == system_prompt + "Question"
+
+
+def test_prefix_matcher_evict():
+    # Budget: 3 nodes
+    prefix_matcher = PrefixMatcher(
+        block_size=4,
+        memory_budget=3 * (PrefixMatcher._NODE_OVERHEAD_BYTES + 48),
+        evict_policy="lru",
+    )
+
+    prefixes = [f"{name} prompt " * 4 for name in ["Alpha", "Bravo", "Charlie"]]
+    for i in range(prefix_matcher.gp_threshold + 1):
+        prefix_matcher.add_prefix(prefixes[0] + f"Question {i}")
+    prefix_matcher.add_prefix(prefixes[1])
+    # Touch prefix 0
+    assert prefix_matcher.query_prefix(prefixes[0] + "XXX") != -1
+    # Evict prefix 1 (LRU)
+    prefix_matcher.add_prefix(prefixes[2])
+
+    assert prefix_matcher.memory_usage <= prefix_matcher.memory_budget
+    assert prefixes[1][:4] not in prefix_matcher._root.children
+    assert prefix_matcher.query_prefix(prefixes[0] + "XXX") != -1
+
+
+def test_prefix_matcher_evict_lfu():
+    prefix_matcher = PrefixMatcher(
+        block_size=4,
+        memory_budget=2 * (PrefixMatcher._NODE_OVERHEAD_BYTES + 48),
+        evict_policy="lfu",
+    )
+
+    prefixes = [f"{name} prompt " * 4 for name in ["Alpha", "Bravo", "Charlie"]]
+    for _ in range(2):
+        prefix_matcher.add_prefix(prefixes[0])
+    prefix_matcher.add_prefix(prefixes[1])
+    # Evict prefix 1 (LFU), though prefix 0 is less recently used.
+    prefix_matcher.add_prefix(prefixes[2])
+
+    assert prefixes[0][:4] in prefix_matcher._root.children
+    assert prefixes[1][:4] not in prefix_matcher._root.children
+
 
 if __name__ == "__main__":
     test_prefix_matcher()
+    test_prefix_matcher_evict()
+    test_prefix_matcher_evict_lfu()
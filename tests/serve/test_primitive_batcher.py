@@ -0,0 +1,163 @@
+import asyncio
+import time
+import aiohttp
+import pytest
+
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI, WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON
+from parrot.protocol.internal.layer_apis import FillResponse, GenerateResponse
+from parrot.protocol.internal.primitive_request import (
+    Fill,
+    Generate,
+    apost_primitives_batch,
+)
+from parrot.sampling_config import SamplingConfig
+from parrot.serve.backend_repr import ExecutionEngine, LanguageModel
+from parrot.serve.primitive_batcher import PrimitiveBatcher
+from parrot.testing.fake_engine_server import (
+    TESTING_SERVER_URL as ENGINE_URL,
+    TESTING_SERVER_HOST,
+    TESTING_SERVER_PORT,
+    TESTING_FILL_PERTOKEN_TIME,
+    TESTING_DECODE_PERTOKEN_TIME,
+)
+from parrot.testing.localhost_server_daemon import fake_engine_server
+
+
+def _make_engine(wire_format: str = WIRE_FORMAT_BINARY, **config) -> ExecutionEngine:
+    config = EngineConfig(
+        engine_name="test",
+        engine_type=ENGINE_TYPE_OPENAI,
+        host=TESTING_SERVER_HOST,
+        port=TESTING_SERVER_PORT,
+        wire_format=wire_format,
+        **config,
+    )
+    return ExecutionEngine(
+        engine_id=0, config=config, model=LanguageModel.from_engine_config(config)
+    )
+
+
+def _make_fill(context_id: int, token_ids=(1, 2, 3)) -> Fill:
+    return Fill(
+        session_id=0,
+        task_id=context_id,
+        context_id=context_id,
+        parent_context_id=-1,
+        end_flag=False,
+        token_ids=None if token_ids is None else list(token_ids),
+    )
+
+
+def _make_generate(context_id: int) -> Generate:
+    return Generate(
+        session_id=0,
+        task_id=context_id,
+        context_id=context_id,
+        parent_context_id=-1,
+        end_flag=False,
+        sampling_config=SamplingConfig(),
+    )
+
+
+def test_primitives_batch():
+    async def main():
+        # One request carries all primitives, in both wire formats.
+        for wire_format in [WIRE_FORMAT_JSON, WIRE_FORMAT_BINARY]:
+            primitives = [_make_fill(0), _make_generate(0), _make_fill(1)]
+            async with aiohttp.ClientSession() as client_session:
+                results = await apost_primitives_batch(
+                    primitives, ENGINE_URL, client_session, wire_format
+                )
+            assert len(results) == len(primitives)
+            assert isinstance(results[0], FillResponse)
+            assert results[0].filled_len == 3
+            assert isinstance(results[1], GenerateResponse)
+            assert results[1].generated_text == "xxx"
+            assert results[2].filled_len == 3
+
+    with fake_engine_server():
+        asyncio.run(main())
+
+
+def test_batcher_error_per_item():
+    async def main():
+        async with aiohttp.ClientSession() as client_session:
+            batcher = PrimitiveBatcher(_make_engine(), client_session)
+            # The fake engine fails a Fill without tokens and text.
+            results = await asyncio.gather(
+                batcher.submit(_make_fill(0)),
+                batcher.submit(_make_fill(1, token_ids=None)),
+                batcher.submit(_make_fill(2)),
+                return_exceptions=True,
+            )
+
+        assert results[0].filled_len == 3
+        assert isinstance(results[1], RuntimeError)
+        assert "AssertionError" in str(results[1])
+        assert results[2].filled_len == 3
+
+    with fake_engine_server():
+        asyncio.run(main())
+
+
+def test_batcher_flush_at_max_batch_size():
+    async def main():
+        async with aiohttp.ClientSession() as client_session:
+            # The batch window is never reached: Full batches are sent at once.
+            batcher = PrimitiveBatcher(
+                _make_engine(primitives_batch_window=100), client_session, 2
+            )
+            results = await asyncio.wait_for(
+                asyncio.gather(*[batcher.submit(_make_fill(i)) for i in range(4)]),
+                timeout=10,
+            )
+            assert all(result.filled_len == 3 for result in results)
+
+            # A partial batch waits for the window.
+            task = asyncio.ensure_future(batcher.submit(_make_fill(4)))
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.shield(task), timeout=1)
+            batcher._flush()
+            assert (await task).filled_len == 3
+
+    with fake_engine_server():
+        asyncio.run(main())
+
+
+def test_fill_latency_independent_of_batch_mates():
+    # The fake engine fills 1 token in 1 * FILL_PERTOKEN_TIME, and generates at least 3
+    # tokens in 3 * DECODE_PERTOKEN_TIME.
+    assert TESTING_FILL_PERTOKEN_TIME * 2 < TESTING_DECODE_PERTOKEN_TIME * 3
+
+    async def submit_timed(batcher, primitive):
+        await batcher.submit(primitive)
+        return time.perf_counter()
+
+    async def main(wire_format):
+        async with aiohttp.ClientSession() as client_session:
+            batcher = PrimitiveBatcher(_make_engine(wire_format), client_session)
+            generate = _make_generate(0)
+            fill = _make_fill(1, token_ids=[1])
+
+            st = time.perf_counter()
+            generate_done, fill_done = await asyncio.gather(
+                submit_timed(batcher, generate), submit_timed(batcher, fill)
+            )
+
+        # Both are sent in one batch, but the Fill is resolved without waiting for the
+        # Generate.
+        assert fill_done < generate_done
+        assert fill_done - st < TESTING_DECODE_PERTOKEN_TIME * 3
+        assert generate_done - st >= TESTING_DECODE_PERTOKEN_TIME * 3
+
+    with fake_engine_server():
+        for wire_format in [WIRE_FORMAT_JSON, WIRE_FORMAT_BINARY]:
+            asyncio.run(main(wire_format))
+
+
+if __name__ == "__main__":
+    test_primitives_batch()
+    test_batcher_error_per_item()
+    test_batcher_flush_at_max_batch_size()
+    test_fill_latency_independent_of_batch_mates()
@@ -1,6 +1,7 @@
 from typing import List, Optional
 from parrot.serve.scheduler import (
     CompletionTask,
+    TaskQueue,
     TaskCreator,
     GlobalScheduler,
     GlobalSchedulerConfig,
@@ -21,6 +22,8 @@ from parrot.serve.graph import (
 )
 from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.serve.engine_manager import EngineManager
 from parrot.serve.graph.visualize_utils import view_graph
 
@@ -448,15 +451,459 @@ def test_ctx_aware():
 
     # Assign context in a round-robin manner (hacky)
     for i in range(4):
-        prefix_cache = context_mgr.prefix_caches[i]
-        prefix_hash = context_mgr._hash_var_id(first_vars[i].id)
-        prefix_cache.cache_prefix_context(prefix_hash=prefix_hash, context_id=i)
+        context_mgr.prefix_cache.cache_prefix_contexts(
+            engine_id=i, prefix=[first_vars[i].id], context_ids=[i]
+        )
 
     scheduler.schedule()
 
     # Expected results: 0, 4, 8, 12 tasks go to engine 0, 1, 2, 3 respectively.
 
 
+def test_task_queue_index():
+    graph = ComputeGraph()
+    task_creator = TaskCreator()
+    task_queue = TaskQueue()
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    # 4 producers with the same prefix, activated and queued first.
+    out_vars: List[SemanticVariable] = []
+    tasks: List[CompletionTask] = []
+    for _ in range(4):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.LATENCY)
+        out_vars.append(comp_chain.gen_node.sv)
+
+        task = task_creator.create_task(comp_chain)
+        task_queue.push(task)
+        tasks.append(task)
+
+    first_sv_id = tasks[0].chain.first_node.sv.id
+    assert len(task_queue.get_tasks_by_first_sv(first_sv_id)) == 4
+
+    # A consumer of all producers comes later. Its chain group is appended to the
+    # chains of the queued tasks.
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            PlaceholderFill(
+                placeholder=RequestPlaceholder(
+                    name=f"a_{i}", var_id=out_vars[i].id, is_output=False
+                )
+            )
+            for i in range(4)
+        ]
+        + [PlaceholderGen(placeholder=RequestPlaceholder(name="b", is_output=True))]
+    )
+    var_mgr.create_vars_for_request(session_id, request_chain)
+    graph.insert_and_update_request_chain(request_chain)
+    activate_completion_chain(request_chain.comp_chains[0], PerformanceCriteria.LATENCY)
+
+    chain_group = tasks[0].chain.chain_groups[0]
+    assert len(task_queue.get_tasks_by_chain_group(chain_group)) == 0
+    for task in tasks:
+        task_queue.sync_chain_groups(task)
+    assert len(task_queue.get_tasks_by_chain_group(chain_group)) == 4
+
+    # Removing tasks cleans the indexes.
+    for task in tasks:
+        task_queue.remove(task)
+    assert len(task_queue) == 0
+    assert len(task_queue.get_tasks_by_chain_group(chain_group)) == 0
+    assert len(task_queue.get_tasks_by_first_sv(first_sv_id)) == 0
+
+
+def test_lazy_tokenize():
+    scheduler_cfg = GlobalSchedulerConfig()
+
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    # 2 engines with different tokenizers
+    for model, tokenizer_name in [
+        ("llama", "hf-internal-testing/llama-tokenizer"),
+        ("opt", "facebook/opt-13b"),
+    ]:
+        engine_mgr.register_engine(EngineConfig(model=model, tokenizer=tokenizer_name))
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("This is a test "),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ]
+    )
+    var_mgr.create_vars_for_request(session_id, request_chain)
+    comp_chain = request_chain.comp_chains[0]
+    activate_completion_chain(comp_chain, PerformanceCriteria.LATENCY)
+    task = task_creator.create_task(comp_chain)
+
+    # Scheduled with the estimated tokens num.
+    task.estimate_tokens_num(tokenizers_wrapper)
+    assert len(task.estimated_tokens_num) == 2
+    scheduler.submit_task(task)
+    scheduler.schedule()
+    assert task.is_scheduled
+
+    # Only tokenized by the tokenizer of the engine.
+    engine = task.engine
+    task.tokenize_chain(tokenizers_wrapper, [engine.tokenizer_name])
+    assert list(task.tokenized_result.keys()) == [engine.tokenizer_name]
+    engine.update_servelayer_runtime_info_task_tokens(task)
+    assert engine.get_tokens_num() == task.get_token_nums(engine.tokenizer_name)
+
+    task_creator.free_task(task)
+    assert engine.get_tokens_num() == 0
+
+
+def test_load_aware_scorer():
+    scheduler_cfg = GlobalSchedulerConfig(engine_scorer="load_aware")
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    # 2 engines of the same model. The slow one reports 4x iteration latency.
+    engine_ids = []
+    for name, latency in [("fast", 10_000_000), ("slow", 40_000_000)]:
+        engine_id = engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=name, engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=64
+            )
+        )
+        engine_mgr.engine_heartbeat(
+            engine_id, EngineRuntimeInfo(recent_average_latency=latency)
+        )
+        engine_ids.append(engine_id)
+    fast_engine, slow_engine = [engine_mgr.get_engine(i) for i in engine_ids]
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def submit_task() -> CompletionTask:
+        metadata = SemanticCallMetadata.get_default()
+        metadata.model_type = "text"
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        scheduler.schedule()
+        assert task.is_scheduled
+        return task
+
+    # The fast engine takes most of the tasks, but not all of them.
+    tasks = [submit_task() for _ in range(32)]
+    print(
+        f"fast: {fast_engine.get_num_tasks()}, slow: {slow_engine.get_num_tasks()}"
+    )
+    assert fast_engine.get_num_tasks() > 2 * slow_engine.get_num_tasks()
+    assert slow_engine.get_num_tasks() > 0
+
+    for task in tasks:
+        task_creator.free_task(task)
+
+    # Jobs queued in the fast engine (e.g. from other clients) are taken into account.
+    engine_mgr.engine_heartbeat(
+        fast_engine.engine_id,
+        EngineRuntimeInfo(
+            num_running_jobs=32, num_total_jobs=64, recent_average_latency=50_000_000
+        ),
+    )
+    task = submit_task()
+    assert task.engine is slow_engine
+
+
+def test_criteria_aware_scheduling():
+    scheduler_cfg = GlobalSchedulerConfig()
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    # Register 2 identical engines
+    for i in range(2):
+        engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"engine_{i}", engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=8
+            )
+        )
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def submit_task(criteria: PerformanceCriteria) -> CompletionTask:
+        metadata = SemanticCallMetadata.get_default()
+        metadata.model_type = "text"
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, criteria)
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        return task
+
+    # Latency-critical tasks are submitted later, but scheduled first.
+    throughput_tasks = [submit_task(PerformanceCriteria.THROUGHPUT) for _ in range(4)]
+    latency_tasks = [submit_task(PerformanceCriteria.LATENCY) for _ in range(2)]
+    ordered_tasks = scheduler.task_queue.ordered_tasks(app_fifo=False)
+    assert ordered_tasks[:2] == latency_tasks
+
+    scheduler.schedule()
+
+    # Expected results: Latency-critical tasks share an engine, and throughput tasks
+    # are packed into the other one.
+    latency_engine = latency_tasks[0].engine
+    assert all(task.engine is latency_engine for task in latency_tasks)
+    assert all(
+        task.is_scheduled and task.engine is not latency_engine
+        for task in throughput_tasks
+    )
+    assert len(set(task.engine.engine_id for task in throughput_tasks)) == 1
+
+
+def test_deadline_scheduling():
+    scheduler_cfg = GlobalSchedulerConfig()
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    graph = ComputeGraph()
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def make_request(
+        nodes: List, latency_budget: Optional[float] = None
+    ) -> RequestChain:
+        metadata = SemanticCallMetadata.get_default()
+        metadata.model_type = "text"
+        metadata.latency_budget = latency_budget
+        request_chain = RequestChain.from_nodes(nodes=nodes, metadata=metadata)
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        return request_chain
+
+    # Deadline propagation: A -> B, and only B has a latency budget. The costs of A and
+    # B are the same, so A gets about half of the budget.
+    request_chain1 = make_request(
+        [
+            ConstantFill("This is a test "),
+            PlaceholderGen(
+                placeholder=RequestPlaceholder(
+                    name="a", is_output=True, sampling_config={"max_gen_length": 100}
+                )
+            ),
+        ]
+    )
+    comp_chain1 = request_chain1.comp_chains[0]
+    request_chain2 = make_request(
+        [
+            PlaceholderFill(
+                placeholder=RequestPlaceholder(
+                    name="a", var_id=comp_chain1.gen_node.sv.id, is_output=False
+                )
+            ),
+            PlaceholderGen(
+                placeholder=RequestPlaceholder(
+                    name="b", is_output=True, sampling_config={"max_gen_length": 100}
+                )
+            ),
+        ],
+        latency_budget=10,
+    )
+    comp_chain2 = request_chain2.comp_chains[0]
+    activate_completion_chain(comp_chain2, PerformanceCriteria.LATENCY)
+
+    assert comp_chain2.deadline == request_chain2.deadline
+    budget_of_a = comp_chain1.deadline - (request_chain2.deadline - 10 * 10**9)
+    print(f"Budget of A: {budget_of_a / 1e9:.3f} s")
+    assert 4.5 * 10**9 < budget_of_a < 5.5 * 10**9
+
+    # EDF: Tasks are ordered by deadlines. Tasks without deadlines are after them, and
+    # tasks which have missed their deadlines are at the end.
+    def submit_task(latency_budget: Optional[float]) -> CompletionTask:
+        request_chain = make_request(
+            [
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            latency_budget=latency_budget,
+        )
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.LATENCY)
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        return task
+
+    missed_task = submit_task(-1)
+    no_deadline_task = submit_task(None)
+    loose_task = submit_task(100)
+    tight_task = submit_task(10)
+    ordered_tasks = scheduler.task_queue.ordered_tasks(app_fifo=False)
+    assert ordered_tasks == [tight_task, loose_task, no_deadline_task, missed_task]
+
+
+def test_critical_path_scheduling():
+    scheduler_cfg = GlobalSchedulerConfig(critical_path=True)
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    graph = ComputeGraph()
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def make_request(nodes: List) -> RequestChain:
+        metadata = SemanticCallMetadata.get_default()
+        metadata.model_type = "text"
+        request_chain = RequestChain.from_nodes(nodes=nodes, metadata=metadata)
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        return request_chain
+
+    def make_gen(name: str, max_gen_length: int) -> PlaceholderGen:
+        return PlaceholderGen(
+            placeholder=RequestPlaceholder(
+                name=name,
+                is_output=True,
+                sampling_config={"max_gen_length": max_gen_length},
+            )
+        )
+
+    def make_fill(name: str, chain: CompletionChain) -> PlaceholderFill:
+        return PlaceholderFill(
+            placeholder=RequestPlaceholder(
+                name=name, var_id=chain.gen_node.sv.id, is_output=False
+            )
+        )
+
+    # Map-reduce: 2 short branches and 1 long branch.
+    branch_lens = [10, 100, 10]
+    branches: List[CompletionChain] = []
+    for i, gen_len in enumerate(branch_lens):
+        request_chain = make_request([ConstantFill(f"Chunk {i}"), make_gen("a", gen_len)])
+        branches.append(request_chain.comp_chains[0])
+    reduce_chain = make_request(
+        [make_fill(f"b{i}", chain) for i, chain in enumerate(branches)]
+        + [make_gen("c", 20)]
+    ).comp_chains[0]
+    activate_completion_chain(reduce_chain, PerformanceCriteria.THROUGHPUT)
+
+    # Branches: critical path = own cost + reduce cost.
+    assert branches[1].critical_path > branches[0].critical_path
+    assert branches[1].critical_path > reduce_chain.critical_path + 100
+    assert branches[1].slack == 0
+    assert branches[0].slack > 0
+
+    # The long branch is scheduled first, though it's submitted later.
+    tasks = [task_creator.create_task(chain) for chain in branches]
+    for task in tasks:
+        scheduler.submit_task(task)
+    ordered_tasks = scheduler.task_queue.ordered_tasks(
+        app_fifo=False, critical_path=True
+    )
+    assert ordered_tasks[0] is tasks[1]
+
+    # A later request consumes the result of the reduce: the critical paths get longer.
+    old_critical_path = branches[1].critical_path
+    final_chain = make_request(
+        [make_fill("c", reduce_chain), make_gen("d", 50)]
+    ).comp_chains[0]
+    activate_completion_chain(final_chain, PerformanceCriteria.THROUGHPUT)
+    assert abs(branches[1].critical_path - old_critical_path - final_chain.cost) < 1e-6
+
+    # After the long branch finishes, the short ones are critical.
+    branches[1].gen_node.sv.set("Done")
+    assert branches[0].slack == 0
+
+
 if __name__ == "__main__":
     # test_default_policy_throughput()
     # test_default_policy_latency()
@@ -464,3 +911,9 @@ if __name__ == "__main__":
     # test_graph_group()
     # test_ctx_group()
     # test_ctx_aware()
+    # test_task_queue_index()
+    # test_lazy_tokenize()
+    # test_load_aware_scorer()
+    # test_criteria_aware_scheduling()
+    # test_deadline_scheduling()
+    # test_critical_path_scheduling()
@@ -68,6 +68,52 @@ def test_session_manager():
         session_mgr.check_session_status(session_id)
 
 
+def test_session_split_global_prefix():
+    scheduler_config = GlobalSchedulerConfig()
+    prefix_matcher = PrefixMatcher()
+    var_mgr = SemanticVariableManager(666)
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    task_creator = TaskCreator()
+    scheduler = GlobalScheduler(scheduler_config, engine_mgr, context_mgr)
+
+    session_mgr = SessionManager(
+        life_span=10,
+        prefix_matcher=prefix_matcher,
+        task_creator=task_creator,
+        scheduler=scheduler,
+        var_mgr=var_mgr,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+        tokenizers_wrapper=tokenizers_wrapper,
+    )
+    session_id = session_mgr.register_session()
+    session = session_mgr.get_session(session_id)
+
+    # A shared system prompt followed by inlined user texts.
+    system_prompt = "You are a helpful assistant. Answer the question briefly. "
+
+    async def main():
+        for i in range(prefix_matcher.gp_threshold + 2):
+            payload = {
+                "template": system_prompt + f"Question {i}: Why? {{{{a}}}}",
+                "placeholders": [{"name": "a", "is_output": True}],
+            }
+            session.add_request(payload)
+
+    asyncio.run(main())
+
+    # The global prefix is split (on the token boundary) into a shared constant prefix SV.
+    global_prefix = system_prompt + "Question"
+    sv = var_mgr.constant_prefix_namespace.get_var_by_content(global_prefix)
+    assert sv is not None and sv.is_constant_prefix
+
+
 def test_graph_executor():
     session_id = 0
 
@@ -126,4 +172,5 @@ def test_graph_executor():
 
 if __name__ == "__main__":
     # test_session_manager()
+    # test_session_split_global_prefix()
     test_graph_executor()
@@ -1,3 +1,6 @@
+import asyncio
+import pytest
+
 from parrot.serve.graph import (
     RequestChain,
     ConstantFill,
@@ -7,6 +10,7 @@ from parrot.serve.graph import (
 from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 from parrot.serve.variable_manager import SemanticVariableManager
 from parrot.sampling_config import SamplingConfig
+from parrot.exceptions import ParrotError
 
 
 def test_content_hash():
@@ -59,6 +63,46 @@ def test_request_chain_hash():
     print(request_chain2.pretty_print())
 
 
+def test_sv_stream():
+    session_id = 0
+    var_mgr = SemanticVariableManager(constant_prefix_var_timeout=10)
+    var_mgr.register_local_var_space(session_id)
+    var = var_mgr.create_var(session_id, "a")
+
+    async def producer():
+        for piece in ["Hello", ", ", "world"]:
+            await asyncio.sleep(0.01)
+            var.append_partial(piece)
+        assert var.get_partial() == "Hello, world"
+        var.set("Hello, world!")
+
+    async def reader():
+        pieces = []
+        async for piece in var.astream():
+            pieces.append(piece)
+        return pieces
+
+    async def main():
+        assert not var.has_stream_readers
+        readers = [asyncio.create_task(reader()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert var.has_stream_readers
+        await producer()
+        for pieces in await asyncio.gather(*readers):
+            assert len(pieces) > 1
+            assert "".join(pieces) == "Hello, world!"
+        assert not var.has_stream_readers
+
+    asyncio.run(main())
+
+    # The content must extend the streamed partial content.
+    var = var_mgr.create_var(session_id, "b")
+    var.append_partial("Hello")
+    with pytest.raises(ParrotError):
+        var.set("Hell")
+
+
 if __name__ == "__main__":
     # test_content_hash()
+    # test_sv_stream()
     test_request_chain_hash()
@@ -1,3 +1,5 @@
+import asyncio
+
 from parrot.serve.tokenizer_wrapper import TokenizersWrapper
 
 from parrot.serve.variable_manager import SemanticVariableManager
@@ -56,6 +58,29 @@ def test_decode():
     assert TESTING_PROMPT_TEXT == decoded
 
 
+def test_incremental_detokenize():
+    tokenizers_wrapper = TokenizersWrapper()
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+    text = "Hello, world! 你好，世界 🦜"
+    token_ids = tokenizers_wrapper.tokenize(text, tokenizer_name)
+    detokenizer = tokenizers_wrapper.get_incremental_detokenizer(tokenizer_name)
+    pieces = [detokenizer.step(token_id) for token_id in token_ids]
+    pieces.append(detokenizer.flush())
+    assert "".join(pieces) == detokenizer.text
+    assert detokenizer.text == tokenizers_wrapper.detokenize(token_ids, tokenizer_name)
+
+    # An incomplete character at the end is emitted by flush().
+    detokenizer = tokenizers_wrapper.get_incremental_detokenizer(tokenizer_name)
+    pieces = [detokenizer.step(token_id) for token_id in token_ids[:-1]]
+    pieces.append(detokenizer.flush())
+    assert "".join(pieces) == detokenizer.text
+    assert detokenizer.text == tokenizers_wrapper.detokenize(
+        token_ids[:-1], tokenizer_name
+    )
+
+
 def test_tokenize_request():
     session_id = 0
     var_mgr = SemanticVariableManager(666)
@@ -97,7 +122,85 @@ def test_tokenize_request():
         print(tokenizers_wrapper.detokenize(token_ids, tokenizer_name1))
 
 
+def test_tokenize_cache():
+    tokenizers_wrapper = TokenizersWrapper()
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+    cache = tokenizers_wrapper.token_ids_cache
+    cache_key = tokenizers_wrapper.get_content_cache_key(TESTING_PROMPT_TEXT)
+
+    for _ in range(3):
+        encoded = tokenizers_wrapper.tokenize(
+            TESTING_PROMPT_TEXT, tokenizer_name, cache_key=cache_key
+        )
+        assert encoded == TESTING_TOKEN_IDS
+
+    assert cache.misses == 1 and cache.hits == 2
+    assert cache.tokens_num == len(TESTING_TOKEN_IDS)
+
+    tokenizers_wrapper.evict_cache(cache_key)
+    assert cache.tokens_num == 0
+
+
+def test_async_tokenize():
+    tokenizers_wrapper = TokenizersWrapper(workers_num=2)
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+    # Long enough to be offloaded to the worker pool.
+    long_text = " ".join([TESTING_PROMPT_TEXT] * 200)
+
+    async def main():
+        token_ids_list = await tokenizers_wrapper.atokenize_batch(
+            [TESTING_PROMPT_TEXT, long_text], tokenizer_name
+        )
+        assert token_ids_list[0] == TESTING_TOKEN_IDS
+        assert token_ids_list[1] == tokenizers_wrapper.tokenize(
+            long_text, tokenizer_name
+        )
+
+        decoded = await tokenizers_wrapper.adetokenize(
+            token_ids_list[1], tokenizer_name
+        )
+        assert decoded == long_text
+
+    asyncio.run(main())
+
+
+def test_async_tokenize_concurrent():
+    tokenizers_wrapper = TokenizersWrapper(workers_num=4)
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+    # Offloaded jobs run in different worker threads at the same time.
+    long_texts = [" ".join([TESTING_PROMPT_TEXT] * (200 + i)) for i in range(16)]
+    expected = [
+        tokenizers_wrapper.tokenize(text, tokenizer_name) for text in long_texts
+    ]
+
+    async def main():
+        results = await asyncio.gather(
+            *[
+                tokenizers_wrapper.atokenize_batch([text], tokenizer_name)
+                for text in long_texts
+            ],
+            *[
+                tokenizers_wrapper.adetokenize(token_ids, tokenizer_name)
+                for token_ids in expected
+            ],
+        )
+        assert [token_ids_list[0] for token_ids_list in results[:16]] == expected
+        assert results[16:] == long_texts
+
+    asyncio.run(main())
+
+
 if __name__ == "__main__":
+    # test_incremental_detokenize()
     # test_encode()
     # test_decode()
+    # test_tokenize_cache()
+    # test_async_tokenize()
+    # test_async_tokenize_concurrent()
     test_tokenize_request()
@@ -7,7 +7,6 @@ from parrot.engine.config import EngineConfig
 from parrot.serve.backend_repr import ExecutionEngine, LanguageModel
 from parrot.serve.tokenizer_wrapper import TokenizersWrapper
 from parrot.serve.backend_repr.context import Context
-from parrot.constants import NONE_THREAD_ID
 
 from parrot.protocol.public.apis import (
     register_session,
@@ -25,6 +24,7 @@ from parrot.protocol.internal.layer_apis import (
     engine_heartbeat,
     register_engine,
 )
+from parrot.constants import WIRE_FORMAT_BINARY
 from parrot.protocol.internal.primitive_request import Fill, Generate
 from parrot.sampling_config import SamplingConfig
 
@@ -271,6 +271,38 @@ def test_generate():
         asyncio.run(main())
 
 
+def test_fill_generate_binary():
+    async def main():
+        primitive = Fill(
+            session_id=0,
+            task_id=0,
+            context_id=0,
+            parent_context_id=-1,
+            end_flag=False,
+            token_ids=[1, 2, 3],
+        )
+        resp = await primitive.apost(
+            ENGINE_URL, wire_format=WIRE_FORMAT_BINARY
+        )
+        assert resp.filled_len == 3
+
+        primitive = Generate(
+            session_id=0,
+            task_id=0,
+            context_id=0,
+            parent_context_id=-1,
+            end_flag=False,
+            sampling_config=SamplingConfig(),
+        )
+        resp = await primitive.apost(
+            ENGINE_URL, wire_format=WIRE_FORMAT_BINARY
+        )
+        assert len(resp.generated_ids) == 0
+
+    with fake_engine_server():
+        asyncio.run(main())
+
+
 if __name__ == "__main__":
     # test_register_session()
     # test_remove_session()
@@ -281,4 +313,5 @@ if __name__ == "__main__":
     # test_free_context()
     # test_fill()
     # test_generate()
+    # test_fill_generate_binary()
     pass